@@ -0,0 +1,102 @@
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Histogram of durations with fixed buckets, for reporting latency of
+operations.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+import threading
+
+# Upper bounds in seconds, from 1 millisecond to 100 seconds.
+DEFAULT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                   1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    """
+    Thread safe histogram counting samples in buckets with fixed upper bounds.
+    Samples larger than the last bound are counted in an overflow bucket.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._bounds = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._counts = [0] * (len(self._bounds) + 1)
+            self._count = 0
+            self._total = 0.0
+            self._max = 0.0
+
+    def add(self, value):
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._count += 1
+            self._total += value
+            if value > self._max:
+                self._max = value
+
+    @property
+    def count(self):
+        return self._count
+
+    def percentile(self, p):
+        """
+        Return the upper bound of the bucket containing the p percentile, or
+        the maximum value if it falls in the overflow bucket. Returns 0 if
+        there are no samples.
+        """
+        with self._lock:
+            return self._percentile(p)
+
+    def info(self):
+        """
+        Return a snapshot of the histogram suitable for reporting. Buckets
+        are keyed by their upper bound, like Prometheus "le" labels.
+        """
+        with self._lock:
+            buckets = {str(bound): count
+                       for bound, count in zip(self._bounds, self._counts)}
+            buckets["+Inf"] = self._counts[-1]
+            return {
+                "count": self._count,
+                "total": self._total,
+                "max": self._max,
+                "p50": self._percentile(50),
+                "p90": self._percentile(90),
+                "p99": self._percentile(99),
+                "buckets": buckets,
+            }
+
+    def _percentile(self, p):
+        if self._count == 0:
+            return 0
+        rank = self._count * p / 100.0
+        seen = 0
+        for bound, count in zip(self._bounds, self._counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self._max
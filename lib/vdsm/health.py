@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -31,6 +31,15 @@ from . import metrics
 
 _monitor = None
 
+# Metrics names and stats keys.
+_METRICS = (
+    ('hosts.vdsm.gc.uncollectable', 'uncollectable_obj'),
+    ('hosts.vdsm.cpu.user_pct', 'utime_pct'),
+    ('hosts.vdsm.cpu.sys_pct', 'stime_pct'),
+    ('hosts.vdsm.memory.rss', 'rss'),
+    ('hosts.vdsm.threads_count', 'threads'),
+)
+
 
 def start():
     global _monitor
@@ -39,11 +48,13 @@ def start():
         interval = config.getint("devel", "health_check_interval")
         _monitor = Monitor(interval)
         _monitor.start()
+        metrics.register(_monitor.report)
 
 
 def stop():
     global _monitor
     if _monitor is not None:
+        metrics.unregister(_monitor.report)
         _monitor.stop()
         _monitor = None
 
@@ -121,15 +132,18 @@ class Monitor(object):
                        self._stats['threads'])
 
     def _report_stats(self):
-        prefix = "hosts.vdsm"
-        report = {}
-        report[prefix + '.gc.uncollectable'] = \
-            self._stats['uncollectable_obj']
-        report[prefix + '.cpu.user_pct'] = self._stats['utime_pct']
-        report[prefix + '.cpu.sys_pct'] = self._stats['stime_pct']
-        report[prefix + '.memory.rss'] = self._stats['rss']
-        report[prefix + '.threads_count'] = self._stats['threads']
-        metrics.send(report)
+        metrics.send(self.report())
+
+    def report(self):
+        """
+        Return list of metrics.Metric with the last health stats.
+        """
+        try:
+            return [metrics.Metric(name, self._stats[key])
+                    for name, key in _METRICS]
+        except KeyError:
+            # Not checked yet.
+            return []
 
 
 class ProcStat(object):
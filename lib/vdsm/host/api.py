@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -80,60 +80,85 @@ def get_stats(cif, sample):
     return ret
 
 
-def send_metrics(hoststats):
-    prefix = "hosts"
-    data = {}
+# Metrics names and stats keys.
+
+_HOST_METRICS = (
+    ('hosts.memory.available', 'memAvailable'),
+    ('hosts.memory.committed', 'memCommitted'),
+    ('hosts.memory.free_mb', 'memFree'),
+    ('hosts.memory.usage_percent', 'memUsed'),
+    ('hosts.memory.anon_huge_pages', 'anonHugePages'),
+    ('hosts.swap.total_mb', 'swapTotal'),
+    ('hosts.swap.free_mb', 'swapFree'),
+    ('hosts.vms.active', 'vmActive'),
+    ('hosts.vms.total', 'vmCount'),
+    ('hosts.cpu.load', 'cpuLoad'),
+    ('hosts.cpu.user', 'cpuUser'),
+    ('hosts.cpu.sys', 'cpuSys'),
+    ('hosts.cpu.idle', 'cpuIdle'),
+    ('hosts.cpu.sys_vdsmd', 'cpuSysVdsmd'),
+    ('hosts.cpu.user_vdsmd', 'cpuUserVdsmd'),
+)
+
+_KSM_METRICS = (
+    ('hosts.cpu.ksm_pages', 'ksmPages'),
+    ('hosts.cpu.ksm_cpu_precent', 'ksmCpu'),
+)
+
+_STORAGE_METRICS = (
+    ('hosts.storage.{sd_id}.delay', 'delay'),
+    ('hosts.storage.{sd_id}.last_check', 'lastCheck'),
+)
+
+_NIC_METRICS = (
+    ('hosts.nic.{nic!e}.speed', 'speed'),
+    ('hosts.nic.{nic!e}.rx_errors', 'rxErrors'),
+    ('hosts.nic.{nic!e}.tx_errors', 'txErrors'),
+    ('hosts.nic.{nic!e}.rx_dropped', 'rxDropped'),
+    ('hosts.nic.{nic!e}.tx_dropped', 'txDropped'),
+    ('hosts.nic.{nic!e}.rx', 'rx'),
+    ('hosts.nic.{nic!e}.tx', 'tx'),
+)
+
+
+def report(hoststats):
+    """
+    Return list of metrics.Metric with the host stats.
+    """
+    report = []
 
     try:
         for dom in hoststats['storageDomains']:
-            storage_prefix = prefix + '.storage.' + dom
-            dom_info = hoststats['storageDomains'][dom]
-            data[storage_prefix + '.delay'] = dom_info['delay']
-            data[storage_prefix + '.last_check'] = dom_info['lastCheck']
-
-        data[prefix + '.memory.available'] = hoststats['memAvailable']
-        data[prefix + '.memory.committed'] = hoststats['memCommitted']
-        data[prefix + '.memory.free_mb'] = hoststats['memFree']
-        data[prefix + '.memory.usage_percent'] = hoststats['memUsed']
-        data[prefix + '.memory.anon_huge_pages'] = hoststats['anonHugePages']
-
-        data[prefix + '.swap.total_mb'] = hoststats['swapTotal']
-        data[prefix + '.swap.free_mb'] = hoststats['swapFree']
-
-        data[prefix + '.vms.active'] = hoststats['vmActive']
-        data[prefix + '.vms.total'] = hoststats['vmCount']
-
-        data[prefix + '.cpu.load'] = hoststats['cpuLoad']
-        data[prefix + '.cpu.user'] = hoststats['cpuUser']
-        data[prefix + '.cpu.sys'] = hoststats['cpuSys']
-        data[prefix + '.cpu.idle'] = hoststats['cpuIdle']
-        data[prefix + '.cpu.sys_vdsmd'] = hoststats['cpuSysVdsmd']
-        data[prefix + '.cpu.user_vdsmd'] = hoststats['cpuUserVdsmd']
+            _add_metrics(report, _STORAGE_METRICS,
+                         hoststats['storageDomains'][dom], {'sd_id': dom})
+
+        _add_metrics(report, _HOST_METRICS, hoststats)
 
         if 'ksmPages' in hoststats:
-            data[prefix + '.cpu.ksm_pages'] = hoststats['ksmPages']
-            data[prefix + '.cpu.ksm_cpu_precent'] = hoststats['ksmCpu']
+            _add_metrics(report, _KSM_METRICS, hoststats)
 
         if hoststats['haStats']['configured']:
-            data[prefix + '.ha_score'] = hoststats['haScore']
+            report.append(metrics.Metric('hosts.ha_score',
+                                         hoststats['haScore']))
 
-        data[prefix + '.elapsed_time'] = hoststats['elapsedTime']
+        report.append(metrics.Metric('hosts.elapsed_time',
+                                     hoststats['elapsedTime']))
 
         if 'network' in hoststats:
             for interface in hoststats['network']:
-                if_info = hoststats['network'][interface]
-                net_prefix = prefix + '.nic.' + interface.replace('.', '_')
-                data[net_prefix + '.speed'] = if_info['speed']
-                data[net_prefix + '.rx_errors'] = if_info['rxErrors']
-                data[net_prefix + '.tx_errors'] = if_info['txErrors']
-                data[net_prefix + '.rx_dropped'] = if_info['rxDropped']
-                data[net_prefix + '.tx_dropped'] = if_info['txDropped']
-                data[net_prefix + '.rx'] = if_info['rx']
-                data[net_prefix + '.tx'] = if_info['tx']
-
-        metrics.send(data)
+                _add_metrics(report, _NIC_METRICS,
+                             hoststats['network'][interface],
+                             {'nic': interface})
+
     except KeyError:
         logging.exception('Host metrics collection failed')
+        return []
+    return report
+
+
+def _add_metrics(report, names, stats, labels=None):
+    for name, key in names:
+        report.append(metrics.Metric(name, stats[key], labels))
 
 
 def _readSwapTotalFree():
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -170,15 +170,20 @@ def get(target=None, killOnFailure=True):
                     setattr(conn, name,
                             wrapMethod(utils.weakmethod(method)))
             if target is not None:
-                for ev in (libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
-                           libvirt.VIR_DOMAIN_EVENT_ID_REBOOT,
-                           libvirt.VIR_DOMAIN_EVENT_ID_RTC_CHANGE,
-                           libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON,
-                           libvirt.VIR_DOMAIN_EVENT_ID_GRAPHICS,
-                           libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_JOB,
-                           libvirt.VIR_DOMAIN_EVENT_ID_WATCHDOG,
-                           libvirt.VIR_DOMAIN_EVENT_ID_JOB_COMPLETED,
-                           libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED):
+                domain_events = [libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                                 libvirt.VIR_DOMAIN_EVENT_ID_REBOOT,
+                                 libvirt.VIR_DOMAIN_EVENT_ID_RTC_CHANGE,
+                                 libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON,
+                                 libvirt.VIR_DOMAIN_EVENT_ID_GRAPHICS,
+                                 libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_JOB,
+                                 libvirt.VIR_DOMAIN_EVENT_ID_WATCHDOG,
+                                 libvirt.VIR_DOMAIN_EVENT_ID_JOB_COMPLETED,
+                                 libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED]
+                # Available since libvirt 3.2.
+                if hasattr(libvirt, 'VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD'):
+                    domain_events.append(
+                        libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD)
+                for ev in domain_events:
                     conn.domainEventRegisterAny(None,
                                                 ev,
                                                 target.dispatchLibvirtEvents,
@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -18,13 +18,92 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+"""
+metrics - report vdsm metrics to a collector
+
+A report is a list of Metric. A metric name is a template including a
+placeholder for some of the metric labels, e.g.
+"vms.{vm_name}.disk.{disk}.read_latency". Collectors without labels use the
+flat name, "vms.vm1.disk.vda.read_latency", while collectors supporting
+labels use the name without the placeholders, "vms.disk.read_latency", and
+report all the labels separately.
+
+A placeholder ending with "!e", e.g. "hosts.nic.{nic!e}.rx", replaces dots in
+the label value by "_" in the flat name, keeping the legacy flat names of host
+nics. Other label values are substituted as is.
+
+Push collectors (statsd, hawkular) get the reports sent by the monitors after
+every sample. Pull collectors (prometheus) collect the metrics from the
+registered sources when the metrics are scraped, so nothing is computed
+between scrapes.
+"""
+
 from __future__ import absolute_import
 
+import collections
 import importlib
+import logging
+import re
+import threading
+
 from ..config import config
 
 _reporter = None
 
+_sources = []
+_lock = threading.Lock()
+
+_PLACEHOLDER = re.compile(r"\{(\w+)(!e)?\}")
+_NAME_PLACEHOLDER = re.compile(r"\.?\{\w+(?:!e)?\}")
+
+# Cache of metric names by template.
+_names = {}
+
+
+class Metric(collections.namedtuple("Metric", "template, value, labels")):
+    """
+    A gauge metric value.
+
+    Arguments:
+        template (str): dotted metric name, with a placeholder for labels
+            which are part of the flat name, e.g. "vms.{vm_name}.cpu.user"
+        value (number or str): the metric value
+        labels (dict): labels of the metric, e.g. {"vm_id": "...",
+            "vm_name": "vm1"}. Labels are shared by many metrics and must not
+            be modified.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, template, value, labels=None):
+        return super(Metric, cls).__new__(cls, template, value, labels or {})
+
+    @property
+    def name(self):
+        """
+        The metric name without label placeholders, e.g. "vms.cpu.user".
+        """
+        try:
+            return _names[self.template]
+        except KeyError:
+            name = _NAME_PLACEHOLDER.sub("", self.template)
+            _names[self.template] = name
+            return name
+
+    @property
+    def flat_name(self):
+        """
+        The metric name including the values of the labels in the template,
+        e.g. "vms.vm1.cpu.user".
+        """
+        return _PLACEHOLDER.sub(self._label_value, self.template)
+
+    def _label_value(self, match):
+        value = self.labels[match.group(1)]
+        if match.group(2):
+            value = value.replace(".", "_")
+        return value
+
 
 def start():
     global _reporter
@@ -42,6 +121,45 @@ def stop():
         _reporter = None
 
 
+def pushing():
+    """
+    Return True if monitors should send reports.
+    """
+    return _reporter is not None and not getattr(_reporter, 'PULL', False)
+
+
 def send(report):
-    if _reporter:
+    """
+    Send report, a list of Metric, to a push collector.
+    """
+    if pushing():
         _reporter.send(report)
+
+
+def register(source):
+    """
+    Register a callable returning a list of Metric, called when a pull
+    collector scrapes the metrics.
+    """
+    with _lock:
+        _sources.append(source)
+
+
+def unregister(source):
+    with _lock:
+        _sources.remove(source)
+
+
+def collect():
+    """
+    Return the metrics of all registered sources.
+    """
+    with _lock:
+        sources = list(_sources)
+    report = []
+    for source in sources:
+        try:
+            report.extend(source())
+        except Exception:
+            logging.exception("Error collecting metrics from %s", source)
+    return report
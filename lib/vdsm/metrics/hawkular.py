@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -24,8 +24,6 @@ import collections
 import logging
 import threading
 
-import six
-
 from vdsm import compat
 from vdsm import concurrent
 from vdsm.config import config
@@ -59,8 +57,8 @@ def stop():
 
 
 def send(report):
-    metrics_list = [_get_gauge_metric(name, value)
-                    for name, value in six.iteritems(report)]
+    metrics_list = [_get_gauge_metric(metric.flat_name, metric.value)
+                    for metric in report]
     _queue.append(metrics_list)
     with _cond:
         _cond.notify()
@@ -0,0 +1,152 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+prometheus - expose metrics in Prometheus text format
+
+Serve the metrics of the registered sources at http://address:port/metrics.
+The metrics are collected when scraped, so nothing is computed or sent
+between scrapes.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import math
+import re
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from vdsm import concurrent
+from vdsm import metrics
+from vdsm.config import config
+
+# Metrics are collected by the server, see vdsm.metrics.pushing().
+PULL = True
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PREFIX = "vdsm_"
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+log = logging.getLogger("metrics.prometheus")
+
+_server = None
+_thread = None
+
+
+def start(address, port=None):
+    global _server, _thread
+    if _server is not None:
+        raise RuntimeError('trying to start reporter while running')
+    if port is None:
+        port = config.getint('metrics', 'prometheus_port')
+    log.info("Starting prometheus endpoint on %s:%d", address, port)
+    _server = _Server((address, port), _Handler)
+    _thread = concurrent.thread(_server.serve_forever, name="prometheus",
+                                log=log)
+    _thread.start()
+
+
+def stop():
+    global _server, _thread
+    if _server is not None:
+        log.info("Stopping prometheus endpoint")
+        _server.shutdown()
+        _server.server_close()
+        _thread.join()
+        _server = None
+        _thread = None
+
+
+def send(report):
+    # Metrics are collected when scraped.
+    pass
+
+
+def render(report):
+    """
+    Return report, a list of vdsm.metrics.Metric, in Prometheus text
+    exposition format.
+    """
+    families = {}
+    for metric in report:
+        try:
+            value = float(metric.value)
+        except (TypeError, ValueError):
+            continue
+        families.setdefault(metric.name, []).append((metric.labels, value))
+
+    lines = []
+    for name in sorted(families):
+        family = PREFIX + _INVALID_NAME_CHARS.sub("_", name)
+        lines.append("# TYPE %s gauge" % family)
+        for labels, value in families[name]:
+            lines.append("%s%s %s" % (family, _format_labels(labels),
+                                      _format_value(value)))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _format_value(value):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, _escape(value))
+        for key, value in sorted(six.iteritems(labels)))
+
+
+def _escape(value):
+    return (value.replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render(metrics.collect())
+        if isinstance(body, six.text_type):
+            body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("%s - " + format, self.client_address[0], *args)
@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -22,13 +22,16 @@ from __future__ import absolute_import
 import six
 import socket
 
+from vdsm.config import config
+
 _client = None
 
 
 def start(address, port=8125):
     global _client
     if _client is None:
-        _client = _StatsClient(address, port=port)
+        tags = config.getboolean('metrics', 'statsd_tags')
+        _client = _StatsClient(address, port=port, tags=tags)
 
 
 def stop():
@@ -38,8 +41,7 @@ def stop():
 
 
 def send(report):
-    for name, value in six.iteritems(report):
-        _client.gauge(name, value)
+    _client.gauges(report)
 
 
 class _StatsClient(object):
@@ -48,14 +50,19 @@ class _StatsClient(object):
     standard (based on http://metrics20.org/spec).
 
     Currently supports only gauge reports which is used in VDSM.
+
+    Metric labels are sent as DogStatsD tags if tags is True, or included in
+    the metric name otherwise.
     """
-    def __init__(self, host, port=8125, maxudpsize=512, ipv6=False):
+    def __init__(self, host, port=8125, maxudpsize=512, ipv6=False,
+                 tags=False):
         fam = socket.AF_INET6 if ipv6 else socket.AF_INET
         family, _, _, _, addr = socket.getaddrinfo(
             host, port, fam, socket.SOCK_DGRAM)[0]
         self._addr = addr
         self._sock = socket.socket(family, socket.SOCK_DGRAM)
         self._maxudpsize = maxudpsize
+        self._tags = tags
 
     def _send(self, data):
         try:
@@ -78,3 +85,38 @@ class _StatsClient(object):
             value (int): numeric value for stat
         """
         self._send('%s:%s|g' % (stat, value))
+
+    def gauges(self, report):
+        """
+        Sending gauge reports for all metrics in report, batching as many
+        reports as possible in every packet, up to maxudpsize bytes.
+
+        Args:
+            report (list): list of vdsm.metrics.Metric
+        """
+        packet = []
+        size = 0
+        for metric in report:
+            line = self._format(metric)
+            if isinstance(line, six.text_type):
+                line = line.encode('utf-8')
+            # Lines are separated by a newline.
+            if packet and size + 1 + len(line) > self._maxudpsize:
+                self._send(b'\n'.join(packet))
+                packet = []
+                size = 0
+            if size:
+                size += 1
+            packet.append(line)
+            size += len(line)
+        if packet:
+            self._send(b'\n'.join(packet))
+
+    def _format(self, metric):
+        if not self._tags:
+            return '%s:%s|g' % (metric.flat_name, metric.value)
+        if not metric.labels:
+            return '%s:%s|g' % (metric.name, metric.value)
+        tags = ','.join('%s:%s' % item
+                        for item in sorted(six.iteritems(metric.labels)))
+        return '%s:%s|g|#%s' % (metric.name, metric.value, tags)
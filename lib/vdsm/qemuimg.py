@@ -1,5 +1,5 @@
 #
-# Copyright 2012-2016 Red Hat, Inc.
+# Copyright 2012-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,6 +19,7 @@
 #
 
 from __future__ import absolute_import
+import codecs
 import json
 import logging
 import os
@@ -40,6 +41,20 @@ _qemuimg = utils.CommandPath("qemu-img",
 
 _log = logging.getLogger("QemuImg")
 
+# Size of qemu-img map output read at once by iter_map().
+_MAP_CHUNK_SIZE = 128 * 1024
+
+# _iter_json_array() states: expecting "[", an object or "]", an object,
+# "," or "]", or nothing.
+_START = "start"
+_FIRST = "first"
+_ITEM = "item"
+_NEXT = "next"
+_END = "end"
+
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+_SEPARATOR = re.compile(r"[ \t\r\n]*,[ \t\r\n]*")
+
 
 class FORMAT:
     QCOW2 = "qcow2"
@@ -233,6 +248,41 @@ def map(image):
         raise InvalidOutput(cmd, out, "Failed to process qemuimg map output")
 
 
+def iter_map(image):
+    """
+    Generate the runs returned by map() while qemu-img is running, parsing
+    the output incrementally. Mapping a fragmented image may return millions
+    of runs; the output and the runs are never kept in memory.
+
+    If the caller stops iterating before the end of the output, qemu-img is
+    killed.
+    """
+    cmd = [_qemuimg.cmd, "map", "--output", "json", image]
+    # For simplicity, we always run commit in the image directory.
+    workdir = os.path.dirname(image)
+    _log.debug(cmdutils.command_log_line(cmd, cwd=workdir))
+    proc = CPopen(cmd, cwd=workdir, deathSignal=signal.SIGKILL)
+    with utils.terminating(proc):
+        chunks = iter(lambda: proc.stdout.read(_MAP_CHUNK_SIZE), b"")
+        try:
+            for run in _iter_json_array(chunks):
+                yield run
+        except ValueError as e:
+            # qemu-img may be blocked writing to stdout.
+            proc.kill()
+            proc.wait()
+            err = proc.stderr.read()
+            if proc.returncode > 0:
+                raise QImgError(cmd, proc.returncode, "", err)
+            raise InvalidOutput(
+                cmd, "", "Failed to process qemuimg map output: %s" % e)
+        err = proc.stderr.read()
+        proc.wait()
+        _log.debug(cmdutils.retcode_log_line(proc.returncode, err=err))
+        if proc.returncode != 0:
+            raise QImgError(cmd, proc.returncode, "", err)
+
+
 def amend(image, compat):
     if compat not in _QCOW2_COMPAT_SUPPORTED:
         raise ValueError("Invalid compat version %r" % compat)
@@ -399,6 +449,69 @@ def _parse_qemuimg_json(output):
     return obj
 
 
+def _iter_json_array(chunks):
+    """
+    Generate the objects in a JSON array of objects, reading the array text
+    from an iterable of bytes chunks.
+
+    Raises ValueError if the text is not a valid array of objects.
+    """
+    scan = json.JSONDecoder().scan_once
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = u""
+    pos = 0
+    state = _START
+
+    for chunk in chunks:
+        buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if state == _ITEM:
+                if buf[pos] != u"{":
+                    raise ValueError(
+                        "Expecting object: %r" % buf[pos:pos + 80])
+                try:
+                    obj, pos = scan(buf, pos)
+                except (StopIteration, ValueError):
+                    # Incomplete object, wait for more data.
+                    break
+                yield obj
+                # Fast path: skip the separator and expect the next object.
+                match = _SEPARATOR.match(buf, pos)
+                if match is None:
+                    state = _NEXT
+                else:
+                    pos = match.end()
+            elif state == _NEXT:
+                if buf[pos] == u",":
+                    state = _ITEM
+                elif buf[pos] == u"]":
+                    state = _END
+                else:
+                    raise ValueError(
+                        "Expecting ',' or ']': %r" % buf[pos:pos + 80])
+                pos += 1
+            elif state == _START:
+                if buf[pos] != u"[":
+                    raise ValueError("Expecting '[': %r" % buf[pos:pos + 80])
+                state = _FIRST
+                pos += 1
+            elif state == _FIRST:
+                if buf[pos] == u"]":
+                    state = _END
+                    pos += 1
+                else:
+                    state = _ITEM
+            else:
+                raise ValueError("Extra data: %r" % buf[pos:pos + 80])
+
+    if state != _END:
+        raise ValueError("Truncated array: %r" % buf[pos:pos + 80])
+
+
 def _validate_qcow2_compat(value):
     if value is None:
         return default_qcow2_compat()
@@ -539,6 +539,56 @@ class BufferedReader(asyncore.file_dispatcher):
         return False
 
 
+class LineReader(asyncore.file_dispatcher):
+    """
+    Read lines from file, invoking line_received with every line, and notify
+    when the file was closed.
+    """
+
+    def __init__(self, fd, line_received, complete, bufsize=4096, map=None):
+        asyncore.file_dispatcher.__init__(self, fd, map=map)
+        filecontrol.set_close_on_exec(self._fileno)
+        self._line_received = line_received
+        self._complete = complete
+        self._bufsize = bufsize
+        self._data = bytearray()
+
+    def handle_read(self):
+        chunk = self.socket.read(self._bufsize)
+        if not chunk:
+            self.handle_close()
+            return
+        self._data += chunk
+        while not self.closing:
+            n = self._data.find(b"\n")
+            if n == -1:
+                break
+            line = bytes(self._data[:n])
+            del self._data[:n + 1]
+            self._line_received(line)
+
+    def handle_close(self):
+        complete = self._complete
+        self.close()
+        if complete:
+            complete()
+
+    def handle_error(self):
+        log.exception("Unhandled error in %s", self)
+        self.handle_close()
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        self._line_received = None
+        self._complete = None
+        asyncore.file_dispatcher.close(self)
+
+    def writable(self):
+        return False
+
+
 class Reaper(object):
     """
     Wait for process and notify when it has terminated.
@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -27,11 +27,30 @@ from vdsm import utils
 _blkdiscard = utils.CommandPath("blkdiscard", "/sbin/blkdiscard")
 
 
-def blkdiscard(device):
+def blkdiscard(device, zeroout=False, stop=None):
+    """
+    Discard the entire device.
+
+    If zeroout is True, zero the device instead of discarding it, using the
+    BLKZEROOUT ioctl. The kernel offloads zeroing to the storage using WRITE
+    SAME if supported by the device.
+
+    If stop is specified, it is called periodically while the command is
+    running, and the command is killed if it returns True.
+
+    Raises:
+        exception.ActionStopped if stopped
+        cmdutils.Error if the command failed
+    """
     cmd = [_blkdiscard.cmd]
+    if zeroout:
+        cmd.append("--zeroout")
     cmd.append(device)
 
-    rc, out, err = commands.execCmd(cmd)
+    if stop is None:
+        rc, out, err = commands.execCmd(cmd)
+    else:
+        rc, out, err = commands.watchCmd(cmd, stop=stop)
 
     if rc != 0:
         raise cmdutils.Error(cmd, rc, out, err)
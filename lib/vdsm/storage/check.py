@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -27,16 +27,23 @@ CheckService     entry point for starting and stopping path checkers.
 DirectioChecker  checker using dd process for file or block based
                  volumes.
 
+HelperChecker    checker using a shared helper process for file or block
+                 based volumes.
+
 CheckResult      result object provided to user callback on each check.
 """
 
 from __future__ import absolute_import
 
+import json
 import logging
+import os
 import re
 import subprocess
 import threading
 
+import six
+
 from vdsm import cmdutils
 from vdsm import concurrent
 from vdsm import constants
@@ -46,6 +53,9 @@ from vdsm.storage import asyncutils
 from vdsm.storage import exception
 
 EXEC_ERROR = 127
+READ_ERROR = 1
+
+_CHECKER = os.path.join(constants.P_VDSM_EXEC, "checker")
 
 _log = logging.getLogger("storage.check")
 
@@ -76,14 +86,17 @@ class CheckService(object):
 
         service.stop()
 
+    If use_helper is True, all paths are checked by a single long lived
+    helper process, instead of starting a dd process for every check.
     """
 
-    def __init__(self):
+    def __init__(self, use_helper=False):
         self._lock = threading.Lock()
         self._loop = asyncevent.EventLoop()
         self._thread = concurrent.thread(self._loop.run_forever,
                                          name="check/loop")
         self._checkers = {}
+        self._helper = HelperProcess(self._loop) if use_helper else None
 
     def start(self):
         """
@@ -109,6 +122,8 @@ class CheckService(object):
             self._checkers.clear()
             self._loop.call_soon_threadsafe(self._loop.stop)
             self._thread.join()
+            if self._helper:
+                self._helper.close()
             self._loop.close()
 
     def start_checking(self, path, complete, interval=10.0):
@@ -123,8 +138,12 @@ class CheckService(object):
         with self._lock:
             if path in self._checkers:
                 raise RuntimeError("Already checking path %r" % path)
-            checker = DirectioChecker(self._loop, path, complete,
-                                      interval=interval)
+            if self._helper:
+                checker = HelperChecker(self._loop, self._helper, path,
+                                        complete, interval=interval)
+            else:
+                checker = DirectioChecker(self._loop, path, complete,
+                                          interval=interval)
             self._checkers[path] = checker
         self._loop.call_soon_threadsafe(checker.start)
 
@@ -331,9 +350,11 @@ class DirectioChecker(object):
         if self._state is STOPPING:
             self._stop_completed()
             return
-        result = CheckResult(self._path, rc, self._err, self._check_time,
-                             elapsed)
-        self._complete(result)
+        self._complete(self._result(rc, elapsed))
+
+    def _result(self, rc, elapsed):
+        return CheckResult(self._path, rc, self._err, self._check_time,
+                           elapsed)
 
     def __repr__(self):
         info = [self.__class__.__name__,
@@ -344,22 +365,176 @@ class DirectioChecker(object):
         return "<%s at 0x%x>" % (" ".join(info), id(self))
 
 
+class HelperChecker(DirectioChecker):
+    """
+    Check path availability using direct I/O in a shared helper process.
+
+    Works like DirectioChecker, but instead of starting a dd process for
+    every check, the path is sent to a long lived helper process checking all
+    paths. The reported delay is measured by the helper around the read, and
+    does not include the time to start a process.
+
+    Usage::
+
+        helper = HelperProcess(loop)
+        checker = HelperChecker(loop, helper, path, complete)
+        loop.call_soon_threadsafe(checker.start)
+
+    """
+
+    def __init__(self, loop, helper, path, complete, interval=10.0):
+        super(HelperChecker, self).__init__(loop, path, complete,
+                                            interval=interval)
+        self._helper = helper
+        self._read_delay = None
+
+    def _start_process(self):
+        """
+        Send the path to the helper process. When the helper has checked the
+        path, _helper_completed will be called.
+        """
+        self._helper.check(self._path, self._helper_completed)
+        # The check is performed by the helper process; the checker is busy
+        # until the helper completes the check.
+        self._proc = self._helper
+
+    def _helper_completed(self, rc, err, delay):
+        assert self._state is not IDLE
+        self._err = err
+        self._read_delay = delay
+        self._check_completed(rc)
+
+    def _result(self, rc, elapsed):
+        return CheckResult(self._path, rc, self._err, self._check_time,
+                           elapsed, read_delay=self._read_delay)
+
+
+class HelperProcess(object):
+    """
+    Long lived helper process checking paths using direct I/O.
+
+    Check requests submitted in the same event loop iteration are sent to the
+    helper together. The helper reads all paths concurrently, so a path that
+    is not accessible does not delay checking other paths.
+
+    If the helper process terminates, pending checks fail, and a new helper is
+    started on the next check.
+
+    Not thread safe, must be used only from the event loop thread.
+    """
+
+    log = logging.getLogger("storage.checkhelper")
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._proc = None
+        self._reader = None
+        # path -> complete callback
+        self._waiting = {}
+        self._requests = []
+
+    def check(self, path, complete):
+        """
+        Check path, invoking complete(rc, err, delay) when done.
+        """
+        if path in self._waiting:
+            raise RuntimeError("Path %r is being checked" % path)
+        self._waiting[path] = complete
+        if not self._requests:
+            self._loop.call_soon(self._send_requests)
+        self._requests.append(path)
+
+    def close(self):
+        """
+        Terminate the helper process, without waiting for it.
+        """
+        if self._proc is None:
+            return
+        self.log.info("Terminating checker helper pid=%s", self._proc.pid)
+        self._proc.stdin.close()
+        self._proc.kill()
+        self._proc = None
+
+    def _send_requests(self):
+        requests = self._requests
+        self._requests = []
+        try:
+            if self._proc is None:
+                self._start_process()
+            data = "".join(path + "\n" for path in requests)
+            if isinstance(data, six.text_type):
+                data = data.encode("utf-8")
+            self._proc.stdin.write(data)
+            self._proc.stdin.flush()
+        except Exception as e:
+            self.log.exception("Error sending requests to checker helper")
+            for path in requests:
+                self._complete(path, EXEC_ERROR,
+                               "Error sending request to helper: %s" % e, None)
+
+    def _start_process(self):
+        cmd = cmdutils.wrap_command([_CHECKER])
+        self._proc = CPopen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=None)
+        self.log.info("Started checker helper pid=%s", self._proc.pid)
+        self._reader = self._loop.create_dispatcher(
+            asyncevent.LineReader, self._proc.stdout, self._line_received,
+            self._helper_terminated)
+
+    def _line_received(self, line):
+        try:
+            result = json.loads(line.decode("utf-8"))
+            path = result["path"]
+        except (ValueError, KeyError):
+            self.log.error("Invalid response from checker helper: %r", line)
+            return
+        if "error" in result:
+            self._complete(path, READ_ERROR, result["error"], None)
+        else:
+            self._complete(path, 0, None, result["delay"])
+
+    def _helper_terminated(self):
+        proc = self._proc
+        self._proc = None
+        self._reader = None
+        if proc is not None:
+            self.log.error("Checker helper pid=%s terminated", proc.pid)
+            asyncevent.Reaper(self._loop, proc, self._helper_reaped)
+        for path in list(self._waiting):
+            self._complete(path, EXEC_ERROR, "Checker helper terminated",
+                           None)
+
+    def _helper_reaped(self, rc):
+        self.log.debug("Checker helper terminated with rc=%s", rc)
+
+    def _complete(self, path, rc, err, delay):
+        try:
+            complete = self._waiting.pop(path)
+        except KeyError:
+            self.log.warning("Unexpected result for path %r", path)
+            return
+        complete(rc, err, delay)
+
+
 class CheckResult(object):
 
     _PATTERN = re.compile(br".*, ([\de\-.]+) s,[^,]+")
 
-    def __init__(self, path, rc, err, time, elapsed):
+    def __init__(self, path, rc, err, time, elapsed, read_delay=None):
         self.path = path
         self.rc = rc
         self.err = err
         self.time = time
         self.elapsed = elapsed
+        self.read_delay = read_delay
 
     def delay(self):
         # TODO: Raising MiscFileReadException for all errors to keep the old
         # behavior. Should probably use StorageDomainAccessError.
         if self.rc != 0:
             raise exception.MiscFileReadException(self.path, self.rc, self.err)
+        if self.read_delay is not None:
+            return self.read_delay
         if not self.err:
             raise exception.MiscFileReadException(self.path, "no stats")
         stats = self.err.splitlines()[-1]
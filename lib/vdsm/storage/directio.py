@@ -1,4 +1,4 @@
-# Copyright 2012-2016 Red Hat, Inc.
+# Copyright 2012-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -36,6 +36,67 @@ _PC_REC_XFER_ALIGN = 17
 _PC_REC_MIN_XFER_SIZE = 16
 
 
+class AlignedBuffer(object):
+    """
+    Aligned buffer for direct I/O, allocated once and reused for many reads
+    and writes.
+    """
+
+    def __init__(self, size, alignment=4096):
+        self._size = size
+        # Keep a reference, libc may be gone when freeing during shutdown.
+        self._free = libc.free
+        self._buf = ctypes.c_void_p()
+        rc = libc.posix_memalign(ctypes.byref(self._buf), alignment, size)
+        if rc:
+            raise OSError(rc, "Could not allocate aligned buffer")
+        ctypes.memset(self._buf, 0, size)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def address(self):
+        return self._buf
+
+    def getvalue(self, size):
+        """
+        Return a copy of the first size bytes in the buffer.
+        """
+        if size > self._size:
+            raise ValueError("size %d larger than buffer size %d"
+                             % (size, self._size))
+        return ctypes.string_at(self._buf, size)
+
+    def setvalue(self, data):
+        """
+        Copy data to the start of the buffer.
+        """
+        if len(data) > self._size:
+            raise ValueError("data length %d larger than buffer size %d"
+                             % (len(data), self._size))
+        if isinstance(data, bytearray):
+            # Copy directly from the bytearray memory.
+            data = (ctypes.c_char * len(data)).from_buffer(data)
+        ctypes.memmove(self._buf, data, len(data))
+
+    def close(self):
+        if self._buf:
+            self._free(self._buf)
+            self._buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_buf"):
+            self.close()
+
+
 class DirectFile(object):
 
     def __init__(self, path, mode):
@@ -160,6 +221,40 @@ class DirectFile(object):
                     msg = os.strerror(err)
                     raise OSError(err, msg)
 
+    def pread(self, buf, size, offset):
+        """
+        Read size bytes at offset into AlignedBuffer buf, without changing
+        the file position. Returns the number of bytes read.
+        """
+        if size % 512 or offset % 512:
+            raise ValueError("You can only read in 512 multiplies")
+        if size > buf.size:
+            raise ValueError("size %d larger than buffer size %d"
+                             % (size, buf.size))
+        numRead = libc.pread(self._fd, buf.address, size,
+                             ctypes.c_int64(offset))
+        if numRead < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return numRead
+
+    def pwrite(self, buf, size, offset):
+        """
+        Write size bytes from AlignedBuffer buf at offset, without changing
+        the file position. Returns the number of bytes written.
+        """
+        if size % 512 or offset % 512:
+            raise ValueError("You can only write in 512 multiplies")
+        if size > buf.size:
+            raise ValueError("size %d larger than buffer size %d"
+                             % (size, buf.size))
+        numWritten = libc.pwrite(self._fd, buf.address, size,
+                                 ctypes.c_int64(offset))
+        if numWritten < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return numWritten
+
     def seek(self, offset, whence=os.SEEK_SET):
         return os.lseek(self._fd, offset, whence)
 
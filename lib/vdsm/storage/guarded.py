@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -88,12 +88,15 @@ class context(object):
         return locks
 
     def __enter__(self):
-        for lock in self._locks:
+        for batch in _batches(self._locks):
             try:
-                lock.acquire()
+                if len(batch) > 1:
+                    type(batch[0]).acquire_many(batch)
+                else:
+                    batch[0].acquire()
             except:
                 exc = sys.exc_info()
-                log.error("Error acquiring lock %r", lock)
+                log.error("Error acquiring locks %r", batch)
                 try:
                     self._release()
                 except ReleaseError:
@@ -103,7 +106,7 @@ class context(object):
                 finally:
                     del exc
 
-            self._held_locks.append(lock)
+            self._held_locks.extend(batch)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -128,6 +131,20 @@ class context(object):
             raise ReleaseError(errors)
 
 
+def _batches(locks):
+    """
+    Group consecutive sorted locks of the same type that can be acquired
+    together. A lock type supports this by implementing an acquire_many()
+    class method, acquiring all the locks or none of them.
+    """
+    for cls, group in itertools.groupby(locks, type):
+        if hasattr(cls, "acquire_many"):
+            yield list(group)
+        else:
+            for lock in group:
+                yield [lock]
+
+
 class AbstractLock(object):
     @property
     def ns(self):
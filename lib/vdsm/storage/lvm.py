@@ -35,10 +35,14 @@ import grp
 import logging
 from collections import namedtuple
 import pprint as pp
+import sys
 import threading
+import time
 from itertools import chain
 from subprocess import list2cmdline
 
+import six
+
 from vdsm import constants
 from vdsm.storage import devicemapper
 from vdsm.storage import exception as se
@@ -100,6 +104,12 @@ PVS_CMD = ("pvs",) + LVM_FLAGS + ("-o", PV_FIELDS)
 VGS_CMD = ("vgs",) + LVM_FLAGS + ("-o", VG_FIELDS)
 LVS_CMD = ("lvs",) + LVM_FLAGS + ("-o", LV_FIELDS)
 
+# Used by the incremental cache. The vg sequence number is incremented by lvm
+# on every metadata commit, so comparing it with the number we expect tells us
+# if the vg was modified by someone else since we loaded its lvs.
+VG_SEQNO_CMD = ("vgs",) + LVM_FLAGS + ("-o", "vg_seqno")
+LVS_SEQNO_CMD = ("lvs",) + LVM_FLAGS + ("-o", LV_FIELDS + ",vg_seqno")
+
 # FIXME we must use different METADATA_USER ownership for qemu-unreadable
 # metadata volumes
 USER_GROUP = constants.DISKIMAGE_USER + ":" + constants.DISKIMAGE_GROUP
@@ -233,9 +243,43 @@ def makeLV(*args):
     return LV(*args)
 
 
+class _LVsBatch(object):
+    """
+    A batch of vgs whose lvs are reloaded by one lvs command.
+    """
+
+    def __init__(self):
+        self.vgNames = set()
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self, load):
+        try:
+            self._result = load(tuple(sorted(self.vgNames)))
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def wait(self):
+        self._done.wait()
+
+    def result(self):
+        if self._exc_info:
+            six.reraise(*self._exc_info)
+        return self._result
+
+
 class LVMCache(object):
     """
     Keep all the LVM information.
+
+    In incremental mode, changes made by vdsm (createLV, extendLV,
+    changeLVTags, removeLVs) are applied directly to the cached lvs, and
+    invalidating a vg only schedules a check of the vg sequence number. The
+    vg lvs are reloaded only if the sequence number shows that the vg was
+    modified by another host.
     """
 
     def _getCachedExtraCfg(self):
@@ -273,7 +317,8 @@ class LVMCache(object):
         self.invalidateFilter()
         self.flush()
 
-    def __init__(self):
+    def __init__(self, incremental=False, batchWindow=0):
+        self._incremental = incremental
         self._filterStale = True
         self._extraCfg = None
         self._filterLock = threading.Lock()
@@ -284,6 +329,19 @@ class LVMCache(object):
         self._pvs = {}
         self._vgs = {}
         self._lvs = {}
+        # Incremental mode: expected seqno of vgs with loaded lvs, and vgs
+        # that must be checked before using their cached lvs.
+        self._seqnos = {}
+        self._unverified = set()
+        # Reloads of entire vgs requested during the batch window are joined
+        # to one lvs command.
+        self._batchWindow = batchWindow
+        self._batchLock = threading.Lock()
+        self._pendingBatch = None
+        self._runningBatch = None
+        self._statsLock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0,
+                       "seqno_checks": 0}
 
     def cmd(self, cmd, devices=tuple()):
         finalCmd = self._addExtraCfg(cmd, devices)
@@ -307,6 +365,21 @@ class LVMCache(object):
                  pp.pformat(self._vgs),
                  pp.pformat(self._lvs)))
 
+    def _count(self, name):
+        with self._statsLock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """
+        Return cache counters:
+            hits: lookups served from the cache
+            misses: lookups that required running lvm
+            reloads: lvm commands run to reload the cache
+            seqno_checks: vg seqno checks (incremental mode)
+        """
+        with self._statsLock:
+            return dict(self._stats)
+
     def bootstrap(self):
         self._reloadpvs()
         self._reloadvgs()
@@ -318,6 +391,7 @@ class LVMCache(object):
         cmd.extend(pvNames)
 
         rc, out, err = self.cmd(cmd)
+        self._count("reloads")
 
         with self._lock:
             if rc != 0:
@@ -371,6 +445,7 @@ class LVMCache(object):
         cmd.extend(vgNames)
 
         rc, out, err = self.cmd(cmd, self._getVGDevs(vgNames))
+        self._count("reloads")
 
         with self._lock:
             if rc != 0:
@@ -419,13 +494,37 @@ class LVMCache(object):
 
     def _reloadlvs(self, vgName, lvNames=None):
         lvNames = _normalizeargs(lvNames)
-        cmd = list(LVS_CMD)
+        if not lvNames and self._batchWindow > 0:
+            return self._batchReloadlvs(vgName)
+        return self._loadlvs((vgName,), lvNames)
+
+    def _loadlvs(self, vgNames, lvNames=()):
+        """
+        Reload the lvs of vgNames using one lvs command. lvNames may be
+        specified only when reloading lvs from a single vg.
+        """
+        # When reloading all the lvs of the vgs, get also the vgs seqno
+        # matching the reloaded lvs.
+        withSeqno = self._incremental and not lvNames
+        cmd = list(LVS_SEQNO_CMD if withSeqno else LVS_CMD)
         if lvNames:
+            vgName = vgNames[0]
             cmd.extend(["%s/%s" % (vgName, lvName) for lvName in lvNames])
         else:
-            cmd.append(vgName)
+            cmd.extend(vgNames)
 
-        rc, out, err = self.cmd(cmd, self._getVGDevs((vgName,)))
+        rc, out, err = self.cmd(cmd, self._getVGDevs(vgNames))
+        self._count("reloads")
+
+        if rc != 0 and len(vgNames) > 1:
+            # lvs fails if any of the vgs is missing; reload each vg
+            # separately so one bad vg does not fail the others.
+            log.warning("lvm lvs failed for vgs %s, reloading each vg: %s %s "
+                        "%s", vgNames, str(rc), str(out), str(err))
+            updatedLVs = {}
+            for vgName in vgNames:
+                updatedLVs.update(self._loadlvs((vgName,)))
+            return updatedLVs
 
         with self._lock:
             if rc != 0:
@@ -438,25 +537,33 @@ class LVMCache(object):
                 return dict(self._lvs)
 
             updatedLVs = {}
+            seqnos = {}
             for line in out:
                 fields = [field.strip() for field in line.split(SEPARATOR)]
+                if withSeqno:
+                    seqno = int(fields.pop())
                 lv = makeLV(*fields)
+                if withSeqno:
+                    seqnos[lv.vg_name] = seqno
                 # For LV we are only interested in its first extent
                 if lv.seg_start_pe == "0":
                     self._lvs[(lv.vg_name, lv.name)] = lv
                     updatedLVs[(lv.vg_name, lv.name)] = lv
 
+            for vg, seqno in six.iteritems(seqnos):
+                self._seqnos[vg] = seqno
+                self._unverified.discard(vg)
+
             # Determine if there are stale LVs
             if lvNames:
-                staleLVs = (lvName for lvName in lvNames
-                            if (vgName, lvName) not in updatedLVs.iterkeys())
+                staleLVs = ((vgName, lvName) for lvName in lvNames
+                            if (vgName, lvName) not in updatedLVs)
             else:
-                # All the LVs in the VG
-                staleLVs = (lvName for v, lvName in self._lvs.keys()
-                            if (v == vgName) and
-                            ((vgName, lvName) not in updatedLVs.iterkeys()))
+                # All the LVs in the VGs
+                staleLVs = (key for key in self._lvs.keys()
+                            if key[0] in vgNames and key not in updatedLVs)
 
-            for lvName in staleLVs:
+            for vgName, lvName in staleLVs:
                 log.warning("Removing stale lv: %s/%s", vgName, lvName)
                 self._lvs.pop((vgName, lvName), None)
 
@@ -464,17 +571,63 @@ class LVMCache(object):
 
         return updatedLVs
 
+    def _batchReloadlvs(self, vgName):
+        """
+        Reload all the lvs in vgName, together with other vgs requested by
+        concurrent callers during the batch window.
+
+        The first caller waits for the batch window and runs one lvs command
+        for all the vgs added to the batch meanwhile. Other callers join the
+        pending batch and wait until it is done.
+
+        Callers arriving while a batch is running cannot use its results,
+        since the lvs command may have started before they invalidated their
+        vg. They are queued into the next batch, which runs when the running
+        batch is done.
+        """
+        with self._batchLock:
+            batch = self._pendingBatch
+            leader = batch is None
+            if leader:
+                batch = self._pendingBatch = _LVsBatch()
+            batch.vgNames.add(vgName)
+
+        if leader:
+            time.sleep(self._batchWindow)
+            with self._batchLock:
+                running = self._runningBatch
+            if running is not None:
+                running.wait()
+            with self._batchLock:
+                self._pendingBatch = None
+                self._runningBatch = batch
+            try:
+                batch.run(self._loadlvs)
+            finally:
+                with self._batchLock:
+                    self._runningBatch = None
+        else:
+            batch.wait()
+
+        return {key: lv for key, lv in six.iteritems(batch.result())
+                if key[0] == vgName}
+
     def _reloadAllLvs(self):
         """
         Used only during bootstrap.
         """
-        cmd = list(LVS_CMD)
+        cmd = list(LVS_SEQNO_CMD if self._incremental else LVS_CMD)
         rc, out, err = self.cmd(cmd)
+        self._count("reloads")
         if rc == 0:
             updatedLVs = set()
             for line in out:
                 fields = [field.strip() for field in line.split(SEPARATOR)]
+                if self._incremental:
+                    seqno = int(fields.pop())
                 lv = makeLV(*fields)
+                if self._incremental:
+                    self._seqnos[lv.vg_name] = seqno
                 # For LV we are only interested in its first extent
                 if lv.seg_start_pe == "0":
                     self._lvs[(lv.vg_name, lv.name)] = lv
@@ -486,6 +639,7 @@ class LVMCache(object):
                     self._lvs.pop((vgName, lvName), None)
                     log.error("Removing stale lv: %s/%s", vgName, lvName)
             self._stalelv = False
+            self._unverified.clear()
         return dict(self._lvs)
 
     def _invalidatepvs(self, pvNames):
@@ -529,6 +683,110 @@ class LVMCache(object):
         with self._lock:
             self._stalelv = True
             self._lvs.clear()
+            self._seqnos.clear()
+            self._unverified.clear()
+
+    def _checklvs(self, vgName):
+        """
+        Invalidate all the lvs in vgName.
+
+        In incremental mode the cached lvs are kept, and the vg seqno is
+        checked before the next access. The lvs are reloaded only if the vg was
+        modified by another host.
+        """
+        if not self._incremental:
+            self._invalidatelvs(vgName)
+            return
+        with self._lock:
+            self._unverified.add(vgName)
+
+    def _committed(self, vgName, commits):
+        """
+        Account for vg metadata commits done by vdsm, so they are not mistaken
+        for changes made by another host. Must be called with self._lock held.
+        """
+        if vgName in self._seqnos:
+            self._seqnos[vgName] += commits
+
+    def _vgchanged(self, vgName):
+        """
+        Called after vdsm changed the vg itself (e.g. vg tags), committing the
+        vg metadata once.
+        """
+        if self._incremental:
+            with self._lock:
+                self._committed(vgName, 1)
+
+    def _addlv(self, vgName, lvName):
+        """
+        Called after vdsm created lvName. Only this lv will be reloaded on the
+        next access, since lvm assigns some of its attributes.
+        """
+        with self._lock:
+            self._lvs[(vgName, lvName)] = Stub(lvName, True)
+            if self._incremental:
+                self._committed(vgName, 1)
+
+    def _updatelv(self, vgName, lvName, update, commits=1):
+        """
+        Called after vdsm changed lvName. In incremental mode the cached lv is
+        replaced by update(lv), otherwise the lv is invalidated.
+        """
+        if not self._incremental:
+            self._invalidatelvs(vgName, lvName)
+            return
+        with self._lock:
+            lv = self._lvs.get((vgName, lvName))
+            if lv is None or isinstance(lv, Stub):
+                self._lvs[(vgName, lvName)] = Stub(lvName, True)
+            else:
+                self._lvs[(vgName, lvName)] = update(lv)
+            self._committed(vgName, commits)
+
+    def _removelvs(self, vgName, lvNames):
+        """
+        Called after vdsm removed lvNames. lvm commits the vg metadata once
+        for every removed lv.
+        """
+        with self._lock:
+            for lvName in lvNames:
+                self._lvs.pop((vgName, lvName), None)
+            if self._incremental:
+                self._committed(vgName, len(lvNames))
+
+    def _readSeqno(self, vgName):
+        cmd = list(VG_SEQNO_CMD)
+        cmd.append(vgName)
+        rc, out, err = self.cmd(cmd, self._getVGDevs((vgName,)))
+        self._count("seqno_checks")
+        if rc != 0 or not out:
+            log.warning("lvm vgs failed: %s %s %s", str(rc), str(out),
+                        str(err))
+            return None
+        return int(out[0].strip())
+
+    def _verifylvs(self, vgName):
+        """
+        Make sure the cached lvs of vgName are up to date, reloading them if
+        they were never loaded, or if the vg seqno does not match the expected
+        seqno. Returns True if the lvs were reloaded.
+        """
+        with self._lock:
+            expected = self._seqnos.get(vgName)
+            unverified = vgName in self._unverified
+            self._unverified.discard(vgName)
+
+        if expected is not None:
+            if not unverified:
+                return False
+            seqno = self._readSeqno(vgName)
+            if seqno == expected:
+                return False
+            log.info("vg %s was modified (seqno=%s, expected=%s), reloading "
+                     "lvs", vgName, seqno, expected)
+
+        self._reloadlvs(vgName)
+        return True
 
     def flush(self):
         self._invalidateAllPvs()
@@ -539,8 +797,11 @@ class LVMCache(object):
         # Get specific PV
         pv = self._pvs.get(pvName)
         if not pv or isinstance(pv, Stub):
+            self._count("misses")
             pvs = self._reloadpvs(pvName)
             pv = pvs.get(pvName)
+        else:
+            self._count("hits")
         return pv
 
     def getAllPvs(self):
@@ -580,8 +841,11 @@ class LVMCache(object):
         # Get specific VG
         vg = self._vgs.get(vgName)
         if not vg or isinstance(vg, Stub):
+            self._count("misses")
             vgs = self._reloadvgs(vgName)
             vg = vgs.get(vgName)
+        else:
+            self._count("hits")
         return vg
 
     def getVgs(self, vgNames):
@@ -617,16 +881,22 @@ class LVMCache(object):
         # If only 'lvName' is None then return all the LVs in the given VG
         # If only 'vgName' is None it is weird, so return nothing
         # (we can consider returning all the LVs with a given name)
+        if self._incremental:
+            return self._getLvIncremental(vgName, lvName)
+
         if lvName:
             # vgName, lvName
             lv = self._lvs.get((vgName, lvName))
             if not lv or isinstance(lv, Stub):
+                self._count("misses")
                 # while we here reload all the LVs in the VG
                 lvs = self._reloadlvs(vgName)
                 lv = lvs.get((vgName, lvName))
                 if not lv:
                     log.warning("lv: %s not found in lvs vg: %s response",
                                 lvName, vgName)
+            else:
+                self._count("hits")
             res = lv
         else:
             # vgName, None
@@ -637,8 +907,10 @@ class LVMCache(object):
             # Fix me: should not be more stubs
             if self._stalelv or any(isinstance(lv, Stub)
                                     for lv in self._lvs.values()):
+                self._count("misses")
                 lvs = self._reloadlvs(vgName)
             else:
+                self._count("hits")
                 lvs = dict(self._lvs)
             # lvs = self._reloadlvs()
             lvs = [lv for lv in lvs.values()
@@ -646,6 +918,38 @@ class LVMCache(object):
             res = lvs
         return res
 
+    def _getLvIncremental(self, vgName, lvName=None):
+        """
+        Like getLv, but reload only the lvs which are not up to date, instead
+        of all the lvs in the vg.
+        """
+        reloaded = self._verifylvs(vgName)
+
+        if lvName:
+            lv = self._lvs.get((vgName, lvName))
+            if not lv or isinstance(lv, Stub):
+                reloaded = True
+                lv = self._reloadlvs(vgName, (lvName,)).get((vgName, lvName))
+                if not lv or isinstance(lv, Stub):
+                    # lvs fails if the lv does not exist, reload the entire vg
+                    # to remove it from the cache.
+                    lv = self._reloadlvs(vgName).get((vgName, lvName))
+                if not lv:
+                    log.warning("lv: %s not found in lvs vg: %s response",
+                                lvName, vgName)
+            res = lv
+        else:
+            stale = any(vg == vgName and isinstance(lv, Stub)
+                        for (vg, _), lv in self._lvs.items())
+            if stale:
+                reloaded = True
+                self._reloadlvs(vgName)
+            res = [lv for lv in self._lvs.values()
+                   if not isinstance(lv, Stub) and lv.vg_name == vgName]
+
+        self._count("misses" if reloaded else "hits")
+        return res
+
     def getAllLvs(self):
         # None, None
         if self._stalelv or any(isinstance(lv, Stub)
@@ -655,7 +959,9 @@ class LVMCache(object):
             lvs = dict(self._lvs)
         return lvs.values()
 
-_lvminfo = LVMCache()
+_lvminfo = LVMCache(
+    incremental=config.getboolean("irs", "lvm_incremental_cache"),
+    batchWindow=config.getfloat("irs", "lvm_reload_batch_window"))
 
 
 def bootstrap(refreshlvs=()):
@@ -706,6 +1012,10 @@ def invalidateCache():
     _lvminfo.invalidateCache()
 
 
+def cacheStats():
+    return _lvminfo.stats()
+
+
 def _fqpvname(pv):
     if pv and not pv.startswith(PV_PREFIX):
         pv = os.path.join(PV_PREFIX, pv)
@@ -1082,7 +1392,7 @@ def deactivateVG(vgName):
 def invalidateVG(vgName, invalidateLVs=True, invalidatePVs=False):
     _lvminfo._invalidatevgs(vgName)
     if invalidateLVs:
-        _lvminfo._invalidatelvs(vgName)
+        _lvminfo._checklvs(vgName)
     if invalidatePVs:
         vgPvs = listPVNames(vgName)
         _lvminfo._invalidatepvs(pvNames=vgPvs)
@@ -1156,7 +1466,7 @@ def createLV(vgName, lvName, size, activate=True, contiguous=False,
 
     if rc == 0:
         _lvminfo._invalidatevgs(vgName)
-        _lvminfo._invalidatelvs(vgName, lvName)
+        _lvminfo._addlv(vgName, lvName)
     else:
         raise se.CannotCreateLogicalVolume(vgName, lvName)
 
@@ -1197,11 +1507,10 @@ def removeLVs(vgName, lvNames):
         cmd.append("%s/%s" % (vgName, lvName))
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vgName, )))
     if rc == 0:
-        for lvName in lvNames:
-            # Remove the LV from the cache
-            _lvminfo._lvs.pop((vgName, lvName), None)
-            # If lvremove succeeded it affected VG as well
-            _lvminfo._invalidatevgs(vgName)
+        # Remove the LVs from the cache
+        _lvminfo._removelvs(vgName, lvNames)
+        # If lvremove succeeded it affected VG as well
+        _lvminfo._invalidatevgs(vgName)
     else:
         # Otherwise LV info needs to be refreshed
         _lvminfo._invalidatelvs(vgName, lvNames)
@@ -1239,8 +1548,7 @@ def extendLV(vgName, lvName, size_mb):
 
         raise se.LogicalVolumeExtendError(vgName, lvName, "%sm" % (size_mb,))
 
-    _lvminfo._invalidatevgs(vgName)
-    _lvminfo._invalidatelvs(vgName, lvName)
+    _resizedLV(vgName, lvName, size_mb)
 
 
 def reduceLV(vgName, lvName, size_mb):
@@ -1267,8 +1575,25 @@ def reduceLV(vgName, lvName, size_mb):
         # TODO: add and raise LogicalVolumeReduceError
         raise se.LogicalVolumeExtendError(vgName, lvName, "%sm" % (size_mb,))
 
+    _resizedLV(vgName, lvName, size_mb)
+
+
+def _resizedLV(vgName, lvName, size_mb):
+    """
+    Update the cache after lvName was resized to size_mb, rounded up to
+    complete extents like lvm does.
+    """
+    vg = _lvminfo._vgs.get(vgName)
     _lvminfo._invalidatevgs(vgName)
-    _lvminfo._invalidatelvs(vgName, lvName)
+    if vg is None or isinstance(vg, Stub):
+        # Without the extent size we cannot tell the new lv size.
+        _lvminfo._updatelv(vgName, lvName, lambda lv: Stub(lv.name, True))
+        return
+
+    extent_size = int(vg.extent_size)
+    extents = (size_mb * constants.MEGAB + extent_size - 1) // extent_size
+    size = str(extents * extent_size)
+    _lvminfo._updatelv(vgName, lvName, lambda lv: lv._replace(size=size))
 
 
 def activateLVs(vgName, lvNames):
@@ -1330,11 +1655,13 @@ def addtag(vg, lv, tag):
     lvname = "%s/%s" % (vg, lv)
     cmd = ("lvchange",) + LVM_NOBACKUP + ("--addtag", tag) + (lvname,)
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
     if rc != 0:
+        _lvminfo._invalidatelvs(vg, lv)
         # Fix me: should be se.ChangeLogicalVolumeError but this not exists.
         raise se.MissingTagOnLogicalVolume("%s/%s" % (vg, lv), tag)
 
+    _changedLVTags(vg, lv, (), (tag,))
+
 
 def changeLVTags(vg, lv, delTags=(), addTags=()):
     lvname = '%s/%s' % (vg, lv)
@@ -1357,12 +1684,28 @@ def changeLVTags(vg, lv, delTags=(), addTags=()):
     cmd.append(lvname)
 
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
     if rc != 0:
+        _lvminfo._invalidatelvs(vg, lv)
         raise se.LogicalVolumeReplaceTagError(
             'lv: `%s` add: `%s` del: `%s` (%s)' %
             (lvname, ", ".join(addTags), ", ".join(delTags), err[-1]))
 
+    _changedLVTags(vg, lv, delTags, addTags)
+
+
+def _changedLVTags(vg, lv, delTags, addTags):
+    """
+    Update the cache after changing lv tags. lvm commits the vg metadata once
+    for the deleted tags and once for the added tags.
+    """
+    def update(cached):
+        tags = [t for t in cached.tags if t not in delTags]
+        tags.extend(sorted(t for t in addTags if t not in tags))
+        return cached._replace(tags=tuple(tags))
+
+    commits = int(bool(delTags)) + int(bool(addTags))
+    _lvminfo._updatelv(vg, lv, update, commits=commits)
+
 
 def addLVTags(vg, lv, addTags):
     changeLVTags(vg, lv, addTags=addTags)
@@ -1416,6 +1759,7 @@ def changeVGTags(vgName, delTags=(), addTags=()):
         raise se.VolumeGroupReplaceTagError(
             "vg:%s del:%s add:%s (%s)" %
             (vgName, ", ".join(delTags), ", ".join(addTags), err[-1]))
+    _lvminfo._vgchanged(vgName)
 
 
 def replaceVGTag(vg, oldTag, newTag):
@@ -1487,7 +1831,9 @@ def replaceLVTag(vg, lv, deltag, addtag):
     cmd = (("lvchange",) + LVM_NOBACKUP + ("--deltag", deltag) +
            ("--addtag", addtag) + (lvname,))
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
     if rc != 0:
+        _lvminfo._invalidatelvs(vg, lv)
         raise se.LogicalVolumeReplaceTagError("%s/%s" % (vg, lv),
                                               "%s,%s" % (deltag, addtag))
+
+    _changedLVTags(vg, lv, (deltag,), (addtag,))
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,6 +19,7 @@
 #
 
 from __future__ import absolute_import
+import collections
 import os
 import errno
 import time
@@ -28,16 +29,20 @@ import logging
 
 import uuid
 
+import six
 from six.moves import queue
 
+from vdsm.common.histogram import Histogram
 from vdsm.config import config
+from vdsm.metrics import Metric
+from vdsm.storage import directio
 from vdsm.storage import misc
 from vdsm.storage import task
 from vdsm.storage.exception import InvalidParameterException
 from vdsm.storage.threadPool import ThreadPool
 
 from vdsm import concurrent
-from vdsm import constants
+from vdsm import utils
 
 __author__ = "ayalb"
 __date__ = "$Mar 9, 2009 5:25:07 PM$"
@@ -60,6 +65,9 @@ SLOTS_PER_MAILBOX = int(MAILBOX_SIZE / MESSAGE_SIZE)
 # etc)
 MESSAGES_PER_MAILBOX = SLOTS_PER_MAILBOX - 1
 
+# Seconds to wait for running volume extensions when stopping the SPM.
+EXTEND_STOP_TIMEOUT = 60
+
 _zeroCheck = misc.checksum(EMPTYMAILBOX, CHECKSUM_BYTES)
 # Assumes CHECKSUM_BYTES equals 4!!!
 pZeroChecksum = struct.pack('<l', _zeroCheck)
@@ -80,10 +88,6 @@ def runTask(args):
     ctask.prepare(cmd, *args)
 
 
-def _mboxExecCmd(*args, **kwargs):
-    return misc.execCmd(*args, **kwargs)
-
-
 class SPM_Extend_Message:
 
     log = logging.getLogger('storage.SPM.Messages.Extend')
@@ -106,6 +110,7 @@ class SPM_Extend_Message:
         self.volumeData = volumeData
         self.newSize = str(dec2hex(newSize))
         self.callback = callbackFunction
+        self.created = utils.monotonic_time()
 
         # Message structure is rigid (order must be kept and is relied upon):
         # Version (1 byte), OpCode (4 bytes), Domain UUID (16 bytes), Volume
@@ -142,19 +147,31 @@ class SPM_Extend_Message:
         return REPLY_OK
 
     @classmethod
-    def processRequest(cls, pool, msgID, payload):
-        cls.log.debug("processRequest, payload:" + repr(payload))
+    def parseRequest(cls, payload):
+        """
+        Return domainID, volumeID and requested size of extend request
+        payload.
+        """
         sdOffset = 5
         volumeOffset = sdOffset + PACKED_UUID_SIZE
         sizeOffset = volumeOffset + PACKED_UUID_SIZE
 
-        volume = {}
-        volume['poolID'] = pool.spUUID
-        volume['domainID'] = misc.unpackUuid(
+        domainID = misc.unpackUuid(
             payload[sdOffset:sdOffset + PACKED_UUID_SIZE])
-        volume['volumeID'] = misc.unpackUuid(
+        volumeID = misc.unpackUuid(
             payload[volumeOffset:volumeOffset + PACKED_UUID_SIZE])
         size = int(payload[sizeOffset:sizeOffset + SIZE_CHARS], 16)
+        return domainID, volumeID, size
+
+    @classmethod
+    def processRequest(cls, pool, msgID, payload):
+        cls.log.debug("processRequest, payload:" + repr(payload))
+        domainID, volumeID, size = cls.parseRequest(payload)
+
+        volume = {}
+        volume['poolID'] = pool.spUUID
+        volume['domainID'] = domainID
+        volume['volumeID'] = volumeID
 
         cls.log.info("processRequest: extending volume %s "
                      "in domain %s (pool %s) to size %d", volume['volumeID'],
@@ -176,6 +193,277 @@ class SPM_Extend_Message:
             return {'status': {'code': 0, 'message': 'Done'}}
 
 
+class _ExtendRequest(object):
+    """
+    Pending request to extend a volume, answering one or more messages.
+    """
+
+    def __init__(self, domainID, volumeID, msgID, size):
+        self.domainID = domainID
+        self.volumeID = volumeID
+        self.size = size
+        self.msgIDs = [msgID]
+        self.created = utils.monotonic_time()
+
+    def add(self, msgID, size):
+        if msgID not in self.msgIDs:
+            self.msgIDs.append(msgID)
+        self.size = max(self.size, size)
+
+
+class ExtendExecutor(object):
+    """
+    Execute extend requests received by the SPM mailbox.
+
+    Requests to extend the same volume waiting for execution are coalesced;
+    the volume is extended once to the largest requested size, and all the
+    messages are answered with the same reply.
+
+    Requests for volumes in the same domain are executed serially, to avoid
+    contention on the domain lvm metadata lock. Requests for different
+    domains are executed in parallel, each domain with pending requests
+    using its own worker thread.
+
+    The executor must be stopped, and waited for, before stopping the
+    mailer, so no reply is sent after the mailer was stopped.
+    """
+
+    log = logging.getLogger('storage.MailBox.ExtendExecutor')
+
+    def __init__(self, pool, mailer):
+        self._pool = pool
+        self._mailer = mailer
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._stopped = False
+        # Number of worker threads
+        self._workers = 0
+        # domainID -> deque of _ExtendRequest
+        self._queues = {}
+        # (domainID, volumeID) -> _ExtendRequest waiting for execution
+        self._pending = {}
+        self._running = 0
+        self._coalesced = 0
+        self._waitTime = Histogram()
+        self._serviceTime = Histogram()
+
+    def submit(self, msgID, payload):
+        """
+        Queue extend request payload received in message msgID. Can be
+        registered as a mailbox message handler.
+        """
+        domainID, volumeID, size = SPM_Extend_Message.parseRequest(payload)
+        key = (domainID, volumeID)
+        startWorker = False
+
+        with self._lock:
+            if self._stopped:
+                self.log.warning("Executor stopped, dropping request %s for "
+                                 "volume %s/%s", msgID, domainID, volumeID)
+                return
+
+            req = self._pending.get(key)
+            if req is not None:
+                self.log.debug("Coalescing request %s for volume %s/%s "
+                               "(size=%d) with requests %s", msgID, domainID,
+                               volumeID, size, req.msgIDs)
+                req.add(msgID, size)
+                self._coalesced += 1
+                return
+
+            req = _ExtendRequest(domainID, volumeID, msgID, size)
+            self._pending[key] = req
+
+            queue = self._queues.get(domainID)
+            if queue is None:
+                queue = self._queues[domainID] = collections.deque()
+                self._workers += 1
+                startWorker = True
+            queue.append(req)
+
+        if startWorker:
+            t = concurrent.thread(self._run, args=(domainID,),
+                                  name="extend/" + domainID[:8], log=self.log)
+            t.start()
+
+    def stats(self):
+        """
+        Return queue depth and timing statistics.
+        """
+        with self._lock:
+            queued = len(self._pending)
+            running = self._running
+            coalesced = self._coalesced
+        return {
+            "queued": queued,
+            "running": running,
+            "coalesced": coalesced,
+            "wait_time": self._waitTime.info(),
+            "service_time": self._serviceTime.info(),
+        }
+
+    def report(self):
+        """
+        Return the queue depth and timing metrics. Registered by the SPM as a
+        metrics source.
+        """
+        stats = self.stats()
+        report = [Metric("storage.extend." + key, stats[key])
+                  for key in ("queued", "running", "coalesced")]
+        for key in ("wait_time", "service_time"):
+            for p in ("p50", "p90", "p99"):
+                report.append(Metric("storage.extend.%s_%s" % (key, p),
+                                     stats[key][p]))
+        return report
+
+    def stop(self):
+        """
+        Stop executing requests. Requests waiting for execution are dropped,
+        requests being executed are completed.
+        """
+        with self._lock:
+            self._stopped = True
+            for req in six.itervalues(self._pending):
+                self.log.warning("Executor stopped, dropping requests %s for "
+                                 "volume %s/%s", req.msgIDs, req.domainID,
+                                 req.volumeID)
+            self._pending.clear()
+            for requests in six.itervalues(self._queues):
+                requests.clear()
+
+    def wait(self, timeout=None):
+        """
+        Wait until all worker threads are done. Return True if they are done,
+        False if timeout expired.
+        """
+        if timeout is not None:
+            deadline = utils.monotonic_time() + timeout
+        with self._lock:
+            while self._workers:
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - utils.monotonic_time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+    def _run(self, domainID):
+        while True:
+            with self._lock:
+                queue = self._queues[domainID]
+                if not queue:
+                    del self._queues[domainID]
+                    self._workers -= 1
+                    self._cond.notify_all()
+                    return
+                req = queue.popleft()
+                del self._pending[(req.domainID, req.volumeID)]
+                self._running += 1
+            try:
+                self._execute(req)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def _execute(self, req):
+        if self._isStopped():
+            self.log.warning("Mailbox stopped, dropping requests %s for "
+                             "volume %s/%s", req.msgIDs, req.domainID,
+                             req.volumeID)
+            return
+
+        volume = {
+            'poolID': self._pool.spUUID,
+            'domainID': req.domainID,
+            'volumeID': req.volumeID,
+        }
+
+        self.log.info("Extending volume %s in domain %s (pool %s) to size %d "
+                      "(requests %s)", req.volumeID, req.domainID,
+                      volume['poolID'], req.size, req.msgIDs)
+
+        start = utils.monotonic_time()
+        self._waitTime.add(start - req.created)
+        try:
+            self._pool.extendVolume(req.domainID, req.volumeID, req.size)
+            reply = SPM_Extend_Message(volume, req.size)
+        except Exception:
+            self.log.error("Exception caught while trying to extend volume: "
+                           "%s in domain: %s", req.volumeID, req.domainID,
+                           exc_info=True)
+            reply = SPM_Extend_Message(volume, 0)
+        finally:
+            self._serviceTime.add(utils.monotonic_time() - start)
+
+        # The mailbox may have been stopped while extending.
+        if self._isStopped():
+            self.log.warning("Mailbox stopped, dropping replies %s for "
+                             "volume %s/%s", req.msgIDs, req.domainID,
+                             req.volumeID)
+            return
+
+        for msgID in req.msgIDs:
+            self._mailer.sendReply(msgID, reply)
+
+    def _isStopped(self):
+        return self._stopped or self._mailer.isStopped()
+
+
+class _PollInterval(object):
+    """
+    Mailbox poll interval, adapting to mailbox activity.
+
+    When there is activity, the interval drops to minInterval, so replies
+    and new requests are noticed quickly. While busy, e.g. waiting for
+    replies to requests in flight, the interval stays at minInterval. On
+    every idle poll without activity the interval is doubled, until it
+    reaches maxInterval.
+    """
+
+    def __init__(self, minInterval, maxInterval):
+        self._min = min(minInterval, maxInterval)
+        self._max = maxInterval
+        self._current = maxInterval
+
+    def activity(self):
+        self._current = self._min
+
+    def next(self, busy=False):
+        if busy:
+            self._current = self._min
+            return self._min
+        interval = self._current
+        self._current = min(interval * 2, self._max)
+        return interval
+
+
+class _Failures(object):
+    """
+    Track consecutive failures to check for mail.
+
+    Failures are sustained if checking for mail kept failing for timeout
+    seconds, regardless of the poll interval.
+    """
+
+    def __init__(self, timeout, clock=utils.monotonic_time):
+        self._timeout = timeout
+        self._clock = clock
+        self._since = None
+
+    def success(self):
+        self._since = None
+
+    def failure(self):
+        if self._since is None:
+            self._since = self._clock()
+
+    def sustained(self):
+        return (self._since is not None and
+                self._clock() - self._since >= self._timeout)
+
+
 class HSM_Mailbox:
 
     log = logging.getLogger('storage.Mailbox.HSM')
@@ -225,6 +513,13 @@ class HSM_Mailbox:
             self.log.warning("HSM_MailboxMonitor - No mail monitor object "
                              "available to flush")
 
+    def extendLatency(self):
+        """
+        Return histogram info of the time from sending an extend message
+        until a reply is received from the SPM.
+        """
+        return self._mailman.extendLatency.info()
+
 
 class HSM_MailMonitor(object):
     log = logging.getLogger('storage.MailBox.HsmMailMonitor')
@@ -240,27 +535,26 @@ class HSM_MailMonitor(object):
         self._queue = queue
         self._activeMessages = {}
         self._monitorInterval = monitorInterval
+        self._pollInterval = _PollInterval(
+            config.getfloat('irs', 'mailbox_min_interval'), monitorInterval)
+        # Back off after failing for 10 monitor intervals, as when polling
+        # every monitorInterval.
+        self._failures = _Failures(10 * monitorInterval)
         self._hostID = int(hostID)
         self._used_slots_array = [0] * MESSAGES_PER_MAILBOX
-        self._outgoingMail = EMPTYMAILBOX
+        self._outgoingMail = bytearray(EMPTYMAILBOX)
         self._incomingMail = EMPTYMAILBOX
+        self.extendLatency = Histogram()
         # TODO: add support for multiple paths (multiple mailboxes)
-        self._inCmd = [constants.EXT_DD,
-                       'if=' + str(inbox),
-                       'iflag=direct,fullblock',
-                       'bs=' + str(MAILBOX_SIZE),
-                       'count=1',
-                       'skip=' + str(self._hostID)
-                       ]
-        self._outCmd = [constants.EXT_DD,
-                        'of=' + str(outbox),
-                        'iflag=fullblock',
-                        'oflag=direct',
-                        'conv=notrunc',
-                        'bs=' + str(MAILBOX_SIZE),
-                        'count=1',
-                        'seek=' + str(self._hostID)
-                        ]
+        self._mailboxOffset = MAILBOX_SIZE * self._hostID
+        self._inbox = inbox
+        self._outbox = outbox
+        # Opened when initializing the mailbox, so errors are retried by
+        # the monitor thread.
+        self._inFile = None
+        self._outFile = None
+        self._inBuf = directio.AlignedBuffer(MAILBOX_SIZE)
+        self._outBuf = directio.AlignedBuffer(MAILBOX_SIZE)
         self._init = False
         self._initMailbox()  # Read initial mailbox state
         self._msgCounter = 0
@@ -271,14 +565,32 @@ class HSM_MailMonitor(object):
 
     def _initMailbox(self):
         # Sync initial incoming mail state with storage view
-        (rc, out, err) = _mboxExecCmd(self._inCmd, raw=True)
-        if rc == 0:
-            self._incomingMail = out
+        try:
+            self._open()
+            self._incomingMail = self._readMail()
             self._init = True
-        else:
+        except (OSError, RuntimeError):
             self.log.warning("HSM_MailboxMonitor - Could not initialize "
                              "mailbox, will not accept requests until init "
-                             "succeeds")
+                             "succeeds", exc_info=True)
+
+    def _readMail(self):
+        n = self._inFile.pread(self._inBuf, MAILBOX_SIZE, self._mailboxOffset)
+        if n != MAILBOX_SIZE:
+            raise RuntimeError("_handleResponses.Could not read mailbox - len "
+                               "%s != %s" % (n, MAILBOX_SIZE))
+        return self._inBuf.getvalue(MAILBOX_SIZE)
+
+    def _open(self):
+        if self._inFile is None:
+            self._inFile = directio.DirectFile(self._inbox, "r")
+        if self._outFile is None:
+            self._outFile = directio.DirectFile(self._outbox, "r+")
+
+    def _close(self):
+        for f in (self._inFile, self._outFile, self._inBuf, self._outBuf):
+            if f is not None:
+                f.close()
 
     def immStop(self):
         self._stop = True
@@ -328,21 +640,20 @@ class HSM_MailMonitor(object):
                 del self._activeMessages[i]
                 self._used_slots_array[i] = 0
                 self._msgCounter -= 1
-                self._outgoingMail = self._outgoingMail[0:start] + \
-                    MESSAGE_SIZE * "\0" + self._outgoingMail[start +
-                                                             MESSAGE_SIZE:]
+                self._outgoingMail[start:start + MESSAGE_SIZE] = \
+                    MESSAGE_SIZE * "\0"
                 continue
 
             msg = self._activeMessages[i]
             self._activeMessages[i] = CLEAN_MESSAGE
-            self._outgoingMail = self._outgoingMail[0:start] + \
-                CLEAN_MESSAGE + self._outgoingMail[start + MESSAGE_SIZE:]
+            self._outgoingMail[start:start + MESSAGE_SIZE] = CLEAN_MESSAGE
 
             try:
                 self.log.debug("HSM_MailboxMonitor(%s/%s) - Checking reply: "
                                "%s", self._msgCounter, MESSAGES_PER_MAILBOX,
                                repr(newMsg))
                 msg.checkReply(newMsg)
+                self.extendLatency.add(utils.monotonic_time() - msg.created)
                 if msg.callback:
                     try:
                         id = str(uuid.uuid4())
@@ -371,27 +682,27 @@ class HSM_MailMonitor(object):
 
     def _checkForMail(self):
         # self.log.debug("HSM_MailMonitor - checking for mail")
-        # self.log.debug("Running command: " + str(self._inCmd))
-        (rc, in_mail, err) = misc.execCmd(self._inCmd, raw=True)
-        if rc:
-            raise RuntimeError("_handleResponses.Could not read mailbox - rc "
-                               "%s" % rc)
-        if (len(in_mail) != MAILBOX_SIZE):
-            raise RuntimeError("_handleResponses.Could not read mailbox - len "
-                               "%s != %s" % (len(in_mail), MAILBOX_SIZE))
+        in_mail = self._readMail()
         # self.log.debug("Parsing inbox content: %s", in_mail)
         return self._handleResponses(in_mail)
 
     def _sendMail(self):
-        self.log.info("HSM_MailMonitor sending mail to SPM - " +
-                      str(self._outCmd))
+        self.log.info("HSM_MailMonitor sending mail to SPM - offset %s",
+                      self._mailboxOffset)
         chk = misc.checksum(
-            self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES],
+            bytes(self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES]),
             CHECKSUM_BYTES)
         pChk = struct.pack('<l', chk)  # Assumes CHECKSUM_BYTES equals 4!!!
-        self._outgoingMail = \
-            self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES] + pChk
-        _mboxExecCmd(self._outCmd, data=self._outgoingMail)
+        self._outgoingMail[MAILBOX_SIZE - CHECKSUM_BYTES:] = pChk
+        self._outBuf.setvalue(self._outgoingMail)
+        try:
+            if self._outFile is None:
+                self._outFile = directio.DirectFile(self._outbox, "r+")
+            self._outFile.pwrite(self._outBuf, MAILBOX_SIZE,
+                                 self._mailboxOffset)
+        except OSError:
+            self.log.error("HSM_MailMonitor - could not write outgoing mail",
+                           exc_info=True)
 
     def _handleMessage(self, message):
         # TODO: add support for multiple mailboxes
@@ -419,8 +730,7 @@ class HSM_MailMonitor(object):
         self._activeMessages[freeSlot] = message
         start = freeSlot * MESSAGE_SIZE
         end = start + MESSAGE_SIZE
-        self._outgoingMail = self._outgoingMail[0:start] + message.payload + \
-            self._outgoingMail[end:]
+        self._outgoingMail[start:end] = message.payload
         self.log.debug("HSM_MailMonitor - start: %s, end: %s, len: %s, "
                        "message(%s/%s): %s" %
                        (start, end, len(self._outgoingMail), self._msgCounter,
@@ -429,8 +739,6 @@ class HSM_MailMonitor(object):
 
     def run(self):
         try:
-            failures = 0
-
             # Do not start processing requests before incoming mailbox is
             # initialized
             while not self._init and not self._stop:
@@ -481,27 +789,33 @@ class HSM_MailMonitor(object):
                         self._flush = False
                         sendMail = True
 
+                    if sendMail:
+                        # New requests were added, expect replies soon.
+                        self._pollInterval.activity()
+
                     try:
-                        sendMail |= self._checkForMail()
-                        failures = 0
+                        if self._checkForMail():
+                            sendMail = True
+                            self._pollInterval.activity()
+                        self._failures.success()
                     except:
                         self.log.error("HSM_MailboxMonitor - Exception caught "
                                        "while checking for mail",
                                        exc_info=True)
-                        failures += 1
+                        self._failures.failure()
 
                     if sendMail:
                         self._sendMail()
 
-                    # If there are active messages waiting for SPM reply, wait
-                    # a few seconds before performing another IO op
+                    # If there are active messages waiting for SPM reply, poll
+                    # again soon, without backing off.
                     if self._activeMessages and not self._stop:
-                        # If recurring failures then sleep for one minute
-                        # before retrying
-                        if (failures > 9):
+                        # If checking for mail keeps failing, sleep for one
+                        # minute before retrying
+                        if self._failures.sustained():
                             time.sleep(60)
                         else:
-                            time.sleep(self._monitorInterval)
+                            time.sleep(self._pollInterval.next(busy=True))
 
                 except:
                     self.log.error("HSM_MailboxMonitor - Incoming mail"
@@ -510,8 +824,9 @@ class HSM_MailMonitor(object):
         finally:
             self.log.info("HSM_MailboxMonitor - Incoming mail monitoring "
                           "thread stopped, clearing outgoing mail")
-            self._outgoingMail = EMPTYMAILBOX
+            self._outgoingMail = bytearray(EMPTYMAILBOX)
             self._sendMail()  # Clear outgoing mailbox
+            self._close()
 
 
 class SPM_MailMonitor:
@@ -553,31 +868,25 @@ class SPM_MailMonitor:
         self._numHosts = int(maxHostID)
         self._outMailLen = MAILBOX_SIZE * self._numHosts
         self._monitorInterval = monitorInterval
+        self._pollInterval = _PollInterval(
+            config.getfloat('irs', 'mailbox_min_interval'), monitorInterval)
         # TODO: add support for multiple paths (multiple mailboxes)
-        self._outgoingMail = self._outMailLen * "\0"
-        self._incomingMail = self._outgoingMail
-        self._inCmd = ['dd',
-                       'if=' + str(self._inbox),
-                       'iflag=direct,fullblock',
-                       'count=1'
-                       ]
-        self._outCmd = ['dd',
-                        'of=' + str(self._outbox),
-                        'oflag=direct',
-                        'iflag=fullblock',
-                        'conv=notrunc',
-                        'count=1'
-                        ]
+        self._outgoingMail = bytearray(self._outMailLen)
+        self._outgoingDirty = False
+        self._incomingMail = self._outMailLen * "\0"
+        self._inFile = directio.DirectFile(self._inbox, "r")
+        self._outFile = directio.DirectFile(self._outbox, "r+")
+        self._inBuf = directio.AlignedBuffer(self._outMailLen)
+        self._outBuf = directio.AlignedBuffer(self._outMailLen)
         self._outLock = threading.Lock()
         self._inLock = threading.Lock()
         # Clear outgoing mail
-        self.log.debug("SPM_MailMonitor - clearing outgoing mail, command is: "
-                       "%s", self._outCmd)
-        cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-        (rc, out, err) = _mboxExecCmd(cmd, data=self._outgoingMail)
-        if rc:
-            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail, "
-                             "dd failed")
+        self.log.debug("SPM_MailMonitor - clearing outgoing mail")
+        try:
+            self._writeMail(0, self._outMailLen)
+        except OSError:
+            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail",
+                             exc_info=True)
 
         self._thread = concurrent.thread(
             self.run, name="mailbox-spm", log=self.log)
@@ -611,6 +920,11 @@ class SPM_MailMonitor:
                     self._incomingMail = self._incomingMail[:-delta]
                 self._numHosts = newMaxId
                 self._outMailLen = MAILBOX_SIZE * self._numHosts
+                if self._outMailLen > self._inBuf.size:
+                    for buf in (self._inBuf, self._outBuf):
+                        buf.close()
+                    self._inBuf = directio.AlignedBuffer(self._outMailLen)
+                    self._outBuf = directio.AlignedBuffer(self._outMailLen)
 
     @classmethod
     def validateMailbox(self, mailbox, mailboxIndex):
@@ -640,8 +954,16 @@ class SPM_MailMonitor:
         # run through all messages and check if new messages have arrived
         # (since last read)
         for host in range(0, self._numHosts):
-            # Check mailbox checksum
             mailboxStart = host * MAILBOX_SIZE
+            mailboxEnd = mailboxStart + MAILBOX_SIZE
+
+            # Most mailboxes do not change between polls. Comparing the
+            # entire mailbox with the previous read is much cheaper than
+            # checking each message, and unlike comparing the mailbox
+            # checksum (a sum of the bytes), cannot miss a change.
+            if (newMail[mailboxStart:mailboxEnd] ==
+                    self._incomingMail[mailboxStart:mailboxEnd]):
+                continue
 
             isMailboxValidated = False
 
@@ -655,6 +977,13 @@ class SPM_MailMonitor:
                 if newMail[msgStart] in ['\0', '0']:
                     continue
 
+                # Skip messages that did not change since the last read,
+                # they were already handled.
+                newMsg = newMail[msgStart:msgStart + MESSAGE_SIZE]
+                if newMsg == self._incomingMail[msgStart:
+                                                msgStart + MESSAGE_SIZE]:
+                    continue
+
                 # Most mailboxes are probably empty so it costs less to check
                 # that all messages start with 0 than to validate the mailbox,
                 # therefor this is done after we find a non empty message in
@@ -671,35 +1000,21 @@ class SPM_MailMonitor:
                                    "checking mail", host)
                     isMailboxValidated = True
 
-                newMsg = newMail[msgStart:msgStart + MESSAGE_SIZE]
                 msgOffset = msgId * MESSAGE_SIZE
                 if newMsg == CLEAN_MESSAGE:
                     # Should probably put a setter on outgoingMail which would
                     # take the lock
                     self._outLock.acquire()
                     try:
-                        self._outgoingMail = \
-                            self._outgoingMail[0:msgOffset] + CLEAN_MESSAGE + \
-                            self._outgoingMail[msgOffset + MESSAGE_SIZE:
-                                               self._outMailLen]
+                        self._outgoingMail[
+                            msgOffset:msgOffset + MESSAGE_SIZE] = CLEAN_MESSAGE
                     finally:
                         self._outLock.release()
                     send = True
                     continue
 
-                # Message isn't empty, check if its new
-                isMessageNew = False
-                for j in range(msgStart, msgStart + MESSAGE_SIZE):
-                    if newMail[j] != self._incomingMail[j]:
-                        isMessageNew = True
-                        break
-
-                # If search exhausted, i.e. message hasn't changed since last
-                # read, it can be skipped
-                if not isMessageNew:
-                    continue
-
                 # We only get here if there is a novel request
+                self._pollInterval.activity()
                 try:
                     msgType = newMail[msgStart + 1:msgStart + 5]
                     if msgType in self._messageTypes:
@@ -738,58 +1053,69 @@ class SPM_MailMonitor:
         self._inLock.acquire()
         try:
             # self.log.debug("SPM_MailMonitor -_checking for mail")
-            cmd = self._inCmd + ['bs=' + str(self._outMailLen)]
-            # self.log.debug("SPM_MailMonitor - reading incoming mail, "
-            #               "command: " + str(cmd))
-            (rc, in_mail, err) = misc.execCmd(cmd, raw=True)
-            if rc:
+            try:
+                n = self._inFile.pread(self._inBuf, self._outMailLen, 0)
+            except OSError as e:
                 raise IOError(errno.EIO, "_handleRequests._checkForMail - "
-                              "Could not read mailbox: %s" % self._inbox)
+                              "Could not read mailbox: %s: %s"
+                              % (self._inbox, e))
 
-            if (len(in_mail) != (self._outMailLen)):
-                self.log.error('SPM_MailMonitor: _checkForMail - dd succeeded '
-                               'but read %d bytes instead of %d, cannot check '
-                               'mail.  Read mail contains: %s', len(in_mail),
-                               self._outMailLen, repr(in_mail[:80]))
+            if n != self._outMailLen:
+                self.log.error('SPM_MailMonitor: _checkForMail - read %d '
+                               'bytes instead of %d, cannot check mail.',
+                               n, self._outMailLen)
                 raise RuntimeError("_handleRequests._checkForMail - Could not "
                                    "read mailbox")
+            in_mail = self._inBuf.getvalue(self._outMailLen)
             # self.log.debug("Parsing inbox content: %s", in_mail)
-            if self._handleRequests(in_mail):
+            if self._handleRequests(in_mail) or self._outgoingDirty:
                 self._outLock.acquire()
                 try:
-                    cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-                    (rc, out, err) = _mboxExecCmd(cmd,
-                                                  data=self._outgoingMail)
-                    if rc:
-                        self.log.warning("SPM_MailMonitor couldn't write "
-                                         "outgoing mail, dd failed")
+                    self._writeMail(0, self._outMailLen)
+                    self._outgoingDirty = False
+                except OSError:
+                    # Cleared messages are not handled again, retry on the
+                    # next poll.
+                    self._outgoingDirty = True
+                    self.log.warning("SPM_MailMonitor couldn't write "
+                                     "outgoing mail", exc_info=True)
                 finally:
                     self._outLock.release()
         finally:
             self._inLock.release()
 
+    def _writeMail(self, offset, size):
+        """
+        Write size bytes of outgoing mail starting at offset. Must be called
+        with self._outLock held.
+        """
+        self._outBuf.setvalue(self._outgoingMail[offset:offset + size])
+        self._outFile.pwrite(self._outBuf, size, offset)
+
     def sendReply(self, msgID, msg):
         # Lock is acquired in order to make sure that neither _numHosts nor
         # outgoingMail are changed while used
         self._outLock.acquire()
         try:
+            # The mailbox files and buffers are closed when stopped.
+            if self._stopped:
+                self.log.warning("SPM_MailMonitor: sendReply - mailbox "
+                                 "stopped, dropping reply %s", msgID)
+                return
             msgOffset = msgID * MESSAGE_SIZE
-            self._outgoingMail = \
-                self._outgoingMail[0:msgOffset] + msg.payload + \
-                self._outgoingMail[msgOffset + MESSAGE_SIZE:self._outMailLen]
-            mailboxOffset = (msgID / SLOTS_PER_MAILBOX) * MAILBOX_SIZE
-            mailbox = self._outgoingMail[mailboxOffset:
-                                         mailboxOffset + MAILBOX_SIZE]
-            cmd = self._outCmd + ['bs=' + str(MAILBOX_SIZE),
-                                  'seek=' + str(mailboxOffset / MAILBOX_SIZE)]
-            # self.log.debug("Running command: %s, for message id: %s",
-            #               str(cmd), str(msgID))
-            (rc, out, err) = _mboxExecCmd(cmd, data=mailbox)
-            if rc:
+            self._outgoingMail[msgOffset:msgOffset + MESSAGE_SIZE] = \
+                msg.payload
+            mailboxOffset = (msgID // SLOTS_PER_MAILBOX) * MAILBOX_SIZE
+            try:
+                self._writeMail(mailboxOffset, MAILBOX_SIZE)
+            except OSError:
+                self._outgoingDirty = True
                 self.log.error("SPM_MailMonitor: sendReply - couldn't send "
-                               "reply, dd failed")
+                               "reply", exc_info=True)
         finally:
             self._outLock.release()
+        # The host will clear the request soon, and may send more requests.
+        self._pollInterval.activity()
 
     def run(self):
         try:
@@ -798,10 +1124,15 @@ class SPM_MailMonitor:
                     self._checkForMail()
                 except:
                     self.log.error("Error checking for mail", exc_info=True)
-                time.sleep(self._monitorInterval)
+                time.sleep(self._pollInterval.next())
         finally:
             self._stopped = True
             self.tp.joinAll(waitForTasks=False)
+            with self._inLock:
+                with self._outLock:
+                    for f in (self._inFile, self._outFile, self._inBuf,
+                              self._outBuf):
+                        f.close()
             self.log.info("SPM_MailMonitor - Incoming mail monitoring thread "
                           "stopped")
 
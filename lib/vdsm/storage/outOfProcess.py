@@ -1,5 +1,5 @@
 #
-# Copyright 2011-2016 Red Hat, Inc.
+# Copyright 2011-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -33,7 +33,10 @@ from functools import partial
 from ioprocess import IOProcess
 
 from vdsm import constants
+from vdsm import utils
+from vdsm.common.histogram import Histogram
 from vdsm.config import config
+from vdsm.metrics import Metric
 from vdsm.storage import exception as se
 
 GLOBAL = 'Global'
@@ -42,6 +45,11 @@ DEFAULT_TIMEOUT = config.getint("irs", "process_pool_timeout")
 IOPROC_IDLE_TIME = config.getint("irs", "max_ioprocess_idle_time")
 HELPERS_PER_DOMAIN = config.getint("irs", "process_pool_max_slots_per_domain")
 MAX_QUEUED = config.getint("irs", "process_pool_max_queued_slots_per_domain")
+INSTANCES_PER_DOMAIN = config.getint("irs",
+                                     "process_pool_instances_per_domain")
+
+# Upper bounds for queue depth histogram.
+QUEUE_DEPTH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
 
 _procPoolLock = threading.Lock()
 _procPool = {}
@@ -61,11 +69,11 @@ def stop():
     """
     with _procPoolLock:
         for name, (eol, proc) in _procPool.items():
-            log.debug("Closing ioprocess %s", name)
+            log.debug("Closing ioprocess pool %s", name)
             try:
                 proc._ioproc.close()
             except Exception:
-                log.exception("Error closing ioprocess %s", name)
+                log.exception("Error closing ioprocess pool %s", name)
         _procPool.clear()
         _refProcPool.clear()
 
@@ -84,10 +92,9 @@ def getProcessPool(clientName):
 
         proc = _refProcPool.get(clientName, lambda: None)()
         if proc is None:
-            log.debug("Creating ioprocess %s", clientName)
-            proc = IOProcess(max_threads=HELPERS_PER_DOMAIN,
-                             timeout=DEFAULT_TIMEOUT,
-                             max_queued_requests=MAX_QUEUED)
+            log.debug("Creating ioprocess pool %s with %d instances",
+                      clientName, INSTANCES_PER_DOMAIN)
+            proc = _IOProcessPool(clientName, INSTANCES_PER_DOMAIN)
             proc = _IOProcWrapper("oop", proc)
             _refProcPool[clientName] = weakref.ref(proc)
 
@@ -99,6 +106,98 @@ def getGlobalProcPool():
     return getProcessPool(GLOBAL)
 
 
+def report():
+    """
+    Return the metrics of all live ioprocess pools. Registered by HSM as a
+    metrics source.
+    """
+    with _procPoolLock:
+        pools = [(name, ref()) for name, ref in _refProcPool.items()]
+    report = []
+    for name, proc in pools:
+        if proc is None:
+            continue
+        stats = proc._ioproc.stats()
+        labels = {"client": name}
+        report.append(Metric("storage.oop.{client}.running",
+                             sum(stats["running"]), labels))
+        report.append(Metric("storage.oop.{client}.queue_depth_p90",
+                             stats["queue_depth"]["p90"], labels))
+        for op, latency in stats["latency"].items():
+            op_labels = {"client": name, "op": op}
+            for p in ("p50", "p90", "p99"):
+                report.append(Metric("storage.oop.{client}.{op}.latency_" + p,
+                                     latency[p], op_labels))
+    return report
+
+
+class _IOProcessPool(object):
+    """
+    Pool of ioprocess instances serving one client.
+
+    Every call is sent to the instance with the least number of running
+    calls, so a call blocked on inaccessible storage delays only the calls
+    queued on the same instance.
+
+    Any ioprocess operation can be called on the pool. Latency is recorded
+    per operation, and the number of calls running on the selected instance
+    is recorded when a call is sent.
+    """
+
+    def __init__(self, name, size):
+        self._name = name
+        self._lock = threading.Lock()
+        self._procs = [IOProcess(max_threads=HELPERS_PER_DOMAIN,
+                                 timeout=DEFAULT_TIMEOUT,
+                                 max_queued_requests=MAX_QUEUED)
+                       for i in range(size)]
+        self._running = [0] * size
+        self._latency = {}
+        self._queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+
+    def __getattr__(self, name):
+        # Called only for attributes not defined by the pool, e.g. "stat".
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return partial(self._call, name)
+
+    def _call(self, name, *args, **kwargs):
+        with self._lock:
+            i = self._running.index(min(self._running))
+            self._running[i] += 1
+            depth = self._running[i]
+            latency = self._latency.get(name)
+            if latency is None:
+                latency = self._latency[name] = Histogram()
+
+        self._queue_depth.add(depth)
+        start = utils.monotonic_time()
+        try:
+            return getattr(self._procs[i], name)(*args, **kwargs)
+        finally:
+            latency.add(utils.monotonic_time() - start)
+            with self._lock:
+                self._running[i] -= 1
+
+    def stats(self):
+        with self._lock:
+            running = self._running[:]
+            latency = list(self._latency.items())
+        return {
+            "instances": len(running),
+            "running": running,
+            "queue_depth": self._queue_depth.info(),
+            "latency": {name: hist.info() for name, hist in latency},
+        }
+
+    def close(self):
+        for proc in self._procs:
+            try:
+                proc.close()
+            except Exception:
+                log.exception("Error closing ioprocess %s", self._name)
+
+
 class _IOProcessGlob(object):
     def __init__(self, iop):
         self._iop = iop
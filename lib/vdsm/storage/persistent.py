@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -31,11 +31,14 @@ from contextlib import contextmanager
 from vdsm.storage import exception as se
 
 import threading
-from copy import deepcopy
+import six
 from six.moves import filter as ifilter
 
 SHA_CKSUM_TAG = "_SHA_CKSUM"
 
+# Marks a key missing before it was modified in a transaction.
+_MISSING = object()
+
 
 def _preprocessLine(line):
     if not isinstance(line, unicode):
@@ -157,6 +160,14 @@ class PersistentDict(object):
 
     @contextmanager
     def transaction(self):
+        """
+        Modify the metadata in a transaction, flushing the changes once when
+        the outermost transaction is finished.
+
+        Transactions are nested; consecutive transactions inside an outer
+        transaction are coalesced into one write. Only modified keys are
+        tracked; if no value was actually changed, nothing is written.
+        """
         with self._syncRoot:
             if self._inTransaction:
                 self.log.debug("Reusing active transaction")
@@ -167,29 +178,57 @@ class PersistentDict(object):
 
             with self._accessWrapper():
                 self.log.debug("Starting transaction")
-                backup = deepcopy(self._metadata)
+                self._dirty = {}
                 try:
                     yield
-                    # TODO : check appropriateness
-                    if backup != self._metadata:
-                        self.log.debug("Flushing changes")
+                    if self._changed():
+                        self.log.debug("Flushing changes to keys %s",
+                                       sorted(self._dirty))
                         self.flush(self._metadata)
                     self.log.debug("Finished transaction")
                 except:
                     self.log.warn("Error in transaction, rolling back changes",
                                   exc_info=True)
                     # TBD: Maybe check that the old MD is what I remember?
-                    self.flush(backup)
+                    self._rollback()
+                    self.flush(self._metadata)
                     raise
                 finally:
+                    self._dirty = None
                     self._inTransaction = False
 
+    def _modify(self, key):
+        """
+        Remember the original value of key before modifying it in a
+        transaction.
+        """
+        if key not in self._dirty:
+            self._dirty[key] = self._metadata.get(key, _MISSING)
+
+    def _changed(self):
+        for key, value in six.iteritems(self._dirty):
+            if self._metadata.get(key, _MISSING) != value:
+                return True
+        return False
+
+    def _rollback(self):
+        for key, value in six.iteritems(self._dirty):
+            if value is _MISSING:
+                self._metadata.pop(key, None)
+            else:
+                self._metadata[key] = value
+
     def __init__(self, metaReaderWriter):
         self._syncRoot = threading.RLock()
         self._metadata = {}
         self._metaRW = metaReaderWriter
         self._isValid = False
         self._inTransaction = False
+        # Original values of keys modified in current transaction
+        self._dirty = None
+        # Checksum and sorted lines of metadata last read or written
+        self._checksum = None
+        self._lines = None
         self.log.debug("Created a persistent dict with %s backend",
                        self._metaRW.__class__.__name__)
 
@@ -205,15 +244,24 @@ class PersistentDict(object):
 
     def __setitem__(self, key, value):
         with self.transaction():
-            self._metadata.__setitem__(key, value)
+            self._set(key, value)
 
     def __delitem__(self, key):
         with self.transaction():
-            self._metadata.__delitem__(key)
+            if key not in self._metadata:
+                raise KeyError(key)
+            self._modify(key)
+            del self._metadata[key]
 
     def update(self, metadata):
         with self.transaction():
-            self._metadata.update(metadata)
+            for key, value in six.iteritems(metadata):
+                self._set(key, value)
+
+    def _set(self, key, value):
+        if self._metadata.get(key, _MISSING) != value:
+            self._modify(key)
+            self._metadata[key] = value
 
     def keys(self):
         with self._accessWrapper():
@@ -234,6 +282,13 @@ class PersistentDict(object):
             self.log.debug("read lines (%s)=%s",
                            self._metaRW.__class__.__name__,
                            lines)
+
+            if self._unchanged(lines):
+                self.log.debug("Metadata checksum unchanged, using cached "
+                               "metadata")
+                self._isValid = True
+                return
+
             newMD = {}
             declaredChecksum = None
             for line in lines:
@@ -254,6 +309,7 @@ class PersistentDict(object):
                 self.log.debug("Empty metadata")
                 self._isValid = True
                 self._metadata = newMD
+                self._checksum = self._lines = None
                 return
 
             if declaredChecksum is None:
@@ -265,6 +321,7 @@ class PersistentDict(object):
                               "trust it as it is")
                 self._isValid = True
                 self._metadata = newMD
+                self._checksum = self._lines = None
                 return
 
             checksumCalculator = hashlib.sha1()
@@ -285,6 +342,28 @@ class PersistentDict(object):
 
             self._isValid = True
             self._metadata = newMD
+            self._checksum = computedChecksum
+            self._lines = sorted(lines)
+
+    def _unchanged(self, lines):
+        """
+        Return True if lines contain the same metadata as the cached metadata,
+        so there is no need to parse and validate them again.
+
+        The declared checksum is checked first, to detect changed metadata
+        without comparing the lines.
+        """
+        if self._checksum is None:
+            return False
+        tag = SHA_CKSUM_TAG + "="
+        for line in reversed(lines):
+            if line.startswith(tag):
+                if line[len(tag):].strip() != self._checksum:
+                    return False
+                break
+        else:
+            return False
+        return sorted(lines) == self._lines
 
     def flush(self, overrideMD):
         with self._syncRoot:
@@ -292,10 +371,14 @@ class PersistentDict(object):
 
             checksumCalculator = hashlib.sha1()
             lines = []
+            # Cached lines can be used only if reading them would recreate md
+            cacheable = True
             keys = md.keys()
             keys.sort()
             for key in keys:
                 value = md[key]
+                if value.strip() != value:
+                    cacheable = False
                 line = "=".join([key, value.strip()])
                 checksumCalculator.update(_preprocessLine(line))
                 lines.append(line)
@@ -305,10 +388,15 @@ class PersistentDict(object):
 
             self.log.debug("about to write lines (%s)=%s",
                            self._metaRW.__class__.__name__, lines)
-            self._metaRW.writelines(lines)
+            # Invalidate the cached lines in case writing fails in the middle.
+            self._checksum = self._lines = None
+            self._metaRW.writelines(lines[:])
 
             self._metadata = md
             self._isValid = True
+            if cacheable:
+                self._checksum = computedChecksum
+                self._lines = sorted(lines)
 
     def invalidate(self):
         with self._syncRoot:
@@ -328,4 +416,6 @@ class PersistentDict(object):
 
     def clear(self):
         with self.transaction():
+            for key in self._metadata:
+                self._modify(key)
             self._metadata.clear()
@@ -19,11 +19,26 @@
 #
 
 from __future__ import absolute_import
+
+import array
+
+import six
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from vdsm import qemuimg
+from vdsm.storage import qcow2reader
 
 CLUSTER_SIZE = 64 * 1024
 SIZEOF_INT_64 = 8
 
+# C long, 64 bits on all supported platforms; array does not support "q" on
+# python 2.
+_TYPECODE = "l"
+
 # Width of refcount block entry configured in the QCOW header
 REFCOUNT_ORDER = 4
 
@@ -146,41 +161,106 @@ def _estimate_metadata_size(virtual_size):
 
 def estimate_size(filename):
     """
-    Estimating qcow2 file size once converted from raw to qcow2.
+    Estimating qcow2 file size once converted from raw or qcow2 to qcow2.
     The filename is a path (sparse or preallocated),
     or a path to preallocated block device.
+
+    A qcow2 image must not have a backing file, since clusters allocated
+    only in the backing chain are not counted.
     """
-    info = qemuimg.info(filename)
-    if (info['format'] != qemuimg.FORMAT.RAW):
-        raise ValueError("Estimate size is only supported for raw format. file"
-                         " %s is with format %s" % (filename, info['format']))
+    if qcow2reader.is_qcow2(filename):
+        virtual_size, used_size = _qcow2_usage(filename)
+    else:
+        info = qemuimg.info(filename)
+        if (info['format'] != qemuimg.FORMAT.RAW):
+            raise ValueError("Estimate size is only supported for raw and "
+                             "qcow2 formats. file %s is with format %s" %
+                             (filename, info['format']))
+        virtual_size = info['virtualsize']
+        runs = qemuimg.iter_map(filename)
+        used_size = count_clusters(runs) * CLUSTER_SIZE
 
-    # Get used clusters and virtual size of destination volume.
-    virtual_size = info['virtualsize']
     meta_size = _estimate_metadata_size(virtual_size)
-    runs = qemuimg.map(filename)
-    used_clusters = count_clusters(runs)
 
     # Return the estimated size.
-    return meta_size + used_clusters * CLUSTER_SIZE
+    return meta_size + used_size
+
+
+def _qcow2_usage(filename):
+    """
+    Return the virtual size of the qcow2 image at filename, and the size of
+    the clusters the converted image will use, without running qemu-img map.
+    """
+    with qcow2reader.Image(filename) as img:
+        if img.backing_file is not None:
+            raise ValueError("Estimate size is not supported for qcow2 image "
+                             "with backing file. file %s" % filename)
+        virtual_size = img.virtual_size
+        allocated = img.allocated_clusters()
+        cluster_size = img.cluster_size
+
+    # With smaller clusters, every allocated cluster may touch a different
+    # destination cluster, but the image cannot use more clusters than its
+    # virtual size.
+    used_size = allocated * max(cluster_size, CLUSTER_SIZE)
+    return virtual_size, min(used_size,
+                             _align_offset(virtual_size, CLUSTER_SIZE))
 
 
 def count_clusters(runs):
+    """
+    Return the number of clusters containing data in runs, an iterable of
+    runs returned by qemuimg.map() or qemuimg.iter_map().
+
+    Only the start and length of data runs are kept, in arrays of 64 bit
+    integers, so counting clusters of images with millions of runs does not
+    keep millions of dicts in memory.
+    """
+    starts = array.array(_TYPECODE)
+    lengths = array.array(_TYPECODE)
+    for r in runs:
+        if r["data"]:
+            starts.append(r["start"])
+            lengths.append(r["length"])
+
+    if numpy is not None:
+        return _count_clusters_numpy(starts, lengths)
+    return _count_clusters(starts, lengths)
+
+
+def _count_clusters(starts, lengths):
     count = 0
     last = -1
-    for r in runs:
+    for start, length in six.moves.zip(starts, lengths):
         # Find the cluster when start and end are located.
-        start = r["start"] // CLUSTER_SIZE
-        end = (r["start"] + r["length"]) // CLUSTER_SIZE
-        if r["data"]:
-            if start == end:
-                # This run is smaller than a cluster. If we have several runs
-                # in the same cluster, we want to count the cluster only once.
-                if start != last:
-                    count += 1
-            else:
-                # This run span over multiple clusters - we want to count all
-                # the clusters this run touches.
-                count += end - start
-            last = end
+        end = (start + length) // CLUSTER_SIZE
+        start = start // CLUSTER_SIZE
+        if start == end:
+            # This run is smaller than a cluster. If we have several runs
+            # in the same cluster, we want to count the cluster only once.
+            if start != last:
+                count += 1
+        else:
+            # This run span over multiple clusters - we want to count all
+            # the clusters this run touches.
+            count += end - start
+        last = end
     return count
+
+
+def _count_clusters_numpy(starts, lengths):
+    """
+    Vectorized version of _count_clusters.
+    """
+    if not starts:
+        return 0
+    starts = numpy.frombuffer(starts, dtype=_TYPECODE)
+    lengths = numpy.frombuffer(lengths, dtype=_TYPECODE)
+    ends = (starts + lengths) // CLUSTER_SIZE
+    starts = starts // CLUSTER_SIZE
+    # End cluster of the previous data run.
+    last = numpy.empty_like(ends)
+    last[0] = -1
+    last[1:] = ends[:-1]
+    counts = numpy.where(starts == ends, starts != last, ends - starts)
+    return int(counts.sum())
@@ -1,5 +1,5 @@
 #
-# Copyright 2011-2016 Red Hat, Inc.
+# Copyright 2011-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,6 +19,9 @@
 #
 from __future__ import absolute_import
 
+import collections
+import itertools
+import operator
 import threading
 import logging
 import re
@@ -32,6 +35,7 @@ from six.moves import queue
 from vdsm.logUtils import SimpleLogAdapter
 from vdsm import concurrent
 from vdsm import utils
+from vdsm.common.histogram import Histogram
 from vdsm.storage import exception as se
 from vdsm.storage import guarded
 from vdsm.storage import rwlock
@@ -178,6 +182,7 @@ class Request(object):
         self._isCanceled = False
         self._doneEvent = threading.Event()
         self._callback = callback
+        self.created = utils.monotonic_time()
         self.reqID = str(uuid4())
         self._log = SimpleLogAdapter(self._log, {"ResName": self.fullName,
                                                  "ReqID": self.reqID})
@@ -510,15 +515,15 @@ class _ResourceManager(object):
                     if not namespaceObj.factory.resourceExists(name):
                         raise KeyError("No such resource '%s'" % (fullName))
                 else:
-                    if len(resource.queue) == 0 and \
-                            resource.currentLock == SHARED and \
-                            request.lockType == SHARED:
+                    if self._canJoin(resource, request.lockType):
                         resource.activeUsers += 1
                         self._log.debug("Resource '%s' found in shared state "
                                         "and queue is empty, Joining current "
                                         "shared lock (%d active users)",
                                         fullName, resource.activeUsers)
                         request.grant()
+                        self._recordGrant(namespaceObj, resource,
+                                          request.created)
                         contextCleanup.defer(request.emit,
                                              ResourceRef(namespace, name,
                                                          resource.realObj,
@@ -553,6 +558,7 @@ class _ResourceManager(object):
                 self._log.debug("Resource '%s' is free. Now locking as '%s' "
                                 "(1 active user)", fullName, request.lockType)
                 request.grant()
+                self._recordGrant(namespaceObj, resource, request.created)
                 contextCleanup.defer(request.emit,
                                      ResourceRef(namespace, name,
                                                  resource.realObj,
@@ -584,6 +590,7 @@ class _ResourceManager(object):
                                      "registered" % (namespace, name))
 
                 resource.activeUsers -= 1
+                self._recordRelease(namespaceObj, resource)
                 self._log.debug("Released resource '%s' (%d active users)",
                                 fullName, resource.activeUsers)
 
@@ -634,6 +641,8 @@ class _ResourceManager(object):
                                                 nextRequest.reqID)))
 
                         resource.activeUsers += 1
+                        self._recordGrant(namespaceObj, resource,
+                                          nextRequest.created)
 
                         self._log.debug("Request '%s' was granted",
                                         nextRequest)
@@ -668,10 +677,152 @@ class _ResourceManager(object):
                         continue
 
                     resource.activeUsers += 1
+                    self._recordGrant(namespaceObj, resource,
+                                      nextRequest.created)
                     self._log.debug("Request '%s' was granted (%d "
                                     "active users)", nextRequest,
                                     resource.activeUsers)
 
+    def acquireResources(self, requests, timeout=None):
+        """
+        Acquire several resources synchronously.
+
+        requests is an iterable of (namespace, name, lockType) tuples. The
+        resources are acquired in sorted order, so callers locking the same
+        resources cannot deadlock.
+
+        If all the resources are locked shared with no waiting requests and
+        requested shared, they are acquired atomically in one pass, taking
+        each namespace lock once. Otherwise the resources are acquired one
+        by one, waiting up to timeout seconds for each of them.
+        If acquiring a resource fails, the resources acquired before it are
+        released.
+
+        :returns: a list of references to the resources, in sorted order.
+        """
+        requests = sorted(requests)
+        for (ns, name), group in itertools.groupby(
+                requests, operator.itemgetter(0, 1)):
+            if len(list(group)) > 1:
+                raise ValueError("Resource '%s.%s' requested more than once"
+                                 % (ns, name))
+        for _, name, lockType in requests:
+            if not self._resourceNameValidator.match(name):
+                raise ValueError("Invalid resource name '%s'" % name)
+            if lockType not in (SHARED, EXCLUSIVE):
+                raise ValueError("invalid lock type %r" % lockType)
+
+        refs = self._tryAcquireResources(requests)
+        if refs is not None:
+            return refs
+
+        self._log.debug("Some resources are locked, acquiring %d resources "
+                        "one by one", len(requests))
+        refs = []
+        try:
+            for namespace, name, lockType in requests:
+                refs.append(self.acquireResource(namespace, name, lockType,
+                                                 timeout=timeout))
+        except:
+            for ref in reversed(refs):
+                ref.release()
+            raise
+        return refs
+
+    def _tryAcquireResources(self, requests):
+        """
+        Acquire resources if all of them exist and none of them needs to
+        wait. Returns a list of references, or None if some resource is
+        locked or must be created.
+
+        Creating a resource may be slow; for example, creating an image
+        resource prepares the image volumes. Creating resources while
+        holding all the namespaces locks would block every other request in
+        these namespaces, so missing resources are created by the one by one
+        path, holding only their own namespace lock.
+        """
+        with self._syncRoot.shared:
+            namespaces = []
+            for namespace, _ in itertools.groupby(requests,
+                                                  operator.itemgetter(0)):
+                try:
+                    namespaces.append(self._namespaces[namespace])
+                except KeyError:
+                    raise ValueError("Namespace '%s' is not registered with "
+                                     "this manager" % namespace)
+
+            with nested(*[ns.lock for ns in namespaces]):
+                acquired = []
+                for namespace, name, lockType in requests:
+                    namespaceObj = self._namespaces[namespace]
+                    resource = namespaceObj.resources.get(name)
+                    if resource is None or not self._canJoin(resource,
+                                                             lockType):
+                        return None
+                    acquired.append((namespaceObj, resource))
+
+                start = utils.monotonic_time()
+                for namespaceObj, resource in acquired:
+                    resource.activeUsers += 1
+                    self._recordGrant(namespaceObj, resource, start)
+
+                self._log.debug("Acquired %d resources in one pass",
+                                len(acquired))
+                return [ResourceRef(resource.namespace, resource.name,
+                                    resource.realObj, str(uuid4()))
+                        for _, resource in acquired]
+
+    def stats(self):
+        """
+        Return statistics for every namespace: the number of resources in
+        use, the number of queued requests, and histograms of the time
+        requests waited until granted, and the time resources were held.
+        """
+        with self._syncRoot.shared:
+            namespaces = list(self._namespaces.items())
+
+        result = {}
+        for namespace, namespaceObj in namespaces:
+            with namespaceObj.lock:
+                resources = namespaceObj.resources.values()
+                inUse = len(resources)
+                queued = sum(len(r.queue) for r in resources)
+            result[namespace] = {
+                "resources": inUse,
+                "queued": queued,
+                "waitTime": namespaceObj.waitTime.info(),
+                "holdTime": namespaceObj.holdTime.info(),
+            }
+        return result
+
+    def _canJoin(self, resource, lockType):
+        """
+        Return True if a request for lockType can be granted immediately
+        while resource is locked.
+        """
+        return (len(resource.queue) == 0 and
+                resource.currentLock == SHARED and
+                lockType == SHARED)
+
+    def _recordGrant(self, namespaceObj, resource, requested):
+        """
+        Must be called when holding namespaceObj.lock.
+        """
+        now = utils.monotonic_time()
+        namespaceObj.waitTime.add(now - requested)
+        resource.grantTimes.append(now)
+
+    def _recordRelease(self, namespaceObj, resource):
+        """
+        Must be called when holding namespaceObj.lock.
+
+        For shared locks we don't know which user released the resource;
+        matching releases with grants in grant order keeps the total hold
+        time correct.
+        """
+        granted = resource.grantTimes.popleft()
+        namespaceObj.holdTime.add(utils.monotonic_time() - granted)
+
 
 class Namespace(object):
     """
@@ -681,6 +832,9 @@ class Namespace(object):
         self.resources = {}
         self.lock = threading.Lock()  # rwlock.RWLock()
         self.factory = factory
+        # Time from request until granted, and from grant until release.
+        self.waitTime = Histogram()
+        self.holdTime = Histogram()
 
 
 class ResourceInfo(object):
@@ -690,6 +844,8 @@ class ResourceInfo(object):
     def __init__(self, realObj, namespace, name):
         self.queue = []
         self.activeUsers = 0
+        # Monotonic time of every grant for active users.
+        self.grantTimes = collections.deque()
         self.currentLock = None
         self.realObj = realObj
         self.namespace = namespace
@@ -1006,6 +1162,16 @@ class ResourceManagerLock(guarded.AbstractLock):
         # autoRelease.
         res.autoRelease = False
 
+    @classmethod
+    def acquire_many(cls, locks):
+        """
+        Acquire sorted locks using one acquireResources() call; used by
+        guarded.context().
+        """
+        refs = acquireResources([(l.ns, l.name, l.mode) for l in locks])
+        for res in refs:
+            res.autoRelease = False
+
     def release(self):
         releaseResource(self.ns, self.name)
 
@@ -1028,10 +1194,18 @@ def acquireResource(namespace, name, lockType, timeout=None):
     return _manager.acquireResource(namespace, name, lockType, timeout=timeout)
 
 
+def acquireResources(requests, timeout=None):
+    return _manager.acquireResources(requests, timeout=timeout)
+
+
 def releaseResource(namespace, name):
     _manager.releaseResource(namespace, name)
 
 
+def stats():
+    return _manager.stats()
+
+
 # Private apis for the tests - clients should never use these!
 
 def _registerResource(namespace, name, lockType, callback):
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -57,6 +57,7 @@ from vdsm.storage import exception as se
 from vdsm.storage.threadlocal import vars
 from vdsm.storage import outOfProcess as oop
 from vdsm.storage import resourceManager
+from vdsm.storage import taskjournal
 
 import uuid
 from weakref import proxy
@@ -83,6 +84,9 @@ TASK_METADATA_VERSION = 1
 
 ROLLBACK_SENTINEL = "rollback sentinel"
 
+# Persist tasks in the store journal instead of a directory per task.
+TASKS_JOURNAL = config.getboolean("irs", "tasks_journal")
+
 
 def _eq_encode(s):
     if KEY_SEPARATOR_ENCODED in s:
@@ -481,6 +485,10 @@ class Task:
         self.persistPolicy = TaskPersistType.none
         self.cleanPolicy = TaskCleanType.auto
         self.store = None
+        self._journal = None
+        # Task manager lane and domain, set when scheduling a job.
+        self.lane = None
+        self.domain = None
         self.defaultException = None
 
         self.state = State(State.init)
@@ -504,20 +512,24 @@ class Task:
         self.log = SimpleLogAdapter(self.log, {"Task": self.id})
 
     def __del__(self):
-        def finalize(log, owner, taskDir):
+        def finalize(log, owner, taskDir, journal, taskID):
             log.warn("Task was autocleaned")
             owner.releaseAll()
-            if taskDir is not None:
+            if journal is not None:
+                journal.remove(taskID)
+            elif taskDir is not None:
                 getProcPool().fileUtils.cleanupdir(taskDir)
 
         if not self.state.isDone():
             taskDir = None
+            journal = None
             if (self.cleanPolicy == TaskCleanType.auto and
                     self.store is not None):
                 taskDir = os.path.join(self.store, self.id)
+                journal = self._journal
             t = concurrent.thread(
                 finalize,
-                args=(self.log, self.resOwner, taskDir),
+                args=(self.log, self.resOwner, taskDir, journal, self.id),
                 name="task/" + self.id[:8])
             t.start()
 
@@ -671,6 +683,27 @@ class Task:
                     lines.append("%s %s %s" % (field, KEY_SEPARATOR, value))
         return lines
 
+    @classmethod
+    def _dumpFields(cls, obj, fields):
+        values = {}
+        for field in fields:
+            try:
+                values[field] = unicode(getattr(obj, field))
+            except AttributeError:
+                cls.log.warning("object %s field %s not found" %
+                                (obj, field), exc_info=True)
+        return values
+
+    @classmethod
+    def _loadFields(cls, obj, fields, values):
+        for field, value in values.items():
+            if field not in fields:
+                cls.log.warning("Task._loadFields: ignoring field %s",
+                                field)
+                continue
+            ftype = fields[field]
+            setattr(obj, field, ftype(value))
+
     @classmethod
     def _saveMetaFile(cls, filename, obj, fields):
         try:
@@ -783,9 +816,82 @@ class Task:
         getProcPool().fileUtils.fsyncPath(origTaskDir)
 
     def _clean(self, storPath):
+        if self._journal is not None:
+            try:
+                self._journal.remove(self.id)
+            except taskjournal.JournalError:
+                self.log.warning("Cannot remove task from journal",
+                                 exc_info=True)
+            return
         taskDir = os.path.join(storPath, self.id)
         getProcPool().fileUtils.cleanupdir(taskDir)
 
+    @classmethod
+    def removeTaskDirs(cls, storPath, taskID):
+        """
+        Remove the task directory of task taskID, and leftovers from
+        interrupted saves.
+        """
+        for ext in ("", TEMP_EXT, BACKUP_EXT):
+            taskDir = os.path.join(storPath, taskID + ext)
+            if getProcPool().os.path.exists(taskDir):
+                getProcPool().fileUtils.cleanupdir(taskDir)
+
+    def _dumpState(self):
+        self.njobs = len(self.jobs)
+        self.nrecoveries = len(self.recoveries)
+        state = {
+            "task": self._dumpFields(self, Task.fields),
+            "jobs": [self._dumpFields(job, Job.fields)
+                     for job in self.jobs],
+            "recoveries": [self._dumpFields(rec, Recovery.fields)
+                           for rec in self.recoveries],
+        }
+        if self.state == State.finished:
+            state["result"] = self._dumpFields(self.result, TaskResult.fields)
+        return state
+
+    def _loadState(self, state):
+        self.log.debug("%s: load from journal", self)
+        if self.state != State.init:
+            raise se.TaskMetaDataLoadError("task %s - can't load self: "
+                                           "not in init state" % self)
+        oldid = self.id
+        try:
+            self._loadFields(self, Task.fields, state["task"])
+            if self.id != oldid:
+                raise se.TaskMetaDataLoadError(
+                    "task %s: loaded state do not match id (%s != %s)" %
+                    (self, self.id, oldid))
+            if self.state == State.finished:
+                self._loadFields(self.result, TaskResult.fields,
+                                 state["result"])
+            for values in state["jobs"]:
+                job = Job("load", None)
+                self._loadFields(job, Job.fields, values)
+                job.setOwnerTask(self)
+                self.jobs.append(job)
+            for values in state["recoveries"]:
+                rec = Recovery("load", "load", "load", "load", "")
+                self._loadFields(rec, Recovery.fields, values)
+                rec.setOwnerTask(self)
+                self.recoveries.append(rec)
+        except se.TaskMetaDataLoadError:
+            raise
+        except Exception:
+            self.log.error("Unexpected error", exc_info=True)
+            raise se.TaskMetaDataLoadError("task %s: invalid journal state" %
+                                           oldid)
+        self.njobs = len(self.jobs)
+        self.nrecoveries = len(self.recoveries)
+
+    def _saveJournal(self):
+        try:
+            self._journal.write(self.id, self._dumpState())
+        except taskjournal.JournalError as e:
+            self.log.error("Unexpected error", exc_info=True)
+            raise se.TaskPersistError("%s persist failed: %s" % (self, e))
+
     def _recoverDone(self):
         # protect agains races with stop/abort
         self.log.debug("Recover Done: state %s", self.state)
@@ -1105,13 +1211,17 @@ class Task:
         self.setCleanPolicy(cleanPolicy)
         if self.persistPolicy != TaskPersistType.none and not self.store:
             raise se.TaskPersistError("no store defined")
-        taskDir = os.path.join(self.store, self.id)
-        try:
-            getProcPool().fileUtils.createdir(taskDir)
-        except Exception as e:
-            self.log.error("Unexpected error", exc_info=True)
-            raise se.TaskPersistError("%s: cannot access/create taskdir"
-                                      " %s: %s" % (self, taskDir, e))
+        if TASKS_JOURNAL:
+            self._journal = taskjournal.get(self.store)
+        else:
+            self._journal = None
+            taskDir = os.path.join(self.store, self.id)
+            try:
+                getProcPool().fileUtils.createdir(taskDir)
+            except Exception as e:
+                self.log.error("Unexpected error", exc_info=True)
+                raise se.TaskPersistError("%s: cannot access/create taskdir"
+                                          " %s: %s" % (self, taskDir, e))
         if (self.persistPolicy == TaskPersistType.auto and
                 self.state != State.init):
             self.persist()
@@ -1136,7 +1246,10 @@ class Task:
             raise se.TaskPersistError("no store defined")
         if self.state == State.init:
             raise se.TaskStateError("can't persist in state %s" % self.state)
-        self._save(self.store)
+        if self._journal is not None:
+            self._saveJournal()
+        else:
+            self._save(self.store)
 
     @classmethod
     def loadTask(cls, store, taskid):
@@ -1157,6 +1270,12 @@ class Task:
         t._load(store, ext)
         return t
 
+    @classmethod
+    def loadJournaledTask(cls, taskid, state):
+        t = Task(taskid)
+        t._loadState(state)
+        return t
+
     @threadlocal_task
     def prepare(self, func, *args, **kwargs):
         message = self.error
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -21,12 +21,25 @@
 from __future__ import absolute_import
 import os
 import logging
+import re
 import threading
 
+from vdsm import executor
+from vdsm import schedule
+from vdsm import utils
 from vdsm.config import config
 from vdsm.storage import exception as se
+from vdsm.storage import task as sttask
+from vdsm.storage import taskexecutor
+from vdsm.storage import taskjournal
 from vdsm.storage.task import Task, Job, TaskCleanType
-from vdsm.storage.threadPool import ThreadPool
+
+# Lane priority of task priorities.
+_PRIORITY = {"low": 0, "medium": 1, "high": 2}
+
+# Job names may end with the image UUID, e.g. "copyImage_<uuid>".
+_UUID_SUFFIX = re.compile(r"_[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}$",
+                          re.IGNORECASE)
 
 
 class TaskManager:
@@ -34,21 +47,32 @@ class TaskManager:
 
     def __init__(self,
                  tpSize=config.getint('irs', 'thread_pool_size'),
-                 waitTimeout=3,
-                 maxTasks=config.getint('irs', 'max_tasks')):
+                 maxTasks=config.getint('irs', 'max_tasks'),
+                 dataTpSize=config.getint('irs', 'data_thread_pool_size'),
+                 maxTasksPerDomain=config.getint('irs',
+                                                 'max_data_tasks_per_domain'),
+                 taskTimeout=config.getint('irs', 'metadata_task_timeout')):
         self.storage_repository = config.get('irs', 'repository')
-        self.tp = ThreadPool("tasks", tpSize, waitTimeout, maxTasks)
+        self._scheduler = schedule.Scheduler(name="tasks.Scheduler",
+                                             clock=utils.monotonic_time)
+        self._scheduler.start()
+        self._executor = taskexecutor.TaskExecutor(
+            "tasks",
+            [(taskexecutor.METADATA, tpSize, taskTimeout),
+             (taskexecutor.DATA, dataTpSize, None)],
+            maxTasks, maxTasksPerDomain, self._scheduler)
+        self._executor.start()
         self._tasks = {}
         self._unqueuedTasks = []
         self._insertTaskLock = threading.Lock()
 
     def queue(self, task):
-        return self._queueTask(task, task.commit)
+        return self._queueTask(task, task.commit, self._jobKind(task))
 
     def queueRecovery(self, task):
-        return self._queueTask(task, task.recover)
+        return self._queueTask(task, task.recover, "recovery")
 
-    def _queueTask(self, task, method):
+    def _queueTask(self, task, method, kind):
         with self._insertTaskLock:
             if task.id in self._tasks:
                 raise se.AddTaskError(
@@ -58,8 +82,16 @@ class TaskManager:
             self._tasks[task.id] = task
 
         try:
-            if not self.tp.queueTask(task.id, method):
-                self.log.error("unable to queue task: %s", task.dumpTask())
+            try:
+                self._executor.dispatch(
+                    task.id, method,
+                    lane=task.lane or taskexecutor.METADATA,
+                    priority=_PRIORITY.get(str(task.priority), 0),
+                    domain=task.domain,
+                    kind=kind)
+            except (executor.NotRunning, executor.TooManyTasks) as e:
+                self.log.error("unable to queue task: %s: %r",
+                               task.dumpTask(), e)
                 del self._tasks[task.id]
                 raise se.AddTaskError()
             self.log.debug("task queued: %s", task.id)
@@ -69,7 +101,26 @@ class TaskManager:
 
         return task.id
 
-    def scheduleJob(self, type, store, task, jobName, func, *args):
+    def _jobKind(self, task):
+        if not task.jobs:
+            return "task"
+        return _UUID_SUFFIX.sub("", task.jobs[0].name)
+
+    def scheduleJob(self, type, store, task, jobName, func, *args, **kwargs):
+        """
+        Schedule func(*args) to run in task.
+
+        Keyword arguments:
+            lane: taskexecutor.METADATA for short operations (default), or
+                taskexecutor.DATA for long operations such as copying
+                images.
+            domain: UUID of the domain limiting the number of tasks running
+                at the same time.
+        """
+        task.lane = kwargs.pop("lane", taskexecutor.METADATA)
+        task.domain = kwargs.pop("domain", None)
+        if kwargs:
+            raise TypeError("Unexpected arguments: %s" % kwargs)
         task.setTag(type)
         if store is not None:
             task.setPersistence(store, cleanPolicy=TaskCleanType.manual)
@@ -96,7 +147,15 @@ class TaskManager:
                 t.stop()
             self.log.info(str(t))
 
-        self.tp.joinAll(waitForTasks=False, waitForThreads=False)
+        self._executor.stop(wait=False)
+        self._scheduler.stop()
+
+    def stats(self):
+        """
+        Return the number of running and queued tasks per lane, and
+        histograms of the queue wait time and run time per kind of task.
+        """
+        return self._executor.stats()
 
     def getTaskStatus(self, taskID):
         """ Internal return Task status for a given task.
@@ -207,21 +266,61 @@ class TaskManager:
         if not os.path.exists(store):
             self.log.debug("task dump path %s does not exist.", store)
             return
+        start = utils.monotonic_time()
+        count = len(self._unqueuedTasks)
+        loaded = self._loadJournaledTasks(store)
         # taskID is the root part of each (root.ext) entry in the dump task dir
-        tasksIDs = set(os.path.splitext(tid)[0] for tid in os.listdir(store))
+        tasksIDs = set(os.path.splitext(tid)[0] for tid in os.listdir(store)
+                       if not taskjournal.is_journal(tid))
         for taskID in tasksIDs:
+            if taskID in loaded:
+                # Leftover from interrupted migration to the journal.
+                if sttask.TASKS_JOURNAL:
+                    Task.removeTaskDirs(store, taskID)
+                continue
             self.log.debug("Loading dumped task %s", taskID)
             try:
                 t = Task.loadTask(store, taskID)
                 t.setPersistence(store,
                                  str(t.persistPolicy),
                                  str(t.cleanPolicy))
+                # The task was migrated to the journal.
+                if sttask.TASKS_JOURNAL:
+                    Task.removeTaskDirs(store, taskID)
                 self._unqueuedTasks.append(t)
             except Exception:
                 self.log.error("taskManager: Skipping directory: %s",
                                taskID,
                                exc_info=True)
                 continue
+        self.log.info("Loaded %d tasks from %s in %.2f seconds",
+                      len(self._unqueuedTasks) - count, store,
+                      utils.monotonic_time() - start)
+
+    def _loadJournaledTasks(self, store):
+        journal = taskjournal.get(store)
+        try:
+            states = journal.load()
+        except Exception:
+            self.log.error("taskManager: Cannot load journal in %s", store,
+                           exc_info=True)
+            return set()
+        for taskID, state in states.items():
+            self.log.debug("Loading journaled task %s", taskID)
+            try:
+                t = Task.loadJournaledTask(taskID, state)
+                t.setPersistence(store,
+                                 str(t.persistPolicy),
+                                 str(t.cleanPolicy))
+                # The task was migrated to a task directory.
+                if not sttask.TASKS_JOURNAL:
+                    journal.remove(taskID)
+                self._unqueuedTasks.append(t)
+            except Exception:
+                self.log.error("taskManager: Skipping journaled task: %s",
+                               taskID,
+                               exc_info=True)
+        return set(states)
 
     def recoverDumpedTasks(self):
         for task in self._unqueuedTasks[:]:
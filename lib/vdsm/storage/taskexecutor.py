@@ -0,0 +1,254 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+taskexecutor - run storage tasks in lanes, by priority
+
+Tasks are dispatched to a lane, each lane running on its own
+vdsm.executor.Executor, so short metadata operations do not wait behind
+long data operations such as copying images. Within a lane, tasks run by
+priority, and in dispatch order for tasks with the same priority.
+
+A task may be dispatched with a domain; the number of tasks running at the
+same time on a domain is limited. Tasks that cannot run because their domain
+is busy do not block other tasks in the lane.
+
+If a lane has a timeout, a task running longer than the timeout stops
+counting towards the lane workers, and the executor replaces the blocked
+worker, so more tasks can run.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import functools
+import heapq
+import itertools
+import logging
+import threading
+
+from vdsm import executor
+from vdsm import utils
+from vdsm.common.histogram import Histogram
+
+METADATA = "metadata"
+DATA = "data"
+
+# Upper bounds in seconds, from 10 milliseconds to 4 hours. Data tasks may
+# run for hours.
+BUCKETS = (0.01, 0.1, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200, 14400)
+
+log = logging.getLogger("storage.TaskExecutor")
+
+
+class TaskExecutor(object):
+
+    def __init__(self, name, lanes, max_tasks, max_tasks_per_domain,
+                 scheduler):
+        """
+        Arguments:
+            name (str): name of the executor, used for workers names
+            lanes (list): list of (lane, workers, timeout) tuples
+            max_tasks (int): maximum number of tasks waiting in all lanes
+            max_tasks_per_domain (int): maximum number of tasks running on
+                the same domain, 0 for no limit
+            scheduler (vdsm.schedule.Scheduler): used to detect blocked
+                tasks
+        """
+        self._name = name
+        self._max_tasks = max_tasks
+        self._max_tasks_per_domain = max_tasks_per_domain
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._lanes = {}
+        for lane, workers, timeout in lanes:
+            # Tasks are dispatched to the executor only when a worker is
+            # available, but the executor queue must have room for the stop
+            # requests, and for tasks dispatched while blocked workers are
+            # replaced.
+            self._lanes[lane] = _Lane(
+                executor.Executor("%s/%s" % (name, lane), workers,
+                                  max_tasks + workers, scheduler,
+                                  max_workers=workers * 2),
+                workers, timeout)
+        self._queued = 0
+        self._domains = collections.defaultdict(int)
+        self._count = itertools.count()
+        self._stats = {}
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            self._running = True
+        for lane in self._lanes.values():
+            lane.executor.start()
+
+    def stop(self, wait=True):
+        with self._lock:
+            self._running = False
+            for lane in self._lanes.values():
+                del lane.queue[:]
+            self._queued = 0
+        for lane in self._lanes.values():
+            lane.executor.stop(wait=wait)
+
+    def dispatch(self, id, func, lane=METADATA, priority=0, domain=None,
+                 kind="task"):
+        """
+        Dispatch func to run in lane. Tasks with higher priority run first.
+
+        Raises:
+            executor.NotRunning if the executor is not running
+            executor.TooManyTasks if max_tasks tasks are waiting
+            KeyError if lane does not exist
+        """
+        task = _Task(id, func, lane, domain, kind)
+        with self._lock:
+            if not self._running:
+                raise executor.NotRunning()
+            queue = self._lanes[lane].queue
+            if self._queued == self._max_tasks:
+                raise executor.TooManyTasks()
+            heapq.heappush(queue, (-priority, next(self._count), task))
+            self._queued += 1
+            self._schedule()
+
+    def stats(self):
+        """
+        Return dict with "lanes", the number of workers, running and queued
+        tasks per lane, and "tasks", histograms of the time tasks waited in
+        the queue and the time tasks ran per kind of task.
+        """
+        with self._lock:
+            lanes = {name: {"workers": lane.workers,
+                            "running": lane.running,
+                            "queued": len(lane.queue)}
+                     for name, lane in self._lanes.items()}
+            kinds = list(self._stats.items())
+        tasks = {kind: {"waitTime": stats.wait_time.info(),
+                        "runTime": stats.run_time.info()}
+                 for kind, stats in kinds}
+        return {"lanes": lanes, "tasks": tasks}
+
+    def _schedule(self):
+        # Must be called with the lock held.
+        for lane in self._lanes.values():
+            skipped = []
+            while lane.running < lane.workers and lane.queue:
+                item = heapq.heappop(lane.queue)
+                task = item[2]
+                if not self._may_run(task):
+                    skipped.append(item)
+                    continue
+                self._start(lane, task)
+            for item in skipped:
+                heapq.heappush(lane.queue, item)
+
+    def _may_run(self, task):
+        return (task.domain is None or
+                self._max_tasks_per_domain == 0 or
+                self._domains.get(task.domain, 0) <
+                self._max_tasks_per_domain)
+
+    def _start(self, lane, task):
+        self._queued -= 1
+        lane.running += 1
+        if task.domain is not None:
+            self._domains[task.domain] += 1
+        lane.executor.dispatch(functools.partial(self._run, lane, task),
+                               timeout=lane.timeout)
+
+    def _run(self, lane, task):
+        start = utils.monotonic_time()
+        stats = self._kind_stats(task.kind)
+        stats.wait_time.add(start - task.queued)
+        if lane.timeout is not None:
+            task.check = self._scheduler.schedule(
+                lane.timeout, functools.partial(self._blocked, lane, task))
+        log.info("START task %s (lane=%s, domain=%s)",
+                 task.id, lane.executor.name, task.domain)
+        try:
+            task.func()
+        finally:
+            elapsed = utils.monotonic_time() - start
+            stats.run_time.add(elapsed)
+            log.info("FINISH task %s in %.2f seconds", task.id, elapsed)
+            self._finished(lane, task)
+
+    def _blocked(self, lane, task):
+        with self._lock:
+            if task.done:
+                return
+            log.warning("Task %s blocked for %s seconds, not counting it "
+                        "towards lane %s workers",
+                        task.id, lane.timeout, lane.executor.name)
+            task.blocked = True
+            lane.running -= 1
+            self._schedule()
+
+    def _finished(self, lane, task):
+        if task.check is not None:
+            task.check.cancel()
+        with self._lock:
+            task.done = True
+            if not task.blocked:
+                lane.running -= 1
+            if task.domain is not None:
+                self._domains[task.domain] -= 1
+                if self._domains[task.domain] == 0:
+                    del self._domains[task.domain]
+            self._schedule()
+
+    def _kind_stats(self, kind):
+        with self._lock:
+            stats = self._stats.get(kind)
+            if stats is None:
+                stats = self._stats[kind] = _Stats()
+            return stats
+
+
+class _Lane(object):
+
+    def __init__(self, executor, workers, timeout):
+        self.executor = executor
+        self.workers = workers
+        self.timeout = timeout
+        self.queue = []
+        self.running = 0
+
+
+class _Task(object):
+
+    def __init__(self, id, func, lane, domain, kind):
+        self.id = id
+        self.func = func
+        self.lane = lane
+        self.domain = domain
+        self.kind = kind
+        self.queued = utils.monotonic_time()
+        self.check = None
+        self.blocked = False
+        self.done = False
+
+
+class _Stats(object):
+
+    def __init__(self):
+        self.wait_time = Histogram(BUCKETS)
+        self.run_time = Histogram(BUCKETS)
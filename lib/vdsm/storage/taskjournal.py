@@ -0,0 +1,298 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+taskjournal - persist storage tasks in an append-only journal
+
+Persisting a task in a task directory writes several small files and renames
+two directories on every state change. With hundreds of tasks this generates
+a storm of metadata operations on the master file system.
+
+The journal keeps the state of all tasks in a store in a single file. Every
+change appends one record with the complete state of one task, or a removal
+record. Concurrent changes are written using one write and one fsync (group
+commit). When most records in the journal are obsolete, the journal is
+compacted by writing the live records to a temporary file and renaming it
+over the journal.
+
+Each record is a line with the crc32 of the data and the data, a JSON object:
+
+    3a5f0c1d {"id": "task-id", "state": {...}}
+
+A record without "state" removes the task. Loading stops at the first invalid
+record, which may be a partial write interrupted by a crash; the invalid tail
+is truncated on the next write.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import json
+import logging
+import os
+import threading
+import zlib
+
+from vdsm import utils
+
+JOURNAL_NAME = "tasks.journal"
+TEMP_EXT = ".tmp"
+
+# Compact the journal when it has more than this number of records, and more
+# than twice the number of live tasks.
+COMPACT_MIN_RECORDS = 1000
+
+log = logging.getLogger("storage.taskjournal")
+
+_lock = threading.Lock()
+_journals = {}
+
+
+class JournalError(Exception):
+    """
+    Raised when writing to the journal failed.
+    """
+
+
+def is_journal(name):
+    """
+    Return True if name is a journal file name in a tasks store.
+    """
+    return name.startswith(JOURNAL_NAME)
+
+
+def get(store):
+    """
+    Return the journal of tasks store directory store.
+    """
+    with _lock:
+        journal = _journals.get(store)
+        if journal is None:
+            journal = _journals[store] = Journal(
+                os.path.join(store, JOURNAL_NAME))
+        return journal
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._cond = threading.Condition(threading.Lock())
+        # Live (state, record) by task id, including pending records.
+        self._live = None
+        # Encoded records waiting for the next flush.
+        self._pending = []
+        self._flushing = False
+        # Number of queued and synced records, for group commit.
+        self._queued = 0
+        self._synced = 0
+        # Number of valid records in the journal, and size of the valid
+        # part of the journal.
+        self._records = 0
+        self._size = 0
+
+    def load(self):
+        """
+        Read the journal from storage, and return dict mapping task id to
+        task state.
+
+        Must be called when the store may have been modified by another
+        host, e.g. when starting the SPM.
+        """
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._read()
+            return {task_id: state
+                    for task_id, (state, _) in self._live.items()}
+
+    def write(self, task_id, state):
+        """
+        Write task state, and return when the record is safely on storage.
+        """
+        self._submit(task_id, state)
+
+    def remove(self, task_id):
+        """
+        Remove task from the journal. Removing a missing task does nothing.
+        """
+        with self._cond:
+            self._ensure_loaded()
+            if task_id not in self._live:
+                return
+        self._submit(task_id, None)
+
+    def _submit(self, task_id, state):
+        record = _encode(task_id, state)
+        with self._cond:
+            self._ensure_loaded()
+            # Writing the same state again is common when loading tasks;
+            # skip it if the journal already contains it on storage.
+            if (task_id in self._live and
+                    self._live[task_id][0] == state and
+                    not self._pending and not self._flushing):
+                return
+            if state is None:
+                self._live.pop(task_id, None)
+            else:
+                self._live[task_id] = (state, record)
+            self._pending.append(record)
+            self._queued += 1
+            seq = self._queued
+
+            # Wait until another thread flushed our record, or become the
+            # thread flushing all pending records.
+            while self._flushing:
+                self._cond.wait()
+            if self._synced >= seq:
+                return
+
+            self._flushing = True
+            batch, self._pending = self._pending, []
+            last = self._queued
+            live = None
+            if self._needs_compaction(len(batch)):
+                live = [record for _, record in self._live.values()]
+
+        try:
+            if live is None:
+                self._append(batch)
+            else:
+                self._compact(live)
+        except EnvironmentError as e:
+            with self._cond:
+                # Retry the records of the waiting threads on the next flush.
+                self._pending[:0] = batch
+                self._flushing = False
+                self._cond.notify_all()
+            raise JournalError("Cannot write journal %s: %s" % (self.path, e))
+
+        with self._cond:
+            if live is None:
+                self._records += len(batch)
+            else:
+                self._records = len(live)
+            self._synced = last
+            self._flushing = False
+            self._cond.notify_all()
+
+    def _ensure_loaded(self):
+        # Compaction writes only the live records, so we must know all the
+        # records before writing. Must be called with the lock held.
+        if self._live is None:
+            self._read()
+
+    def _needs_compaction(self, count):
+        records = self._records + count
+        return (records > COMPACT_MIN_RECORDS and
+                records > 2 * len(self._live))
+
+    def _read(self):
+        start = utils.monotonic_time()
+        live = {}
+        records = 0
+        size = 0
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        task_id, state = _decode(line)
+                    except ValueError as e:
+                        log.warning("Ignoring invalid journal %s tail at "
+                                    "offset %d: %s", self.path, size, e)
+                        break
+                    if state is None:
+                        live.pop(task_id, None)
+                    else:
+                        live[task_id] = (state, line)
+                    records += 1
+                    size += len(line)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self._live = live
+        self._records = records
+        self._size = size
+        log.info("Loaded %d tasks (%d records) from %s in %.2f seconds",
+                 len(live), records, self.path,
+                 utils.monotonic_time() - start)
+
+    def _append(self, batch):
+        data = b"".join(batch)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o660)
+        try:
+            # Drop partial records written by a failed write.
+            if os.fstat(fd).st_size != self._size:
+                os.ftruncate(fd, self._size)
+            os.lseek(fd, self._size, os.SEEK_SET)
+            _write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._size += len(data)
+
+    def _compact(self, live):
+        start = utils.monotonic_time()
+        data = b"".join(live)
+        tmp_path = self.path + TEMP_EXT
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o660)
+        try:
+            _write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(tmp_path, self.path)
+        _fsync_dir(os.path.dirname(self.path))
+        log.info("Compacted journal %s from %d to %d records in %.2f "
+                 "seconds", self.path, self._records, len(live),
+                 utils.monotonic_time() - start)
+        self._size = len(data)
+
+
+def _encode(task_id, state):
+    obj = {"id": task_id}
+    if state is not None:
+        obj["state"] = state
+    data = json.dumps(obj).encode("utf-8")
+    checksum = "%08x " % (zlib.crc32(data) & 0xffffffff)
+    return checksum.encode("ascii") + data + b"\n"
+
+
+def _decode(line):
+    if not line.endswith(b"\n"):
+        raise ValueError("Partial record")
+    checksum, _, data = line[:-1].partition(b" ")
+    if int(checksum, 16) != zlib.crc32(data) & 0xffffffff:
+        raise ValueError("Checksum mismatch")
+    obj = json.loads(data.decode("utf-8"))
+    return obj["id"], obj.get("state")
+
+
+def _write(fd, data):
+    while data:
+        n = os.write(fd, data)
+        data = data[n:]
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
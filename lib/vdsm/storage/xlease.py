@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -127,11 +127,14 @@ This is where user leases are created.
 
 from __future__ import absolute_import
 
+import bisect
 import io
 import logging
 import mmap
 import os
 import struct
+import sys
+import threading
 import time
 
 from collections import namedtuple
@@ -180,6 +183,9 @@ RECORD_SIZE = 64
 # Each lookup will read this size from storage.
 INDEX_SIZE = METADATA_SIZE + (MAX_RECORDS * RECORD_SIZE)
 
+# Number of records in each index block.
+RECORDS_PER_BLOCK = BLOCK_SIZE // RECORD_SIZE
+
 # Current index format
 INDEX_VERSION = 1
 
@@ -458,6 +464,9 @@ class Record(object):
 # Record with empty values, mark a free record in the index.
 EMPTY_RECORD = Record("", 0)
 
+# Storage format of a free record.
+EMPTY_RECORD_BYTES = EMPTY_RECORD.bytes()
+
 
 class LeasesVolume(object):
     """
@@ -481,7 +490,7 @@ class LeasesVolume(object):
             self._md = self._index.read_metadata()
             if self._md.updating:
                 raise IndexIsUpdating(self._md)
-        except:
+        except Exception:
             self._index.close()
             raise
         log.debug("Loaded %s", self._md)
@@ -588,6 +597,99 @@ class LeasesVolume(object):
 
         self._write_record(recnum, EMPTY_RECORD)
 
+    def add_many(self, lease_ids):
+        """
+        Add many leases to index, returning list of LeaseInfo.
+
+        Works like add(), but the records are written to storage in batches;
+        every modified index block is written once to mark the records as
+        updating, and once to complete the records, waiting for storage only
+        once per batch.
+
+        If creating a sanlock resource fails, the leases created before the
+        failure are completed, and the rest of the leases are left in updating
+        state, like a failed add().
+
+        Raises:
+        - LeaseExists if lease already stored for one of lease_ids, or if
+          lease_ids contains duplicate items
+        - LeaseUpdating if one of the leases is updating
+        - InvalidRecord if corrupted lease record is found
+        - NoSpace if there are not enough free slots
+        - OSError if I/O operation failed
+        - sanlock.SanlockException if sanlock operation failed.
+        """
+        log.info("Adding %d leases in lockspace %r",
+                 len(lease_ids), self.lockspace)
+        seen = set()
+        for lease_id in lease_ids:
+            if lease_id in seen:
+                raise LeaseExists(lease_id)
+            seen.add(lease_id)
+            recnum = self._index.find_record(lease_id)
+            if recnum != -1:
+                record = self._index.read_record(recnum)
+                if record.updating:
+                    raise LeaseUpdating(lease_id)
+                else:
+                    raise LeaseExists(lease_id)
+
+        recnums = self._index.find_free_records(len(lease_ids))
+        if len(recnums) < len(lease_ids):
+            raise NoSpace(lease_ids[len(recnums)])
+
+        leases = [(lease_id, recnum, lease_offset(recnum))
+                  for lease_id, recnum in zip(lease_ids, recnums)]
+
+        self._write_records([(recnum, Record(lease_id, offset, updating=True))
+                             for lease_id, recnum, offset in leases])
+
+        def create(lease):
+            lease_id, recnum, offset = lease
+            sanlock.write_resource(self.lockspace, lease_id,
+                                   [(self._file.name, offset)])
+
+        created = self._apply(create, leases)
+
+        return [LeaseInfo(self.lockspace, lease_id, self._file.name, offset)
+                for lease_id, recnum, offset in created]
+
+    def remove_many(self, lease_ids):
+        """
+        Remove many leases from index.
+
+        Works like remove(), but the records are written to storage in
+        batches, like add_many().
+
+        If clearing a sanlock resource fails, the leases cleared before the
+        failure are removed, and the rest of the leases are left in updating
+        state, like a failed remove().
+
+        Raises:
+        - NoSuchLease if one of the leases was not found
+        - OSError if I/O operation failed
+        - sanlock.SanlockException if sanlock operation failed.
+        """
+        log.info("Removing %d leases in lockspace %r",
+                 len(lease_ids), self.lockspace)
+        leases = []
+        for lease_id in set(lease_ids):
+            recnum = self._index.find_record(lease_id)
+            if recnum == -1:
+                raise NoSuchLease(lease_id)
+            leases.append((lease_id, recnum, lease_offset(recnum)))
+
+        self._write_records([(recnum, Record(lease_id, offset, updating=True))
+                             for lease_id, recnum, offset in leases])
+
+        def clear(lease):
+            lease_id, recnum, offset = lease
+            # There is no way to remove a resource, so we write an invalid
+            # resource with empty resource and lockspace values.
+            sanlock.write_resource("", "", [(self._file.name, offset)])
+
+        self._apply(clear, leases, EMPTY_RECORD)
+
     def leases(self):
         """
         Return all leases in the index
@@ -612,6 +714,37 @@ class LeasesVolume(object):
         log.debug("Closing index for lockspace %r", self.lockspace)
         self._index.close()
 
+    def _apply(self, func, leases, record=None):
+        """
+        Call func with every lease, and write the completed records for the
+        leases that were successfully processed. If record is None, write a
+        non-updating record for every lease.
+
+        Returns the processed leases. If func fails, complete the leases
+        processed before the failure and re-raise the error.
+        """
+        done = []
+        try:
+            for lease in leases:
+                func(lease)
+                done.append(lease)
+        except Exception:
+            exc_info = sys.exc_info()
+            try:
+                self._complete(done, record)
+            except Exception:
+                log.exception("Error completing %d leases", len(done))
+            six.reraise(*exc_info)
+        self._complete(done, record)
+        return done
+
+    def _complete(self, leases, record):
+        if not leases:
+            return
+        self._write_records([
+            (recnum, record or Record(lease_id, offset))
+            for lease_id, recnum, offset in leases])
+
     def _write_record(self, recnum, record):
         """
         Write record recnum to storage atomically.
@@ -619,11 +752,34 @@ class LeasesVolume(object):
         Copy the block where the record is located, modify it and write the
         block to storage. If this succeeds, write the record to the index.
         """
-        block = self._index.copy_record_block(recnum)
-        with utils.closing(block):
-            block.write_record(recnum, record)
-            block.dump(self._file)
-        self._index.write_record(recnum, record)
+        self._write_records([(recnum, record)])
+
+    def _write_records(self, records):
+        """
+        Write list of (recnum, record) tuples to storage, and wait until the
+        data reach storage.
+
+        Records are grouped by block, and every block is written once
+        atomically, like _write_record(). When a block was written, its
+        records are written to the index. If writing a block fails, blocks
+        written before the failure remain written.
+        """
+        blocks = {}
+        for recnum, record in records:
+            blocks.setdefault(recnum // RECORDS_PER_BLOCK, []).append(
+                (recnum, record))
+
+        for blocknum in sorted(blocks):
+            block_records = blocks[blocknum]
+            block = self._index.copy_record_block(block_records[0][0])
+            with utils.closing(block):
+                for recnum, record in block_records:
+                    block.write_record(recnum, record)
+                block.dump(self._file, sync=False)
+            for recnum, record in block_records:
+                self._index.write_record(recnum, record)
+
+        os.fsync(self._file.fileno())
 
 
 def format_index(lockspace, file):
@@ -653,40 +809,87 @@ def lease_offset(recnum):
     return USER_RESOURCE_BASE + (recnum * SLOT_SIZE)
 
 
+class _IndexCache(object):
+    """
+    Cache of lookup tables built from index contents, keyed by volume path.
+
+    Building the lookup tables requires parsing all the records, so we keep
+    the tables built from the last index loaded from each volume. Cached
+    tables are used only if the index loaded from storage is identical to the
+    cached index, including the metadata block (mtime and updating flag), so
+    changes made by another host are always detected.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> (index data, records, free)
+        self._entries = {}
+
+    def get(self, path, data):
+        """
+        Return a copy of the lookup tables cached for path if data is
+        identical to the cached index, None otherwise.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None or entry[0] != data:
+            return None
+        return dict(entry[1]), list(entry[2])
+
+    def put(self, path, data, records, free):
+        entry = (data, dict(records), list(free))
+        with self._lock:
+            self._entries[path] = entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = _IndexCache()
+
+
 class VolumeIndex(object):
     """
     Index maintaining volume metadata and the mapping from lease id to lease
     offset.
+
+    The index contents are kept in memory, with lookup tables mapping lease
+    id to record number, and listing the free records. The tables are built
+    when loading the index from storage, and updated when writing records to
+    the index.
     """
 
     def __init__(self):
         self._buf = mmap.mmap(-1, INDEX_SIZE, mmap.MAP_SHARED)
+        self._path = None
+        # lease_id (bytes) -> record number
+        self._records = {}
+        # Sorted free record numbers
+        self._free = []
 
     def find_record(self, lease_id):
         """
         Search for lease_id record. Returns record number if found, -1
         otherwise.
         """
-        prefix = LOOKUP_STRUCT.pack(lease_id.encode("ascii"))
-
-        # TODO: continue search if offset is not aligned to record size.
-        offset = self._buf.find(prefix, RECORD_BASE)
-        if offset == -1:
-            return -1
-
-        return self._record_number(offset)
+        return self._records.get(lease_id.encode("ascii"), -1)
 
     def find_free_record(self):
         """
         Find the first free record. Returns record number if found, -1
         otherwise.
         """
-        # TODO: continue search if offset is not aligned to record size.
-        offset = self._buf.find(EMPTY_RECORD.bytes(), RECORD_BASE)
-        if offset == -1:
+        if not self._free:
             return -1
+        return self._free[0]
 
-        return self._record_number(offset)
+    def find_free_records(self, count):
+        """
+        Find the first count free records. Returns list of record numbers,
+        which may be shorter than count if there are not enough free records.
+        """
+        return self._free[:count]
 
     def read_record(self, recnum):
         """
@@ -706,8 +909,27 @@ class VolumeIndex(object):
         storage.
         """
         offset = self._record_offset(recnum)
+        data = record.bytes()
+
+        # Update lookup tables.
+        old_key = self._buf[offset:offset + LOOKUP_STRUCT.size - 1]
+        old_key = old_key.rstrip(b"\0")
+        if old_key and self._records.get(old_key) == recnum:
+            del self._records[old_key]
+        key = record.resource.encode("ascii")
+        if key:
+            self._records.setdefault(key, recnum)
+
+        i = bisect.bisect_left(self._free, recnum)
+        is_free = i < len(self._free) and self._free[i] == recnum
+        if data == EMPTY_RECORD_BYTES:
+            if not is_free:
+                self._free.insert(i, recnum)
+        elif is_free:
+            del self._free[i]
+
         self._buf.seek(offset)
-        self._buf.write(record.bytes())
+        self._buf.write(data)
 
     def read_metadata(self):
         """
@@ -738,6 +960,14 @@ class VolumeIndex(object):
         """
         file.seek(INDEX_BASE)
         file.readinto(self._buf)
+        self._path = file.name
+        data = self._buf[:]
+        tables = _cache.get(self._path, data)
+        if tables is None:
+            self._build_tables()
+            _cache.put(self._path, data, self._records, self._free)
+        else:
+            self._records, self._free = tables
 
     def dump(self, file):
         """
@@ -778,8 +1008,34 @@ class VolumeIndex(object):
             block.dump(file)
 
     def close(self):
+        if self._path is not None:
+            # Keep the tables matching the current contents, so the next load
+            # can use them if nobody else modified the index.
+            _cache.put(self._path, self._buf[:], self._records, self._free)
+            self._path = None
         self._buf.close()
 
+    def _build_tables(self):
+        """
+        Build lookup tables from index contents. If several records use the
+        same lease id, the first record is used.
+        """
+        records = {}
+        free = []
+        buf = self._buf
+        key_size = LOOKUP_STRUCT.size - 1
+        for recnum in range(MAX_RECORDS):
+            offset = self._record_offset(recnum)
+            data = buf[offset:offset + RECORD_SIZE]
+            if data == EMPTY_RECORD_BYTES:
+                free.append(recnum)
+                continue
+            key = data[:key_size].rstrip(b"\0")
+            if key:
+                records.setdefault(key, recnum)
+        self._records = records
+        self._free = free
+
     def _record_offset(self, recnum):
         return RECORD_BASE + recnum * RECORD_SIZE
 
@@ -819,16 +1075,20 @@ class ChangeBlock(object):
         self._buf.seek(offset)
         self._buf.write(record.bytes())
 
-    def dump(self, file):
+    def dump(self, file, sync=True):
         """
         Write the block to storage and wait until the data reach storage.
 
         This is atomic operation, the block is either fully written to storage
         or not.
+
+        If sync is False, do not wait; the caller is responsible for syncing
+        the file after writing all blocks.
         """
         file.seek(INDEX_BASE + self._offset)
         file.write(self._buf)
-        os.fsync(file.fileno())
+        if sync:
+            os.fsync(file.fileno())
 
     def close(self):
         self._buf.close()
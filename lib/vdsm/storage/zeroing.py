@@ -0,0 +1,119 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+zeroing - zero block devices without copying zeroes from user space
+
+Writing zeroes from user space copies every byte through a pipe, even when
+the storage can zero the device without any data transfer. Devices are zeroed
+using the BLKZEROOUT ioctl (blkdiscard --zeroout); the kernel offloads
+zeroing to the storage using WRITE SAME if supported by the device, or writes
+zeroes itself. If blkdiscard fails, for example with old util-linux, zeroes
+are written using dd with direct I/O.
+
+Discard is never used for zeroing; discard_zeroes_data is deprecated and the
+device may return stale data after discarding.
+
+The entire device is zeroed using a single blkdiscard command, killed if
+zeroing is aborted.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import logging
+import threading
+from contextlib import contextmanager
+
+from vdsm import cmdutils
+from vdsm import utils
+from vdsm.common import exception
+from vdsm.config import config
+from vdsm.storage import blkdiscard
+from vdsm.storage import misc
+
+ZEROOUT = "zeroout"
+DD = "dd"
+
+MAX_ZEROING_PER_VG = config.getint("irs", "max_zeroing_per_vg")
+
+# How often to check if zeroing was aborted while waiting for a slot.
+ABORT_CHECK_INTERVAL = 1.0
+
+log = logging.getLogger("storage.zeroing")
+
+# Number of devices zeroed per volume group.
+_cond = threading.Condition(threading.Lock())
+_running = collections.defaultdict(int)
+
+
+def zero(path, size, aborting):
+    """
+    Zero size bytes of the device at path using BLKZEROOUT, falling back to
+    dd if blkdiscard failed.
+
+    aborting is a callable returning True if zeroing should be aborted.
+
+    Returns the method used, ZEROOUT or DD.
+
+    Raises:
+        exception.ActionStopped if aborted
+        cmdutils.Error or se.StorageException if zeroing failed
+    """
+    start = utils.monotonic_time()
+    try:
+        blkdiscard.blkdiscard(path, zeroout=True, stop=aborting)
+        method = ZEROOUT
+    except cmdutils.Error as e:
+        # blkdiscard may have zeroed only part of the device, so dd must
+        # zero the entire device.
+        log.warning("Cannot zero %s using %s, trying %s: %s",
+                    path, ZEROOUT, DD, e)
+        misc.ddWatchCopy("/dev/zero", path, aborting, size)
+        method = DD
+
+    elapsed = utils.monotonic_time() - start
+    log.info("Zeroed %s (%d bytes) using %s in %.2f seconds (%.2f MiB/s)",
+             path, size, method, elapsed,
+             size / max(elapsed, 0.001) / 1024**2)
+    return method
+
+
+@contextmanager
+def slot(vg_name, aborting):
+    """
+    Context manager limiting the number of devices zeroed at the same time in
+    volume group vg_name to irs:max_zeroing_per_vg.
+
+    Raises exception.ActionStopped if aborted while waiting for a slot.
+    """
+    with _cond:
+        while _running[vg_name] >= MAX_ZEROING_PER_VG:
+            if aborting():
+                raise exception.ActionStopped()
+            _cond.wait(ABORT_CHECK_INTERVAL)
+        _running[vg_name] += 1
+    try:
+        yield
+    finally:
+        with _cond:
+            _running[vg_name] -= 1
+            if _running[vg_name] == 0:
+                del _running[vg_name]
+            _cond.notify_all()
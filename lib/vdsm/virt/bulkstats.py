@@ -0,0 +1,189 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+bulkstats - compact storage for libvirt bulk stats samples
+
+Libvirt returns the stats of every vm as a dict with string keys such as
+"block.0.rd.bytes". Keeping these dicts in the stats cache, and looking up
+device indexes by scanning "block.N.name" keys on every getStats call, is
+costly on hosts running hundreds of vms.
+
+A Sample keeps the numeric values of a vm in an array, and shares a Layout
+with the previous samples of the vm: the keys of the numeric values, their
+slots in the array, the non-numeric values (e.g. device names and paths),
+and the index of every device by name. A new layout is created only when the
+devices of a vm change.
+
+When a sample is added after a sample with the same layout, the difference
+between the values of the two samples is computed once for all values, so
+rates and latencies are computed using a single subtraction per value.
+
+Samples implement the read only dict interface, so they can be used
+everywhere a raw bulk stats dict is expected.
+"""
+
+from __future__ import absolute_import
+
+import array
+import collections
+import operator
+
+import six
+
+# Device groups reported by libvirt bulk stats as "<group>.<index>.name".
+DEVICE_GROUPS = ("block", "net")
+
+_NUMBER_TYPES = six.integer_types + (float,)
+
+_MISSING = object()
+
+
+class Layout(object):
+    """
+    The keys of a bulk stats sample, shared by consecutive samples of a vm
+    with the same keys and non-numeric values.
+    """
+
+    __slots__ = ("keys", "slots", "constants", "devices")
+
+    def __init__(self, keys, constants):
+        self.keys = keys
+        self.slots = {key: slot for slot, key in enumerate(keys)}
+        self.constants = constants
+        self.devices = {group: _device_indexes(constants, group)
+                        for group in DEVICE_GROUPS}
+
+    def matches(self, stats):
+        """
+        Return True if stats can be stored using this layout.
+        """
+        if len(stats) != len(self.keys) + len(self.constants):
+            return False
+        for key, value in six.iteritems(self.constants):
+            if stats.get(key, _MISSING) != value:
+                return False
+        for key in self.keys:
+            if key not in stats:
+                return False
+        return True
+
+
+class Sample(collections.Mapping):
+    """
+    Read only view of a bulk stats sample of a vm.
+    """
+
+    __slots__ = ("layout", "values", "_delta")
+
+    def __init__(self, layout, values):
+        self.layout = layout
+        self.values = values
+        # Tuple of the previous sample with the same layout, and the
+        # difference between the values of this sample and the previous
+        # sample. Readers may access the sample while the next sample is
+        # added, so both are replaced using one assignment.
+        self._delta = None
+
+    def __getitem__(self, key):
+        slot = self.layout.slots.get(key)
+        if slot is None:
+            return self.layout.constants[key]
+        return self.values[slot]
+
+    def __contains__(self, key):
+        return key in self.layout.slots or key in self.layout.constants
+
+    def __iter__(self):
+        for key in self.layout.keys:
+            yield key
+        for key in self.layout.constants:
+            yield key
+
+    def __len__(self):
+        return len(self.layout.keys) + len(self.layout.constants)
+
+    def devices(self, group):
+        """
+        Return dict mapping device name to device index in group.
+        """
+        return self.layout.devices[group]
+
+    def difference(self, base, key):
+        """
+        Return the difference between the value of key in this sample and in
+        base sample.
+        """
+        delta = self._delta
+        if delta is not None and delta[0] is base:
+            return delta[1][self.layout.slots[key]]
+        return self[key] - base[key]
+
+
+def sample(stats, previous=None):
+    """
+    Return a Sample with the values of bulk stats dict stats. If previous
+    sample of the same vm has the same keys and names, the sample reuses its
+    layout, and keeps the difference from the previous sample values.
+    """
+    if previous is not None and previous.layout.matches(stats):
+        layout = previous.layout
+    else:
+        layout = _layout(stats)
+    result = Sample(layout, _column(stats[key] for key in layout.keys))
+    if previous is not None and previous.layout is layout:
+        result._delta = (previous, _column(map(operator.sub, result.values,
+                                               previous.values)))
+        # Keep only one level of history.
+        previous._delta = None
+    return result
+
+
+def _layout(stats):
+    keys = []
+    constants = {}
+    for key, value in six.iteritems(stats):
+        if isinstance(value, _NUMBER_TYPES) and not isinstance(value, bool):
+            keys.append(key)
+        else:
+            constants[key] = value
+    keys.sort()
+    return Layout(tuple(keys), constants)
+
+
+def _column(values):
+    # Bulk stats values are integers, but keep other values in a list.
+    values = list(values)
+    try:
+        return array.array("l", values)
+    except (TypeError, OverflowError):
+        return values
+
+
+def _device_indexes(constants, group):
+    # Bulk stats accumulate what they can get, so the count is an upper bound
+    # and some devices may be missing.
+    prefix = group + "."
+    indexes = {}
+    for key, value in six.iteritems(constants):
+        if key.startswith(prefix) and key.endswith(".name"):
+            index = key[len(prefix):-len(".name")]
+            if index.isdigit():
+                indexes[value] = int(index)
+    return indexes
@@ -0,0 +1,239 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+drivemonitor - monitor chunked drives using block threshold events
+
+Polling the allocation of every chunked drive using virDomain.blockInfo()
+every couple of seconds is costly on hosts running many vms, and a fast
+writer may still fill the free space in its chunk between polls.
+
+When libvirt supports VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD, we register a
+write threshold for every chunked drive, and libvirt sends an event when the
+guest writes beyond the threshold. The drive is extended immediately, and a
+new threshold is registered after the extension completes.
+
+Drives without a threshold, and drives exceeding their threshold, are polled
+every vm_watermark_interval seconds. All chunked drives are polled every
+vm_watermark_safety_interval seconds, in case an event was missed.
+"""
+
+from __future__ import absolute_import
+
+import re
+import threading
+
+import libvirt
+
+from vdsm import utils
+from vdsm.common.histogram import Histogram
+from vdsm.config import config
+
+# Upper bounds in seconds, from 100 milliseconds to 2 minutes. Extensions
+# are requested from the SPM using the storage mailbox, typically completing
+# in few seconds.
+BUCKETS = (0.1, 0.2, 0.5, 1, 2, 3, 4, 5, 7.5, 10, 15, 20, 30, 60, 120)
+
+EVENT = "event"
+POLL = "poll"
+
+_latency = {EVENT: Histogram(BUCKETS), POLL: Histogram(BUCKETS)}
+
+# Libvirt reports the device of a backing chain element using the index of
+# the element, e.g. "vda[1]".
+_DEVICE = re.compile(r"^(?P<name>[^\[]+)(\[(?P<index>\d+)\])?$")
+
+
+class BLOCK_THRESHOLD:
+    UNSET = "unset"
+    SET = "set"
+    EXCEEDED = "exceeded"
+
+
+def events_supported():
+    """
+    Return True if libvirt can report block threshold events.
+    """
+    return hasattr(libvirt, "VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD")
+
+
+def stats():
+    """
+    Return dict with histograms of the time from detecting that a drive
+    should be extended until the extension was completed, by the way the
+    drive was detected, "event" or "poll".
+    """
+    return {"thresholdEvents": events_supported() and
+            config.getboolean("vars", "vm_watermark_events"),
+            "extensionLatency": {source: histogram.info()
+                                 for source, histogram in _latency.items()}}
+
+
+class DriveMonitor(object):
+    """
+    Track the block threshold state of the chunked drives of a vm.
+    """
+
+    def __init__(self, vm, log, enabled=None, safety_interval=None,
+                 clock=utils.monotonic_time):
+        self._vm = vm
+        self._log = log
+        if enabled is None:
+            enabled = (events_supported() and
+                       config.getboolean("vars", "vm_watermark_events"))
+        self._events = enabled
+        if safety_interval is None:
+            safety_interval = config.getint(
+                "vars", "vm_watermark_safety_interval")
+        self._safety_interval = safety_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_poll = None
+        # Time the extension of a drive was triggered, by drive name.
+        self._triggered = {}
+
+    def events_enabled(self):
+        return self._events
+
+    def monitored_drives(self):
+        """
+        Return the drives that should be polled now. Without block threshold
+        events, all chunked drives are polled.
+        """
+        drives = self._vm.getChunkedDrives()
+        if not self._events or self._safety_poll_due():
+            return drives
+        return [drive for drive in drives
+                if self._threshold_state(drive) != BLOCK_THRESHOLD.SET]
+
+    def polled(self, drives):
+        """
+        Called after polling drives, to record a full poll.
+        """
+        if len(drives) == len(self._vm.getChunkedDrives()):
+            self._last_poll = self._clock()
+
+    def set_threshold(self, drive, apparentsize):
+        """
+        Register a block threshold for a chunked drive, so libvirt sends an
+        event when the guest writes beyond drive.watermarkLimit bytes before
+        the end of the volume.
+
+        Drives replicating to another volume are always polled, since the
+        threshold is set only on the source volume.
+        """
+        if not self._events or not drive.chunked or \
+                drive.isDiskReplicationInProgress():
+            return
+
+        threshold = apparentsize - drive.watermarkLimit
+        if threshold <= 0:
+            return
+
+        self._log.debug("Setting block threshold to %d bytes for drive %r "
+                        "(apparentsize %d)", threshold, drive.name,
+                        apparentsize)
+        try:
+            self._vm._dom.setBlockThreshold(drive.name, threshold)
+        except libvirt.libvirtError as e:
+            # Keep polling the drive.
+            self._log.error("Failed to set block threshold for drive %r: %s",
+                            drive.name, e)
+            drive.threshold_state = BLOCK_THRESHOLD.UNSET
+        else:
+            drive.threshold_state = BLOCK_THRESHOLD.SET
+
+    def clear_thresholds(self):
+        """
+        Forget the registered thresholds, so drives are polled and new
+        thresholds are registered on the next poll. Must be called when the
+        volume chain of the drives may have changed, since libvirt registers
+        the threshold on the current top volume.
+        """
+        for drive in self._vm.getChunkedDrives():
+            drive.threshold_state = BLOCK_THRESHOLD.UNSET
+
+    def on_block_threshold(self, dev, path, threshold, excess):
+        """
+        Handle a block threshold event, returning the drive exceeding its
+        threshold, or None if the event is not relevant.
+        """
+        match = _DEVICE.match(dev)
+        if match is None:
+            self._log.warning("Unexpected block threshold event for "
+                              "device %r", dev)
+            return None
+
+        name = match.group("name")
+        drive = self._find_drive(name)
+        if drive is None:
+            self._log.warning("Block threshold event for unknown drive %r",
+                              name)
+            return None
+
+        # We register thresholds only on the top volume, so an event for a
+        # backing chain element was registered before the volume chain
+        # changed, and will be replaced on the next poll.
+        if match.group("index") is not None:
+            self._log.debug("Ignoring block threshold event for backing "
+                            "volume %r of drive %r", dev, name)
+            return None
+
+        self._log.info("Block threshold %s exceeded by %s bytes for drive "
+                       "%r (%s)", threshold, excess, name, path)
+        drive.threshold_state = BLOCK_THRESHOLD.EXCEEDED
+        with self._lock:
+            self._triggered.setdefault(name, (self._clock(), EVENT))
+        return drive
+
+    def extension_requested(self, drive):
+        """
+        Called when an extension is requested for drive found by polling. If
+        the extension was triggered by an event, the event time is kept.
+        """
+        with self._lock:
+            self._triggered.setdefault(drive.name, (self._clock(), POLL))
+
+    def extension_completed(self, drive):
+        """
+        Called when the extension of the drive completed, to record the
+        extension latency.
+        """
+        with self._lock:
+            triggered = self._triggered.pop(drive.name, None)
+        if triggered is None:
+            return
+        start, source = triggered
+        elapsed = self._clock() - start
+        _latency[source].add(elapsed)
+        self._log.info("Extension of drive %r (%s) completed in %.2f "
+                       "seconds", drive.name, source, elapsed)
+
+    def _safety_poll_due(self):
+        return (self._last_poll is None or
+                self._clock() - self._last_poll >= self._safety_interval)
+
+    def _threshold_state(self, drive):
+        return getattr(drive, "threshold_state", BLOCK_THRESHOLD.UNSET)
+
+    def _find_drive(self, name):
+        for drive in self._vm.getChunkedDrives():
+            if drive.name == name:
+                return drive
+        return None
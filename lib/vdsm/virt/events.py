@@ -34,6 +34,10 @@ LIBVIRT_EVENTS = {
     libvirt.VIR_DOMAIN_EVENT_ID_JOB_COMPLETED: 'JOB_COMPLETED'
 }
 
+if hasattr(libvirt, 'VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD'):
+    LIBVIRT_EVENTS[libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD] = \
+        'BLOCK_THRESHOLD'
+
 
 def event_name(event_id):
     try:
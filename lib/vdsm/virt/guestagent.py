@@ -39,6 +39,9 @@ _MAX_SUPPORTED_API_VERSION = 3
 _IMPLICIT_API_VERSION_ZERO = 0
 _REPLY_CAP_MIN_VERSION = 3
 
+# Guest info updated on every heartbeat.
+HEARTBEAT_INFO = ('memUsage', 'memoryStats')
+
 _MESSAGE_API_VERSION_LOOKUP = {
     'set-number-of-cpus': 1,
     'lifecycle-event': 3}
@@ -175,6 +178,9 @@ class GuestAgent(object):
             'disksUsage': [],
             'netIfaces': [],
             'memoryStats': {}}
+        # Protects guestInfo and _infoGeneration.
+        self._infoLock = threading.Lock()
+        self._infoGeneration = 0
         self._agentTimestamp = 0
         self._channelListener = channelListener
         self._messageState = MessageState.NORMAL
@@ -236,6 +242,14 @@ class GuestAgent(object):
         self._guestDiskMapping = value
         self._diskMappingHash = hash(json.dumps(value, sort_keys=True))
 
+    @property
+    def infoGeneration(self):
+        """
+        Changes when guest info, except the info updated on every heartbeat,
+        is changed.
+        """
+        return self._infoGeneration
+
     @property
     def diskMappingHash(self):
         return self._diskMappingHash
@@ -332,32 +346,46 @@ class GuestAgent(object):
     def _handleMessage(self, message, args):
         self.log.debug("Guest's message %s: %s", message, args)
         if message == 'heartbeat':
+            self._handleHeartbeat(args)
+        elif message == 'completion':
+            self._on_completion(args.pop('reply_id', None))
+        else:
+            with self._infoLock:
+                self._handleInfoMessage(message, args)
+                # Change the generation only after the info was updated, so
+                # info cached with the new generation is never stale.
+                self._infoGeneration += 1
+
+    def _handleHeartbeat(self, args):
+        with self._infoLock:
             self.guestInfo['memUsage'] = int(args['free-ram'])
-            # ovirt-guest-agent reports the following fields in 'memory-stat':
-            # 'mem_total', 'mem_free', 'mem_unused', 'swap_in', 'swap_out',
-            # 'pageflt' and 'majflt'
+            # ovirt-guest-agent reports the following fields in
+            # 'memory-stat': 'mem_total', 'mem_free', 'mem_unused',
+            # 'swap_in', 'swap_out', 'pageflt' and 'majflt'
             if 'memory-stat' in args:
                 for (k, v) in args['memory-stat'].iteritems():
-                    # Convert the value to string since 64-bit integer is not
-                    # supported in XMLRPC
+                    # Convert the value to string since 64-bit integer is
+                    # not supported in XMLRPC
                     self.guestInfo['memoryStats'][k] = str(v)
 
-            if 'apiVersion' in args:
-                # The guest agent supports API Versioning
-                self._handleAPIVersion(args['apiVersion'])
-            elif self.effectiveApiVersion != _IMPLICIT_API_VERSION_ZERO:
-                # Older versions of the guest agent (before the introduction
-                # of API versioning) do not report this field
-                # Disable the API if not already disabled (e.g. after
-                # downgrade of the guest agent)
-                self.log.debug("API versioning no longer reported by guest.")
-                self.effectiveApiVersion = _IMPLICIT_API_VERSION_ZERO
-            # Only change the state AFTER all data of the heartbeat has been
-            # consumed
-            self.guestStatus = vmstatus.UP
-            if self._seen_shutdown:
-                self._seen_shutdown = False
-        elif message == 'host-name':
+        if 'apiVersion' in args:
+            # The guest agent supports API Versioning
+            self._handleAPIVersion(args['apiVersion'])
+        elif self.effectiveApiVersion != _IMPLICIT_API_VERSION_ZERO:
+            # Older versions of the guest agent (before the introduction
+            # of API versioning) do not report this field
+            # Disable the API if not already disabled (e.g. after
+            # downgrade of the guest agent)
+            self.log.debug("API versioning no longer reported by guest.")
+            self.effectiveApiVersion = _IMPLICIT_API_VERSION_ZERO
+        # Only change the state AFTER all data of the heartbeat has been
+        # consumed
+        self.guestStatus = vmstatus.UP
+        if self._seen_shutdown:
+            self._seen_shutdown = False
+
+    def _handleInfoMessage(self, message, args):
+        if message == 'host-name':
             self.guestInfo['guestName'] = args['name']
         elif message == 'os-version':
             self.guestInfo['guestOs'] = args['version']
@@ -420,8 +448,6 @@ class GuestAgent(object):
             self.guestDiskMapping = args.get('mapping', {})
         elif message == 'number-of-cpus':
             self.guestInfo['guestCPUCount'] = int(args['count'])
-        elif message == 'completion':
-            self._on_completion(args.pop('reply_id', None))
         else:
             self.log.error('Unknown message type %s', message)
 
@@ -446,23 +472,37 @@ class GuestAgent(object):
         return self.guestStatus
 
     def getGuestInfo(self):
-        if self.isResponsive():
-            return utils.picklecopy(self.guestInfo)
-        else:
-            return {
-                'username': 'Unknown',
-                'session': 'Unknown',
-                'memUsage': 0,
-                'guestCPUCount': -1,
-                'appsList': self.guestInfo['appsList'],
-                'guestIPs': self.guestInfo['guestIPs'],
-                'guestFQDN': self.guestInfo['guestFQDN']}
+        with self._infoLock:
+            if self.isResponsive():
+                return utils.picklecopy(self.guestInfo)
+            else:
+                return {
+                    'username': 'Unknown',
+                    'session': 'Unknown',
+                    'memUsage': 0,
+                    'guestCPUCount': -1,
+                    'appsList': self.guestInfo['appsList'],
+                    'guestIPs': self.guestInfo['guestIPs'],
+                    'guestFQDN': self.guestInfo['guestFQDN']}
+
+    def getHeartbeatInfo(self):
+        """
+        Return the guest info updated on every heartbeat.
+        """
+        with self._infoLock:
+            if self.isResponsive():
+                return utils.picklecopy({key: self.guestInfo[key]
+                                         for key in HEARTBEAT_INFO})
+            else:
+                return {'memUsage': 0}
 
     def onReboot(self):
         self.guestStatus = vmstatus.REBOOT_IN_PROGRESS
-        self.guestInfo['lastUser'] = '' + self.guestInfo['username']
-        self.guestInfo['username'] = 'Unknown'
-        self.guestInfo['lastLogout'] = time.time()
+        with self._infoLock:
+            self.guestInfo['lastUser'] = '' + self.guestInfo['username']
+            self.guestInfo['username'] = 'Unknown'
+            self.guestInfo['lastLogout'] = time.time()
+            self._infoGeneration += 1
 
     def desktopLock(self):
         try:
@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -49,6 +49,7 @@ _MAX_WORKERS = config.getint('sampling', 'max_workers')
 
 _operations = []
 _executor = None
+_metrics_sources = None
 
 
 def _timeout_from(interval):
@@ -61,6 +62,7 @@ def _timeout_from(interval):
 def start(cif, scheduler):
     global _operations
     global _executor
+    global _metrics_sources
 
     _executor = executor.Executor(name="periodic",
                                   workers_count=_WORKERS,
@@ -97,9 +99,10 @@ def start(cif, scheduler):
             config.getint('vars', 'vm_sample_interval'),
             scheduler),
 
-        # We do this only until we get high water mark notifications
-        # from QEMU. It accesses storage and/or QEMU monitor, so can block,
-        # thus we need dispatching.
+        # When using block threshold events, this checks only drives without
+        # a threshold, and all drives every vm_watermark_safety_interval.
+        # It accesses storage and/or QEMU monitor, so can block, thus we need
+        # dispatching.
         per_vm_operation(
             DriveWatermarkMonitor,
             config.getint('vars', 'vm_watermark_interval')),
@@ -123,8 +126,30 @@ def start(cif, scheduler):
     for op in _operations:
         op.start()
 
+    _metrics_sources = sampling.MetricsSources(cif)
+    _metrics_sources.start()
+
+
+def dispatch(func, timeout=None):
+    """
+    Run func once on the periodic executor. Used to handle events that
+    may block, without blocking the thread delivering the event.
+
+    Raises executor.NotRunning if periodic operations are not running, or
+    executor.TooManyTasks if the executor is overloaded.
+    """
+    if _executor is None:
+        raise executor.NotRunning()
+    _executor.dispatch(func, timeout)
+
 
 def stop():
+    global _metrics_sources
+
+    if _metrics_sources is not None:
+        _metrics_sources.stop()
+        _metrics_sources = None
+
     for op in _operations:
         op.stop()
 
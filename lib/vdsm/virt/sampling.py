@@ -1,5 +1,5 @@
 #
-# Copyright 2008-2016 Red Hat, Inc.
+# Copyright 2008-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -33,13 +33,14 @@ import threading
 import time
 
 from vdsm import hugepages
+from vdsm import metrics
 from vdsm import numa
 from vdsm import utils
-from vdsm.config import config
 from vdsm.constants import P_VDSM_RUN, P_VDSM_CLIENT_LOG
 from vdsm.host import api as hostapi
 from vdsm.network import ipwrapper
 from vdsm.network.netinfo import nics, bonding, vlans
+from vdsm.virt import bulkstats
 from vdsm.virt import vmstats
 from vdsm.virt.utils import ExpiringCache
 
@@ -47,7 +48,6 @@ from vdsm.virt.utils import ExpiringCache
 _THP_STATE_PATH = '/sys/kernel/mm/transparent_hugepage/enabled'
 if not os.path.exists(_THP_STATE_PATH):
     _THP_STATE_PATH = '/sys/kernel/mm/redhat_transparent_hugepage/enabled'
-_METRICS_ENABLED = config.getboolean('metrics', 'enabled')
 
 
 class InterfaceSample(object):
@@ -434,7 +434,7 @@ class StatsCache(object):
         with self._lock:
             last_sample_time = self._last_sample_time
             if monotonic_ts >= last_sample_time:
-                self._samples.append(bulk_stats)
+                self._samples.append(self._columnar(bulk_stats))
                 self._last_sample_time = monotonic_ts
 
                 self._update_ts(bulk_stats, monotonic_ts)
@@ -443,6 +443,21 @@ class StatsCache(object):
                     'dropped stale old sample: sampled %f stored %f',
                     monotonic_ts, last_sample_time)
 
+    def _columnar(self, bulk_stats):
+        # Store the vms stats as bulkstats.Sample, reusing the layout of the
+        # previous sample and computing the difference from the previous
+        # sample for all vms in one pass.
+        previous_batch = self._samples.last() or {}
+        batch = {}
+        for vmid, vm_stats in six.iteritems(bulk_stats):
+            if isinstance(vm_stats, dict):
+                previous = previous_batch.get(vmid)
+                if not isinstance(previous, bulkstats.Sample):
+                    previous = None
+                vm_stats = bulkstats.sample(vm_stats, previous)
+            batch[vmid] = vm_stats
+        return batch
+
     def _update_ts(self, bulk_stats, monotonic_ts):
         # FIXME: this is expected to be costly performance-wise.
         for vmid in bulk_stats:
@@ -508,27 +523,8 @@ class VMBulkstatsMonitor(object):
                 'sampled timestamp %r elapsed %.3f acquired %r domains %s',
                 timestamp, self._stats_cache.clock() - timestamp, acquired,
                 'all' if fast_path else len(doms))
-        if _METRICS_ENABLED:
-            self._send_metrics()
-
-    def _send_metrics(self):
-        vms = self._get_vms()
-        vm_samples = self._stats_cache.get_batch()
-        if vm_samples is None:
-            return
-        stats = {}
-        for vm_id, vm_sample in six.iteritems(vm_samples):
-            vm_obj = vms.get(vm_id)
-            if vm_obj is None:
-                # unknown VM, such as an external VM
-                continue
-            vm_data = vmstats.produce(vm_obj,
-                                      vm_sample.first_value,
-                                      vm_sample.last_value,
-                                      vm_sample.interval)
-            vm_data["vmName"] = vm_obj.name
-            stats[vm_id] = vm_data
-        vmstats.send_metrics(stats)
+        if metrics.pushing():
+            metrics.send(vms_report(self._get_vms(), self._stats_cache))
 
     def _get_responsive_doms(self):
         vms = self._get_vms()
@@ -564,9 +560,63 @@ class HostMonitor(object):
         sample = HostSample(self._pid)
         self._samples.append(sample)
 
-        if self._cif and _METRICS_ENABLED:
-            stats = hostapi.get_stats(self._cif, self._samples.stats())
-            hostapi.send_metrics(stats)
+        if self._cif and metrics.pushing():
+            metrics.send(host_report(self._cif, self._samples))
+
+
+def vms_report(vms, stats_cache=stats_cache):
+    """
+    Return list of metrics.Metric with the stats of vms, dict of vms by
+    vm id, computed from the last samples in stats_cache.
+    """
+    vm_samples = stats_cache.get_batch()
+    if vm_samples is None:
+        return []
+    stats = {}
+    for vm_id, vm_sample in six.iteritems(vm_samples):
+        vm_obj = vms.get(vm_id)
+        if vm_obj is None:
+            # unknown VM, such as an external VM
+            continue
+        vm_data = vmstats.produce(vm_obj,
+                                  vm_sample.first_value,
+                                  vm_sample.last_value,
+                                  vm_sample.interval)
+        vm_data["vmName"] = vm_obj.name
+        stats[vm_id] = vm_data
+    return vmstats.report(stats)
+
+
+def host_report(cif, samples=host_samples):
+    """
+    Return list of metrics.Metric with the host stats, computed from the last
+    samples.
+    """
+    return hostapi.report(hostapi.get_stats(cif, samples.stats()))
+
+
+class MetricsSources(object):
+    """
+    Register the vms and host stats as metrics sources, collected from the
+    last samples when the metrics are scraped.
+    """
+
+    def __init__(self, cif):
+        self._cif = cif
+
+    def start(self):
+        metrics.register(self.vms)
+        metrics.register(self.host)
+
+    def stop(self):
+        metrics.unregister(self.vms)
+        metrics.unregister(self.host)
+
+    def vms(self):
+        return vms_report(self._cif.getVMs())
+
+    def host(self):
+        return host_report(self._cif)
 
 
 def _getLinkSpeed(dev):
@@ -0,0 +1,175 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+statstracker - track changes in vms stats between client requests
+
+Returning the stats of all vms on every poll is costly with hundreds of vms,
+while the stats of most vms do not change between polls, e.g. idle or down
+vms, or polls more frequent than the stats sampling interval.
+
+The tracker keeps the stats of every vm, and the generation in which they
+changed. A client passes the cursor returned by the previous call, and
+gets only the stats of the vms which changed since that call, and the ids of
+the vms which were removed.
+
+Fields which change on every call, like statusTime, are ignored when
+detecting changes; the client gets their current value when other stats
+change. Changes are detected by comparing the stats dicts, without encoding
+them; the stats items must not be modified after they were returned.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import threading
+import uuid
+
+import six
+
+from yajsonrpc import EncodedDict
+
+# Fields changing on every call.
+VOLATILE_FIELDS = frozenset(("statusTime", "elapsedTime"))
+VOLATILE_NIC_FIELDS = frozenset(("sampleTime",))
+
+# Number of removed vms to remember. Clients with an older cursor get the
+# stats of all vms.
+MAX_REMOVED = 1000
+
+_Entry = collections.namedtuple("_Entry", "generation, fragment, stats")
+
+
+class StatsTracker(object):
+
+    def __init__(self, max_removed=MAX_REMOVED):
+        # Cursors from another instance (e.g. before vdsm was restarted)
+        # are not valid.
+        self._instance = str(uuid.uuid4())
+        self._max_removed = max_removed
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._vms = {}
+        # Generation in which a vm was removed, by vm id.
+        self._removed = collections.OrderedDict()
+        # Oldest generation we can report removed vms since.
+        self._horizon = 0
+
+    def changes(self, stats_list, cursor=None):
+        """
+        Update the tracker with the current stats of all vms, and return a
+        dict with:
+            cursor (str): pass this value in the next call
+            full (bool): True if changed contains the stats of all vms, when
+                cursor is None or not valid
+            changed (list): stats of the vms changed since cursor
+            removed (list): ids of the vms removed since cursor
+        """
+        with self._lock:
+            self._update(stats_list)
+            generation = self._parse(cursor)
+            if generation is None:
+                changed = stats_list
+                removed = []
+            else:
+                if generation == self._generation:
+                    changed = []
+                else:
+                    changed = [stats for stats in stats_list
+                               if self._vms[stats["vmId"]].generation >
+                               generation]
+                removed = [vm_id for vm_id, removed_generation
+                           in six.iteritems(self._removed)
+                           if removed_generation > generation]
+            return {
+                "cursor": "%s:%d" % (self._instance, self._generation),
+                "full": generation is None,
+                "changed": changed,
+                "removed": removed,
+            }
+
+    def _update(self, stats_list):
+        generation = self._generation + 1
+        modified = False
+        seen = set()
+
+        for stats in stats_list:
+            vm_id = stats["vmId"]
+            seen.add(vm_id)
+            fragment, stable = _stable(stats)
+            entry = self._vms.get(vm_id)
+            if (entry is None or entry.fragment is not fragment or
+                    entry.stats != stable):
+                self._vms[vm_id] = _Entry(generation, fragment, stable)
+                modified = True
+            self._removed.pop(vm_id, None)
+
+        for vm_id in list(self._vms):
+            if vm_id not in seen:
+                del self._vms[vm_id]
+                self._removed[vm_id] = generation
+                modified = True
+
+        while len(self._removed) > self._max_removed:
+            _, removed_generation = self._removed.popitem(last=False)
+            self._horizon = removed_generation
+
+        if modified:
+            self._generation = generation
+
+    def _parse(self, cursor):
+        """
+        Return the generation of a valid cursor, or None.
+        """
+        if not cursor:
+            return None
+        instance, _, generation = cursor.rpartition(":")
+        if instance != self._instance:
+            return None
+        try:
+            generation = int(generation)
+        except ValueError:
+            return None
+        if generation < self._horizon or generation > self._generation:
+            return None
+        return generation
+
+
+def _stable(stats):
+    """
+    Return the JsonFragment included in stats or None, and a dict with the
+    other items of stats, without the volatile fields.
+    """
+    fragment = None
+    if isinstance(stats, EncodedDict):
+        unencoded = stats.unencoded_items()
+        if unencoded is not None:
+            # A new fragment is created when the fragment items change, so
+            # the items are compared by the fragment identity.
+            fragment = stats.fragment
+            stats = unencoded
+    stable = {key: value for key, value in six.iteritems(stats)
+              if key not in VOLATILE_FIELDS}
+    network = stable.get("network")
+    if network:
+        stable["network"] = {
+            name: {key: value for key, value in six.iteritems(nic)
+                   if key not in VOLATILE_NIC_FIELDS}
+            for name, nic in six.iteritems(network)}
+    return fragment, stable
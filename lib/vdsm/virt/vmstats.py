@@ -1,5 +1,5 @@
 #
-# Copyright 2008-2016 Red Hat, Inc.
+# Copyright 2008-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -28,6 +28,7 @@ from vdsm import metrics
 from vdsm.utils import convertToStr
 
 from vdsm.utils import monotonic_time
+from vdsm.virt import bulkstats
 from vdsm.virt.utils import isVdsmImage
 
 
@@ -133,13 +134,13 @@ def cpu(stats, first_sample, last_sample, interval):
         stats['cpuUsage'] = str(last_sample['cpu.system'] +
                                 last_sample['cpu.user'])
 
-        cpu_sys = ((last_sample['cpu.user'] - first_sample['cpu.user']) +
-                   (last_sample['cpu.system'] - first_sample['cpu.system']))
+        cpu_sys = (_difference(first_sample, last_sample, 'cpu.user') +
+                   _difference(first_sample, last_sample, 'cpu.system'))
         stats['cpuSys'] = _usage_percentage(cpu_sys, interval)
 
         if all('cpu.time' in s for s in samples):
             stats['cpuUser'] = _usage_percentage(
-                ((last_sample['cpu.time'] - first_sample['cpu.time']) -
+                (_difference(first_sample, last_sample, 'cpu.time') -
                  cpu_sys),
                 interval)
 
@@ -191,78 +192,88 @@ def cpu_count(stats, sample):
             logging.error('Failed to get VM cpu count')
 
 
-def send_metrics(vms_stats):
-    data = {}
+# Metrics names and stats keys.
+
+_CPU_METRICS = (
+    ('vms.{vm_name}.cpu.user', 'cpuUser'),
+    ('vms.{vm_name}.cpu.sys', 'cpuSys'),
+    ('vms.{vm_name}.cpu.usage', 'cpuUsage'),
+)
+
+_BALLOON_METRICS = (
+    ('vms.{vm_name}.balloon.max', 'balloon_max'),
+    ('vms.{vm_name}.balloon.min', 'balloon_min'),
+    ('vms.{vm_name}.balloon.target', 'balloon_target'),
+    ('vms.{vm_name}.balloon.cur', 'balloon_cur'),
+)
+
+_DISK_METRICS = (
+    ('vms.{vm_name}.disk.{disk}.read_latency', 'readLatency'),
+    ('vms.{vm_name}.disk.{disk}.read_ops', 'readOps'),
+    ('vms.{vm_name}.disk.{disk}.read_bytes', 'readBytes'),
+    ('vms.{vm_name}.disk.{disk}.read_rate', 'readRate'),
+    ('vms.{vm_name}.disk.{disk}.write_bytes', 'writtenBytes'),
+    ('vms.{vm_name}.disk.{disk}.write_ops', 'writeOps'),
+    ('vms.{vm_name}.disk.{disk}.write_latency', 'writeLatency'),
+    ('vms.{vm_name}.disk.{disk}.write_rate', 'writeRate'),
+    ('vms.{vm_name}.disk.{disk}.apparent_size', 'apparentsize'),
+    ('vms.{vm_name}.disk.{disk}.flush_latency', 'flushLatency'),
+    ('vms.{vm_name}.disk.{disk}.true_size', 'truesize'),
+)
+
+_NIC_METRICS = (
+    ('vms.{vm_name}.nic.{nic}.speed', 'speed'),
+    ('vms.{vm_name}.nic.{nic}.rx_bytes', 'rx'),
+    ('vms.{vm_name}.nic.{nic}.rx_errors', 'rxErrors'),
+    ('vms.{vm_name}.nic.{nic}.rx_dropped', 'rxDropped'),
+    ('vms.{vm_name}.nic.{nic}.tx_bytes', 'tx'),
+    ('vms.{vm_name}.nic.{nic}.tx_errors', 'txErrors'),
+    ('vms.{vm_name}.nic.{nic}.tx_dropped', 'txDropped'),
+)
+
+
+def report(vms_stats):
+    """
+    Return list of metrics.Metric with the stats of the vms in vms_stats,
+    dict of vm stats by vm id. The stats must include the vm name.
+    """
+    report = []
     try:
         for vm_uuid in vms_stats:
             stat = vms_stats[vm_uuid]
-            prefix = "vms." + stat['vmName']
-            data[prefix + '.cpu.user'] = stat['cpuUser']
-            data[prefix + '.cpu.sys'] = stat['cpuSys']
-            data[prefix + '.cpu.usage'] = stat['cpuUsage']
+            labels = {'vm_id': vm_uuid, 'vm_name': stat['vmName']}
+            _add_metrics(report, _CPU_METRICS, stat, labels)
 
             if stat['balloonInfo']:
-                data[prefix + '.balloon.max'] = \
-                    stat['balloonInfo']['balloon_max']
-                data[prefix + '.balloon.min'] = \
-                    stat['balloonInfo']['balloon_min']
-                data[prefix + '.balloon.target'] = \
-                    stat['balloonInfo']['balloon_target']
-                data[prefix + '.balloon.cur'] = \
-                    stat['balloonInfo']['balloon_cur']
+                _add_metrics(report, _BALLOON_METRICS, stat['balloonInfo'],
+                             labels)
 
             if 'disks' in stat:
                 for disk in stat['disks']:
-                    diskprefix = prefix + '.disk.' + disk
-                    diskinfo = stat['disks'][disk]
-
-                    data[diskprefix + '.read_latency'] = \
-                        diskinfo['readLatency']
-                    data[diskprefix + '.read_ops'] = \
-                        diskinfo['readOps']
-                    data[diskprefix + '.read_bytes'] = \
-                        diskinfo['readBytes']
-                    data[diskprefix + '.read_rate'] = \
-                        diskinfo['readRate']
-
-                    data[diskprefix + '.write_bytes'] = \
-                        diskinfo['writtenBytes']
-                    data[diskprefix + '.write_ops'] = \
-                        diskinfo['writeOps']
-                    data[diskprefix + '.write_latency'] = \
-                        diskinfo['writeLatency']
-                    data[diskprefix + '.write_rate'] = \
-                        diskinfo['writeRate']
-
-                    data[diskprefix + '.apparent_size'] = \
-                        diskinfo['apparentsize']
-                    data[diskprefix + '.flush_latency'] = \
-                        diskinfo['flushLatency']
-                    data[diskprefix + '.true_size'] = \
-                        diskinfo['truesize']
+                    _add_metrics(report, _DISK_METRICS, stat['disks'][disk],
+                                 dict(labels, disk=disk))
 
             if 'network' in stat:
                 for interface in stat['network']:
-                    netprefix = prefix + '.nic.' + interface
-                    if_info = stat['network'][interface]
-                    data[netprefix + '.speed'] = if_info['speed']
-                    data[netprefix + '.rx_bytes'] = if_info['rx']
-                    data[netprefix + '.rx_errors'] = if_info['rxErrors']
-                    data[netprefix + '.rx_dropped'] = if_info['rxDropped']
-
-                    data[netprefix + '.tx_bytes'] = if_info['tx']
-                    data[netprefix + '.tx_errors'] = if_info['txErrors']
-                    data[netprefix + '.tx_dropped'] = if_info['txDropped']
+                    _add_metrics(report, _NIC_METRICS,
+                                 stat['network'][interface],
+                                 dict(labels, nic=interface))
 
         # Guest cpu-count,apps list, status, mac addr, client IP,
         # display type, kvm enabled, username, vcpu info, vm jobs,
-        # displayinfo, hash, acpi, fqdn, vm uuid, pid,
+        # displayinfo, hash, acpi, fqdn, pid,
         #
         # are all meta-data that should be published separately
 
-        metrics.send(data)
     except KeyError:
         logging.exception('VM metrics collection failed')
+        return []
+    return report
+
+
+def _add_metrics(report, names, stats, labels):
+    for name, key in names:
+        report.append(metrics.Metric(name, stats[key], labels))
 
 
 def _nic_traffic(vm_obj, name, model, mac,
@@ -328,8 +339,8 @@ def networks(vm, stats, first_sample, last_sample, interval):
             interval, vm.id)
         return None
 
-    first_indexes = _find_bulk_stats_reverse_map(first_sample, 'net')
-    last_indexes = _find_bulk_stats_reverse_map(last_sample, 'net')
+    first_indexes = _device_indexes(first_sample, 'net')
+    last_indexes = _device_indexes(last_sample, 'net')
 
     for nic in vm.getNicDevices():
         if nic.name.startswith('hostdev'):
@@ -356,8 +367,8 @@ def disks(vm, stats, first_sample, last_sample, interval):
     # order across calls. It is usually like this, but not always,
     # for example if hotplug/hotunplug comes into play.
     # To be safe, we need to find the mapping after each call.
-    first_indexes = _find_bulk_stats_reverse_map(first_sample, 'block')
-    last_indexes = _find_bulk_stats_reverse_map(last_sample, 'block')
+    first_indexes = _device_indexes(first_sample, 'block')
+    last_indexes = _device_indexes(last_sample, 'block')
     disk_stats = {}
 
     for vm_drive in vm.getDiskDevices():
@@ -417,11 +428,11 @@ def _disk_rate(first_sample, first_index, last_sample, last_index, interval):
         first_key = 'block.%d.%s.bytes' % (first_index, mode)
         last_key = 'block.%d.%s.bytes' % (last_index, mode)
         try:
-            first_value = first_sample[first_key]
-            last_value = last_sample[last_key]
+            value = _difference(first_sample, last_sample, first_key,
+                                last_key)
         except KeyError:
             continue
-        stats[name] = str((last_value - first_value) / interval)
+        stats[name] = str(value / interval)
 
     return stats
 
@@ -435,10 +446,11 @@ def _disk_latency(first_sample, first_index, last_sample, last_index):
         try:
             last_key = "block.%d.%s" % (last_index, mode)
             first_key = "block.%d.%s" % (first_index, mode)
-            operations = (last_sample[last_key + ".reqs"] -
-                          first_sample[first_key + ".reqs"])
-            elapsed_time = (last_sample[last_key + ".times"] -
-                            first_sample[first_key + ".times"])
+            operations = _difference(first_sample, last_sample,
+                                     first_key + ".reqs", last_key + ".reqs")
+            elapsed_time = _difference(first_sample, last_sample,
+                                       first_key + ".times",
+                                       last_key + ".times")
         except KeyError:
             continue
         if operations:
@@ -470,6 +482,25 @@ def _usage_percentage(val, interval):
     return 100 * val / interval / 1000 ** 3
 
 
+def _difference(first_sample, last_sample, first_key, last_key=None):
+    """
+    Return the difference between the value of last_key in last_sample and
+    the value of first_key in first_sample, using the difference computed
+    when the sample was cached if possible.
+    """
+    if last_key is None:
+        last_key = first_key
+    if first_key == last_key and isinstance(last_sample, bulkstats.Sample):
+        return last_sample.difference(first_sample, last_key)
+    return last_sample[last_key] - first_sample[first_key]
+
+
+def _device_indexes(stats, group):
+    if isinstance(stats, bulkstats.Sample):
+        return stats.devices(group)
+    return _find_bulk_stats_reverse_map(stats, group)
+
+
 def _find_bulk_stats_reverse_map(stats, group):
     name_to_idx = {}
     for idx in six.moves.xrange(stats.get('%s.count' % group, 0)):
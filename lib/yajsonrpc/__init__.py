@@ -15,10 +15,13 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
 from __future__ import absolute_import
 import logging
+import re
 from six.moves import queue
 from weakref import ref
 from threading import Lock, Event
 
+import six
+
 from vdsm.compat import json
 
 from vdsm.common import exception
@@ -35,6 +38,11 @@ _STATE_INCOMING = 1
 _STATE_OUTGOING = 2
 _STATE_ONESHOT = 4
 
+# Placeholder for a JsonFragment in an encoded response, replaced with the
+# encoded fragment. Vdsm does not use keys with control characters.
+_FRAGMENT_KEY = "\0fragment-%d\0"
+_FRAGMENT_RE = re.compile(r'"\\u0000fragment-(\d+)\\u0000": null')
+
 
 class JsonRpcError(RuntimeError):
     def __init__(self, code, msg):
@@ -149,7 +157,7 @@ class JsonRpcRequest(object):
 
 class JsonRpcResponse(object):
     def __init__(self, result=None, error=None, reqId=None):
-        self.result = unprotect_passwords(result)
+        self.result = result
         self.error = error
         self.id = reqId
 
@@ -167,6 +175,16 @@ class JsonRpcResponse(object):
 
     def encode(self):
         res = self.toDict()
+        if self.error is None:
+            # Encoded fragments cannot contain passwords, so only the
+            # items which are not encoded yet are checked.
+            fragments = []
+            res['result'] = unprotect_passwords(
+                _extract_fragments(self.result, fragments))
+            if fragments:
+                encoded = json.dumps(res, 'utf-8')
+                return _FRAGMENT_RE.sub(
+                    lambda m: fragments[int(m.group(1))].text, encoded)
         return json.dumps(res, 'utf-8')
 
     @staticmethod
@@ -191,6 +209,95 @@ class JsonRpcResponse(object):
         return JsonRpcResponse(result, error, reqId)
 
 
+class JsonFragment(object):
+    """
+    Items of a JSON object, encoded once and included in many responses.
+
+    Use for items which change rarely but are returned often, such as the
+    static stats of a vm.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        # Members only, without the braces.
+        self.text = json.dumps(items)[1:-1]
+
+
+class EncodedDict(dict):
+    """
+    Dict including the items of a JsonFragment.
+
+    This is a plain dict that can be modified and copied, but when it is
+    returned in a response, the items of the fragment are not encoded again;
+    only the other items are encoded, and the encoded fragment is spliced
+    into the response.
+
+    To keep responses cheap to inspect, fragments are spliced only when the
+    EncodedDict is the result, an item of the result list, or an item of a
+    list in the result dict.
+    """
+
+    def __init__(self, fragment, *args, **kwargs):
+        dict.__init__(self, fragment.items)
+        self.update(*args, **kwargs)
+        self.fragment = fragment
+
+    def unencoded_items(self):
+        """
+        Return a dict with the items not in the fragment, or None if the
+        fragment items were modified since this dict was created.
+        """
+        items = self.fragment.items
+        for key, value in six.iteritems(items):
+            if self.get(key, _MISSING) is not value:
+                return None
+        return {key: value for key, value in six.iteritems(self)
+                if key not in items}
+
+    def _unencoded(self, fragments):
+        """
+        Return the unencoded items with a placeholder for the fragment, or
+        self if the fragment cannot be used.
+        """
+        if not self.fragment.text:
+            return self
+        res = self.unencoded_items()
+        if res is None:
+            return self
+        res[_FRAGMENT_KEY % len(fragments)] = None
+        fragments.append(self.fragment)
+        return res
+
+
+_MISSING = object()
+
+
+def _extract_fragments(result, fragments):
+    if isinstance(result, EncodedDict):
+        return result._unencoded(fragments)
+    if isinstance(result, list):
+        return _extract_list_fragments(result, fragments)
+    if isinstance(result, dict):
+        res = None
+        for key, value in six.iteritems(result):
+            if isinstance(value, list):
+                extracted = _extract_list_fragments(value, fragments)
+                if extracted is not value:
+                    if res is None:
+                        res = dict(result)
+                    res[key] = extracted
+        return result if res is None else res
+    return result
+
+
+def _extract_list_fragments(values, fragments):
+    count = len(fragments)
+    res = [value._unencoded(fragments) if isinstance(value, EncodedDict)
+           else value
+           for value in values]
+    return values if len(fragments) == count else res
+
+
 class Notification(object):
     """
     Represents jsonrpc notification message. It builds proper jsonrpc
@@ -0,0 +1,62 @@
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+from testlib import VdsmTestCase
+
+from vdsm.common.histogram import Histogram
+
+
+class HistogramTests(VdsmTestCase):
+
+    def test_empty(self):
+        h = Histogram(buckets=(1, 2))
+        info = h.info()
+        self.assertEqual(info["count"], 0)
+        self.assertEqual(info["p50"], 0)
+        self.assertEqual(info["buckets"], {"1": 0, "2": 0, "+Inf": 0})
+
+    def test_buckets(self):
+        h = Histogram(buckets=(1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            h.add(value)
+        info = h.info()
+        self.assertEqual(info["count"], 4)
+        self.assertEqual(info["total"], 6.0)
+        self.assertEqual(info["max"], 3)
+        self.assertEqual(info["buckets"], {"1": 2, "2": 1, "+Inf": 1})
+
+    def test_percentile(self):
+        h = Histogram(buckets=(1, 2, 5))
+        for i in range(90):
+            h.add(0.5)
+        for i in range(9):
+            h.add(1.5)
+        h.add(7)
+        self.assertEqual(h.percentile(50), 1)
+        self.assertEqual(h.percentile(90), 1)
+        self.assertEqual(h.percentile(99), 2)
+        self.assertEqual(h.percentile(100), 7)
+
+    def test_clear(self):
+        h = Histogram(buckets=(1,))
+        h.add(0.5)
+        h.clear()
+        self.assertEqual(h.count, 0)
+        self.assertEqual(h.info()["buckets"], {"1": 0, "+Inf": 0})
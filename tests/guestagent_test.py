@@ -198,6 +198,28 @@ class TestGuestIF(TestCaseBase):
             for (k, v) in t.assertDict.iteritems():
                 self.assertEqual(fakeGuestAgent.guestInfo[k], v)
 
+    def test_info_generation(self):
+        fake_guest_agent = guestagent.GuestAgent(None, None, self.log,
+                                                 lambda: None)
+        generation = fake_guest_agent.infoGeneration
+        fake_guest_agent._handleMessage('heartbeat', {'free-ram': 1024})
+        self.assertEqual(fake_guest_agent.infoGeneration, generation)
+
+        # A reader seeing the new generation must see the new info.
+        seen = []
+        info = fake_guest_agent.guestInfo
+
+        class Info(dict):
+            def __setitem__(self, key, value):
+                seen.append(fake_guest_agent.infoGeneration)
+                dict.__setitem__(self, key, value)
+
+        fake_guest_agent.guestInfo = Info(info)
+        fake_guest_agent._handleMessage('host-name', {'name': 'guest'})
+        self.assertEqual(seen, [generation])
+        self.assertEqual(fake_guest_agent.infoGeneration, generation + 1)
+        self.assertEqual(fake_guest_agent.guestInfo['guestName'], 'guest')
+
     def test_guestinfo_encapsulation(self):
         fake_guest_agent = guestagent.GuestAgent(None, None, self.log,
                                                  lambda: None)
@@ -0,0 +1,167 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import print_function
+
+import timeit
+
+from vdsm.compat import json
+from yajsonrpc import EncodedDict, JsonFragment, JsonRpcResponse
+
+from testValidation import slowtest
+from testlib import VdsmTestCase, expandPermutations, permutations
+
+
+def make_static(vm_id):
+    return {
+        "vmId": vm_id,
+        "vmName": "vm-" + vm_id,
+        "pid": "4242",
+        "vmType": "kvm",
+        "kvmEnable": "true",
+        "acpiEnable": "true",
+        "guestFQDN": "vm-%s.example.com" % vm_id,
+        "guestIPs": "192.168.1.10 10.0.0.10",
+        "appsList": ["app-%d-1.0.%d" % (i, i) for i in range(30)],
+        "netIfaces": [
+            {"name": "eth%d" % i,
+             "hw": "00:1a:4a:16:01:%02d" % i,
+             "inet": ["192.168.1.%d" % i],
+             "inet6": ["fe80::21a:4aff:fe16:1%02d" % i]}
+            for i in range(2)],
+        "disksUsage": [
+            {"path": "/", "fs": "xfs", "total": "10724835328",
+             "used": "1779736576"}],
+        "guestOsInfo": {"type": "linux", "arch": "x86_64",
+                        "kernel": "3.10.0-693.el7.x86_64",
+                        "distribution": "CentOS Linux",
+                        "version": "7", "codename": "Core"},
+    }
+
+
+def make_dynamic(n):
+    return {
+        "statusTime": "4296012345",
+        "status": "Up",
+        "elapsedTime": str(n),
+        "monitorResponse": "0",
+        "cpuUser": "%.2f" % (n / 100.0),
+        "cpuSys": "0.40",
+        "memUsage": "20",
+        "network": {
+            "vnet0": {"name": "vnet0", "rx": str(n), "tx": str(n * 2),
+                      "rxErrors": "0", "txErrors": "0",
+                      "rxDropped": "0", "txDropped": "0",
+                      "sampleTime": 4296012.34, "speed": "1000",
+                      "state": "unknown", "macAddr": "00:1a:4a:16:01:51"}},
+        "disks": {
+            "vda": {"readRate": "0.0", "writeRate": str(n * 512.0),
+                    "readLatency": "0", "writeLatency": "1250000",
+                    "flushLatency": "0", "apparentsize": "10737418240",
+                    "truesize": "1779736576"}},
+    }
+
+
+def make_stats_list(count, encoded):
+    stats_list = []
+    for n in range(count):
+        vm_id = "%08d-0000-0000-0000-000000000000" % n
+        static = make_static(vm_id)
+        if encoded:
+            stats_list.append(EncodedDict(JsonFragment(static),
+                                          make_dynamic(n)))
+        else:
+            stats = dict(static)
+            stats.update(make_dynamic(n))
+            stats_list.append(stats)
+    return stats_list
+
+
+def encode_decode(result):
+    return json.loads(JsonRpcResponse(result, None, 1).encode())["result"]
+
+
+@expandPermutations
+class TestResponseFragments(VdsmTestCase):
+
+    def test_result(self):
+        stats = EncodedDict(JsonFragment({"a": 1, "b": [2]}), c="3")
+        self.assertEqual(encode_decode(stats), {"a": 1, "b": [2], "c": "3"})
+
+    def test_result_list(self):
+        stats_list = make_stats_list(3, encoded=True)
+        self.assertEqual(encode_decode(stats_list),
+                         make_stats_list(3, encoded=False))
+
+    def test_result_dict(self):
+        result = {"cursor": "x", "changed": make_stats_list(2, encoded=True)}
+        self.assertEqual(encode_decode(result),
+                         {"cursor": "x",
+                          "changed": make_stats_list(2, encoded=False)})
+
+    def test_fragment_only(self):
+        stats = EncodedDict(JsonFragment({"a": 1}))
+        self.assertEqual(encode_decode([stats]), [{"a": 1}])
+
+    def test_empty_fragment(self):
+        stats = EncodedDict(JsonFragment({}), a=1)
+        self.assertEqual(encode_decode([stats]), [{"a": 1}])
+
+    @permutations([
+        # modify
+        [lambda d: d.__setitem__("a", 2), {"a": 2, "c": 3}],
+        # remove
+        [lambda d: d.pop("a"), {"c": 3}],
+    ])
+    def test_fragment_item_modified(self, modify, expected):
+        stats = EncodedDict(JsonFragment({"a": 1}), c=3)
+        modify(stats)
+        self.assertEqual(encode_decode([stats]), [expected])
+
+    def test_fragment_not_modified(self):
+        fragment = JsonFragment({"a": 1})
+        stats = EncodedDict(fragment, c=3)
+        encode_decode([stats])
+        self.assertEqual(stats, {"a": 1, "c": 3})
+        self.assertEqual(fragment.items, {"a": 1})
+
+    def test_plain_result(self):
+        result = {"a": [{"b": 1}], "c": "d"}
+        self.assertEqual(encode_decode(result), result)
+
+    @slowtest
+    @permutations([[100], [500], [1000]])
+    def test_time_encode_all_vm_stats(self, vms):
+        setup = """
+from jsonrpc_test import make_stats_list
+from yajsonrpc import JsonRpcResponse
+
+plain = make_stats_list(%d, encoded=False)
+encoded = make_stats_list(%d, encoded=True)
+
+def bench(stats_list):
+    JsonRpcResponse(stats_list, None, 1).encode()
+"""
+        count = 20
+        for name in ("plain", "encoded"):
+            elapsed = timeit.timeit("bench(%s)" % name,
+                                    setup=setup % (vms, vms), number=count)
+            print("%d vms, %s stats: %.6f seconds per response"
+                  % (vms, name, elapsed / count))
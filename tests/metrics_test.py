@@ -0,0 +1,155 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+
+from six.moves import http_client
+
+from vdsm import metrics
+from vdsm.metrics import Metric
+from vdsm.metrics import prometheus
+
+from monkeypatch import MonkeyPatchScope
+from testlib import VdsmTestCase
+
+LABELS = {"vm_id": "id", "vm_name": "vm.1", "disk": "vda"}
+
+
+class TestMetric(VdsmTestCase):
+
+    def test_name(self):
+        metric = Metric("vms.{vm_name}.disk.{disk}.read_ops", 1, LABELS)
+        self.assertEqual(metric.name, "vms.disk.read_ops")
+
+    def test_flat_name(self):
+        metric = Metric("vms.{vm_name}.disk.{disk}.read_ops", 1, LABELS)
+        self.assertEqual(metric.flat_name, "vms.vm.1.disk.vda.read_ops")
+
+    def test_flat_name_escaped(self):
+        metric = Metric("hosts.nic.{nic!e}.rx", 1, {"nic": "eth0.100"})
+        self.assertEqual(metric.name, "hosts.nic.rx")
+        self.assertEqual(metric.flat_name, "hosts.nic.eth0_100.rx")
+
+    def test_no_labels(self):
+        metric = Metric("hosts.cpu.load", 1)
+        self.assertEqual(metric.name, "hosts.cpu.load")
+        self.assertEqual(metric.flat_name, "hosts.cpu.load")
+        self.assertEqual(metric.labels, {})
+
+
+class TestSources(VdsmTestCase):
+
+    def test_collect(self):
+        def source():
+            return [Metric("hosts.cpu.load", 1)]
+
+        def failing_source():
+            raise RuntimeError("source failed")
+
+        with MonkeyPatchScope([(metrics, "_sources", [])]):
+            metrics.register(source)
+            metrics.register(failing_source)
+            self.assertEqual(metrics.collect(), [Metric("hosts.cpu.load", 1)])
+            metrics.unregister(source)
+            metrics.unregister(failing_source)
+            self.assertEqual(metrics.collect(), [])
+
+    def test_pull_reporter_not_pushing(self):
+        with MonkeyPatchScope([(metrics, "_reporter", prometheus)]):
+            self.assertFalse(metrics.pushing())
+
+
+class TestPrometheus(VdsmTestCase):
+
+    def test_render(self):
+        report = [
+            Metric("vms.{vm_name}.disk.{disk}.read_ops", "3", LABELS),
+            Metric("hosts.cpu.load", 0.5),
+            Metric("vms.{vm_name}.disk.{disk}.read_ops", 4,
+                   dict(LABELS, disk="vdb")),
+            Metric("hosts.cpu.invalid", "N/A"),
+        ]
+        expected = "\n".join([
+            '# TYPE vdsm_hosts_cpu_load gauge',
+            'vdsm_hosts_cpu_load 0.5',
+            '# TYPE vdsm_vms_disk_read_ops gauge',
+            'vdsm_vms_disk_read_ops{disk="vda",vm_id="id",vm_name="vm.1"} '
+            '3.0',
+            'vdsm_vms_disk_read_ops{disk="vdb",vm_id="id",vm_name="vm.1"} '
+            '4.0',
+            '',
+        ])
+        self.assertEqual(prometheus.render(report), expected)
+
+    def test_render_special_values(self):
+        report = [
+            Metric("hosts.a", float("inf")),
+            Metric("hosts.b", "-inf"),
+            Metric("hosts.c", float("nan")),
+        ]
+        expected = "\n".join([
+            '# TYPE vdsm_hosts_a gauge',
+            'vdsm_hosts_a +Inf',
+            '# TYPE vdsm_hosts_b gauge',
+            'vdsm_hosts_b -Inf',
+            '# TYPE vdsm_hosts_c gauge',
+            'vdsm_hosts_c NaN',
+            '',
+        ])
+        self.assertEqual(prometheus.render(report), expected)
+
+    def test_render_escape(self):
+        report = [Metric("vms.{vm_name}.cpu.user", 1,
+                         {"vm_name": 'a"b\\c\nd'})]
+        self.assertIn('{vm_name="a\\"b\\\\c\\nd"}', prometheus.render(report))
+
+    def test_endpoint(self):
+        def source():
+            return [Metric("hosts.cpu.load", 1)]
+
+        with MonkeyPatchScope([(metrics, "_sources", [source])]):
+            with endpoint() as port:
+                status, content_type, body = get(port, "/metrics")
+                self.assertEqual(status, 200)
+                self.assertEqual(content_type, prometheus.CONTENT_TYPE)
+                self.assertEqual(body, b"# TYPE vdsm_hosts_cpu_load gauge\n"
+                                       b"vdsm_hosts_cpu_load 1.0\n")
+                status, _, _ = get(port, "/other")
+                self.assertEqual(status, 404)
+
+
+@contextmanager
+def endpoint():
+    prometheus.start("127.0.0.1", port=0)
+    try:
+        yield prometheus._server.server_address[1]
+    finally:
+        prometheus.stop()
+
+
+def get(port, path):
+    conn = http_client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request("GET", path)
+        res = conn.getresponse()
+        return res.status, res.getheader("Content-Type"), res.read()
+    finally:
+        conn.close()
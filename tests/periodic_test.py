@@ -31,6 +31,7 @@ from vdsm.virt import periodic
 from vdsm.virt import vmstatus
 
 
+from monkeypatch import MonkeyPatchScope
 from testValidation import slowtest
 from testValidation import broken_on_ci
 from testlib import expandPermutations, permutations
@@ -331,6 +332,52 @@ class VmDispatcherTests(TestCaseBase):
                     vm_id, vm_id)
 
 
+class DispatchTests(TestCaseBase):
+
+    def test_dispatch(self):
+        calls = []
+        with MonkeyPatchScope([(periodic, "_executor", _FakeExecutor())]):
+            periodic.dispatch(lambda: calls.append(True), 1)
+        self.assertEqual(calls, [True])
+
+    def test_not_running(self):
+        with MonkeyPatchScope([(periodic, "_executor", None)]):
+            with self.assertRaises(executor.NotRunning):
+                periodic.dispatch(lambda: None)
+
+
+class StopTests(TestCaseBase):
+
+    def test_stop_metrics_not_started(self):
+        with MonkeyPatchScope([
+            (periodic, "_metrics_sources", None),
+            (periodic, "_operations", []),
+            (periodic, "_executor", _FakeExecutor()),
+        ]):
+            periodic.stop()
+
+    def test_stop_twice(self):
+        sources = _FakeMetricsSources()
+        with MonkeyPatchScope([
+            (periodic, "_metrics_sources", sources),
+            (periodic, "_operations", []),
+            (periodic, "_executor", _FakeExecutor()),
+        ]):
+            periodic.stop()
+            periodic.stop()
+            self.assertIsNone(periodic._metrics_sources)
+        self.assertEqual(sources.stopped, 1)
+
+
+class _FakeMetricsSources(object):
+
+    def __init__(self):
+        self.stopped = 0
+
+    def stop(self):
+        self.stopped += 1
+
+
 def _fake_vm_id(i):
     return 'VM-%03i' % i
 
@@ -389,6 +436,9 @@ class _FakeExecutor(object):
         else:
             func()
 
+    def stop(self, wait=True):
+        pass
+
 
 # fake.VM is a quite complex beast. We need only the bare minimum here,
 # literally only `id' and `name', so it seems sensible to create this
@@ -514,6 +514,19 @@ class TestMap(TestCaseBase):
 
             self.check_map(qemuimg.map(image), expected)
 
+    @permutations([["0.10"], ["1.1"]])
+    def test_iter_map(self, qcow2_compat):
+        with namedTemporaryDir() as tmpdir:
+            size = 1048576
+            image = os.path.join(tmpdir, "base.img")
+            qemuimg.create(image, size=size, format=self.FORMAT,
+                           qcow2Compat=qcow2_compat)
+            for offset in (0, 128 * 1024, 512 * 1024):
+                qemu_pattern_write(image, self.FORMAT, offset=offset,
+                                   len=4096, pattern=0xf0)
+            self.assertEqual(list(qemuimg.iter_map(image)),
+                             qemuimg.map(image))
+
     def check_map(self, actual, expected):
         if len(expected) != len(actual):
             msg = "Length mismatch: %d != %d" % (len(expected), len(actual))
@@ -527,6 +540,55 @@ class TestMap(TestCaseBase):
                     raise MapMismatch(msg, expected, actual)
 
 
+@expandPermutations
+class TestIterJSONArray(TestCaseBase):
+
+    RUNS = [
+        {"start": 0, "length": 65536, "depth": 0, "zero": False,
+         "data": True, "offset": 327680},
+        {"start": 65536, "length": 983040, "depth": 0, "zero": True,
+         "data": False},
+    ]
+
+    @permutations([[1], [7], [64], [4096]])
+    def test_chunks(self, chunk_size):
+        text = json.dumps(self.RUNS, indent=4).encode("utf-8")
+        chunks = [text[i:i + chunk_size]
+                  for i in range(0, len(text), chunk_size)]
+        self.assertEqual(list(qemuimg._iter_json_array(chunks)), self.RUNS)
+
+    def test_qemu_img_format(self):
+        # qemu-img map prints one run per line.
+        text = ("[" + ",\n".join(json.dumps(r) for r in self.RUNS) +
+                "]\n").encode("utf-8")
+        self.assertEqual(list(qemuimg._iter_json_array([text])), self.RUNS)
+
+    @permutations([[b"[]"], [b" [ ] \n"]])
+    def test_empty(self, text):
+        self.assertEqual(list(qemuimg._iter_json_array([text])), [])
+
+    @permutations([
+        [b""],
+        [b"["],
+        [b'[{"start": 0}'],
+        [b'[{"start": 0},'],
+        [b'[{"start": 0}]]'],
+        [b'{"start": 0}'],
+        [b'[{"start": 0} {"start": 1}]'],
+        [b"[1, 2]"],
+    ])
+    def test_invalid(self, text):
+        with self.assertRaises(ValueError):
+            list(qemuimg._iter_json_array([text]))
+
+    def test_invalid_error_context(self):
+        text = ("[" + ", ".join(json.dumps(r) for r in self.RUNS * 10) +
+                " invalid]").encode("utf-8")
+        with self.assertRaises(ValueError) as ctx:
+            list(qemuimg._iter_json_array([text]))
+        self.assertIn("invalid]", str(ctx.exception))
+
+
 @expandPermutations
 class TestAmend(TestCaseBase):
 
@@ -1,5 +1,5 @@
 #
-# Copyright 2014 Red Hat, Inc.
+# Copyright 2014-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -374,6 +374,20 @@ class StatsCacheTests(TestCaseBase):
         self.assertTrue(res.is_empty())
         self.assertEqual(res.stats_age, 100)
 
+    def test_columnar_samples(self):
+        self._feed_cache((
+            ({'a': {'cpu.time': 1000, 'block.0.name': 'vda'}}, 1),
+            ({'a': {'cpu.time': 3000, 'block.0.name': 'vda'}}, 2),
+        ))
+        res = self.cache.get('a')
+        self.assertEqual(dict(res.first_value),
+                         {'cpu.time': 1000, 'block.0.name': 'vda'})
+        self.assertEqual(dict(res.last_value),
+                         {'cpu.time': 3000, 'block.0.name': 'vda'})
+        self.assertIs(res.last_value.layout, res.first_value.layout)
+        self.assertEqual(
+            res.last_value.difference(res.first_value, 'cpu.time'), 2000)
+
     def _feed_cache(self, samples):
         for sample in samples:
             self.cache.put(*sample)
@@ -1,6 +1,6 @@
 # coding=utf-8
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -18,6 +18,7 @@
 #
 # Refer to the README and COPYING files for full details of the license
 #
+from vdsm.metrics import Metric
 from vdsm.metrics import statsd
 from testlib import mock
 from testlib import VdsmTestCase as TestCaseBase
@@ -42,33 +43,67 @@ class StatsdModuleTest(TestCaseBase):
         self.mock_socket.reset_mock()
 
     def test_send_single(self):
-        data = {'hello': 3}
+        data = [Metric('hello', 3)]
         statsd.send(data)
         self.mock_socket.return_value.sendto.assert_called_once_with(
             b'hello:3|g', self._address)
 
     def test_send_unicode(self):
-        data = {'\xd7\xa9\xd7\x9c\xd7\x95\xd7\x9d': 3}
+        data = [Metric('\xd7\xa9\xd7\x9c\xd7\x95\xd7\x9d', 3)]
         statsd.send(data)
         self.mock_socket.return_value.sendto.assert_called_once_with(
             b'\xd7\xa9\xd7\x9c\xd7\x95\xd7\x9d:3|g', self._address)
 
     def test_send_mixed_chars(self):
-        data = {'hello.\xd7\xa9\xd7\x9c\xd7\x95\xd7\x9d.ma': 3}
+        data = [Metric('hello.\xd7\xa9\xd7\x9c\xd7\x95\xd7\x9d.ma', 3)]
         statsd.send(data)
         self.mock_socket.return_value.sendto.assert_called_once_with(
             b'hello.\xd7\xa9\xd7\x9c\xd7\x95\xd7\x9d.ma:3|g', self._address)
 
     def test_send_long_metric_name(self):
         long_metric_name = ".".join(["1234567890"] * 12)
-        data = {long_metric_name: 3}
+        data = [Metric(long_metric_name, 3)]
         statsd.send(data)
         self.mock_socket.return_value.sendto.assert_called_once_with(
             b'%s:3|g' % long_metric_name, self._address)
 
     def test_send_multiple(self):
-        data = {'hello': 7, 'goodbye': 11}
+        data = [Metric('hello', 7), Metric('goodbye', 11)]
         statsd.send(data)
-        calls = [mock.call(b'hello:7|g', self._address),
-                 mock.call(b'goodbye:11|g', self._address)]
-        self.mock_socket.return_value.sendto.assert_has_calls(calls)
+        self.mock_socket.return_value.sendto.assert_called_once_with(
+            b'hello:7|g\ngoodbye:11|g', self._address)
+
+    def test_send_multiple_packets(self):
+        # Lines are 57 bytes, 8 lines fit in a 512 bytes packet.
+        data = [Metric('%050d' % i, 1234) for i in range(10)]
+        statsd.send(data)
+        lines = [b'%050d:1234|g' % i for i in range(10)]
+        calls = [mock.call(b'\n'.join(lines[:8]), self._address),
+                 mock.call(b'\n'.join(lines[8:]), self._address)]
+        self.assertEqual(
+            self.mock_socket.return_value.sendto.call_args_list, calls)
+
+    def test_send_labels(self):
+        labels = {'vm_id': 'id', 'vm_name': 'vm.1', 'disk': 'vda'}
+        data = [Metric('vms.{vm_name}.disk.{disk}.read_ops', 3, labels)]
+        statsd.send(data)
+        self.mock_socket.return_value.sendto.assert_called_once_with(
+            b'vms.vm.1.disk.vda.read_ops:3|g', self._address)
+
+
+class StatsClientTagsTest(TestCaseBase):
+
+    def setUp(self):
+        self.mock_socket = mock.Mock()
+        with mock.patch.object(statsd.socket, 'socket', self.mock_socket):
+            self.client = statsd._StatsClient('localhost', tags=True)
+
+    def test_send_tags(self):
+        labels = {'vm_id': 'id', 'vm_name': 'vm1', 'disk': 'vda'}
+        data = [Metric('vms.{vm_name}.disk.{disk}.read_ops', 3, labels),
+                Metric('hosts.cpu.load', 1)]
+        self.client.gauges(data)
+        self.mock_socket.return_value.sendto.assert_called_once_with(
+            b'vms.disk.read_ops:3|g|#disk:vda,vm_id:id,vm_name:vm1\n'
+            b'hosts.cpu.load:1|g',
+            ('127.0.0.1', 8125))
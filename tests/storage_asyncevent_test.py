@@ -528,6 +528,43 @@ class TestBufferedReader(VdsmTestCase):
             self.assertEqual(self.received, data)
 
 
+@expandPermutations
+class TestLineReader(VdsmTestCase):
+
+    def setUp(self):
+        self.loop = asyncevent.EventLoop()
+        self.lines = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def line_received(self, line):
+        self.lines.append(line)
+
+    def complete(self):
+        self.loop.stop()
+
+    @permutations([
+        # data, bufsize, lines
+        (b"", 1, []),
+        (b"a\n", 1, [b"a"]),
+        (b"a\nbb\n\nccc\n", 1, [b"a", b"bb", b"", b"ccc"]),
+        (b"a\nbb\n\nccc\n", 4, [b"a", b"bb", b"", b"ccc"]),
+        (b"a\nbb\n\nccc\n", 4096, [b"a", b"bb", b"", b"ccc"]),
+        (b"a\npartial", 4096, [b"a"]),
+    ])
+    def test_read(self, data, bufsize, lines):
+        r, w = os.pipe()
+        reader = self.loop.create_dispatcher(
+            asyncevent.LineReader, r, self.line_received, self.complete,
+            bufsize=bufsize)
+        with closing(reader):
+            os.close(r)  # Dupped by LineReader
+            Sender(self.loop, w, data, bufsize)
+            self.loop.run_forever()
+            self.assertEqual(self.lines, lines)
+
+
 class Sender(object):
 
     def __init__(self, loop, fd, data, bufsize):
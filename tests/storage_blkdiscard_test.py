@@ -21,6 +21,7 @@
 from monkeypatch import MonkeyPatch
 from testlib import VdsmTestCase as TestCaseBase
 from vdsm import cmdutils
+from vdsm.common.exception import ActionStopped
 from vdsm.storage import blkdiscard
 
 BLKDISCARD = blkdiscard._blkdiscard.cmd
@@ -35,3 +36,8 @@ class BlkDiscardTests(TestCaseBase):
     @MonkeyPatch(blkdiscard._blkdiscard, '_cmd', '/usr/bin/false')
     def test_error(self):
         self.assertRaises(cmdutils.Error, blkdiscard.blkdiscard, "/dev/vg/lv")
+
+    @MonkeyPatch(blkdiscard._blkdiscard, '_cmd', '/usr/bin/sleep')
+    def test_stop(self):
+        self.assertRaises(ActionStopped, blkdiscard.blkdiscard, "10",
+                          stop=lambda: True)
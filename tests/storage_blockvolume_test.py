@@ -1,5 +1,5 @@
 #
-# Copyright 2015-2016 Red Hat, Inc.
+# Copyright 2015-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -18,15 +18,20 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import io
+
 from contextlib import contextmanager
 
+from vdsm import concurrent
 from vdsm.config import config
 from vdsm.constants import MEGAB
 from vdsm.constants import GIB
 from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
+from vdsm.storage import misc
 
 from monkeypatch import MonkeyPatch
+from monkeypatch import MonkeyPatchScope
 from storagetestlib import fake_env
 from storagetestlib import qemu_pattern_write
 from storagetestlib import make_qemu_chain
@@ -139,3 +144,138 @@ class TestBlockVolumeManifest(TestCaseBase):
                                len=200 * MEGAB)
             max_size = vol.max_size(GIB, vol.getFormat())
             self.assertEqual(vol.optimal_size(), max_size)
+
+
+class TestMetadataSnapshot(TestCaseBase):
+
+    @contextmanager
+    def make_volumes(self, count):
+        img_id = make_uuid()
+        with fake_env('block') as env:
+            vols = []
+            for i in range(count):
+                vol_id = make_uuid()
+                env.make_volume(GIB, img_id, vol_id, desc="volume %d" % i)
+                vols.append(env.sd_manifest.produceVolume(img_id, vol_id))
+            yield env, vols
+
+    def overwrite_description(self, env, vol, desc):
+        # Simulate metadata written by another host.
+        sd_id, offset = vol.getMetadataId()
+        path = env.lvm.lvPath(sd_id, "metadata")
+        meta = vol.getMetadata()
+        meta[sc.DESCRIPTION] = desc
+        data = vol.formatMetadata(meta)
+        data += "\0" * (sc.METADATA_SIZE - len(data))
+        with io.open(path, "r+b") as f:
+            f.seek(offset * sc.METADATA_SIZE)
+            f.write(data)
+
+    def test_read_from_snapshot(self):
+        with self.make_volumes(1) as (env, vols):
+            vol = vols[0]
+            with BlockVolume.metadataSnapshot(vol.sdUUID):
+                self.assertEqual(vol.getDescription(), "volume 0")
+                self.overwrite_description(env, vol, "modified")
+                # Served from the snapshot.
+                self.assertEqual(vol.getDescription(), "volume 0")
+            # Read from storage.
+            self.assertEqual(vol.getDescription(), "modified")
+
+    def test_write_updates_snapshot(self):
+        with self.make_volumes(1) as (env, vols):
+            vol = vols[0]
+            with BlockVolume.metadataSnapshot(vol.sdUUID):
+                self.assertEqual(vol.getDescription(), "volume 0")
+                vol.setDescription("new")
+                self.assertEqual(vol.getDescription(), "new")
+
+    def test_load(self):
+        with self.make_volumes(3) as (env, vols):
+            sd_id = vols[0].sdUUID
+            with BlockVolume.metadataSnapshot(sd_id, load=True):
+                with MonkeyPatchScope([(misc, "readblock", fail)]):
+                    for i, vol in enumerate(vols):
+                        self.assertEqual(vol.getDescription(),
+                                         "volume %d" % i)
+
+    def test_nested(self):
+        with self.make_volumes(1) as (env, vols):
+            sd_id = vols[0].sdUUID
+            with BlockVolume.metadataSnapshot(sd_id) as outer:
+                with BlockVolume.metadataSnapshot(sd_id) as inner:
+                    self.assertIs(inner, outer)
+                self.assertIs(blockVolume._activeSnapshot(sd_id), outer)
+            self.assertIs(blockVolume._activeSnapshot(sd_id), None)
+
+    def test_no_reuse(self):
+        with self.make_volumes(1) as (env, vols):
+            sd_id = vols[0].sdUUID
+            with BlockVolume.metadataSnapshot(sd_id) as first:
+                pass
+            with BlockVolume.metadataSnapshot(sd_id) as second:
+                self.assertIsNot(first, second)
+
+    def test_other_thread(self):
+        with self.make_volumes(1) as (env, vols):
+            vol = vols[0]
+            with BlockVolume.metadataSnapshot(vol.sdUUID):
+                self.assertEqual(vol.getDescription(), "volume 0")
+                self.overwrite_description(env, vol, "modified")
+                # Other threads do not use this thread snapshot.
+                result = []
+                t = concurrent.thread(
+                    lambda: result.append(vol.getDescription()))
+                t.start()
+                t.join()
+                self.assertEqual(result, ["modified"])
+
+    @MonkeyPatch(blockVolume, "METADATA_SNAPSHOT_TTL", 60)
+    def test_reuse(self):
+        with self.make_volumes(1) as (env, vols):
+            vol = vols[0]
+            with BlockVolume.metadataSnapshot(vol.sdUUID) as first:
+                vol.getDescription()
+            with BlockVolume.metadataSnapshot(vol.sdUUID) as second:
+                self.assertIs(first, second)
+
+    @MonkeyPatch(blockVolume, "METADATA_SNAPSHOT_TTL", 60)
+    def test_reuse_after_write(self):
+        with self.make_volumes(1) as (env, vols):
+            vol = vols[0]
+            with BlockVolume.metadataSnapshot(vol.sdUUID) as first:
+                vol.getDescription()
+            vol.setDescription("new")
+            with BlockVolume.metadataSnapshot(vol.sdUUID) as second:
+                self.assertIsNot(first, second)
+                self.assertEqual(vol.getDescription(), "new")
+
+    def test_ttl_while_used(self):
+        with self.make_volumes(1) as (env, vols):
+            sd_id = vols[0].sdUUID
+            with BlockVolume.metadataSnapshot(sd_id) as first:
+                # Operations in other threads do not share a used snapshot
+                # after the ttl expired.
+                result = []
+
+                def other():
+                    with BlockVolume.metadataSnapshot(sd_id) as snapshot:
+                        result.append(snapshot)
+                t = concurrent.thread(other)
+                t.start()
+                t.join()
+                self.assertIsNot(result[0], first)
+
+    @MonkeyPatch(blockVolume, "METADATA_SNAPSHOT_TTL", 60)
+    def test_reuse_generation_changed(self):
+        with self.make_volumes(1) as (env, vols):
+            sd_id = vols[0].sdUUID
+            with BlockVolume.metadataSnapshot(sd_id) as first:
+                pass
+            env.make_volume(GIB, make_uuid(), make_uuid())
+            with BlockVolume.metadataSnapshot(sd_id) as second:
+                self.assertIsNot(first, second)
+
+
+def fail(*args):
+    raise RuntimeError("Should not read from storage")
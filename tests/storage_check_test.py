@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -312,6 +312,100 @@ class TestDirectioCheckerTimings(VdsmTestCase):
             self.assertRaises(exception.MiscFileReadException, res.delay)
 
 
+class TestHelperChecker(VdsmTestCase):
+
+    def setUp(self):
+        self.loop = asyncevent.EventLoop()
+        self.helper = check.HelperProcess(self.loop)
+        self.results = []
+        self.checks = 1
+
+    def tearDown(self):
+        self.helper.close()
+        self.loop.close()
+
+    def complete(self, result):
+        self.results.append(result)
+        if len(self.results) == self.checks:
+            self.loop.stop()
+
+    @MonkeyPatch(check, "_CHECKER", "../helpers/checker")
+    def test_path_missing(self):
+        self.checks = 1
+        checker = check.HelperChecker(self.loop, self.helper, "/no/such/path",
+                                      self.complete)
+        checker.start()
+        self.loop.run_forever()
+        pprint.pprint(self.results)
+        result = self.results[0]
+        self.assertRaises(exception.MiscFileReadException, result.delay)
+
+    @MonkeyPatch(check, "_CHECKER", "../helpers/checker")
+    def test_path_ok(self):
+        self.checks = 1
+        with temporaryPath(data=b"blah") as path:
+            checker = check.HelperChecker(self.loop, self.helper, path,
+                                          self.complete)
+            checker.start()
+            self.loop.run_forever()
+            pprint.pprint(self.results)
+            result = self.results[0]
+            delay = result.delay()
+            print("delay:", delay)
+            self.assertEqual(type(delay), float)
+
+    @MonkeyPatch(check, "_CHECKER", "../helpers/checker")
+    def test_many_paths(self):
+        self.checks = 10
+        with temporaryPath(data=b"blah") as path:
+            for i in range(self.checks - 1):
+                checker = check.HelperChecker(self.loop, self.helper,
+                                              "%s-%d" % (path, i),
+                                              self.complete)
+                checker.start()
+            checker = check.HelperChecker(self.loop, self.helper, path,
+                                          self.complete)
+            checker.start()
+            self.loop.run_forever()
+        pprint.pprint(self.results)
+        failed = [r for r in self.results if r.path != path]
+        for result in failed:
+            self.assertRaises(exception.MiscFileReadException, result.delay)
+        ok = [r for r in self.results if r.path == path]
+        self.assertEqual(len(ok), 1)
+        self.assertEqual(type(ok[0].delay()), float)
+
+    @MonkeyPatch(check, "_CHECKER", "/no/such/executable")
+    def test_executable_missing(self):
+        self.checks = 1
+        with temporaryPath(data=b"blah") as path:
+            checker = check.HelperChecker(self.loop, self.helper, path,
+                                          self.complete)
+            checker.start()
+            self.loop.run_forever()
+            pprint.pprint(self.results)
+            result = self.results[0]
+            self.assertEqual(result.rc, check.EXEC_ERROR)
+            self.assertRaises(exception.MiscFileReadException, result.delay)
+
+    def test_helper_terminated(self):
+        self.checks = 2
+        script = b"#!/bin/sh\nexit 1\n"
+        with temporaryPath(data=script) as fake_checker:
+            os.chmod(fake_checker, 0o700)
+            with MonkeyPatchScope([(check, "_CHECKER", fake_checker)]):
+                checker = check.HelperChecker(self.loop, self.helper,
+                                              "/path", self.complete,
+                                              interval=0.1)
+                checker.start()
+                self.loop.run_forever()
+        pprint.pprint(self.results)
+        # A new helper is started for the second check.
+        for result in self.results:
+            self.assertEqual(result.rc, check.EXEC_ERROR)
+            self.assertRaises(exception.MiscFileReadException, result.delay)
+
+
 @expandPermutations
 class TestCheckResult(VdsmTestCase):
 
@@ -343,6 +437,15 @@ class TestCheckResult(VdsmTestCase):
         result = check.CheckResult("/path", 0, err, 0, 0)
         self.assertEqual(result.delay(), seconds)
 
+    def test_read_delay(self):
+        result = check.CheckResult("/path", 0, None, 0, 0, read_delay=0.5)
+        self.assertEqual(result.delay(), 0.5)
+
+    def test_read_delay_error(self):
+        result = check.CheckResult("/path", 1, "REASON", 0, 0,
+                                   read_delay=None)
+        self.assertRaises(exception.MiscFileReadException, result.delay)
+
     def test_non_zero_exit_code(self):
         path = "/path"
         reason = "REASON"
@@ -94,3 +94,32 @@ class TestDirectFile(TestCaseBase):
                 directio.DirectFile(srcPath, "r") as direct_file, \
                 io.open(srcPath, "rb") as buffered_file:
             self.assertEqual(direct_file.read(), buffered_file.read())
+
+    def test_pread(self):
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r") as f, \
+                directio.AlignedBuffer(2 * BLOCK_SIZE) as buf:
+            n = f.pread(buf, BLOCK_SIZE, BLOCK_SIZE)
+            self.assertEqual(n, BLOCK_SIZE)
+            self.assertEqual(buf.getvalue(n),
+                             self.DATA[BLOCK_SIZE:2 * BLOCK_SIZE])
+            # The file position is not modified
+            self.assertEqual(f.tell(), 0)
+
+    def test_pwrite(self):
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r+") as f, \
+                directio.AlignedBuffer(BLOCK_SIZE) as buf:
+            buf.setvalue(bytearray(b"x" * BLOCK_SIZE))
+            f.pwrite(buf, BLOCK_SIZE, BLOCK_SIZE)
+            with io.open(srcPath, "rb") as f:
+                self.assertEqual(f.read(),
+                                 self.DATA[:BLOCK_SIZE] + b"x" * BLOCK_SIZE +
+                                 self.DATA[2 * BLOCK_SIZE:])
+
+    def test_pread_unaligned(self):
+        with temporaryPath(data=self.DATA) as srcPath, \
+                directio.DirectFile(srcPath, "r") as f, \
+                directio.AlignedBuffer(BLOCK_SIZE) as buf:
+            self.assertRaises(ValueError, f.pread, buf, BLOCK_SIZE, 1)
+            self.assertRaises(ValueError, f.pread, buf, 2 * BLOCK_SIZE, 0)
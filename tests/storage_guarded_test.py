@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -30,6 +30,17 @@ class InjectedFailure(Exception):
     pass
 
 
+class FakeBatchLock(FakeGuardedLock):
+
+    @classmethod
+    def acquire_many(cls, locks):
+        for lock in locks:
+            if lock._acquire_err:
+                raise lock._acquire_err()
+        lock._log.append(('acquire_many',
+                          [(l.ns, l.name, l.mode) for l in locks]))
+
+
 class ContextTest(VdsmTestCase):
 
     def test_empty(self):
@@ -204,3 +215,38 @@ class ContextTest(VdsmTestCase):
                 pass
         # Without locking any of the locks
         self.assertEqual([], log)
+
+    def test_batch(self):
+        log = []
+        locks = [
+            FakeBatchLock('01_dom', 'dom', 'mode', log),
+            FakeBatchLock('02_img', 'img', 'mode', log),
+            FakeGuardedLock('03_lease', 'vol', 'mode', log),
+            FakeBatchLock('04_vol', 'vol', 'mode', log)]
+        expected = [
+            ('acquire_many', [('01_dom', 'dom', 'mode'),
+                              ('02_img', 'img', 'mode')]),
+            ('acquire', '03_lease', 'vol', 'mode'),
+            ('acquire', '04_vol', 'vol', 'mode'),
+            ('release', '04_vol', 'vol', 'mode'),
+            ('release', '03_lease', 'vol', 'mode'),
+            ('release', '02_img', 'img', 'mode'),
+            ('release', '01_dom', 'dom', 'mode')]
+        with guarded.context(locks):
+            self.assertEqual(expected[:3], log)
+        self.assertEqual(expected, log)
+
+    def test_batch_failure(self):
+        log = []
+        locks = [
+            FakeGuardedLock('01_dom', 'dom', 'mode', log),
+            FakeBatchLock('02_img', 'img', 'mode', log),
+            FakeBatchLock('03_vol', 'vol', 'mode', log,
+                          acquire=InjectedFailure)]
+        expected = [
+            ('acquire', '01_dom', 'dom', 'mode'),
+            ('release', '01_dom', 'dom', 'mode')]
+        with self.assertRaises(InjectedFailure):
+            with guarded.context(locks):
+                pass
+        self.assertEqual(expected, log)
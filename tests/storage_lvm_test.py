@@ -1,5 +1,5 @@
 #
-# Copyright 2012 Red Hat, Inc.
+# Copyright 2012-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,8 +19,14 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import threading
+import time
+
+from monkeypatch import MonkeyPatch
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
 
+from vdsm import concurrent
 import vdsm.storage.lvm as lvm
 
 
@@ -37,3 +43,192 @@ class LvmTests(TestCaseBase):
                           "\\\\x22\\\\x28|\', \'r|.*|\' ]"
                           )
         self.assertEqual(expectedFilter, filter)
+
+
+class FakeLVMCommands(object):
+    """
+    Simulate the lvm commands used by LVMCache.
+    """
+
+    def __init__(self, vgs):
+        # vg name: {lv name: [size, tags]}
+        self.vgs = {vgName: {name: [size, list(tags)]
+                             for name, size, tags in lvs}
+                    for vgName, lvs in vgs.items()}
+        self.seqnos = dict.fromkeys(vgs, 1)
+        self.calls = []
+
+    def __call__(self, cmd, devices=()):
+        self.calls.append(cmd[0])
+        handler = getattr(self, "_" + cmd[0])
+        return handler(cmd)
+
+    def _lvs(self, cmd):
+        fields = cmd[cmd.index("-o") + 1]
+        args = cmd[cmd.index("-o") + 2:]
+        lvs = []
+        err = []
+        for arg in args:
+            if "/" in arg:
+                lvs.append(tuple(arg.split("/")))
+            elif arg in self.vgs:
+                lvs.extend((arg, name) for name in sorted(self.vgs[arg]))
+            else:
+                err.append("  Volume group \"%s\" not found" % arg)
+        out = []
+        for vgName, name in lvs:
+            size, tags = self.vgs[vgName][name]
+            line = lvm.SEPARATOR.join(
+                ("uuid-" + name, name, vgName, "-wi-------", str(size),
+                 "0", "/dev/mapper/pv(0)", ",".join(tags)))
+            if fields.endswith(",vg_seqno"):
+                line += lvm.SEPARATOR + str(self.seqnos[vgName])
+            out.append("  " + line)
+        return 5 if err else 0, out, err
+
+    def _vgs(self, cmd):
+        return 0, ["  %d" % self.seqnos[cmd[-1]]], []
+
+    def _lvchange(self, cmd):
+        vgName, lvName = cmd[-1].split("/")
+        tags = self.vgs[vgName][lvName][1]
+        opts = list(zip(cmd[1:-1:2], cmd[2:-1:2]))
+        for opt, tag in opts:
+            if opt == "--deltag":
+                tags.remove(tag)
+            elif opt == "--addtag":
+                tags.append(tag)
+        self.seqnos[vgName] += len(set(opt for opt, _ in opts
+                                       if opt in ("--deltag", "--addtag")))
+        return 0, [], []
+
+    def _lvremove(self, cmd):
+        for arg in cmd[2:]:
+            if "/" in arg:
+                vgName, lvName = arg.split("/")
+                del self.vgs[vgName][lvName]
+                self.seqnos[vgName] += 1
+        return 0, [], []
+
+
+class IncrementalCacheTests(TestCaseBase):
+
+    def setUp(self):
+        self.fake = FakeLVMCommands(
+            {"vg": [("lv1", 1024, ("a",)), ("lv2", 2048, ())]})
+        self.cache = lvm.LVMCache(incremental=True)
+        self.cache.cmd = self.fake
+
+    def test_verify_unchanged_vg(self):
+        self.assertEqual(len(self.cache.getLv("vg")), 2)
+        self.cache._checklvs("vg")
+        lv = self.cache.getLv("vg", "lv1")
+        self.assertEqual(lv.size, "1024")
+        self.assertEqual(self.fake.calls, ["lvs", "vgs"])
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["reloads"], 1)
+        self.assertEqual(stats["seqno_checks"], 1)
+
+    def test_no_check_without_invalidation(self):
+        self.cache.getLv("vg")
+        self.cache.getLv("vg", "lv1")
+        self.cache.getLv("vg", "lv2")
+        self.assertEqual(self.fake.calls, ["lvs"])
+
+    def test_reload_vg_modified_by_other_host(self):
+        self.cache.getLv("vg")
+        self.fake.vgs["vg"]["lv1"][0] = 4096
+        self.fake.seqnos["vg"] += 1
+        self.cache._checklvs("vg")
+        lv = self.cache.getLv("vg", "lv1")
+        self.assertEqual(lv.size, "4096")
+        self.assertEqual(self.fake.calls, ["lvs", "vgs", "lvs"])
+
+    def test_reload_only_invalidated_lv(self):
+        self.cache.getLv("vg")
+        self.cache._invalidatelvs("vg", ["lv2"])
+        self.cache.getLv("vg", "lv2")
+        self.assertEqual(self.fake.calls, ["lvs", "lvs"])
+        self.assertEqual(len(self.cache.getLv("vg")), 2)
+        self.assertEqual(self.fake.calls, ["lvs", "lvs"])
+
+    @MonkeyPatch(lvm, "_isLVActive", lambda vg, lv: False)
+    def test_own_changes(self):
+        with MonkeyPatchScope([(lvm, "_lvminfo", self.cache)]):
+            lvm.getLV("vg")
+            lvm.changeLVTags("vg", "lv1", delTags=("a",), addTags=("b",))
+            lvm.removeLVs("vg", ("lv2",))
+            lvm.invalidateVG("vg")
+            self.assertEqual(lvm.getLV("vg", "lv1").tags, ("b",))
+            self.assertEqual([lv.name for lv in lvm.getLV("vg")], ["lv1"])
+        self.assertEqual(self.fake.calls,
+                         ["lvs", "lvchange", "lvremove", "vgs"])
+
+
+class BatchReloadTests(TestCaseBase):
+
+    def setUp(self):
+        self.fake = FakeLVMCommands({
+            "vg1": [("lv1", 1024, ())],
+            "vg2": [("lv2", 1024, ())],
+            "vg3": [("lv3", 1024, ())],
+        })
+        self.cache = lvm.LVMCache(batchWindow=0.2)
+        self.cache.cmd = self.fake
+
+    def test_concurrent_reloads(self):
+        results = {}
+
+        def reload(vgName):
+            results[vgName] = self.cache._reloadlvs(vgName)
+
+        threads = [concurrent.thread(reload, args=(vgName,))
+                   for vgName in ("vg1", "vg2", "vg3")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.fake.calls, ["lvs"])
+        for vgName in ("vg1", "vg2", "vg3"):
+            self.assertEqual([key[0] for key in results[vgName]], [vgName])
+
+    def test_reloads_during_running_batch(self):
+        running = threading.Event()
+        resume = threading.Event()
+        lvs = self.fake._lvs
+        batches = []
+
+        def blocking_lvs(cmd):
+            batches.append(cmd[cmd.index("-o") + 2:])
+            if len(batches) == 1:
+                running.set()
+                resume.wait()
+            return lvs(cmd)
+
+        self.fake._lvs = blocking_lvs
+        first = concurrent.thread(self.cache._reloadlvs, args=("vg1",))
+        first.start()
+        running.wait()
+
+        # Arrive while the first batch is running.
+        late = [concurrent.thread(self.cache._reloadlvs, args=(vgName,))
+                for vgName in ("vg1", "vg2", "vg3")]
+        for t in late:
+            t.start()
+        time.sleep(0.4)
+        # The next batch must wait for the running batch.
+        self.assertEqual(len(batches), 1)
+        resume.set()
+
+        for t in [first] + late:
+            t.join()
+        self.assertEqual(batches, [["vg1"], ["vg1", "vg2", "vg3"]])
+
+    def test_failed_batch(self):
+        del self.fake.vgs["vg2"]
+        lvs = self.cache._loadlvs(("vg1", "vg2", "vg3"))
+        self.assertEqual(sorted(lvs), [("vg1", "lv1"), ("vg3", "lv3")])
+        self.assertEqual(self.fake.calls, ["lvs", "lvs", "lvs", "lvs"])
@@ -1,5 +1,5 @@
 #
-# Copyright 2012-2016 Red Hat, Inc.
+# Copyright 2012-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -24,6 +24,7 @@ import io
 import os
 import threading
 import struct
+import time
 
 from testlib import VdsmTestCase as TestCaseBase
 from testlib import namedTemporaryDir
@@ -110,6 +111,17 @@ class SPM_MailMonitorTests(TestCaseBase):
 
 class TestSPMMailbox(TestCaseBase):
 
+    def test_reply_after_stop(self):
+        with make_env() as env:
+            with make_spm_mailbox(env) as mailer:
+                pass
+            vol_data = dict(poolID=SPUUID, domainID=DOMAIN1,
+                            volumeID=VOLUME1)
+            # Must not write to the closed mailbox buffers.
+            mailer.sendReply(0, sm.SPM_Extend_Message(vol_data, 100))
+            with io.open(env.outbox, "rb") as f:
+                self.assertEqual(f.read(), sm.EMPTYMAILBOX * MAX_HOSTS)
+
     def test_clear_outbox(self):
         with make_env() as env:
             with io.open(env.outbox, "wb") as f:
@@ -151,6 +163,23 @@ class TestHSMMailbox(TestCaseBase):
                     data = f.read()
                 self.assertEqual(data, dirty_outbox)
 
+    def test_init_retry(self):
+        with make_env() as env:
+            inbox = env.outbox + ".missing"
+            mailer = sm.HSM_MailMonitor(inbox, env.inbox, 7, None,
+                                        MONITOR_INTERVAL)
+            try:
+                self.assertFalse(mailer._init)
+                os.rename(env.outbox, inbox)
+
+                def check():
+                    self.assertTrue(mailer._init)
+                retry(check, expectedException=AssertionError, timeout=4,
+                      sleep=0.1)
+            finally:
+                mailer.immStop()
+                self.assertTrue(mailer.wait(timeout=MAILER_TIMEOUT))
+
 
 class TestCommunicate(TestCaseBase):
 
@@ -185,6 +214,325 @@ class TestCommunicate(TestCaseBase):
             "\xd8\xfcs.\xa4\xc3C\xbb>\xc6\xf1r\xd700000000000000640"
             "0000000000"))])
 
+    def test_request_handled_once(self):
+        msg_processed = threading.Event()
+        received_messages = []
+
+        def spm_callback(msg_id, data):
+            received_messages.append((msg_id, data))
+            msg_processed.set()
+
+        with make_env() as env:
+            with make_hsm_mailbox(env, 7) as hsm_mb:
+                with make_spm_mailbox(env) as spm_mm:
+                    spm_mm.registerMessageType("xtnd", spm_callback)
+
+                    VOL_DATA = dict(
+                        poolID=SPUUID,
+                        domainID='8adbc85e-e554-4ae0-b318-8a5465fe5fe1',
+                        volumeID='d772f1c6-3ebb-43c3-a42e-73fcd8255a5f')
+                    hsm_mb.sendExtendMsg(VOL_DATA, 100)
+
+                    self.assertTrue(msg_processed.wait(10 * MONITOR_INTERVAL),
+                                    'message was not processed on time')
+                    # The request stays in the mailbox until the SPM
+                    # replies, but must not be handled again.
+                    time.sleep(5 * MONITOR_INTERVAL)
+
+        self.assertEqual(len(received_messages), 1)
+
+    def test_extend_latency(self):
+        reply_received = threading.Event()
+
+        VOL_DATA = dict(
+            poolID=SPUUID,
+            domainID='8adbc85e-e554-4ae0-b318-8a5465fe5fe1',
+            volumeID='d772f1c6-3ebb-43c3-a42e-73fcd8255a5f')
+        REQUESTED_SIZE = 100
+
+        with make_env() as env:
+            with make_hsm_mailbox(env, 7) as hsm_mb:
+                with make_spm_mailbox(env) as spm_mm:
+
+                    def spm_callback(msg_id, data):
+                        reply = sm.SPM_Extend_Message(VOL_DATA, REQUESTED_SIZE)
+                        spm_mm.sendReply(msg_id, reply)
+
+                    def hsm_callback(vol_data):
+                        reply_received.set()
+
+                    spm_mm.registerMessageType("xtnd", spm_callback)
+                    hsm_mb.sendExtendMsg(VOL_DATA, REQUESTED_SIZE,
+                                         hsm_callback)
+
+                    self.assertTrue(reply_received.wait(20 * MONITOR_INTERVAL),
+                                    'reply was not received on time')
+                    latency = hsm_mb.extendLatency()
+
+        self.assertEqual(latency["count"], 1)
+        self.assertGreater(latency["max"], 0)
+
+
+class FakePool(object):
+
+    spUUID = SPUUID
+
+    def __init__(self):
+        self.calls = []
+        self.running = threading.Event()
+        self.resume = threading.Event()
+        self.resume.set()
+        self.fail = False
+
+    def extendVolume(self, sdUUID, volumeUUID, size):
+        self.calls.append((sdUUID, volumeUUID, size))
+        self.running.set()
+        self.resume.wait(MAILER_TIMEOUT)
+        if self.fail:
+            raise RuntimeError("No space left in vg")
+
+
+class FakeMailer(object):
+
+    def __init__(self, expected):
+        self.replies = {}
+        self.expected = expected
+        self.done = threading.Event()
+        self.stopped = False
+
+    def isStopped(self):
+        return self.stopped
+
+    def sendReply(self, msgID, msg):
+        self.replies[msgID] = msg.payload
+        if len(self.replies) == self.expected:
+            self.done.set()
+
+
+DOMAIN1 = '8adbc85e-e554-4ae0-b318-8a5465fe5fe1'
+DOMAIN2 = '5c4f3a4a-4c6b-45f4-a6ac-3a9b8b6b0fda'
+VOLUME1 = 'd772f1c6-3ebb-43c3-a42e-73fcd8255a5f'
+VOLUME2 = '0b8ef1ef-20ef-4f10-9f55-fd1c1ebf3b5c'
+
+
+def extend_payload(domain, volume, size):
+    vol_data = dict(poolID=SPUUID, domainID=domain, volumeID=volume)
+    return sm.SPM_Extend_Message(vol_data, size).payload
+
+
+class TestExtendExecutor(TestCaseBase):
+
+    def test_coalesce(self):
+        pool = FakePool()
+        mailer = FakeMailer(3)
+        executor = sm.ExtendExecutor(pool, mailer)
+
+        # Block the first request so the next requests are queued.
+        pool.resume.clear()
+        executor.submit(1, extend_payload(DOMAIN1, VOLUME1, 100))
+        self.assertTrue(pool.running.wait(MAILER_TIMEOUT))
+        executor.submit(2, extend_payload(DOMAIN1, VOLUME1, 200))
+        executor.submit(3, extend_payload(DOMAIN1, VOLUME1, 150))
+        self.assertEqual(executor.stats()["queued"], 1)
+        pool.resume.set()
+
+        self.assertTrue(mailer.done.wait(MAILER_TIMEOUT))
+        self.assertEqual(pool.calls, [
+            (DOMAIN1, VOLUME1, 100),
+            (DOMAIN1, VOLUME1, 200),
+        ])
+        reply = extend_payload(DOMAIN1, VOLUME1, 200)
+        self.assertEqual(mailer.replies[2], reply)
+        self.assertEqual(mailer.replies[3], reply)
+
+        stats = executor.stats()
+        self.assertEqual(stats["coalesced"], 1)
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["service_time"]["count"], 2)
+        self.assertEqual(stats["wait_time"]["count"], 2)
+
+    def test_report(self):
+        pool = FakePool()
+        mailer = FakeMailer(1)
+        executor = sm.ExtendExecutor(pool, mailer)
+        executor.submit(1, extend_payload(DOMAIN1, VOLUME1, 100))
+        self.assertTrue(mailer.done.wait(MAILER_TIMEOUT))
+        self.assertTrue(executor.wait(MAILER_TIMEOUT))
+
+        report = {m.flat_name: m.value for m in executor.report()}
+        self.assertEqual(report["storage.extend.queued"], 0)
+        self.assertEqual(report["storage.extend.running"], 0)
+        self.assertEqual(report["storage.extend.coalesced"], 0)
+        for key in ("wait_time", "service_time"):
+            for p in ("p50", "p90", "p99"):
+                self.assertIn("storage.extend.%s_%s" % (key, p), report)
+
+    def test_serial_in_domain(self):
+        pool = FakePool()
+        mailer = FakeMailer(2)
+        executor = sm.ExtendExecutor(pool, mailer)
+
+        pool.resume.clear()
+        executor.submit(1, extend_payload(DOMAIN1, VOLUME1, 100))
+        self.assertTrue(pool.running.wait(MAILER_TIMEOUT))
+        executor.submit(2, extend_payload(DOMAIN1, VOLUME2, 100))
+        # Second volume must wait for the first.
+        time.sleep(0.1)
+        self.assertEqual(len(pool.calls), 1)
+        pool.resume.set()
+
+        self.assertTrue(mailer.done.wait(MAILER_TIMEOUT))
+        self.assertEqual(len(pool.calls), 2)
+
+    def test_parallel_domains(self):
+        pool = FakePool()
+        mailer = FakeMailer(2)
+        executor = sm.ExtendExecutor(pool, mailer)
+
+        pool.resume.clear()
+        executor.submit(1, extend_payload(DOMAIN1, VOLUME1, 100))
+        self.assertTrue(pool.running.wait(MAILER_TIMEOUT))
+        executor.submit(2, extend_payload(DOMAIN2, VOLUME1, 100))
+        # Other domain is not blocked by the first request.
+        retry(lambda: self.assertEqual(len(pool.calls), 2),
+              expectedException=AssertionError,
+              timeout=MAILER_TIMEOUT, sleep=0.05)
+        self.assertEqual(executor.stats()["running"], 2)
+        pool.resume.set()
+
+        self.assertTrue(mailer.done.wait(MAILER_TIMEOUT))
+
+    def test_failure(self):
+        pool = FakePool()
+        pool.fail = True
+        mailer = FakeMailer(1)
+        executor = sm.ExtendExecutor(pool, mailer)
+
+        executor.submit(1, extend_payload(DOMAIN1, VOLUME1, 100))
+
+        self.assertTrue(mailer.done.wait(MAILER_TIMEOUT))
+        self.assertEqual(mailer.replies[1],
+                         extend_payload(DOMAIN1, VOLUME1, 0))
+
+    def test_stop(self):
+        pool = FakePool()
+        mailer = FakeMailer(1)
+        executor = sm.ExtendExecutor(pool, mailer)
+
+        pool.resume.clear()
+        executor.submit(1, extend_payload(DOMAIN1, VOLUME1, 100))
+        self.assertTrue(pool.running.wait(MAILER_TIMEOUT))
+        executor.submit(2, extend_payload(DOMAIN1, VOLUME2, 100))
+        executor.stop()
+        # Running request is completed, waiting request is dropped.
+        self.assertFalse(executor.wait(timeout=0.1))
+        pool.resume.set()
+        self.assertTrue(executor.wait(timeout=MAILER_TIMEOUT))
+        self.assertEqual(len(pool.calls), 1)
+
+        executor.submit(3, extend_payload(DOMAIN2, VOLUME1, 100))
+        self.assertTrue(executor.wait(timeout=MAILER_TIMEOUT))
+        self.assertEqual(len(pool.calls), 1)
+        # Replies are not sent after the executor was stopped.
+        self.assertEqual(mailer.replies, {})
+
+    def test_mailer_stopped_while_extending(self):
+        pool = FakePool()
+        mailer = FakeMailer(1)
+        executor = sm.ExtendExecutor(pool, mailer)
+
+        pool.resume.clear()
+        executor.submit(1, extend_payload(DOMAIN1, VOLUME1, 100))
+        self.assertTrue(pool.running.wait(MAILER_TIMEOUT))
+        mailer.stopped = True
+        pool.resume.set()
+        self.assertTrue(executor.wait(timeout=MAILER_TIMEOUT))
+        self.assertEqual(mailer.replies, {})
+
+
+class TestPollInterval(TestCaseBase):
+
+    def test_idle(self):
+        interval = sm._PollInterval(0.05, 2)
+        self.assertEqual([interval.next() for i in range(3)], [2, 2, 2])
+
+    def test_activity(self):
+        interval = sm._PollInterval(0.25, 2)
+        interval.activity()
+        self.assertEqual([interval.next() for i in range(5)],
+                         [0.25, 0.5, 1, 2, 2])
+
+    def test_activity_again(self):
+        interval = sm._PollInterval(0.25, 2)
+        interval.activity()
+        interval.next()
+        interval.next()
+        interval.activity()
+        self.assertEqual(interval.next(), 0.25)
+
+    def test_busy(self):
+        interval = sm._PollInterval(0.25, 2)
+        self.assertEqual([interval.next(busy=True) for i in range(3)],
+                         [0.25, 0.25, 0.25])
+
+    def test_busy_then_idle(self):
+        interval = sm._PollInterval(0.25, 2)
+        interval.next(busy=True)
+        self.assertEqual([interval.next() for i in range(3)],
+                         [0.25, 0.5, 1])
+
+    def test_min_larger_than_max(self):
+        interval = sm._PollInterval(3, 2)
+        interval.activity()
+        self.assertEqual(interval.next(), 2)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFailures(TestCaseBase):
+
+    def test_no_failures(self):
+        failures = sm._Failures(20, clock=FakeClock())
+        self.assertFalse(failures.sustained())
+
+    def test_many_quick_failures(self):
+        clock = FakeClock()
+        failures = sm._Failures(20, clock=clock)
+        # Polling every 0.05 seconds while requests are in flight.
+        for i in range(100):
+            failures.failure()
+            clock.now += 0.05
+        self.assertFalse(failures.sustained())
+
+    def test_sustained(self):
+        clock = FakeClock()
+        failures = sm._Failures(20, clock=clock)
+        failures.failure()
+        clock.now += 19
+        failures.failure()
+        self.assertFalse(failures.sustained())
+        clock.now += 1
+        self.assertTrue(failures.sustained())
+
+    def test_success_resets(self):
+        clock = FakeClock()
+        failures = sm._Failures(20, clock=clock)
+        failures.failure()
+        clock.now += 19
+        failures.success()
+        clock.now += 1
+        failures.failure()
+        self.assertFalse(failures.sustained())
+        clock.now += 20
+        self.assertTrue(failures.sustained())
+
 
 class TestValidation(TestCaseBase):
 
@@ -43,7 +43,7 @@ from vdsm.storage import misc
 from vdsm.storage import outOfProcess as oop
 
 from monkeypatch import MonkeyPatch
-from testValidation import checkSudo
+from testValidation import checkSudo, slowtest
 
 EXT_CHMOD = "/bin/chmod"
 EXT_CHOWN = "/bin/chown"
@@ -787,6 +787,108 @@ class ReadBlock(TestCaseBase):
 
         os.unlink(path)
 
+    def testReadLargeBlock(self):
+        """
+        Test reading more than the buffer size.
+        """
+        size = 2 * misc.MEGA + 512
+        with temporaryPath(data=make_slots(size // 512)) as path:
+            lines = misc.readblock(path, 512, size - 512)
+        self.assertEqual(lines, [slot(i) for i in range(1, size // 512)])
+
+
+@expandPermutations
+class ReadBlocks(TestCaseBase):
+
+    @permutations([
+        # offsets
+        [[0]],
+        [[512, 0, 1024]],
+        [[1024 * 512, 3 * 512, 512]],
+        [[512, 512, 1024]],
+    ])
+    def test_read(self, offsets):
+        with temporaryPath(data=make_slots(2000)) as path:
+            blocks = misc.readblocks(path, offsets, 512)
+        self.assertEqual(blocks, [[slot(offset // 512)]
+                                  for offset in offsets])
+
+    def test_read_multiple_slots(self):
+        with temporaryPath(data=make_slots(10)) as path:
+            blocks = misc.readblocks(path, [1024, 0], 1024)
+        self.assertEqual(blocks, [[slot(2), slot(3)], [slot(0), slot(1)]])
+
+    def test_invalid_offset(self):
+        self.assertRaises(misc.se.MiscBlockReadException, misc.readblocks,
+                          "/dev/urandom", [512, 513], 512)
+
+    def test_invalid_size(self):
+        self.assertRaises(misc.se.MiscBlockReadException, misc.readblocks,
+                          "/dev/urandom", [512], 513)
+
+    def test_read_after_end(self):
+        with temporaryPath(data=make_slots(2)) as path:
+            self.assertRaises(misc.se.MiscBlockReadIncomplete,
+                              misc.readblocks, path, [0, 1024], 512)
+
+    def test_missing(self):
+        self.assertRaises(misc.se.MiscBlockReadException, misc.readblocks,
+                          "/no/such/path", [0], 512)
+
+    @permutations([
+        # offsets, ranges
+        [[0, 512, 1024], [(0, 1536)]],
+        [[1024, 0], [(0, 1536)]],
+        [[0, 0], [(0, 512)]],
+        [[0, misc.READBLOCKS_MAX_GAP + 512],
+         [(0, misc.READBLOCKS_MAX_GAP + 1024)]],
+        [[0, misc.READBLOCKS_MAX_GAP + 1024],
+         [(0, 512), (misc.READBLOCKS_MAX_GAP + 1024, 512)]],
+    ])
+    def test_merge_ranges(self, offsets, ranges):
+        self.assertEqual(misc._mergeRanges(offsets, 512, misc.MEGA), ranges)
+
+    def test_merge_ranges_max_length(self):
+        ranges = misc._mergeRanges([0, 512, 1024], 512, 1024)
+        self.assertEqual(ranges, [(0, 1024), (1024, 512)])
+
+    @slowtest
+    def test_benchmark(self):
+        # Reading metadata slots of 100 volumes scattered in the first 2000
+        # slots of the metadata LV.
+        count = 100
+        offsets = [i * 20 * 512 for i in range(count)]
+        with temporaryPath(data=make_slots(2000)) as path:
+            start = time.time()
+            for offset in offsets:
+                cmd = ["dd", "iflag=direct", "skip=%d" % (offset // 512),
+                       "bs=512", "if=%s" % path, "count=1"]
+                commands.execCmd(cmd, raw=True)
+            dd = time.time() - start
+
+            start = time.time()
+            for offset in offsets:
+                misc.readblock(path, offset, 512)
+            readblock = time.time() - start
+
+            start = time.time()
+            misc.readblocks(path, offsets, 512)
+            readblocks = time.time() - start
+
+        print("\nread %d slots: dd %.6f seconds, readblock %.6f seconds, "
+              "readblocks %.6f seconds" % (count, dd, readblock, readblocks))
+
+
+def make_slots(count):
+    """
+    Return count 512 bytes slots, each containing one line.
+    """
+    return b"".join(slot(i) + b"\n" for i in range(count))
+
+
+def slot(i):
+    return (b"slot=%d" % i).ljust(511)
+
 
 class CleanUpDir(TestCaseBase):
 
@@ -1,5 +1,5 @@
 #
-# Copyright 2012-2016 Red Hat, Inc.
+# Copyright 2012-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -21,12 +21,15 @@
 from vdsm.storage import outOfProcess as oop
 
 from testlib import VdsmTestCase as TestCaseBase
-from monkeypatch import MonkeyPatchScope
+from monkeypatch import MonkeyPatch, MonkeyPatchScope
+
+from vdsm import concurrent
 
 import gc
 import logging
 import os
 import tempfile
+import threading
 import time
 import re
 from weakref import ref
@@ -44,7 +47,7 @@ class OopWrapperTests(TestCaseBase):
         poolA = "A"
         pids = []
         for pool in (poolA, poolA):
-            proc = oop.getProcessPool(pool)._ioproc
+            proc = oop.getProcessPool(pool)._ioproc._procs[0]
             name = proc._commthread.getName()
             pids.append(int(re.search(r'\d+', name).group()))
 
@@ -56,7 +59,7 @@ class OopWrapperTests(TestCaseBase):
         pools = (poolA, poolB)
         pids = []
         for pool in pools:
-            proc = oop.getProcessPool(pool)._ioproc
+            proc = oop.getProcessPool(pool)._ioproc._procs[0]
             name = proc._commthread.name
             pids.append(int(re.search(r'\d+', name).group()))
 
@@ -107,3 +110,77 @@ class OopWrapperTests(TestCaseBase):
         self.pool.utils.rmFile(tmpfile)
         os.close(tmpfd)
         return True
+
+
+class FakeIOProcess(object):
+
+    def __init__(self, **kw):
+        self.closed = False
+
+    def echo(self, data):
+        return self, data
+
+    def wait(self, event):
+        event.wait()
+
+    def close(self):
+        self.closed = True
+
+
+class IOProcessPoolTests(TestCaseBase):
+
+    @MonkeyPatch(oop, "IOProcess", FakeIOProcess)
+    def test_dispatch_least_loaded(self):
+        pool = oop._IOProcessPool("test", 2)
+        event = threading.Event()
+        t = concurrent.thread(pool.wait, args=(event,))
+        t.start()
+        try:
+            # Wait until the blocked call is running
+            while pool.stats()["running"] != [1, 0]:
+                time.sleep(0.01)
+            # Calls are sent to the other instance
+            for i in range(3):
+                proc, data = pool.echo(i)
+                self.assertIs(proc, pool._procs[1])
+        finally:
+            event.set()
+            t.join()
+        self.assertEqual(pool.stats()["running"], [0, 0])
+
+    @MonkeyPatch(oop, "IOProcess", FakeIOProcess)
+    def test_stats(self):
+        pool = oop._IOProcessPool("test", 2)
+        for i in range(3):
+            pool.echo(i)
+        stats = pool.stats()
+        self.assertEqual(stats["instances"], 2)
+        self.assertEqual(stats["queue_depth"]["count"], 3)
+        self.assertEqual(stats["queue_depth"]["max"], 1)
+        self.assertEqual(list(stats["latency"]), ["echo"])
+        self.assertEqual(stats["latency"]["echo"]["count"], 3)
+
+    @MonkeyPatch(oop, "IOProcess", FakeIOProcess)
+    def test_report(self):
+        proc = oop._IOProcWrapper("oop", oop._IOProcessPool("test", 2))
+        proc._ioproc.echo("data")
+        with MonkeyPatchScope([(oop, "_refProcPool", {"test": ref(proc)})]):
+            report = {(m.flat_name, tuple(sorted(m.labels.items())))
+                      for m in oop.report()}
+        self.assertEqual(report, {
+            ("storage.oop.test.running", (("client", "test"),)),
+            ("storage.oop.test.queue_depth_p90", (("client", "test"),)),
+            ("storage.oop.test.echo.latency_p50",
+             (("client", "test"), ("op", "echo"))),
+            ("storage.oop.test.echo.latency_p90",
+             (("client", "test"), ("op", "echo"))),
+            ("storage.oop.test.echo.latency_p99",
+             (("client", "test"), ("op", "echo"))),
+        })
+
+    @MonkeyPatch(oop, "IOProcess", FakeIOProcess)
+    def test_close(self):
+        pool = oop._IOProcessPool("test", 2)
+        pool.close()
+        for proc in pool._procs:
+            self.assertTrue(proc.closed)
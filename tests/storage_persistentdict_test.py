@@ -1,5 +1,5 @@
 #
-# Copyright 2012-2016 Red Hat, Inc.
+# Copyright 2012-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -17,7 +17,9 @@
 #
 # Refer to the README and COPYING files for full details of the license
 #
+from monkeypatch import MonkeyPatch
 from testlib import VdsmTestCase as TestCaseBase
+from vdsm.storage import exception as se
 from vdsm.storage import persistent as persistentDict
 
 
@@ -50,6 +52,32 @@ class DummyWriter(object):
         self.lines = lines[:]
 
 
+class CountingWriter(DummyWriter):
+    def __init__(self):
+        DummyWriter.__init__(self)
+        self.writes = 0
+
+    def writelines(self, lines):
+        self.writes += 1
+        DummyWriter.writelines(self, lines)
+
+
+class Checksums(object):
+    """
+    Count lines checksummed by persistent module.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, line):
+        self.count += 1
+        return _preprocessLine(line)
+
+
+_preprocessLine = persistentDict._preprocessLine
+
+
 class SpecialError (RuntimeError):
     pass
 
@@ -75,3 +103,80 @@ class PersistentDictTests(TestCaseBase):
             return
 
         self.fail("Exception was not thrown")
+
+    def testSetSameValueDoesNotFlush(self):
+        writer = CountingWriter()
+        pd = persistentDict.PersistentDict(writer)
+        pd["key"] = "value"
+        self.assertEqual(writer.writes, 1)
+        pd["key"] = "value"
+        pd.update({"key": "value"})
+        self.assertEqual(writer.writes, 1)
+
+    def testChangeAndRevertDoesNotFlush(self):
+        writer = CountingWriter()
+        pd = persistentDict.PersistentDict(writer)
+        pd["key"] = "value"
+        with pd.transaction():
+            pd["key"] = "new"
+            pd["other"] = "value"
+            del pd["other"]
+            pd["key"] = "value"
+        self.assertEqual(writer.writes, 1)
+
+    def testNestedTransactionsFlushOnce(self):
+        writer = CountingWriter()
+        pd = persistentDict.PersistentDict(writer)
+        with pd.transaction():
+            pd["a"] = "1"
+            pd.update({"b": "2", "c": "3"})
+            with pd.transaction():
+                pd["d"] = "4"
+            del pd["a"]
+        self.assertEqual(writer.writes, 1)
+        pd.invalidate()
+        self.assertEqual(pd.copy(), {"b": "2", "c": "3", "d": "4"})
+
+    def testRollback(self):
+        writer = CountingWriter()
+        pd = persistentDict.PersistentDict(writer)
+        pd.update({"a": "1", "b": "2"})
+        with self.assertRaises(SpecialError):
+            with pd.transaction():
+                pd["a"] = "changed"
+                del pd["b"]
+                pd["c"] = "3"
+                raise SpecialError()
+        self.assertEqual(pd.copy(), {"a": "1", "b": "2"})
+        pd.invalidate()
+        self.assertEqual(pd.copy(), {"a": "1", "b": "2"})
+
+    @MonkeyPatch(persistentDict, "_preprocessLine", Checksums())
+    def testRefreshUnchanged(self):
+        checksums = persistentDict._preprocessLine
+        pd = persistentDict.PersistentDict(DummyWriter())
+        pd.update({"a": "1", "b": "2"})
+        count = checksums.count
+        pd.invalidate()
+        self.assertEqual(pd.copy(), {"a": "1", "b": "2"})
+        # Unchanged metadata is not checksummed again
+        self.assertEqual(checksums.count, count)
+
+    def testRefreshChanged(self):
+        writer = DummyWriter()
+        pd = persistentDict.PersistentDict(writer)
+        pd.update({"a": "1", "b": "2"})
+        # Another host modifies the metadata
+        other = persistentDict.PersistentDict(writer)
+        other["a"] = "changed"
+        pd.invalidate()
+        self.assertEqual(pd.copy(), {"a": "changed", "b": "2"})
+
+    def testRefreshBrokenSeal(self):
+        writer = DummyWriter()
+        pd = persistentDict.PersistentDict(writer)
+        pd.update({"a": "1", "b": "2"})
+        # Metadata modified without updating the checksum
+        writer.lines[0] = "a=changed"
+        pd.invalidate()
+        self.assertRaises(se.MetaDataSealIsBroken, pd.copy)
@@ -21,12 +21,20 @@
 from __future__ import print_function
 
 import io
+import json
 import os
+import random
+import time
+from contextlib import contextmanager
 
+from nose.plugins.skip import SkipTest
+
+from monkeypatch import MonkeyPatchScope
 from testlib import namedTemporaryDir
 from testlib import VdsmTestCase
 from testlib import permutations, expandPermutations
 from testValidation import slowtest
+from testValidation import stresstest
 from vdsm import qemuimg
 from vdsm import utils
 from vdsm.storage import qcow2
@@ -114,6 +122,106 @@ class TestCountClusters(VdsmTestCase):
             self.assertEqual(qcow2.count_clusters(runs), 2)
 
 
+def fragmented_runs(count, seed=0):
+    """
+    Generate count alternating data and zero runs of random lengths, similar
+    to qemu-img map output for a fragmented raw image.
+    """
+    rnd = random.Random(seed)
+    start = 0
+    for i in range(count):
+        length = rnd.choice((512, 4096, 65536, 1024**2)) * rnd.randint(1, 4)
+        yield {"start": start, "length": length, "depth": 0,
+               "zero": i % 2 == 1, "data": i % 2 == 0}
+        start += length
+
+
+def count_clusters_slow(runs):
+    # The original implementation, walking the runs dicts.
+    count = 0
+    last = -1
+    for r in runs:
+        start = r["start"] // qcow2.CLUSTER_SIZE
+        end = (r["start"] + r["length"]) // qcow2.CLUSTER_SIZE
+        if r["data"]:
+            if start == end:
+                if start != last:
+                    count += 1
+            else:
+                count += end - start
+            last = end
+    return count
+
+
+@expandPermutations
+class TestCountClustersRuns(VdsmTestCase):
+
+    @permutations([["python"], ["numpy"]])
+    def test_empty(self, impl):
+        with self.implementation(impl):
+            self.assertEqual(qcow2.count_clusters([]), 0)
+
+    @permutations([["python"], ["numpy"]])
+    def test_small_runs(self, impl):
+        runs = [
+            # First cluster, counted once.
+            {"start": 0, "length": 512, "data": True},
+            {"start": 4096, "length": 512, "data": True},
+            # Zero run, ignored.
+            {"start": 4608, "length": 65536, "data": False},
+            # Second and third clusters.
+            {"start": 70144, "length": 65536, "data": True},
+        ]
+        with self.implementation(impl):
+            self.assertEqual(qcow2.count_clusters(runs),
+                             count_clusters_slow(runs))
+
+    @permutations([["python"], ["numpy"]])
+    def test_fragmented(self, impl):
+        runs = list(fragmented_runs(10000))
+        with self.implementation(impl):
+            self.assertEqual(qcow2.count_clusters(runs),
+                             count_clusters_slow(runs))
+
+    @permutations([["python"], ["numpy"]])
+    def test_iter_json_array(self, impl):
+        runs = list(fragmented_runs(1000))
+        text = ("[" + ",\n".join(json.dumps(r) for r in runs) +
+                "]\n").encode("utf-8")
+        chunks = [text[i:i + 4096] for i in range(0, len(text), 4096)]
+        with self.implementation(impl):
+            self.assertEqual(
+                qcow2.count_clusters(qemuimg._iter_json_array(chunks)),
+                count_clusters_slow(runs))
+
+    @stresstest
+    @permutations([["python"], ["numpy"]])
+    def test_benchmark(self, impl):
+        # About 2.5 TiB of fragmented data.
+        count = 2 * 1000**2
+        runs = fragmented_runs(count)
+        text = ("[" + ",\n".join(json.dumps(r) for r in runs) +
+                "]\n").encode("utf-8")
+        chunks = [text[i:i + 128 * 1024]
+                  for i in range(0, len(text), 128 * 1024)]
+        with self.implementation(impl):
+            start = time.time()
+            qcow2.count_clusters(qemuimg._iter_json_array(chunks))
+            elapsed = time.time() - start
+        print("%d runs, %s: %.2f seconds (%d runs/s)" % (
+              count, impl, elapsed, count / elapsed))
+
+    @contextmanager
+    def implementation(self, impl):
+        if impl == "numpy":
+            if qcow2.numpy is None:
+                raise SkipTest("numpy is not available")
+            yield
+        else:
+            with MonkeyPatchScope([(qcow2, "numpy", None)]):
+                yield
+
+
 @expandPermutations
 class TestAlign(VdsmTestCase):
 
@@ -263,14 +371,45 @@ class TestEstimate(VdsmTestCase):
         self.assertGreaterEqual(estimate, actual)
         self.assertGreaterEqual(0.1, error_pct)
 
-
-def converted_size(filename, compat):
-    converted = filename + ".qcow2"
-    operation = qemuimg.convert(filename,
-                                converted,
-                                srcFormat=qemuimg.FORMAT.RAW,
+    @permutations((('0.10',), ('1.1',)))
+    def test_qcow2(self, compat):
+        with namedTemporaryDir() as tmpdir:
+            raw = os.path.join(tmpdir, 'raw')
+            with io.open(raw, "wb") as f:
+                f.truncate(GB)
+                f.write("x" * MB)
+                f.seek(512 * MB)
+                f.write("x" * MB)
+            filename = os.path.join(tmpdir, 'test')
+            convert(raw, filename, compat)
+            estimate = qcow2.estimate_size(filename)
+            self.assertEqual(estimate, qcow2.estimate_size(raw))
+            self.assertGreaterEqual(
+                estimate,
+                converted_size(filename, compat, qemuimg.FORMAT.QCOW2))
+
+    def test_qcow2_backing_file(self):
+        with namedTemporaryDir() as tmpdir:
+            base = os.path.join(tmpdir, 'base')
+            top = os.path.join(tmpdir, 'top')
+            qemuimg.create(base, size=GB, format=qemuimg.FORMAT.QCOW2)
+            qemuimg.create(top, format=qemuimg.FORMAT.QCOW2, backing='base',
+                           backingFormat=qemuimg.FORMAT.QCOW2)
+            with self.assertRaises(ValueError):
+                qcow2.estimate_size(top)
+
+
+def convert(src, dst, compat, src_format=qemuimg.FORMAT.RAW):
+    operation = qemuimg.convert(src,
+                                dst,
+                                srcFormat=src_format,
                                 dstFormat=qemuimg.FORMAT.QCOW2,
                                 dstQcow2Compat=compat)
     with utils.closing(operation):
         operation.wait_for_completion()
+
+
+def converted_size(filename, compat, src_format=qemuimg.FORMAT.RAW):
+    converted = filename + ".qcow2"
+    convert(filename, converted, compat, src_format)
     return os.stat(converted).st_size
@@ -0,0 +1,273 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+
+import io
+import os
+import struct
+
+from testlib import VdsmTestCase
+from testlib import expandPermutations, permutations
+from testlib import namedTemporaryDir
+
+from vdsm import qemuimg
+from vdsm import utils
+from vdsm.storage import qcow2
+from vdsm.storage import qcow2reader
+
+MB = 1024**2
+GB = 1024**3
+
+DATA = "data"
+COMPRESSED = "compressed"
+ZERO = "zero"
+PREALLOCATED_ZERO = "preallocated-zero"
+
+
+def make_image(path, size=GB, version=3, cluster_bits=16, clusters=None,
+               backing=None, incompatible_features=0):
+    """
+    Write a minimal qcow2 image with clusters, a dict mapping guest cluster
+    index to cluster type.
+
+    Layout: header, L1 table, refcount table, refcount block, L2 tables and
+    data clusters, one cluster each. The refcount block is not filled.
+    """
+    clusters = clusters or {}
+    cluster_size = 1 << cluster_bits
+    l2_entries = cluster_size // 8
+    l1_size = -(-size // (cluster_size * l2_entries))
+
+    l1_offset = cluster_size
+    refcount_table_offset = 2 * cluster_size
+    next_cluster = 4
+
+    l2_tables = {}
+    for index in sorted(clusters):
+        l1_index, l2_index = divmod(index, l2_entries)
+        if l1_index not in l2_tables:
+            l2_tables[l1_index] = (next_cluster, [0] * l2_entries)
+            next_cluster += 1
+        kind = clusters[index]
+        if kind == ZERO:
+            entry = 1
+        elif kind == COMPRESSED:
+            entry = qcow2reader.L2E_COMPRESSED | next_cluster * cluster_size
+            next_cluster += 1
+        else:
+            entry = next_cluster * cluster_size
+            if kind == PREALLOCATED_ZERO:
+                entry |= 1
+            next_cluster += 1
+        l2_tables[l1_index][1][l2_index] = entry
+
+    with io.open(path, "wb") as f:
+        if backing:
+            backing_offset = 1024
+            backing_size = len(backing)
+        else:
+            backing_offset = backing_size = 0
+
+        header = struct.pack(
+            ">4sIQIIQIIQQIIQ", qcow2reader.MAGIC, version, backing_offset,
+            backing_size, cluster_bits, size, 0, l1_size, l1_offset,
+            refcount_table_offset, 1, 0, 0)
+        if version == 3:
+            header += struct.pack(">QQQII", incompatible_features, 0, 0, 4,
+                                  104)
+        f.write(header)
+
+        if backing:
+            f.seek(backing_offset)
+            f.write(backing.encode("utf-8"))
+
+        l1 = [0] * l1_size
+        for l1_index, (cluster, _) in l2_tables.items():
+            l1[l1_index] = (1 << 63) | cluster * cluster_size
+        f.seek(l1_offset)
+        f.write(struct.pack(">%dQ" % l1_size, *l1))
+
+        for cluster, table in l2_tables.values():
+            f.seek(cluster * cluster_size)
+            f.write(struct.pack(">%dQ" % l2_entries, *table))
+
+        f.truncate(next_cluster * cluster_size)
+
+
+@expandPermutations
+class TestHeader(VdsmTestCase):
+
+    @permutations([[2], [3]])
+    def test_info(self, version):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, size=10 * GB, version=version)
+            info = qcow2reader.info(path)
+        self.assertEqual(info, {
+            "format": "qcow2",
+            "virtualsize": 10 * GB,
+            "clustersize": 64 * 1024,
+            "compat": {2: "0.10", 3: "1.1"}[version],
+        })
+
+    def test_backing_file(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, backing="../img/parent")
+            info = qcow2reader.info(path)
+        self.assertEqual(info["backingfile"], "../img/parent")
+
+    def test_cluster_size(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, cluster_bits=12)
+            with qcow2reader.Image(path) as img:
+                self.assertEqual(img.cluster_size, 4096)
+
+    def test_is_qcow2(self):
+        with namedTemporaryDir() as tmpdir:
+            qcow2_path = os.path.join(tmpdir, "qcow2")
+            make_image(qcow2_path)
+            raw_path = os.path.join(tmpdir, "raw")
+            with io.open(raw_path, "wb") as f:
+                f.truncate(MB)
+            self.assertTrue(qcow2reader.is_qcow2(qcow2_path))
+            self.assertFalse(qcow2reader.is_qcow2(raw_path))
+
+    def test_raw_image(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            with io.open(path, "wb") as f:
+                f.truncate(MB)
+            with self.assertRaises(qcow2reader.InvalidImage):
+                qcow2reader.info(path)
+
+    def test_truncated(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            with io.open(path, "wb") as f:
+                f.write(qcow2reader.MAGIC)
+            with self.assertRaises(qcow2reader.InvalidImage):
+                qcow2reader.info(path)
+
+    def test_unsupported_version(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, version=4)
+            with self.assertRaises(qcow2reader.InvalidImage):
+                qcow2reader.info(path)
+
+    def test_unknown_incompatible_features(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, incompatible_features=0x4)
+            with self.assertRaises(qcow2reader.InvalidImage):
+                qcow2reader.info(path)
+
+    def test_dirty(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, incompatible_features=0x1)
+            self.assertEqual(qcow2reader.info(path)["virtualsize"], GB)
+
+
+class TestAllocation(VdsmTestCase):
+
+    def test_empty(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path)
+            with qcow2reader.Image(path) as img:
+                self.assertEqual(img.allocated_clusters(), 0)
+
+    def test_clusters(self):
+        clusters = {0: DATA, 1: DATA, 8191: DATA, 8192: DATA, 16000: DATA}
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, clusters=clusters)
+            with qcow2reader.Image(path) as img:
+                self.assertEqual(img.allocated_clusters(), 5)
+
+    def test_cluster_types(self):
+        clusters = {0: DATA, 1: COMPRESSED, 2: ZERO, 3: PREALLOCATED_ZERO}
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, clusters=clusters)
+            with qcow2reader.Image(path) as img:
+                self.assertEqual(img.allocated_clusters(), 3)
+
+    def test_truncated_l2_table(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            make_image(path, clusters={0: DATA})
+            with io.open(path, "r+b") as f:
+                f.truncate(4 * 64 * 1024 + 4096)
+            with qcow2reader.Image(path) as img:
+                with self.assertRaises(qcow2reader.InvalidImage):
+                    img.allocated_clusters()
+
+
+@expandPermutations
+class TestQemuImg(VdsmTestCase):
+    """
+    Validate the reader using images created by qemu-img.
+    """
+
+    @permutations([["0.10"], ["1.1"]])
+    def test_info(self, compat):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            qemuimg.create(path, size=GB, format=qemuimg.FORMAT.QCOW2,
+                           qcow2Compat=compat)
+            self.assertEqual(qcow2reader.info(path), qemuimg.info(path))
+
+    @permutations([["0.10"], ["1.1"]])
+    def test_info_backing(self, compat):
+        with namedTemporaryDir() as tmpdir:
+            base = os.path.join(tmpdir, "base")
+            top = os.path.join(tmpdir, "top")
+            qemuimg.create(base, size=GB, format=qemuimg.FORMAT.QCOW2,
+                           qcow2Compat=compat)
+            qemuimg.create(top, format=qemuimg.FORMAT.QCOW2,
+                           qcow2Compat=compat, backing="base",
+                           backingFormat=qemuimg.FORMAT.QCOW2)
+            self.assertEqual(qcow2reader.info(top), qemuimg.info(top))
+
+    @permutations([["0.10"], ["1.1"]])
+    def test_allocated_clusters(self, compat):
+        with namedTemporaryDir() as tmpdir:
+            raw = os.path.join(tmpdir, "raw")
+            with io.open(raw, "wb") as f:
+                f.truncate(GB)
+                for offset in (0, 10 * MB, 512 * MB + 4096, GB - MB):
+                    f.seek(offset)
+                    f.write(b"x" * MB)
+            path = os.path.join(tmpdir, "image")
+            operation = qemuimg.convert(raw, path,
+                                        srcFormat=qemuimg.FORMAT.RAW,
+                                        dstFormat=qemuimg.FORMAT.QCOW2,
+                                        dstQcow2Compat=compat)
+            with utils.closing(operation):
+                operation.wait_for_completion()
+            runs = qemuimg.map(path)
+            with qcow2reader.Image(path) as img:
+                self.assertEqual(img.allocated_clusters(),
+                                 qcow2.count_clusters(runs))
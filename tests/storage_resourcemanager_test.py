@@ -1,5 +1,5 @@
 #
-# Copyright 2012 Red Hat, Inc.
+# Copyright 2012-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -26,9 +26,10 @@ from StringIO import StringIO
 import types
 from resource import getrlimit, RLIMIT_NPROC
 
+from vdsm.storage import exception as se
 from vdsm.storage import resourceManager as rm
 
-from monkeypatch import MonkeyPatch
+from monkeypatch import MonkeyPatch, MonkeyPatchScope
 from storagefakelib import FakeResourceManager
 from testlib import expandPermutations, permutations
 from testlib import VdsmTestCase as TestCaseBase
@@ -113,6 +114,21 @@ class FailAfterSwitchFactory(rm.SimpleResourceFactory):
         return s
 
 
+class BlockingFactory(rm.SimpleResourceFactory):
+    """
+    A resource factory blocking in createResource until unblocked, like
+    image resources preparing the image volumes.
+    """
+    def __init__(self):
+        self.creating = threading.Event()
+        self.unblock = threading.Event()
+
+    def createResource(self, name, lockType):
+        self.creating.set()
+        self.unblock.wait()
+        return None
+
+
 def manager():
     """
     Create fresh _ResourceManager instance for testing.
@@ -538,6 +554,166 @@ class ResourceManagerTests(TestCaseBase):
         self.assertTrue(exclusiveReq2.granted())
         resources.pop().release()  # exclusiveReq 2
 
+    @MonkeyPatch(rm, "_manager", manager())
+    def testAcquireResources(self):
+        refs = rm.acquireResources([
+            ("string", "b", rm.SHARED),
+            ("storage", "a", rm.EXCLUSIVE),
+            ("string", "a", rm.EXCLUSIVE),
+        ])
+        self.assertEqual([r.fullName for r in refs],
+                         ["storage.a", "string.a", "string.b"])
+        self.assertEqual(rm._getResourceStatus("storage", "a"),
+                         rm.LockState.locked)
+        self.assertEqual(rm._getResourceStatus("string", "b"),
+                         rm.LockState.shared)
+        # The resources are created by the factories.
+        self.assertEqual(refs[1].read(), "a:exclusive")
+        for ref in refs:
+            ref.release()
+        self.assertEqual(rm._getResourceStatus("string", "a"),
+                         rm.LockState.free)
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testAcquireResourcesJoinShared(self):
+        shared = rm.acquireResource("storage", "a", rm.SHARED)
+        refs = rm.acquireResources([("storage", "a", rm.SHARED),
+                                    ("storage", "b", rm.EXCLUSIVE)])
+        shared.release()
+        self.assertEqual(rm._getResourceStatus("storage", "a"),
+                         rm.LockState.shared)
+        for ref in refs:
+            ref.release()
+        self.assertEqual(rm._getResourceStatus("storage", "a"),
+                         rm.LockState.free)
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testAcquireResourcesWaitForLocked(self):
+        exclusive = rm.acquireResource("storage", "b", rm.EXCLUSIVE)
+        releaser = threading.Timer(0.2, exclusive.release)
+        releaser.start()
+        try:
+            refs = rm.acquireResources([("storage", "a", rm.EXCLUSIVE),
+                                        ("storage", "b", rm.SHARED)],
+                                       timeout=10)
+        finally:
+            releaser.join()
+        self.assertEqual(rm._getResourceStatus("storage", "b"),
+                         rm.LockState.shared)
+        for ref in refs:
+            ref.release()
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testAcquireResourcesTimeout(self):
+        exclusive = rm.acquireResource("storage", "b", rm.EXCLUSIVE)
+        with self.assertRaises(rm.RequestTimedOutError):
+            rm.acquireResources([("storage", "a", rm.EXCLUSIVE),
+                                 ("storage", "b", rm.EXCLUSIVE)],
+                                timeout=0)
+        exclusive.release()
+        # Resources acquired before the timeout were released.
+        self.assertEqual(rm._getResourceStatus("storage", "a"),
+                         rm.LockState.free)
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testAcquireResourcesFactoryError(self):
+        shared = rm.acquireResource("storage", "b", rm.SHARED)
+        with self.assertRaises(se.ResourceAcqusitionFailed):
+            rm.acquireResources([("storage", "a", rm.EXCLUSIVE),
+                                 ("storage", "b", rm.SHARED),
+                                 ("string", "c", rm.EXCLUSIVE),
+                                 ("error", "d", rm.EXCLUSIVE)])
+        self.assertEqual(rm._getResourceStatus("storage", "a"),
+                         rm.LockState.free)
+        self.assertEqual(rm._getResourceStatus("string", "c"),
+                         rm.LockState.free)
+        # Shared users acquired before are not affected.
+        self.assertEqual(rm._getResourceStatus("storage", "b"),
+                         rm.LockState.shared)
+        shared.release()
+        self.assertEqual(rm._getResourceStatus("storage", "b"),
+                         rm.LockState.free)
+
+    def testAcquireResourcesBlockingFactory(self):
+        factory = BlockingFactory()
+        manager_ = manager()
+        manager_.registerNamespace("blocking", factory)
+        with MonkeyPatchScope([(rm, "_manager", manager_)]):
+            shared = rm.acquireResource("storage", "a", rm.SHARED)
+            refs = []
+
+            def acquire():
+                refs.extend(rm.acquireResources(
+                    [("storage", "a", rm.SHARED),
+                     ("blocking", "b", rm.EXCLUSIVE)]))
+
+            acquired = threading.Event()
+
+            def acquire_other():
+                rm.acquireResource("storage", "c", rm.EXCLUSIVE).release()
+                acquired.set()
+
+            t = threading.Thread(target=acquire)
+            t.daemon = True
+            t.start()
+            try:
+                self.assertTrue(factory.creating.wait(5))
+                # Other requests in the namespaces are not blocked while
+                # the factory creates the resource.
+                other = threading.Thread(target=acquire_other)
+                other.daemon = True
+                other.start()
+                self.assertTrue(acquired.wait(5))
+                shared.release()
+            finally:
+                factory.unblock.set()
+                t.join()
+
+            self.assertEqual([r.fullName for r in refs],
+                             ["blocking.b", "storage.a"])
+            for ref in refs:
+                ref.release()
+            self.assertEqual(rm._getResourceStatus("storage", "a"),
+                             rm.LockState.free)
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testAcquireResourcesDuplicate(self):
+        with self.assertRaises(ValueError):
+            rm.acquireResources([("storage", "a", rm.EXCLUSIVE),
+                                 ("storage", "a", rm.SHARED)])
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testAcquireResourcesNonExisting(self):
+        with self.assertRaises(KeyError):
+            rm.acquireResources([("storage", "a", rm.EXCLUSIVE),
+                                 ("null", "b", rm.EXCLUSIVE)])
+        self.assertEqual(rm._getResourceStatus("storage", "a"),
+                         rm.LockState.free)
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testStats(self):
+        exclusive = rm.acquireResource("storage", "a", rm.EXCLUSIVE)
+        shared = []
+
+        def callback(req, res):
+            shared.append(res)
+
+        rm._registerResource("storage", "a", rm.SHARED, callback)
+        stats = rm.stats()["storage"]
+        self.assertEqual(stats["resources"], 1)
+        self.assertEqual(stats["queued"], 1)
+        self.assertEqual(stats["waitTime"]["count"], 1)
+        self.assertEqual(stats["holdTime"]["count"], 0)
+
+        exclusive.release()
+        shared.pop().release()
+        stats = rm.stats()["storage"]
+        self.assertEqual(stats["resources"], 0)
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["waitTime"]["count"], 2)
+        self.assertEqual(stats["holdTime"]["count"], 2)
+        self.assertEqual(rm.stats()["string"]["waitTime"]["count"], 0)
+
     @MonkeyPatch(rm, "_manager", manager())
     def testCancelRequest(self):
         resources = []
@@ -687,6 +863,20 @@ class ResourceManagerLockTest(TestCaseBase):
         self.assertFalse(a < b)
         self.assertFalse(b < a)
 
+    @MonkeyPatch(rm, "_manager", manager())
+    def test_acquire_many(self):
+        locks = [rm.ResourceManagerLock("storage", "a", rm.EXCLUSIVE),
+                 rm.ResourceManagerLock("storage", "b", rm.SHARED)]
+        rm.ResourceManagerLock.acquire_many(locks)
+        self.assertEqual(rm._getResourceStatus("storage", "a"),
+                         rm.LockState.locked)
+        self.assertEqual(rm._getResourceStatus("storage", "b"),
+                         rm.LockState.shared)
+        for lock in locks:
+            lock.release()
+        self.assertEqual(rm._getResourceStatus("storage", "a"),
+                         rm.LockState.free)
+
     @MonkeyPatch(rm, "_manager", FakeResourceManager())
     def test_acquire_release(self):
         lock = rm.ResourceManagerLock('ns_A', 'name_A', rm.SHARED)
@@ -1,4 +1,4 @@
-# Copyright 2015 Red Hat, Inc.
+# Copyright 2015-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,9 +19,11 @@
 
 import os
 import uuid
+from contextlib import contextmanager
 
 from vdsm.storage import constants as sc
 
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase, recorded
 from testlib import make_uuid
 from testlib import expandPermutations, permutations
@@ -29,10 +31,11 @@ from testlib import expandPermutations, permutations
 from storagetestlib import (
     make_file_volume,
     fake_block_env,
+    fake_env,
     fake_file_env
 )
 
-from storage import sd, blockSD
+from storage import sd, blockSD, blockVolume, volume
 
 MB = 1048576
 
@@ -216,3 +219,126 @@ class DomainLockTests(VdsmTestCase):
             with manifest.domain_lock(1):
                 raise InjectedFailure()
         self.assertEqual(manifest.__calls__, expected_calls)
+
+
+@contextmanager
+def volumes_env(env_type):
+    # Volume leases cannot be inquired without sanlock.
+    with fake_env(env_type) as env, MonkeyPatchScope([
+        (volume.VolumeManifest, 'getLeaseStatus', lambda self: None),
+    ]):
+        yield env
+
+
+@expandPermutations
+class VolumesInfoTests(VdsmTestCase):
+
+    def make_volumes(self, env, count, img_id=None):
+        vols = []
+        for i in range(count):
+            vol_img_id = img_id or make_uuid()
+            vol_id = make_uuid()
+            env.make_volume(VOLSIZE, vol_img_id, vol_id,
+                            desc='volume %d' % i)
+            vols.append((vol_img_id, vol_id))
+        return sorted(vols)
+
+    def volumes(self, infos):
+        return [(info['image'], info['uuid']) for info in infos]
+
+    @permutations([['file'], ['block']])
+    def test_domain(self, env_type):
+        with volumes_env(env_type) as env:
+            vols = self.make_volumes(env, 3)
+            infos, errors, next = env.sd_manifest.getVolumesInfo()
+            self.assertEqual(vols, self.volumes(infos))
+            self.assertEqual([], errors)
+            self.assertIsNone(next)
+
+    @permutations([['file'], ['block']])
+    def test_image(self, env_type):
+        with volumes_env(env_type) as env:
+            img_id = make_uuid()
+            vols = self.make_volumes(env, 2, img_id=img_id)
+            self.make_volumes(env, 2)
+            infos, _, next = env.sd_manifest.getVolumesInfo(img_id)
+            self.assertEqual(vols, self.volumes(infos))
+            self.assertIsNone(next)
+
+    @permutations([['file'], ['block']])
+    def test_pages(self, env_type):
+        with volumes_env(env_type) as env:
+            vols = self.make_volumes(env, 5)
+            found = []
+            offset = 0
+            while offset is not None:
+                infos, _, offset = env.sd_manifest.getVolumesInfo(
+                    offset=offset, limit=2)
+                self.assertLessEqual(len(infos), 2)
+                found.extend(self.volumes(infos))
+            self.assertEqual(vols, found)
+
+    @permutations([['file'], ['block']])
+    def test_empty(self, env_type):
+        with volumes_env(env_type) as env:
+            self.assertEqual(([], [], None),
+                             env.sd_manifest.getVolumesInfo())
+
+    def test_block_metadata_read_once(self):
+        with volumes_env('block') as env:
+            vols = self.make_volumes(env, 3)
+            calls = []
+            read = blockVolume.MetadataSnapshot.load
+
+            def load(self, volUUIDs=None):
+                calls.append(volUUIDs)
+                return read(self, volUUIDs)
+
+            with MonkeyPatchScope([
+                (blockVolume.MetadataSnapshot, 'load', load),
+            ]):
+                infos, _, next = env.sd_manifest.getVolumesInfo()
+            self.assertEqual(vols, self.volumes(infos))
+            self.assertEqual([[vol_id for _, vol_id in vols]], calls)
+
+    def test_block_load_page_only(self):
+        with volumes_env('block') as env:
+            vols = self.make_volumes(env, 5)
+            offsets = []
+            metadata_offsets = blockVolume._metadataOffsets
+
+            def record(sdUUID, volUUIDs=None):
+                result = metadata_offsets(sdUUID, volUUIDs)
+                offsets.append(result)
+                return result
+
+            with MonkeyPatchScope([
+                (blockVolume, '_metadataOffsets', record),
+            ]):
+                infos, _, next = env.sd_manifest.getVolumesInfo(offset=1,
+                                                                limit=2)
+            self.assertEqual(vols[1:3], self.volumes(infos))
+            self.assertEqual(1, len(offsets))
+            self.assertEqual(2, len(offsets[0]))
+
+    @permutations([['file'], ['block']])
+    def test_volume_error(self, env_type):
+        with volumes_env(env_type) as env:
+            vols = self.make_volumes(env, 3)
+            bad_img_id, bad_vol_id = vols[1]
+            get_info = volume.VolumeManifest.getInfo
+
+            def getInfo(self):
+                if self.volUUID == bad_vol_id:
+                    raise RuntimeError("Cannot read volume")
+                return get_info(self)
+
+            with MonkeyPatchScope([
+                (volume.VolumeManifest, 'getInfo', getInfo),
+            ]):
+                infos, errors, next = env.sd_manifest.getVolumesInfo()
+            self.assertEqual([vols[0], vols[2]], self.volumes(infos))
+            self.assertEqual(1, len(errors))
+            self.assertEqual(bad_vol_id, errors[0]["uuid"])
+            self.assertEqual(bad_img_id, errors[0]["image"])
+            self.assertEqual(100, errors[0]["error"]["code"])
@@ -0,0 +1,169 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+
+import threading
+
+from testlib import VdsmTestCase
+
+from vdsm import executor
+from vdsm import schedule
+from vdsm import utils
+from vdsm.storage import taskexecutor
+
+TIMEOUT = 5
+
+
+class Recorder(object):
+    """
+    Record tasks ids in the order they started, blocking each task until
+    released.
+    """
+
+    def __init__(self):
+        self.started = []
+        self._cond = threading.Condition(threading.Lock())
+        self._released = set()
+
+    def task(self, id):
+        def run():
+            with self._cond:
+                self.started.append(id)
+                self._cond.notify_all()
+                while id not in self._released:
+                    self._cond.wait()
+        return run
+
+    def release(self, id):
+        with self._cond:
+            self._released.add(id)
+            self._cond.notify_all()
+
+    def wait_for(self, count):
+        deadline = utils.monotonic_time() + TIMEOUT
+        with self._cond:
+            while len(self.started) < count:
+                remaining = deadline - utils.monotonic_time()
+                if remaining <= 0:
+                    raise RuntimeError("Timeout waiting for %d tasks, "
+                                       "started: %s" % (count, self.started))
+                self._cond.wait(remaining)
+            return list(self.started)
+
+
+class TestTaskExecutor(VdsmTestCase):
+
+    def setUp(self):
+        self.scheduler = schedule.Scheduler(clock=utils.monotonic_time)
+        self.scheduler.start()
+        self.recorder = Recorder()
+        self.executor = None
+
+    def tearDown(self):
+        self.executor.stop(wait=False)
+        for id in self.recorder.started:
+            self.recorder.release(id)
+        self.scheduler.stop(wait=True)
+
+    def start(self, metadata=1, data=1, max_tasks=10, per_domain=0,
+              timeout=None):
+        self.executor = taskexecutor.TaskExecutor(
+            "test",
+            [(taskexecutor.METADATA, metadata, timeout),
+             (taskexecutor.DATA, data, None)],
+            max_tasks, per_domain, self.scheduler)
+        self.executor.start()
+
+    def dispatch(self, id, **kwargs):
+        self.executor.dispatch(id, self.recorder.task(id), **kwargs)
+
+    def test_lanes(self):
+        self.start()
+        self.dispatch("copy", lane=taskexecutor.DATA)
+        self.dispatch("create", lane=taskexecutor.METADATA)
+        # The metadata task does not wait for the data task.
+        self.assertEqual(sorted(self.recorder.wait_for(2)),
+                         ["copy", "create"])
+
+    def test_priority(self):
+        self.start()
+        self.dispatch("first")
+        self.recorder.wait_for(1)
+        self.dispatch("low-1", priority=0)
+        self.dispatch("high", priority=2)
+        self.dispatch("low-2", priority=0)
+        self.dispatch("medium", priority=1)
+        for i, id in enumerate(["first", "high", "medium", "low-1"]):
+            self.recorder.release(id)
+            self.recorder.wait_for(i + 2)
+        self.assertEqual(self.recorder.started,
+                         ["first", "high", "medium", "low-1", "low-2"])
+
+    def test_domain_limit(self):
+        self.start(data=3, per_domain=1)
+        self.dispatch("sd1-1", lane=taskexecutor.DATA, domain="sd1")
+        self.dispatch("sd1-2", lane=taskexecutor.DATA, domain="sd1")
+        self.dispatch("sd2-1", lane=taskexecutor.DATA, domain="sd2")
+        # sd1-2 must wait for sd1-1, but sd2-1 can run.
+        self.assertEqual(sorted(self.recorder.wait_for(2)),
+                         ["sd1-1", "sd2-1"])
+        self.recorder.release("sd1-1")
+        self.assertEqual(self.recorder.wait_for(3)[2], "sd1-2")
+
+    def test_blocked_task(self):
+        self.start(timeout=0.1)
+        self.dispatch("blocked")
+        self.recorder.wait_for(1)
+        # The blocked task does not prevent the next task from running.
+        self.dispatch("next")
+        self.assertEqual(self.recorder.wait_for(2), ["blocked", "next"])
+
+    def test_too_many_tasks(self):
+        self.start(max_tasks=1)
+        self.dispatch("running")
+        self.recorder.wait_for(1)
+        self.dispatch("queued")
+        with self.assertRaises(executor.TooManyTasks):
+            self.dispatch("rejected")
+
+    def test_not_running(self):
+        self.start()
+        self.executor.stop()
+        with self.assertRaises(executor.NotRunning):
+            self.dispatch("task")
+
+    def test_stats(self):
+        self.start()
+        self.dispatch("running", kind="copyImage")
+        self.recorder.wait_for(1)
+        self.dispatch("queued", kind="createVolume")
+        stats = self.executor.stats()
+        self.assertEqual(stats["lanes"], {
+            taskexecutor.METADATA: {"workers": 1, "running": 1, "queued": 1},
+            taskexecutor.DATA: {"workers": 1, "running": 0, "queued": 0},
+        })
+        self.assertEqual(stats["tasks"]["copyImage"]["waitTime"]["count"], 1)
+        self.recorder.release("running")
+        self.recorder.wait_for(2)
+        stats = self.executor.stats()
+        self.assertEqual(stats["tasks"]["copyImage"]["runTime"]["count"], 1)
+        self.assertEqual(stats["tasks"]["createVolume"]["waitTime"]["count"],
+                         1)
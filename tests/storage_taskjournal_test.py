@@ -0,0 +1,229 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+
+import io
+import os
+import time
+import uuid
+
+from monkeypatch import MonkeyPatch, MonkeyPatchScope
+from testlib import VdsmTestCase
+from testlib import namedTemporaryDir
+from testValidation import stresstest
+
+from vdsm import concurrent
+from vdsm.storage import outOfProcess as oop
+from vdsm.storage import task
+from vdsm.storage import taskjournal
+from vdsm.storage import taskManager
+
+
+def make_state(n):
+    return {"task": {"id": "task-%d" % n, "state": "running"},
+            "jobs": [], "recoveries": []}
+
+
+def read_lines(path):
+    with io.open(path, "rb") as f:
+        return f.readlines()
+
+
+class TestJournal(VdsmTestCase):
+
+    def test_missing(self):
+        with namedTemporaryDir() as tmpdir:
+            journal = taskjournal.Journal(os.path.join(tmpdir, "journal"))
+            self.assertEqual(journal.load(), {})
+
+    def test_write(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "journal")
+            journal = taskjournal.Journal(path)
+            journal.write("1", make_state(1))
+            journal.write("2", make_state(2))
+            journal.write("1", make_state(3))
+            states = taskjournal.Journal(path).load()
+        self.assertEqual(states, {"1": make_state(3), "2": make_state(2)})
+
+    def test_remove(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "journal")
+            journal = taskjournal.Journal(path)
+            journal.write("1", make_state(1))
+            journal.write("2", make_state(2))
+            journal.remove("1")
+            states = taskjournal.Journal(path).load()
+        self.assertEqual(states, {"2": make_state(2)})
+
+    def test_remove_missing(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "journal")
+            journal = taskjournal.Journal(path)
+            journal.remove("1")
+            self.assertFalse(os.path.exists(path))
+
+    def test_unchanged_state(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "journal")
+            journal = taskjournal.Journal(path)
+            journal.write("1", make_state(1))
+            journal.write("1", make_state(1))
+            self.assertEqual(len(read_lines(path)), 1)
+
+    def test_partial_record(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "journal")
+            taskjournal.Journal(path).write("1", make_state(1))
+            with io.open(path, "ab") as f:
+                f.write(b"0000000 {\"id\": ")
+            journal = taskjournal.Journal(path)
+            self.assertEqual(journal.load(), {"1": make_state(1)})
+            # The partial record is truncated by the next write.
+            journal.write("2", make_state(2))
+            states = taskjournal.Journal(path).load()
+        self.assertEqual(states, {"1": make_state(1), "2": make_state(2)})
+
+    def test_checksum_mismatch(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "journal")
+            journal = taskjournal.Journal(path)
+            journal.write("1", make_state(1))
+            journal.write("2", make_state(2))
+            lines = read_lines(path)
+            with io.open(path, "wb") as f:
+                f.write(lines[0])
+                f.write(lines[1].replace(b"task-2", b"task-3"))
+            states = taskjournal.Journal(path).load()
+        self.assertEqual(states, {"1": make_state(1)})
+
+    @MonkeyPatch(taskjournal, "COMPACT_MIN_RECORDS", 10)
+    def test_compaction(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "journal")
+            journal = taskjournal.Journal(path)
+            journal.write("1", make_state(1))
+            for i in range(20):
+                journal.write("2", make_state(i + 2))
+            self.assertLess(len(read_lines(path)), 11)
+            states = taskjournal.Journal(path).load()
+        self.assertEqual(states, {"1": make_state(1), "2": make_state(21)})
+
+    def test_concurrent_writes(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "journal")
+            journal = taskjournal.Journal(path)
+
+            def write(n):
+                for i in range(10):
+                    journal.write(str(n), make_state(i))
+
+            threads = [concurrent.thread(write, args=(n,)) for n in range(10)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            states = taskjournal.Journal(path).load()
+        self.assertEqual(states, {str(n): make_state(9) for n in range(10)})
+
+
+class TestTaskPersistence(VdsmTestCase):
+
+    def tearDown(self):
+        oop.stop()
+
+    def test_load(self):
+        with namedTemporaryDir() as store:
+            with MonkeyPatchScope([(task, "TASKS_JOURNAL", True)]):
+                t = self.make_task(store)
+                loaded = self.load_tasks(store)
+            self.assertEqual(os.listdir(store), [taskjournal.JOURNAL_NAME])
+        self.assertTaskEqual(loaded, t)
+
+    def test_clean(self):
+        with namedTemporaryDir() as store:
+            with MonkeyPatchScope([(task, "TASKS_JOURNAL", True)]):
+                t = self.make_task(store)
+                t._clean(store)
+                self.assertEqual(self.load_tasks(store), [])
+
+    def test_migrate_to_journal(self):
+        with namedTemporaryDir() as store:
+            with MonkeyPatchScope([(task, "TASKS_JOURNAL", False)]):
+                t = self.make_task(store)
+            with MonkeyPatchScope([(task, "TASKS_JOURNAL", True)]):
+                loaded = self.load_tasks(store)
+            self.assertEqual(os.listdir(store), [taskjournal.JOURNAL_NAME])
+            self.assertEqual(list(taskjournal.get(store).load()), [t.id])
+        self.assertTaskEqual(loaded, t)
+
+    def test_migrate_from_journal(self):
+        with namedTemporaryDir() as store:
+            with MonkeyPatchScope([(task, "TASKS_JOURNAL", True)]):
+                t = self.make_task(store)
+            with MonkeyPatchScope([(task, "TASKS_JOURNAL", False)]):
+                loaded = self.load_tasks(store)
+            self.assertEqual(taskjournal.get(store).load(), {})
+            self.assertIn(t.id, os.listdir(store))
+        self.assertTaskEqual(loaded, t)
+
+    @stresstest
+    @MonkeyPatch(task, "TASKS_JOURNAL", True)
+    def test_recovery_time(self):
+        count = 10000
+        with namedTemporaryDir() as store:
+            state = self.make_task(store)._dumpState()
+            with io.open(os.path.join(store, taskjournal.JOURNAL_NAME),
+                         "wb") as f:
+                for i in range(count):
+                    task_id = str(uuid.uuid4())
+                    state["task"]["id"] = task_id
+                    f.write(taskjournal._encode(task_id, state))
+            start = time.time()
+            loaded = self.load_tasks(store)
+            elapsed = time.time() - start
+        self.assertEqual(len(loaded), count)
+        print("%d tasks recovered in %.2f seconds" % (count, elapsed))
+
+    def make_task(self, store):
+        t = task.Task(str(uuid.uuid4()), name="test", tag="spm")
+        t.setPersistence(store, cleanPolicy=task.TaskCleanType.manual)
+        t._updateState(task.State.preparing)
+        t.pushRecovery(task.Recovery("rollback", "sd", "StorageDomain",
+                                     "rollback", ["a", "b"]))
+        return t
+
+    def load_tasks(self, store):
+        tm = taskManager.TaskManager(tpSize=1, maxTasks=1)
+        try:
+            tm.loadDumpedTasks(store)
+        finally:
+            tm.prepareForShutdown()
+        return tm._unqueuedTasks
+
+    def assertTaskEqual(self, loaded, t):
+        self.assertEqual(len(loaded), 1)
+        self.assertEqual(loaded[0].id, t.id)
+        self.assertEqual(loaded[0].tag, t.tag)
+        self.assertEqual(str(loaded[0].state), str(t.state))
+        self.assertEqual(str(loaded[0].cleanPolicy), str(t.cleanPolicy))
+        self.assertEqual([str(r) for r in loaded[0].recoveries],
+                         [str(r) for r in t.recoveries])
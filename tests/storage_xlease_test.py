@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -21,6 +21,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import errno
 import io
 import os
 import time
@@ -32,6 +33,7 @@ from fakesanlock import FakeSanlock
 from monkeypatch import MonkeyPatch
 from testValidation import slowtest
 from testlib import VdsmTestCase
+from testlib import expandPermutations, permutations
 from testlib import make_uuid
 from testlib import namedTemporaryDir
 
@@ -58,6 +60,33 @@ class FailingWriter(xlease.DirectFile):
         raise WriteError
 
 
+class CountingWriter(xlease.DirectFile):
+    def __init__(self, path):
+        super(CountingWriter, self).__init__(path)
+        self.writes = 0
+
+    def write(self, buf):
+        self.writes += 1
+        return super(CountingWriter, self).write(buf)
+
+
+class PartialSanlock(FakeSanlock):
+    """
+    Fake sanlock failing to write resources after count successful writes.
+    """
+
+    def __init__(self, count):
+        super(PartialSanlock, self).__init__()
+        self.count = count
+
+    def write_resource(self, *args, **kwargs):
+        if self.count == 0:
+            raise self.SanlockException(errno.EIO, "Sanlock failure")
+        self.count -= 1
+        return super(PartialSanlock, self).write_resource(*args, **kwargs)
+
+
+@expandPermutations
 class TestIndex(VdsmTestCase):
 
     @MonkeyPatch(time, 'time', lambda: 123456789)
@@ -276,6 +305,145 @@ class TestIndex(VdsmTestCase):
             self.assertEqual(res["lockspace"], vol.lockspace)
             self.assertEqual(res["resource"], lease_id)
 
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_many(self):
+        with make_volume() as vol:
+            # Spans 3 index blocks.
+            lease_ids = [make_uuid() for i in range(20)]
+            infos = vol.add_many(lease_ids)
+            self.assertEqual(infos, [vol.lookup(lease_id)
+                                     for lease_id in lease_ids])
+            leases = vol.leases()
+            sanlock = xlease.sanlock
+            for i, lease_id in enumerate(lease_ids):
+                offset = xlease.USER_RESOURCE_BASE + xlease.SLOT_SIZE * i
+                self.assertEqual(leases[lease_id],
+                                 {"offset": offset, "updating": False})
+                res = sanlock.read_resource(vol.path, offset)
+                self.assertEqual(res["lockspace"], vol.lockspace)
+                self.assertEqual(res["resource"], lease_id)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_many_writes_blocks_once(self):
+        with make_volume() as base:
+            file = CountingWriter(base.path)
+            with utils.closing(file):
+                vol = xlease.LeasesVolume(file)
+                with utils.closing(vol):
+                    vol.add_many([make_uuid() for i in range(20)])
+                    # 3 blocks marked updating, then 3 blocks completed.
+                    self.assertEqual(file.writes, 6)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_many_exists(self):
+        with make_volume() as vol:
+            lease_ids = [make_uuid() for i in range(3)]
+            vol.add(lease_ids[1])
+            with self.assertRaises(xlease.LeaseExists):
+                vol.add_many(lease_ids)
+            self.assertEqual(list(vol.leases()), [lease_ids[1]])
+
+    def test_add_many_updating(self):
+        record = xlease.Record(make_uuid(), 0, updating=True)
+        with make_volume((42, record)) as vol:
+            with self.assertRaises(xlease.LeaseUpdating):
+                vol.add_many([make_uuid(), record.resource])
+            self.assertEqual(list(vol.leases()), [record.resource])
+
+    def test_add_many_duplicate(self):
+        with make_volume() as vol:
+            lease_id = make_uuid()
+            with self.assertRaises(xlease.LeaseExists):
+                vol.add_many([lease_id, lease_id])
+            self.assertEqual(vol.leases(), {})
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_many_no_space(self):
+        with make_leases() as path:
+            lockspace = os.path.basename(os.path.dirname(path))
+            file = xlease.DirectFile(path)
+            with utils.closing(file):
+                xlease.format_index(lockspace, file)
+            fill_records(path, xlease.MAX_RECORDS - 1)
+            with open_volume(path) as vol:
+                with self.assertRaises(xlease.NoSpace):
+                    vol.add_many([make_uuid(), make_uuid()])
+                self.assertEqual(len(vol.leases()), xlease.MAX_RECORDS - 1)
+
+    def test_add_many_write_failure(self):
+        with make_volume() as base:
+            file = FailingWriter(base.path)
+            with utils.closing(file):
+                vol = xlease.LeasesVolume(file)
+                with utils.closing(vol):
+                    with self.assertRaises(WriteError):
+                        vol.add_many([make_uuid(), make_uuid()])
+                    self.assertEqual(vol.leases(), {})
+
+    @MonkeyPatch(xlease, "sanlock", PartialSanlock(2))
+    def test_add_many_sanlock_failure(self):
+        with make_volume() as vol:
+            lease_ids = [make_uuid() for i in range(4)]
+            sanlock = xlease.sanlock
+            with self.assertRaises(sanlock.SanlockException):
+                vol.add_many(lease_ids)
+            leases = vol.leases()
+            # Leases created before the failure were completed
+            for lease_id in lease_ids[:2]:
+                self.assertFalse(leases[lease_id]["updating"])
+                res = sanlock.read_resource(vol.path,
+                                            leases[lease_id]["offset"])
+                self.assertEqual(res["resource"], lease_id)
+            # The rest are left updating
+            for lease_id in lease_ids[2:]:
+                self.assertTrue(leases[lease_id]["updating"])
+            # The volume reloaded from storage must agree
+            with open_volume(vol.path) as reloaded:
+                self.assertEqual(reloaded.leases(), leases)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_remove_many(self):
+        with make_volume() as vol:
+            lease_ids = [make_uuid() for i in range(20)]
+            infos = vol.add_many(lease_ids)
+            vol.remove_many(lease_ids[::2])
+            self.assertEqual(sorted(vol.leases()), sorted(lease_ids[1::2]))
+            sanlock = xlease.sanlock
+            for info in infos[::2]:
+                res = sanlock.read_resource(info.path, info.offset)
+                self.assertEqual(res["lockspace"], "")
+                self.assertEqual(res["resource"], "")
+            # Removed slots are reused
+            lease_id = make_uuid()
+            info = vol.add(lease_id)
+            self.assertEqual(info.offset, xlease.USER_RESOURCE_BASE)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_remove_many_missing(self):
+        with make_volume() as vol:
+            lease_id = make_uuid()
+            vol.add(lease_id)
+            with self.assertRaises(xlease.NoSuchLease):
+                vol.remove_many([lease_id, make_uuid()])
+            self.assertIn(lease_id, vol.leases())
+
+    @MonkeyPatch(xlease, "sanlock", PartialSanlock(5))
+    def test_remove_many_sanlock_failure(self):
+        with make_volume() as vol:
+            lease_ids = [make_uuid() for i in range(4)]
+            # Uses 4 of 5 successful writes
+            vol.add_many(lease_ids)
+            sanlock = xlease.sanlock
+            with self.assertRaises(sanlock.SanlockException):
+                vol.remove_many(lease_ids)
+            leases = vol.leases()
+            # One lease was removed, the rest are left updating
+            self.assertEqual(len(leases), 3)
+            for lease in leases.values():
+                self.assertTrue(lease["updating"])
+            with open_volume(vol.path) as reloaded:
+                self.assertEqual(reloaded.leases(), leases)
+
     @MonkeyPatch(xlease, "sanlock", FakeSanlock())
     def test_add_first_free_slot(self):
         with make_volume() as vol:
@@ -296,8 +464,71 @@ class TestIndex(VdsmTestCase):
             self.assertEqual(leases[uuids[2]]["offset"],
                              xlease.USER_RESOURCE_BASE + xlease.SLOT_SIZE * 2)
 
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_lookup_after_external_add(self):
+        with make_volume() as vol:
+            lease_id = make_uuid()
+            # Simulate another host adding a lease.
+            offset = xlease.lease_offset(3)
+            file = xlease.DirectFile(vol.path)
+            with utils.closing(file):
+                write_records([(3, xlease.Record(lease_id, offset))], file)
+            with open_volume(vol.path) as vol2:
+                lease = vol2.lookup(lease_id)
+                self.assertEqual(lease.offset, offset)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_lookup_after_external_remove(self):
+        with make_volume() as vol:
+            lease_id = make_uuid()
+            lease = vol.add(lease_id)
+            recnum = (lease.offset - xlease.USER_RESOURCE_BASE) // \
+                xlease.SLOT_SIZE
+            # Simulate another host removing the lease.
+            file = xlease.DirectFile(vol.path)
+            with utils.closing(file):
+                write_records([(recnum, xlease.EMPTY_RECORD)], file)
+            with open_volume(vol.path) as vol2:
+                with self.assertRaises(xlease.NoSuchLease):
+                    vol2.lookup(lease_id)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_remove_reopen(self):
+        with make_volume() as vol:
+            uuids = [make_uuid() for i in range(3)]
+            for uuid in uuids:
+                vol.add(uuid)
+            vol.remove(uuids[1])
+            with open_volume(vol.path) as vol2:
+                self.assertEqual(vol2.leases(), vol.leases())
+                with self.assertRaises(xlease.NoSuchLease):
+                    vol2.lookup(uuids[1])
+                lease = vol2.lookup(uuids[2])
+                self.assertEqual(lease.offset,
+                                 xlease.USER_RESOURCE_BASE +
+                                 xlease.SLOT_SIZE * 2)
+
+    def test_lookup_duplicate_record(self):
+        lease_id = make_uuid()
+        records = (
+            (1, xlease.Record(lease_id, xlease.lease_offset(1))),
+            (9, xlease.Record(lease_id, xlease.lease_offset(9))),
+        )
+        with make_volume(*records) as vol:
+            lease = vol.lookup(lease_id)
+            self.assertEqual(lease.offset, xlease.lease_offset(1))
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_full(self):
+        with make_volume() as vol:
+            fill_records(vol.path, xlease.MAX_RECORDS)
+            with open_volume(vol.path) as vol2:
+                with self.assertRaises(xlease.NoSpace):
+                    vol2.add(make_uuid())
+
     @slowtest
-    def test_time_lookup(self):
+    @permutations([[0], [2000], [3900]])
+    def test_time_lookup(self, leases):
         setup = """
 import os
 from testlib import make_uuid
@@ -319,15 +550,18 @@ def bench():
                 pass
 """
         with make_volume() as vol:
+            fill_records(vol.path, leases)
             count = 100
             elapsed = timeit.timeit("bench()", setup=setup % vol.path,
                                     number=count)
-            print("%d lookups in %.6f seconds (%.6f seconds per lookup)"
-                  % (count, elapsed, elapsed / count))
+            print("%d leases: %d lookups in %.6f seconds "
+                  "(%.6f seconds per lookup)"
+                  % (leases, count, elapsed, elapsed / count))
 
     @slowtest
+    @permutations([[0], [2000], [3900]])
     @MonkeyPatch(xlease, "sanlock", FakeSanlock())
-    def test_time_add(self):
+    def test_time_add(self, leases):
         setup = """
 import os
 from testlib import make_uuid
@@ -346,13 +580,48 @@ def bench():
             vol.add(lease_id)
 """
         with make_volume() as vol:
+            fill_records(vol.path, leases)
             count = 100
             elapsed = timeit.timeit("bench()", setup=setup % vol.path,
                                     number=count)
             # Note: this does not include the time to create the real sanlock
             # resource.
-            print("%d adds in %.6f seconds (%.6f seconds per add)"
-                  % (count, elapsed, elapsed / count))
+            print("%d leases: %d adds in %.6f seconds "
+                  "(%.6f seconds per add)"
+                  % (leases, count, elapsed, elapsed / count))
+
+    @slowtest
+    @permutations([[100], [2000], [3900]])
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_time_remove(self, leases):
+        setup = """
+import os
+from vdsm import utils
+from vdsm.storage import xlease
+
+path = "%s"
+lockspace = os.path.basename(os.path.dirname(path))
+lease_ids = iter(%r)
+
+def bench():
+    lease_id = next(lease_ids)
+    file = xlease.DirectFile(path)
+    with utils.closing(file):
+        vol = xlease.LeasesVolume(file)
+        with utils.closing(vol, log="test"):
+            vol.remove(lease_id)
+"""
+        with make_volume() as vol:
+            lease_ids = fill_records(vol.path, leases)
+            count = 100
+            elapsed = timeit.timeit(
+                "bench()", setup=setup % (vol.path, lease_ids[-count:]),
+                number=count)
+            # Note: this does not include the time to clear the real sanlock
+            # resource.
+            print("%d leases: %d removes in %.6f seconds "
+                  "(%.6f seconds per remove)"
+                  % (leases, count, elapsed, elapsed / count))
 
 
 class TestDirectFile(VdsmTestCase):
@@ -389,6 +658,33 @@ def make_leases():
         yield path
 
 
+@contextmanager
+def open_volume(path):
+    file = xlease.DirectFile(path)
+    with utils.closing(file):
+        vol = xlease.LeasesVolume(file)
+        with utils.closing(vol):
+            yield vol
+
+
+def fill_records(path, count):
+    """
+    Add count lease records to the index, writing the index once. Returns the
+    lease ids.
+    """
+    lease_ids = [make_uuid() for i in range(count)]
+    file = xlease.DirectFile(path)
+    with utils.closing(file):
+        index = xlease.VolumeIndex()
+        with utils.closing(index):
+            index.load(file)
+            for recnum, lease_id in enumerate(lease_ids):
+                record = xlease.Record(lease_id, xlease.lease_offset(recnum))
+                index.write_record(recnum, record)
+            index.dump(file)
+    return lease_ids
+
+
 def write_records(records, file):
     index = xlease.VolumeIndex()
     with utils.closing(index):
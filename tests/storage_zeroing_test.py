@@ -0,0 +1,129 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+
+import threading
+
+from monkeypatch import MonkeyPatch, MonkeyPatchScope
+from testlib import VdsmTestCase
+
+from vdsm import cmdutils
+from vdsm import concurrent
+from vdsm.common import exception
+from vdsm.storage import blkdiscard
+from vdsm.storage import misc
+from vdsm.storage import zeroing
+
+GIB = 1024**3
+
+
+class FakeDevice(object):
+    """
+    Record zeroing commands, failing blkdiscard if unsupported is True.
+    """
+
+    def __init__(self, unsupported=False):
+        self.unsupported = unsupported
+        self.calls = []
+
+    def blkdiscard(self, path, zeroout=False, stop=None):
+        if stop is not None and stop():
+            raise exception.ActionStopped()
+        if self.unsupported:
+            raise cmdutils.Error(["blkdiscard"], 1, "", "not supported")
+        self.calls.append(("zeroout" if zeroout else "discard", path))
+
+    def dd(self, src, dst, stop, size):
+        self.calls.append(("dd", dst, size))
+
+    def patch(self):
+        return MonkeyPatchScope([
+            (blkdiscard, "blkdiscard", self.blkdiscard),
+            (misc, "ddWatchCopy", self.dd),
+        ])
+
+
+def not_aborting():
+    return False
+
+
+class TestZero(VdsmTestCase):
+
+    def test_zeroout(self):
+        dev = FakeDevice()
+        with dev.patch():
+            method = zeroing.zero("/dev/vg/lv", 2 * GIB + 4096, not_aborting)
+        self.assertEqual(method, zeroing.ZEROOUT)
+        self.assertEqual(dev.calls, [("zeroout", "/dev/vg/lv")])
+
+    def test_fallback_to_dd(self):
+        dev = FakeDevice(unsupported=True)
+        with dev.patch():
+            method = zeroing.zero("/dev/vg/lv", GIB, not_aborting)
+        self.assertEqual(method, zeroing.DD)
+        self.assertEqual(dev.calls, [("dd", "/dev/vg/lv", GIB)])
+
+    def test_abort(self):
+        dev = FakeDevice()
+        with dev.patch():
+            with self.assertRaises(exception.ActionStopped):
+                zeroing.zero("/dev/vg/lv", GIB, lambda: True)
+        self.assertEqual(dev.calls, [])
+
+
+class TestSlot(VdsmTestCase):
+
+    @MonkeyPatch(zeroing, "MAX_ZEROING_PER_VG", 2)
+    def test_limit(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+        release = threading.Event()
+
+        def run():
+            with zeroing.slot("vg", not_aborting):
+                with lock:
+                    running[0] += 1
+                    max_running[0] = max(max_running[0], running[0])
+                release.wait(0.1)
+                with lock:
+                    running[0] -= 1
+
+        threads = [concurrent.thread(run) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(max_running[0], 2)
+
+    @MonkeyPatch(zeroing, "MAX_ZEROING_PER_VG", 1)
+    def test_other_vg_not_limited(self):
+        with zeroing.slot("vg1", not_aborting):
+            with zeroing.slot("vg2", not_aborting):
+                pass
+
+    @MonkeyPatch(zeroing, "MAX_ZEROING_PER_VG", 1)
+    @MonkeyPatch(zeroing, "ABORT_CHECK_INTERVAL", 0.01)
+    def test_abort_while_waiting(self):
+        with zeroing.slot("vg", not_aborting):
+            with self.assertRaises(exception.ActionStopped):
+                with zeroing.slot("vg", lambda: True):
+                    pass
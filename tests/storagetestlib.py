@@ -103,6 +103,7 @@ def fake_block_env(obj=None, sd_version=3):
             (volume_artifacts, 'lvm', lvm),
             (sd, 'storage_repository', tmpdir),
             (volume, 'sdCache', fake_sdc),
+            (blockVolume, 'sdCache', fake_sdc),
             (hsm, 'sdCache', fake_sdc),
         ]):
             sd_manifest = make_blocksd_manifest(tmpdir, lvm,
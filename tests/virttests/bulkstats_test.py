@@ -0,0 +1,119 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+from vdsm.virt import bulkstats
+
+from testlib import VdsmTestCase
+
+
+def make_stats(rd_bytes=0, name="vda", path="/path/to/vda"):
+    return {
+        "state.state": 1,
+        "cpu.time": 1000,
+        "block.count": 2,
+        "block.0.name": "hdc",
+        "block.0.rd.bytes": 0,
+        "block.1.name": name,
+        "block.1.path": path,
+        "block.1.rd.bytes": rd_bytes,
+        "net.count": 1,
+        "net.0.name": "vnet0",
+        "net.0.rx.bytes": 42,
+    }
+
+
+class TestSample(VdsmTestCase):
+
+    def test_mapping(self):
+        stats = make_stats()
+        sample = bulkstats.sample(stats)
+        self.assertEqual(dict(sample), stats)
+        self.assertEqual(len(sample), len(stats))
+        self.assertEqual(sample["block.1.path"], "/path/to/vda")
+        self.assertEqual(sample["block.1.rd.bytes"], 0)
+        self.assertIn("net.0.rx.bytes", sample)
+        self.assertNotIn("net.1.rx.bytes", sample)
+        self.assertIsNone(sample.get("net.1.rx.bytes"))
+        with self.assertRaises(KeyError):
+            sample["net.1.rx.bytes"]
+
+    def test_devices(self):
+        sample = bulkstats.sample(make_stats())
+        self.assertEqual(sample.devices("block"), {"hdc": 0, "vda": 1})
+        self.assertEqual(sample.devices("net"), {"vnet0": 0})
+
+    def test_devices_missing_name(self):
+        stats = make_stats()
+        del stats["block.0.name"]
+        sample = bulkstats.sample(stats)
+        self.assertEqual(sample.devices("block"), {"vda": 1})
+
+    def test_same_layout(self):
+        first = bulkstats.sample(make_stats(rd_bytes=1024))
+        last = bulkstats.sample(make_stats(rd_bytes=4096), first)
+        self.assertIs(last.layout, first.layout)
+        self.assertEqual(last.difference(first, "block.1.rd.bytes"), 3072)
+
+    def test_devices_changed(self):
+        first = bulkstats.sample(make_stats())
+        last = bulkstats.sample(make_stats(name="vdb"), first)
+        self.assertIsNot(last.layout, first.layout)
+        self.assertEqual(last.devices("block"), {"hdc": 0, "vdb": 1})
+
+    def test_path_changed(self):
+        first = bulkstats.sample(make_stats())
+        last = bulkstats.sample(make_stats(path="/path/to/top"), first)
+        self.assertIsNot(last.layout, first.layout)
+        self.assertEqual(last["block.1.path"], "/path/to/top")
+
+    def test_keys_changed(self):
+        first = bulkstats.sample(make_stats())
+        stats = make_stats()
+        stats["block.1.wr.bytes"] = 0
+        last = bulkstats.sample(stats, first)
+        self.assertIsNot(last.layout, first.layout)
+        self.assertEqual(dict(last), stats)
+
+    def test_difference_other_base(self):
+        first = bulkstats.sample(make_stats(rd_bytes=1024))
+        middle = bulkstats.sample(make_stats(rd_bytes=2048), first)
+        last = bulkstats.sample(make_stats(rd_bytes=4096), middle)
+        self.assertEqual(last.difference(first, "block.1.rd.bytes"), 3072)
+
+    def test_difference_history(self):
+        first = bulkstats.sample(make_stats(rd_bytes=1024))
+        middle = bulkstats.sample(make_stats(rd_bytes=2048), first)
+        bulkstats.sample(make_stats(rd_bytes=4096), middle)
+        # Adding a sample drops the reference to the older sample.
+        self.assertIsNone(middle._delta)
+        self.assertEqual(middle.difference(first, "block.1.rd.bytes"), 1024)
+
+    def test_difference_missing(self):
+        first = bulkstats.sample(make_stats())
+        last = bulkstats.sample(make_stats(), first)
+        with self.assertRaises(KeyError):
+            last.difference(first, "block.1.wr.bytes")
+
+    def test_float_values(self):
+        stats = make_stats()
+        stats["cpu.time"] = 1.5
+        sample = bulkstats.sample(stats)
+        self.assertEqual(sample["cpu.time"], 1.5)
@@ -0,0 +1,183 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+import logging
+
+import libvirt
+
+from vdsm.virt import drivemonitor
+from vdsm.virt.drivemonitor import BLOCK_THRESHOLD
+
+from monkeypatch import MonkeyPatchScope
+from testlib import VdsmTestCase
+
+GB = 1024**3
+WATERMARK_LIMIT = 512 * 1024**2
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class FakeDrive(object):
+
+    def __init__(self, name, chunked=True, replicating=False):
+        self.name = name
+        self.chunked = chunked
+        self.watermarkLimit = WATERMARK_LIMIT
+        self._replicating = replicating
+
+    def isDiskReplicationInProgress(self):
+        return self._replicating
+
+
+class FakeDomain(object):
+
+    def __init__(self):
+        self.thresholds = {}
+        self.error = None
+
+    def setBlockThreshold(self, dev, threshold, flags=0):
+        if self.error:
+            raise self.error
+        self.thresholds[dev] = threshold
+
+
+class FakeVM(object):
+
+    def __init__(self, drives):
+        self._drives = drives
+        self._dom = FakeDomain()
+
+    def getChunkedDrives(self):
+        return [d for d in self._drives if d.chunked]
+
+
+class TestDriveMonitor(VdsmTestCase):
+
+    def setUp(self):
+        self.vda = FakeDrive("vda")
+        self.vdb = FakeDrive("vdb")
+        self.vm = FakeVM([self.vda, self.vdb])
+        self.clock = FakeClock()
+        self.monitor = drivemonitor.DriveMonitor(
+            self.vm, logging.getLogger("test"), enabled=True,
+            safety_interval=60, clock=self.clock)
+
+    def poll(self):
+        drives = self.monitor.monitored_drives()
+        self.monitor.polled(drives)
+        return drives
+
+    def test_poll_all_without_events(self):
+        monitor = drivemonitor.DriveMonitor(
+            self.vm, logging.getLogger("test"), enabled=False,
+            safety_interval=60, clock=self.clock)
+        monitor.set_threshold(self.vda, GB)
+        self.assertEqual(monitor.monitored_drives(), [self.vda, self.vdb])
+        self.assertEqual(self.vm._dom.thresholds, {})
+
+    def test_set_threshold(self):
+        self.monitor.set_threshold(self.vda, GB)
+        self.assertEqual(self.vm._dom.thresholds,
+                         {"vda": GB - WATERMARK_LIMIT})
+        self.assertEqual(self.vda.threshold_state, BLOCK_THRESHOLD.SET)
+
+    def test_set_threshold_error(self):
+        self.vm._dom.error = libvirt.libvirtError("error")
+        self.monitor.set_threshold(self.vda, GB)
+        self.assertEqual(self.vda.threshold_state, BLOCK_THRESHOLD.UNSET)
+
+    def test_set_threshold_replicating(self):
+        drive = FakeDrive("vdc", replicating=True)
+        self.monitor.set_threshold(drive, GB)
+        self.assertEqual(self.vm._dom.thresholds, {})
+
+    def test_poll_drives_without_threshold(self):
+        self.assertEqual(self.poll(), [self.vda, self.vdb])
+        self.monitor.set_threshold(self.vda, GB)
+        self.assertEqual(self.poll(), [self.vdb])
+        self.monitor.set_threshold(self.vdb, GB)
+        self.assertEqual(self.poll(), [])
+
+    def test_safety_poll(self):
+        self.poll()
+        self.monitor.set_threshold(self.vda, GB)
+        self.monitor.set_threshold(self.vdb, GB)
+        self.clock.time = 59
+        self.assertEqual(self.poll(), [])
+        self.clock.time = 60
+        self.assertEqual(self.poll(), [self.vda, self.vdb])
+        self.assertEqual(self.poll(), [])
+
+    def test_block_threshold_event(self):
+        self.poll()
+        self.monitor.set_threshold(self.vda, GB)
+        self.monitor.set_threshold(self.vdb, GB)
+        drive = self.monitor.on_block_threshold(
+            "vda", "/path", GB - WATERMARK_LIMIT, 4096)
+        self.assertIs(drive, self.vda)
+        self.assertEqual(self.vda.threshold_state, BLOCK_THRESHOLD.EXCEEDED)
+        self.assertEqual(self.poll(), [self.vda])
+
+    def test_block_threshold_event_backing_volume(self):
+        self.monitor.set_threshold(self.vda, GB)
+        drive = self.monitor.on_block_threshold(
+            "vda[1]", "/path", GB - WATERMARK_LIMIT, 4096)
+        self.assertIsNone(drive)
+        self.assertEqual(self.vda.threshold_state, BLOCK_THRESHOLD.SET)
+
+    def test_block_threshold_event_unknown_drive(self):
+        drive = self.monitor.on_block_threshold(
+            "sda", "/path", GB - WATERMARK_LIMIT, 4096)
+        self.assertIsNone(drive)
+
+    def test_clear_thresholds(self):
+        self.monitor.set_threshold(self.vda, GB)
+        self.monitor.clear_thresholds()
+        self.assertEqual(self.vda.threshold_state, BLOCK_THRESHOLD.UNSET)
+
+    def test_extension_latency(self):
+        latency = {drivemonitor.EVENT: drivemonitor.Histogram(),
+                   drivemonitor.POLL: drivemonitor.Histogram()}
+        with MonkeyPatchScope([(drivemonitor, "_latency", latency)]):
+            self.monitor.on_block_threshold(
+                "vda", "/path", GB - WATERMARK_LIMIT, 4096)
+            self.clock.time = 1
+            # Polling the drive keeps the event time.
+            self.monitor.extension_requested(self.vda)
+            self.clock.time = 3
+            self.monitor.extension_completed(self.vda)
+
+            self.monitor.extension_requested(self.vdb)
+            self.clock.time = 4
+            self.monitor.extension_completed(self.vdb)
+
+            stats = drivemonitor.stats()["extensionLatency"]
+        self.assertEqual(stats["event"]["count"], 1)
+        self.assertEqual(stats["event"]["max"], 3)
+        self.assertEqual(stats["poll"]["count"], 1)
+        self.assertEqual(stats["poll"]["max"], 1)
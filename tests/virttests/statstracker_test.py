@@ -0,0 +1,148 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+
+from vdsm.virt import statstracker
+from yajsonrpc import EncodedDict, JsonFragment
+
+from testlib import VdsmTestCase
+
+
+def make_stats(vm_id, cpu_user="0.00", status_time=1000):
+    return {
+        "vmId": vm_id,
+        "status": "Up",
+        "statusTime": status_time,
+        "elapsedTime": str(status_time // 1000),
+        "cpuUser": cpu_user,
+        "network": {
+            "vnet0": {"name": "vnet0", "rx": "0", "sampleTime": status_time},
+        },
+    }
+
+
+class TestStatsTracker(VdsmTestCase):
+
+    def setUp(self):
+        self.tracker = statstracker.StatsTracker()
+
+    def test_first_request(self):
+        stats = [make_stats("a"), make_stats("b")]
+        res = self.tracker.changes(stats)
+        self.assertTrue(res["full"])
+        self.assertEqual(res["changed"], stats)
+        self.assertEqual(res["removed"], [])
+
+    def test_unchanged(self):
+        cursor = self.tracker.changes([make_stats("a")])["cursor"]
+        res = self.tracker.changes([make_stats("a", status_time=2000)],
+                                   cursor)
+        self.assertFalse(res["full"])
+        self.assertEqual(res["changed"], [])
+        self.assertEqual(res["removed"], [])
+        self.assertEqual(res["cursor"], cursor)
+
+    def test_unchanged_keys_order(self):
+        stats = make_stats("a")
+        cursor = self.tracker.changes([stats])["cursor"]
+        reordered = dict(reversed(list(stats.items())))
+        res = self.tracker.changes([reordered], cursor)
+        self.assertEqual(res["changed"], [])
+
+    def test_changed(self):
+        cursor = self.tracker.changes(
+            [make_stats("a"), make_stats("b")])["cursor"]
+        b = make_stats("b", cpu_user="1.50")
+        res = self.tracker.changes([make_stats("a"), b], cursor)
+        self.assertFalse(res["full"])
+        self.assertEqual(res["changed"], [b])
+        self.assertNotEqual(res["cursor"], cursor)
+
+    def test_added(self):
+        cursor = self.tracker.changes([make_stats("a")])["cursor"]
+        b = make_stats("b")
+        res = self.tracker.changes([make_stats("a"), b], cursor)
+        self.assertEqual(res["changed"], [b])
+
+    def test_removed(self):
+        cursor = self.tracker.changes(
+            [make_stats("a"), make_stats("b")])["cursor"]
+        res = self.tracker.changes([make_stats("a")], cursor)
+        self.assertEqual(res["changed"], [])
+        self.assertEqual(res["removed"], ["b"])
+
+    def test_changes_since_older_cursor(self):
+        cursor = self.tracker.changes(
+            [make_stats("a"), make_stats("b")])["cursor"]
+        a = make_stats("a", cpu_user="1.50")
+        self.tracker.changes([a, make_stats("b")], cursor)
+        res = self.tracker.changes([a], cursor)
+        self.assertEqual(res["changed"], [a])
+        self.assertEqual(res["removed"], ["b"])
+
+    def test_removed_and_added_again(self):
+        cursor = self.tracker.changes(
+            [make_stats("a"), make_stats("b")])["cursor"]
+        self.tracker.changes([make_stats("a")], cursor)
+        b = make_stats("b")
+        res = self.tracker.changes([make_stats("a"), b], cursor)
+        self.assertEqual(res["changed"], [b])
+        self.assertEqual(res["removed"], [])
+
+    def test_removed_horizon(self):
+        tracker = statstracker.StatsTracker(max_removed=1)
+        cursor = tracker.changes(
+            [make_stats("a"), make_stats("b"), make_stats("c")])["cursor"]
+        tracker.changes([make_stats("a"), make_stats("c")])
+        a = make_stats("a")
+        res = tracker.changes([a], cursor)
+        # The removal of "b" was forgotten.
+        self.assertTrue(res["full"])
+        self.assertEqual(res["changed"], [a])
+
+    def test_invalid_cursor(self):
+        stats = [make_stats("a")]
+        self.tracker.changes(stats)
+        other = statstracker.StatsTracker()
+        cursor = other.changes(stats)["cursor"]
+        for cursor in (cursor, "invalid", "invalid:x"):
+            res = self.tracker.changes(stats, cursor)
+            self.assertTrue(res["full"])
+            self.assertEqual(res["changed"], stats)
+
+    def test_encoded_stats(self):
+        fragment = JsonFragment({"vmName": "a", "guestIPs": "10.0.0.1"})
+        cursor = self.tracker.changes(
+            [EncodedDict(fragment, make_stats("a"))])["cursor"]
+
+        res = self.tracker.changes(
+            [EncodedDict(fragment, make_stats("a", status_time=2000))],
+            cursor)
+        self.assertEqual(res["changed"], [])
+
+        a = EncodedDict(fragment, make_stats("a", cpu_user="1.50"))
+        res = self.tracker.changes([a], cursor)
+        self.assertEqual(res["changed"], [a])
+
+        cursor = res["cursor"]
+        fragment = JsonFragment({"vmName": "a", "guestIPs": "10.0.0.2"})
+        a = EncodedDict(fragment, make_stats("a", cpu_user="1.50"))
+        res = self.tracker.changes([a], cursor)
+        self.assertEqual(res["changed"], [a])
@@ -1,5 +1,5 @@
 #
-# Copyright 2015 Red Hat, Inc.
+# Copyright 2015-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -24,6 +24,7 @@ import uuid
 
 import six
 
+from vdsm.virt import bulkstats
 from vdsm.virt import vmstats
 
 from testlib import VdsmTestCase as TestCaseBase
@@ -536,6 +537,88 @@ class CpuStatsTests(VmStatsTestCase):
         self.assertNotEquals(res, None)
 
 
+class ColumnarSampleTests(VmStatsTestCase):
+
+    def setUp(self):
+        super(ColumnarSampleTests, self).setUp()
+        self.first = copy.deepcopy(self.bulk_stats)
+        self.last = copy.deepcopy(self.bulk_stats)
+        for key, delta in (('cpu.time', 10 ** 9),
+                           ('cpu.user', 10 ** 8),
+                           ('block.0.rd.reqs', 1024),
+                           ('block.0.rd.bytes', 128 * 1024),
+                           ('block.0.rd.times', 10 ** 6),
+                           ('block.1.wr.reqs', 2048),
+                           ('block.1.wr.bytes', 256 * 1024),
+                           ('block.1.wr.times', 10 ** 7)):
+            self.last[key] += delta
+        first_sample = bulkstats.sample(self.first)
+        last_sample = bulkstats.sample(self.last, first_sample)
+        self.samples = (first_sample, last_sample)
+
+    def test_disks(self):
+        drives = (FakeDrive(name='hdc', size=700 * 1024 * 1024),
+                  FakeDrive(name='vda', size=10 * 1024 * 1024 * 1024))
+        testvm = FakeVM(drives=drives)
+        expected = {}
+        vmstats.disks(testvm, expected, self.first, self.last, self.interval)
+        stats = {}
+        vmstats.disks(testvm, stats, self.samples[0], self.samples[1],
+                      self.interval)
+        self.assertEqual(stats, expected)
+
+    def test_cpu(self):
+        expected = {}
+        vmstats.cpu(expected, self.first, self.last, self.interval)
+        stats = {}
+        vmstats.cpu(stats, self.samples[0], self.samples[1], self.interval)
+        self.assertEqual(stats, expected)
+
+    def test_networks(self):
+        nics = (FakeNic(name='vnet0', model='virtio',
+                        mac_addr='00:1a:4a:16:01:51'),)
+        testvm = FakeVM(nics=nics)
+        stats = {}
+        vmstats.networks(testvm, stats, self.samples[0], self.samples[1],
+                         self.interval)
+        self.assertEqual(list(stats['network']), ['vnet0'])
+
+
+class ReportTests(TestCaseBase):
+
+    def test_report(self):
+        vm_id = str(uuid.uuid4())
+        vms_stats = {
+            vm_id: {
+                'vmName': 'vm1',
+                'cpuUser': '1.50',
+                'cpuSys': '0.50',
+                'cpuUsage': '2000000000',
+                'balloonInfo': {},
+                'network': {
+                    'vnet0': {
+                        'speed': '1000', 'rx': '10', 'rxErrors': '0',
+                        'rxDropped': '0', 'tx': '20', 'txErrors': '0',
+                        'txDropped': '0',
+                    },
+                },
+            },
+        }
+        report = {metric.flat_name: metric
+                  for metric in vmstats.report(vms_stats)}
+        self.assertEqual(report['vms.vm1.cpu.user'].value, '1.50')
+        metric = report['vms.vm1.nic.vnet0.rx_bytes']
+        self.assertEqual(metric.name, 'vms.nic.rx_bytes')
+        self.assertEqual(metric.value, '10')
+        self.assertEqual(metric.labels,
+                         {'vm_id': vm_id, 'vm_name': 'vm1', 'nic': 'vnet0'})
+        self.assertEqual(len(report), 3 + 7)
+
+    def test_report_missing_stats(self):
+        vms_stats = {str(uuid.uuid4()): {'vmName': 'vm1'}}
+        self.assertEqual(vmstats.report(vms_stats), [])
+
+
 # helpers
 
 def _ensure_delta(stats_before, stats_after, key, delta):
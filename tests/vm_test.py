@@ -32,6 +32,7 @@ import libvirt
 import six
 from six.moves import zip
 
+from vdsm.virt import periodic
 from vdsm.virt import vmchannels
 from vdsm.virt import vmexitreason
 from vdsm.virt import vmstats
@@ -1446,6 +1447,25 @@ class TestVmStats(TestCaseBase):
             self.assertNotEquals(res['hash'],
                                  testvm.getStats()['hash'])
 
+    def testStaticStatsEncodedOnce(self):
+        with fake.VM(_VM_PARAMS) as testvm:
+            res = testvm.getStats()
+            self.assertIs(res.fragment, testvm.getStats().fragment)
+            self.assertEqual(res['vmName'], testvm.name)
+            self.assertIn('appsList', res)
+
+    def testStaticStatsGuestInfoChanged(self):
+        with fake.VM(_VM_PARAMS) as testvm:
+            res = testvm.getStats()
+            testvm.guestAgent.infoGeneration += 1
+            self.assertIsNot(res.fragment, testvm.getStats().fragment)
+
+    def testStaticStatsStatusChanged(self):
+        with fake.VM(_VM_PARAMS) as testvm:
+            res = testvm.getStats()
+            testvm._lastStatus = vmstatus.PAUSED
+            self.assertIsNot(res.fragment, testvm.getStats().fragment)
+
     @MonkeyPatch(vm, 'config',
                  make_config([('vars', 'vm_command_timeout', '10')]))
     def testMonitorTimeoutResponsive(self):
@@ -1505,6 +1525,27 @@ class TestLibVirtCallbacks(TestCaseBase):
             self.assertTrue(testvm._guestCpuRunning)
             self.assertNotIn('pauseCode', testvm.conf)  # no error recorded
 
+    @permutations([[True], [False]])
+    def test_onBlockThreshold(self, enabled):
+        dispatched = []
+
+        def dispatch(func, timeout=None):
+            dispatched.append(func)
+
+        with fake.VM(_VM_PARAMS) as testvm:
+            testvm._driveMonitor.on_block_threshold = \
+                lambda dev, path, threshold, excess: object()
+            if enabled:
+                testvm.enableDriveMonitor()
+            with MonkeyPatchScope([(periodic, "dispatch", dispatch)]):
+                testvm.onBlockThreshold("vda", "/path", 1024, 512)
+
+        # The drive is extended on the periodic executor, not on the libvirt
+        # events thread.
+        self.assertEqual(len(dispatched), 1 if enabled else 0)
+        for func in dispatched:
+            self.assertIsInstance(func, periodic.DriveWatermarkMonitor)
+
     @permutations([
         ['dimm0', set(('balloon',))],
         ['balloon', set(('dimm0', 'balloon',))],
@@ -1,6 +1,6 @@
 #
 # Copyright IBM Corp. 2012
-# Copyright 2013-2016 Red Hat, Inc.
+# Copyright 2013-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -223,6 +223,7 @@ class GuestAgent(object):
     def __init__(self):
         self.guestDiskMapping = {}
         self.diskMappingHash = 0
+        self.infoGeneration = 0
 
     def getGuestInfo(self):
         return {
@@ -237,6 +238,14 @@ class GuestAgent(object):
             'memoryStats': {},
             'guestCPUCount': -1}
 
+    def getHeartbeatInfo(self):
+        return {
+            'memUsage': 0,
+            'memoryStats': {}}
+
+    def isResponsive(self):
+        return False
+
     def stop(self):
         pass
 
@@ -45,6 +45,7 @@ from vdsm.logUtils import AllVmStatsValue, Suppressed
 from vdsm.storage import clusterlock
 from vdsm.storage import misc
 from vdsm.storage import constants as sc
+from vdsm.virt import drivemonitor
 from vdsm.virt import migration
 from vdsm.virt import secret
 import storage.volume
@@ -992,6 +993,11 @@ class StorageDomain(APIBase):
     def getVolumes(self, storagepoolID, imageID=Image.BLANK_UUID):
         return self._irs.getVolumesList(self._UUID, storagepoolID, imageID)
 
+    def getVolumesInfo(self, storagepoolID, imageID=Image.BLANK_UUID,
+                       offset=0, limit=0):
+        return self._irs.getVolumesInfo(self._UUID, storagepoolID, imageID,
+                                        offset, limit)
+
     def setDescription(self, description):
         return self._irs.setStorageDomainDescription(self._UUID, description)
 
@@ -1287,6 +1293,20 @@ class Global(APIBase):
                           AllVmStatsValue(statsList))
         return {'status': doneCode, 'statsList': Suppressed(statsList)}
 
+    def getAllVmStatsChanges(self, cursor=None):
+        """
+        Get statistics of the VMs whose statistics changed since the call
+        returning cursor, and the ids of the removed VMs.
+        """
+        hooks.before_get_all_vm_stats()
+        statsList = self._cif.getAllVmStats()
+        statsList = hooks.after_get_all_vm_stats(statsList)
+        changes = self._cif.getAllVmStatsChanges(statsList, cursor)
+        throttledlog.info('getAllVmStatsChanges',
+                          "Current getAllVmStatsChanges: %s",
+                          AllVmStatsValue(changes['changed']))
+        return {'status': doneCode, 'changes': Suppressed(changes)}
+
     def getAllVmIoTunePolicies(self):
         """
         Get IO tuning policies of all running VMs.
@@ -1316,6 +1336,12 @@ class Global(APIBase):
                 'info': hostapi.get_stats(self._cif,
                                           sampling.host_samples.stats())}
 
+    def getDriveMonitorStats(self):
+        """
+        Report drive monitor statistics.
+        """
+        return {'status': doneCode, 'stats': drivemonitor.stats()}
+
     def setLogLevel(self, level, name=''):
         """
         Set verbosity level of vdsm's log.
@@ -1448,6 +1474,12 @@ class Global(APIBase):
     def getStorageRepoStats(self):
         return self._irs.repoStats()
 
+    def getResourceManagerStats(self):
+        return self._irs.getResourceManagerStats()
+
+    def getTaskManagerStats(self):
+        return self._irs.getTaskManagerStats()
+
     def startMonitoringDomain(self, sdUUID, hostID):
         return self._irs.startMonitoringDomain(sdUUID, hostID)
 
@@ -40,6 +40,7 @@ from vdsm.virt import events
 from vdsm.virt import migration
 from vdsm.virt import recovery
 from vdsm.virt import secret
+from vdsm.virt import statstracker
 from vdsm.virt import vmstatus
 from vdsm.virt.vmchannels import Listener
 from vdsm.virt.utils import isVdsmImage
@@ -94,6 +95,7 @@ class clientIF(object):
         self._broker_client = None
         self._subscriptions = defaultdict(list)
         self._scheduler = scheduler
+        self._vmStatsTracker = statstracker.StatsTracker()
         if _glusterEnabled:
             self.gluster = gapi.GlusterApi()
         else:
@@ -452,6 +454,9 @@ class clientIF(object):
     def getAllVmStats(self):
         return [v.getStats() for v in self.vmContainer.values()]
 
+    def getAllVmStatsChanges(self, statsList, cursor):
+        return self._vmStatsTracker.changes(statsList, cursor)
+
     def getAllVmIoTunePolicies(self):
         vm_io_tune_policies = {}
         for v in self.vmContainer.values():
@@ -550,6 +555,11 @@ class clientIF(object):
             elif eventid == libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED:
                 device_alias, = args[:-1]
                 v.onDeviceRemoved(device_alias)
+            elif eventid == getattr(libvirt,
+                                    'VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD',
+                                    None):
+                dev, path, threshold, excess = args[:-1]
+                v.onBlockThreshold(dev, path, threshold, excess)
             else:
                 v.log.debug('unhandled libvirt event (event_name=%s, args=%s)',
                             events.event_name(eventid), args)
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -53,6 +53,7 @@ from vdsm.storage import misc
 from vdsm.storage import mount
 from vdsm.storage import multipath
 from vdsm.storage import resourceManager as rm
+from vdsm.storage import zeroing
 from vdsm.storage.mailbox import MAILBOX_SIZE
 from vdsm.storage.persistent import PersistentDict, DictValidator
 from vdsm.storage.threadlocal import vars
@@ -225,17 +226,20 @@ def zeroImgVolumes(sdUUID, imgUUID, volUUIDs, discard):
                   'volume %s task %s', volUUID, taskid)
         path = lvm.lvPath(sdUUID, volUUID)
         size = multipath.getDeviceSize(lvm.lvDmDev(sdUUID, volUUID))
+        discardEnable = config.getboolean('irs', 'discard_enable')
 
-        try:
-            misc.ddWatchCopy("/dev/zero", path, aborting, size)
-            log.debug('Zero volume %s task %s completed', volUUID, taskid)
-        except Exception:
-            log.exception('Zero volume %s task %s failed', volUUID, taskid)
-            # LV zeroing failed, so we must not remove it. The administrator
-            # can zero and remove it manually.
-            raise
+        with zeroing.slot(sdUUID, aborting):
+            try:
+                zeroing.zero(path, size, aborting)
+                log.debug('Zero volume %s task %s completed', volUUID,
+                          taskid)
+            except Exception:
+                log.exception('Zero volume %s task %s failed', volUUID,
+                              taskid)
+                # LV zeroing failed, so we must not remove it. The
+                # administrator can zero and remove it manually.
+                raise
 
-        discardEnable = config.getboolean('irs', 'discard_enable')
         if discard or discardEnable:
             try:
                 blkdiscard.blkdiscard(path)
@@ -20,6 +20,8 @@
 
 import os
 import logging
+import threading
+from contextlib import contextmanager
 
 from vdsm import cmdutils
 from vdsm import constants
@@ -59,6 +61,9 @@ QCOW_OVERHEAD_FACTOR = 1.1
 #  - 2..100  (Unassigned)
 RESERVED_LEASES = 100
 
+# Seconds to keep an unused metadata snapshot for reuse. 0 disables reuse.
+METADATA_SNAPSHOT_TTL = config.getint("irs", "volume_metadata_snapshot_ttl")
+
 log = logging.getLogger('storage.Volume')
 
 
@@ -108,9 +113,11 @@ class BlockVolumeManifest(volume.VolumeManifest):
         vgname, offs = metaId
 
         try:
-            lines = misc.readblock(lvm.lvPath(vgname, sd.METADATA),
-                                   offs * sc.METADATA_SIZE,
-                                   sc.METADATA_SIZE)
+            snapshot = _activeSnapshot(vgname)
+            if snapshot:
+                lines = snapshot.read(offs)
+            else:
+                lines = _readMetadata(vgname, offs)
         except Exception as e:
             self.log.error(e, exc_info=True)
             raise se.VolumeMetadataReadError("%s: %s" % (metaId, e))
@@ -243,9 +250,19 @@ class BlockVolumeManifest(volume.VolumeManifest):
         data += "\0" * (sc.METADATA_SIZE - len(data))
 
         metavol = lvm.lvPath(vgname, sd.METADATA)
-        with directio.DirectFile(metavol, "r+") as f:
-            f.seek(offs * sc.METADATA_SIZE)
-            f.write(data)
+        try:
+            with directio.DirectFile(metavol, "r+") as f:
+                f.seek(offs * sc.METADATA_SIZE)
+                f.write(data)
+        except Exception:
+            # The slot content is unknown now.
+            _updateSnapshot(vgname, offs, None)
+            raise
+        _updateSnapshot(vgname, offs, data.splitlines())
+
+    @classmethod
+    def metadataSnapshot(cls, sdUUID, load=False, volUUIDs=None):
+        return metadataSnapshot(sdUUID, load=load, volUUIDs=volUUIDs)
 
     def changeVolumeTag(self, tagPrefix, uuid):
 
@@ -738,6 +755,198 @@ class BlockVolume(volume.Volume):
         lvm.extendLV(self.sdUUID, self.volUUID, newSizeMb)
 
 
+class MetadataSnapshot(object):
+    """
+    Snapshot of the volumes metadata slots in the metadata LV of a block
+    storage domain.
+
+    A slot is read from storage when first accessed, or all slots are read by
+    load(), reading the used area of the metadata LV sequentially. Slots
+    written by this host are updated in the snapshot, but writes by other
+    hosts are not seen, so a snapshot should be used only by one operation,
+    or for a short time.
+    """
+
+    def __init__(self, sdUUID):
+        self.sdUUID = sdUUID
+        self.created = utils.monotonic_time()
+        self.generation = None
+        # Number of active users, modified by metadataSnapshot().
+        self.users = 0
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def read(self, offs):
+        """
+        Return metadata lines of slot offs.
+        """
+        with self._lock:
+            lines = self._slots.get(offs)
+        if lines is None:
+            lines = _readMetadata(self.sdUUID, offs)
+            with self._lock:
+                # Keep the slot if it was written while we were reading.
+                lines = self._slots.setdefault(offs, lines)
+        return lines
+
+    def load(self, volUUIDs=None):
+        """
+        Read the slots used by volUUIDs, or by all volumes, which were not
+        read yet.
+        """
+        with self._lock:
+            offsets = [offs for offs in _metadataOffsets(self.sdUUID, volUUIDs)
+                       if offs not in self._slots]
+        if not offsets:
+            return
+        log.debug("Loading %d metadata slots in domain %s",
+                  len(offsets), self.sdUUID)
+        blocks = misc.readblocks(lvm.lvPath(self.sdUUID, sd.METADATA),
+                                 [offs * sc.METADATA_SIZE for offs in offsets],
+                                 sc.METADATA_SIZE)
+        with self._lock:
+            for offs, lines in zip(offsets, blocks):
+                self._slots.setdefault(offs, lines)
+
+    def update(self, offs, lines):
+        """
+        Update slot offs after it was written by this host. If lines is None,
+        the slot will be read again when accessed.
+        """
+        with self._lock:
+            if lines is None:
+                self._slots.pop(offs, None)
+            else:
+                self._slots[offs] = lines
+
+
+_snapshotsLock = threading.Lock()
+# Snapshot which may be reused by new operations, by domain.
+_snapshots = {}
+# Snapshots used by running operations, by domain.
+_inUse = {}
+# Snapshots used by the current thread, by domain.
+_local = threading.local()
+
+
+@contextmanager
+def metadataSnapshot(sdUUID, load=False, volUUIDs=None):
+    """
+    Read volumes metadata of domain sdUUID from a snapshot within this
+    context. If load is True, read the metadata of volUUIDs, or of all
+    volumes, when entering.
+
+    The snapshot is used only by the current thread, and nested contexts
+    share the same snapshot. When volume_metadata_snapshot_ttl is positive,
+    another operation may reuse a snapshot if it is not older than the ttl,
+    and the domain generation, the domain volumes and their tags as seen by
+    this host, was not modified. Writing volume metadata invalidates the
+    snapshot.
+    """
+    active = _threadSnapshots()
+    snapshot = active.get(sdUUID)
+    if snapshot is not None:
+        # Nested context in the same operation.
+        if load:
+            snapshot.load(volUUIDs)
+        yield snapshot
+        return
+
+    snapshot = _acquireSnapshot(sdUUID)
+    active[sdUUID] = snapshot
+    try:
+        if load:
+            snapshot.load(volUUIDs)
+        yield snapshot
+    finally:
+        del active[sdUUID]
+        _releaseSnapshot(snapshot)
+
+
+def _threadSnapshots():
+    try:
+        return _local.snapshots
+    except AttributeError:
+        _local.snapshots = {}
+        return _local.snapshots
+
+
+def _acquireSnapshot(sdUUID):
+    generation = _generation(sdUUID) if METADATA_SNAPSHOT_TTL > 0 else None
+    with _snapshotsLock:
+        snapshot = _snapshots.get(sdUUID)
+        if snapshot is None or not _reusable(snapshot, generation):
+            snapshot = MetadataSnapshot(sdUUID)
+            snapshot.generation = generation
+            if METADATA_SNAPSHOT_TTL > 0:
+                _snapshots[sdUUID] = snapshot
+            else:
+                _snapshots.pop(sdUUID, None)
+        snapshot.users += 1
+        _inUse.setdefault(sdUUID, set()).add(snapshot)
+        return snapshot
+
+
+def _reusable(snapshot, generation):
+    age = utils.monotonic_time() - snapshot.created
+    return (age < METADATA_SNAPSHOT_TTL and
+            snapshot.generation == generation)
+
+
+def _releaseSnapshot(snapshot):
+    with _snapshotsLock:
+        snapshot.users -= 1
+        if snapshot.users == 0:
+            inUse = _inUse[snapshot.sdUUID]
+            inUse.discard(snapshot)
+            if not inUse:
+                del _inUse[snapshot.sdUUID]
+
+
+def _activeSnapshot(sdUUID):
+    """
+    Return the snapshot used by the current thread, or None.
+    """
+    return _threadSnapshots().get(sdUUID)
+
+
+def _updateSnapshot(sdUUID, offs, lines):
+    """
+    Called after writing slot offs. The written slot is updated in the
+    snapshots used by running operations, and no new operation will reuse
+    them.
+    """
+    with _snapshotsLock:
+        _snapshots.pop(sdUUID, None)
+        snapshots = list(_inUse.get(sdUUID, ()))
+    for snapshot in snapshots:
+        snapshot.update(offs, lines)
+
+
+def _generation(sdUUID):
+    return sorted((lv.name, lv.tags) for lv in lvm.getLV(sdUUID))
+
+
+def _metadataOffsets(sdUUID, volUUIDs=None):
+    if volUUIDs is not None:
+        volUUIDs = frozenset(volUUIDs)
+    offsets = []
+    for lv in lvm.getLV(sdUUID):
+        if volUUIDs is not None and lv.name not in volUUIDs:
+            continue
+        for tag in lv.tags:
+            if tag.startswith(sc.TAG_PREFIX_MD):
+                offsets.append(int(tag[len(sc.TAG_PREFIX_MD):]))
+                break
+    return offsets
+
+
+def _readMetadata(sdUUID, offs):
+    return misc.readblock(lvm.lvPath(sdUUID, sd.METADATA),
+                          offs * sc.METADATA_SIZE,
+                          sc.METADATA_SIZE)
+
+
 def getVolumeTag(sdUUID, volUUID, tagPrefix):
     tags = lvm.getLV(sdUUID, volUUID).tags
     if sc.TAG_VOL_UNINIT in tags:
@@ -40,6 +40,7 @@ from vdsm import concurrent
 from vdsm import constants
 from vdsm import jobs
 from vdsm import logUtils
+from vdsm import metrics
 from vdsm import qemuimg
 from vdsm import supervdsm
 from vdsm import utils
@@ -57,8 +58,10 @@ from vdsm.storage import misc
 from vdsm.storage import mount
 from vdsm.storage import multipath
 from vdsm.storage import outOfProcess as oop
+from vdsm.storage import qcow2reader
 from vdsm.storage import resourceManager as rm
 from vdsm.storage import taskManager
+from vdsm.storage import taskexecutor
 from vdsm.storage import types
 from vdsm.storage.constants import STORAGE
 from vdsm.storage.constants import SECTOR_SIZE
@@ -402,6 +405,8 @@ class HSM(object):
         monitorInterval = config.getint('irs', 'sd_health_check_delay')
         self.domainMonitor = monitor.DomainMonitor(monitorInterval)
 
+        metrics.register(oop.report)
+
     @property
     def ready(self):
         return self._ready
@@ -706,7 +711,7 @@ class HSM(object):
 
         volToExtend.prepare()
         try:
-            imgInfo = qemuimg.info(volPath, qemuImgFormat)
+            imgInfo = qcow2reader.info(volPath)
             if imgInfo['virtualsize'] > newSizeBytes:
                 self.log.error(
                     "volume %s size %s is larger than the size requested "
@@ -716,8 +721,7 @@ class HSM(object):
             # Uncommit the current size
             volToExtend.setSize(0)
             qemuimg.resize(volPath, newSizeBytes, qemuImgFormat)
-            roundedSizeBytes = qemuimg.info(volPath,
-                                            qemuImgFormat)['virtualsize']
+            roundedSizeBytes = qcow2reader.info(volPath)['virtualsize']
         finally:
             volToExtend.teardown(sdUUID, volUUID)
 
@@ -871,11 +875,19 @@ class HSM(object):
             if pool.hsmMailer:
                 pool.hsmMailer.sendExtendMsg(volDict, newSize, callbackFunc)
 
-    def _spmSchedule(self, spUUID, name, func, *args):
+    def _spmSchedule(self, spUUID, name, func, *args, **kwargs):
         pool = self.getPool(spUUID)
         pool.validateSPM()
         self.taskMng.scheduleJob("spm", pool.tasksDir, vars.task,
-                                 name, func, *args)
+                                 name, func, *args, **kwargs)
+
+    def _spmScheduleData(self, spUUID, sdUUID, name, func, *args):
+        """
+        Schedule a long data operation on domain sdUUID, running in the task
+        manager data lane.
+        """
+        self._spmSchedule(spUUID, name, func, *args,
+                          lane=taskexecutor.DATA, domain=sdUUID)
 
     @public
     def createStoragePool(self, poolType, spUUID, poolName, masterDom,
@@ -1473,8 +1485,9 @@ class HSM(object):
         if misc.parseBool(postZero):
             # postZero implies block domain. Backup domains are always NFS
             # hence no need to create fake template if postZero is true.
-            self._spmSchedule(spUUID, "zeroImage_%s" % imgUUID, dom.zeroImage,
-                              sdUUID, imgUUID, volsByImg, discard)
+            self._spmScheduleData(spUUID, sdUUID, "zeroImage_%s" % imgUUID,
+                                  dom.zeroImage, sdUUID, imgUUID, volsByImg,
+                                  discard)
         else:
             if fakeTUUID:
                 tParams = dom.produceVolume(imgUUID, fakeTUUID).\
@@ -1484,9 +1497,9 @@ class HSM(object):
                 img = image.Image(os.path.join(self.storage_repository,
                                                spUUID))
                 img.createFakeTemplate(sdUUID=sdUUID, volParams=tParams)
-            self._spmSchedule(spUUID, "purgeImage_%s" % imgUUID,
-                              pool.purgeImage, sdUUID, imgUUID, volsByImg,
-                              discard)
+            self._spmScheduleData(spUUID, sdUUID, "purgeImage_%s" % imgUUID,
+                                  pool.purgeImage, sdUUID, imgUUID, volsByImg,
+                                  discard)
 
     @public
     def verify_untrusted_volume(self, spUUID, sdUUID, imgUUID, volUUID):
@@ -1590,10 +1603,10 @@ class HSM(object):
         for dom in domains:
             vars.task.getSharedLock(STORAGE, dom)
 
-        self._spmSchedule(
-            spUUID, "moveImage_%s" % imgUUID, pool.moveImage, srcDomUUID,
-            dstDomUUID, imgUUID, vmUUID, op, misc.parseBool(postZero),
-            misc.parseBool(force), discard)
+        self._spmScheduleData(
+            spUUID, dstDomUUID, "moveImage_%s" % imgUUID, pool.moveImage,
+            srcDomUUID, dstDomUUID, imgUUID, vmUUID, op,
+            misc.parseBool(postZero), misc.parseBool(force), discard)
 
     @public
     def sparsifyImage(self, spUUID, tmpSdUUID, tmpImgUUID, tmpVolUUID,
@@ -1610,9 +1623,9 @@ class HSM(object):
         for dom in sdUUIDs:
             vars.task.getSharedLock(STORAGE, dom)
 
-        self._spmSchedule(spUUID, "sparsifyImage", pool.sparsifyImage,
-                          tmpSdUUID, tmpImgUUID, tmpVolUUID, dstSdUUID,
-                          dstImgUUID, dstVolUUID)
+        self._spmScheduleData(spUUID, dstSdUUID, "sparsifyImage",
+                              pool.sparsifyImage, tmpSdUUID, tmpImgUUID,
+                              tmpVolUUID, dstSdUUID, dstImgUUID, dstVolUUID)
 
     @public
     def cloneImageStructure(self, spUUID, sdUUID, imgUUID, dstSdUUID):
@@ -1643,8 +1656,9 @@ class HSM(object):
             vars.task.getSharedLock(STORAGE, dom)
 
         pool = self.getPool(spUUID)
-        self._spmSchedule(spUUID, "syncImageData", pool.syncImageData,
-                          sdUUID, imgUUID, dstSdUUID, syncType)
+        self._spmScheduleData(spUUID, dstSdUUID, "syncImageData",
+                              pool.syncImageData, sdUUID, imgUUID, dstSdUUID,
+                              syncType)
 
     @public
     def uploadImage(self, methodArgs, spUUID, sdUUID, imgUUID, volUUID=None):
@@ -1655,8 +1669,8 @@ class HSM(object):
         sdCache.produce(sdUUID)
         pool = self.getPool(spUUID)
         # NOTE: this could become an hsm task
-        self._spmSchedule(spUUID, "uploadImage", pool.uploadImage,
-                          methodArgs, sdUUID, imgUUID, volUUID)
+        self._spmScheduleData(spUUID, sdUUID, "uploadImage", pool.uploadImage,
+                              methodArgs, sdUUID, imgUUID, volUUID)
 
     @public
     def downloadImage(self, methodArgs, spUUID, sdUUID, imgUUID, volUUID=None):
@@ -1668,8 +1682,9 @@ class HSM(object):
         pool = self.getPool(spUUID)
         # NOTE: this could become an hsm task, in such case the LV extension
         # required to prepare the destination should go through the mailbox.
-        self._spmSchedule(spUUID, "downloadImage", pool.downloadImage,
-                          methodArgs, sdUUID, imgUUID, volUUID)
+        self._spmScheduleData(spUUID, sdUUID, "downloadImage",
+                              pool.downloadImage, methodArgs, sdUUID, imgUUID,
+                              volUUID)
 
     @public
     def uploadImageToStream(self, methodArgs, callback, startEvent, spUUID,
@@ -1682,9 +1697,9 @@ class HSM(object):
         sdCache.produce(sdUUID)
         pool = self.getPool(spUUID)
         # NOTE: this could become an hsm task
-        self._spmSchedule(spUUID, "uploadImageToStream",
-                          pool.uploadImageToStream, methodArgs, callback,
-                          startEvent, sdUUID, imgUUID, volUUID)
+        self._spmScheduleData(spUUID, sdUUID, "uploadImageToStream",
+                              pool.uploadImageToStream, methodArgs, callback,
+                              startEvent, sdUUID, imgUUID, volUUID)
 
     @public
     def downloadImageFromStream(self, methodArgs, callback, spUUID, sdUUID,
@@ -1698,9 +1713,9 @@ class HSM(object):
         pool = self.getPool(spUUID)
         # NOTE: this could become an hsm task, in such case the LV extension
         # required to prepare the destination should go through the mailbox.
-        self._spmSchedule(spUUID, "downloadImageFromStream",
-                          pool.downloadImageFromStream, methodArgs, callback,
-                          sdUUID, imgUUID, volUUID)
+        self._spmScheduleData(spUUID, sdUUID, "downloadImageFromStream",
+                              pool.downloadImageFromStream, methodArgs,
+                              callback, sdUUID, imgUUID, volUUID)
 
     @public
     def copyImage(
@@ -1749,8 +1764,8 @@ class HSM(object):
         for dom in domains:
             vars.task.getSharedLock(STORAGE, dom)
 
-        self._spmSchedule(
-            spUUID, "copyImage_%s" % dstImgUUID, pool.copyImage, sdUUID,
+        self._spmScheduleData(
+            spUUID, dom, "copyImage_%s" % dstImgUUID, pool.copyImage, sdUUID,
             vmUUID, srcImgUUID, srcVolUUID, dstImgUUID, dstVolUUID,
             description, dstSdUUID, volType, volFormat, preallocate,
             misc.parseBool(postZero), misc.parseBool(force), discard)
@@ -1807,9 +1822,10 @@ class HSM(object):
         pool = self.getPool(spUUID)
         sdCache.produce(sdUUID=sdUUID)
         vars.task.getSharedLock(STORAGE, sdUUID)
-        self._spmSchedule(
-            spUUID, "mergeSnapshots", pool.mergeSnapshots, sdUUID, vmUUID,
-            imgUUID, ancestor, successor, misc.parseBool(postZero), discard)
+        self._spmScheduleData(
+            spUUID, sdUUID, "mergeSnapshots", pool.mergeSnapshots, sdUUID,
+            vmUUID, imgUUID, ancestor, successor, misc.parseBool(postZero),
+            discard)
 
     @public
     def reconstructMaster(self, spUUID, poolName, masterDom, domDict,
@@ -3180,6 +3196,40 @@ class HSM(object):
             volUUIDs = [k for k, v in vols.iteritems() if imgUUID in v.imgs]
         return dict(uuidlist=volUUIDs)
 
+    @public
+    def getVolumesInfo(self, sdUUID, spUUID, imgUUID=sc.BLANK_UUID, offset=0,
+                       limit=0, options=None):
+        """
+        Gets info about all the volumes of a domain, or of one image, in
+        pages.
+
+        :param sdUUID: The UUID of the storage domain you want to query.
+        :type sdUUID: UUID
+        :param spUUID: Unused.
+        :type spUUID: UUID
+        :param imgUUID: The UUID of the an image you want to filter the
+                        results.
+                        if imgUUID equals :attr:`~volume.BLANK_UUID` no
+                        filtering will be done.
+        :param offset: The index of the first volume to return.
+        :type offset: int
+        :param limit: The maximum number of volumes to return, or 0 to return
+                      all the volumes.
+        :type limit: int
+
+        :returns: a dict with a list of volumes info, a list of errors for
+                  volumes whose info could not be read, and the offset of the
+                  next page, if there are more volumes.
+        :rtype: dict
+        """
+        vars.task.getSharedLock(STORAGE, sdUUID)
+        dom = sdCache.produce(sdUUID=sdUUID)
+        infos, errors, nextOffset = dom.getVolumesInfo(imgUUID, offset, limit)
+        page = {"volumes": infos, "errors": errors}
+        if nextOffset is not None:
+            page["next"] = nextOffset
+        return dict(info=page)
+
     @public
     def getImagesList(self, sdUUID, options=None):
         """
@@ -3254,7 +3304,8 @@ class HSM(object):
             self.__releaseLocks()
 
             try:
-                # Stop spmMailer thread
+                # Stop extend executor and spmMailer threads
+                self._pool.stopExtendExecutor()
                 if self._pool.spmMailer:
                     self._pool.spmMailer.stop()
                     self._pool.spmMailer.tp.joinAll(waitForTasks=False)
@@ -3273,6 +3324,7 @@ class HSM(object):
                                  exc_info=True)
 
             self.taskMng.prepareForShutdown()
+            metrics.unregister(oop.report)
             oop.stop()
         except:
             pass
@@ -3452,6 +3504,30 @@ class HSM(object):
 
         return result
 
+    @public
+    def getResourceManagerStats(self, options=None):
+        """
+        Collects resource manager statistics for every namespace.
+
+        :returns: a dict mapping namespace to the number of locked resources,
+                  the number of queued requests, and histograms of request
+                  wait time and resource hold time.
+        :rtype: dict
+        """
+        return dict(stats=rm.stats())
+
+    @public
+    def getTaskManagerStats(self, options=None):
+        """
+        Collects task manager statistics.
+
+        :returns: a dict with the number of workers, running and queued
+                  tasks per lane, and histograms of queue wait time and run
+                  time per kind of task.
+        :rtype: dict
+        """
+        return dict(stats=self.taskMng.stats())
+
     @deprecated
     @public
     def startMonitoringDomain(self, sdUUID, hostID, options=None):
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -37,6 +37,7 @@ from vdsm.storage import fileUtils
 from vdsm.storage import imageSharing
 from vdsm.storage import misc
 from vdsm.storage import qcow2
+from vdsm.storage import qcow2reader
 from vdsm.storage import resourceManager as rm
 from vdsm.storage import task
 from vdsm.storage import workarounds
@@ -170,8 +171,9 @@ class Image:
 
     def estimate_qcow2_size(self, src_vol_params, dst_sd_id):
         """
-        Calculate volume allocation size for converting RAW
-        source volume to QCOW2 volume on destination storage domain.
+        Calculate volume allocation size for converting RAW source volume,
+        or QCOW2 source volume without a parent, to QCOW2 volume on
+        destination storage domain.
 
         Arguments:
             src_vol_params(dict): Dictionary returned from
@@ -227,9 +229,15 @@ class Image:
         Return the chain of volumes of image as a sorted list
         (not including a shared base (template) if any)
         """
-        chain = []
         volclass = sdCache.produce(sdUUID).getVolumeClass()
 
+        # Volumes metadata is read many times while building the chain.
+        with volclass.metadataSnapshot(sdUUID):
+            return self._getChain(volclass, sdUUID, imgUUID, volUUID)
+
+    def _getChain(self, volclass, sdUUID, imgUUID, volUUID):
+        chain = []
+
         # Use volUUID when provided
         if volUUID:
             srcVol = volclass(self.repoPath, sdUUID, imgUUID, volUUID)
@@ -923,9 +931,11 @@ class Image:
                         src_vol_params['volUUID'], src_vol_params['size'])
                 else:
                     # source 'cow' without parent.
-                    # The source volume should already contains the
-                    # qcow metadata.
-                    return src_vol_params['apparentsize']
+                    # Using estimated size of the allocated clusters, the
+                    # apparent size of an extended volume may be much
+                    # bigger.
+                    return self.estimate_qcow2_size(src_vol_params,
+                                                    dst_sd_id)
             else:
                 # source 'raw'.
                 # Add additional space for qcow2 metadata.
@@ -1253,9 +1263,12 @@ class Image:
         while volUUID is not None:
             actualVolumes.insert(0, volUUID)
             vol = dom.produceVolume(imgUUID, volUUID)
-            qemuImgFormat = sc.fmt2str(vol.getFormat())
-            imgInfo = qemuimg.info(vol.volumePath, qemuImgFormat)
-            backingFile = imgInfo.get('backingfile')
+            if vol.getFormat() == sc.COW_FORMAT:
+                # Reading the header is much faster than running qemu-img.
+                imgInfo = qcow2reader.info(vol.volumePath)
+                backingFile = imgInfo.get('backingfile')
+            else:
+                backingFile = None
             if backingFile is not None:
                 volUUID = os.path.basename(backingFile)
             else:
@@ -145,7 +145,8 @@ class DomainMonitor(object):
         # the checker event loop thread.
         self.onDomainStateChange = misc.Event(
             "storage.DomainMonitor.onDomainStateChange", sync=False)
-        self._checker = check.CheckService()
+        self._checker = check.CheckService(
+            use_helper=config.getboolean('irs', 'use_check_helper'))
         self._checker.start()
 
     @property
@@ -26,6 +26,8 @@ from collections import namedtuple
 import codecs
 from contextlib import contextmanager
 
+import six
+
 from vdsm.common import exception
 from vdsm.storage import clusterlock
 from vdsm.storage import constants as sc
@@ -440,6 +442,56 @@ class StorageDomainManifest(object):
         return self.getVolumeClass()(self.mountpoint, self.sdUUID, imgUUID,
                                      volUUID)
 
+    def getVolumesInfo(self, imgUUID=BLANK_UUID, offset=0, limit=0):
+        """
+        Return info about the domain volumes, or the volumes of image imgUUID,
+        sorted by image and volume UUID.
+
+        The volumes are found using one getAllVolumes() call, and the
+        metadata of the volumes in the page is read from one metadata
+        snapshot.
+
+        Returns tuple (infos, errors, nextOffset). errors is a list of dicts
+        with the uuid and image of volumes whose info could not be read, and
+        the error info. If limit is not 0, return up to limit volumes
+        starting at offset, and nextOffset is the offset of the next page, or
+        None if this is the last page.
+        """
+        vols = []
+        for volUUID, (imgs, parent) in six.iteritems(self.getAllVolumes()):
+            if imgUUID == BLANK_UUID or imgUUID in imgs:
+                # The first image of a template volume is its own image.
+                vols.append((imgs[0], volUUID))
+        vols.sort()
+
+        end = offset + limit if limit else len(vols)
+        page = vols[offset:end]
+        nextOffset = end if end < len(vols) else None
+
+        # Reading the page volumes metadata with few large reads is cheaper
+        # than reading the volumes one by one.
+        infos = []
+        errors = []
+        with self.getVolumeClass().metadataSnapshot(
+                self.sdUUID, load=True,
+                volUUIDs=[volUUID for _, volUUID in page]):
+            for volImgUUID, volUUID in page:
+                try:
+                    vol = self.produceVolume(volImgUUID, volUUID)
+                    infos.append(vol.getInfo())
+                except se.VolumeDoesNotExist:
+                    self.log.warning("Volume %s/%s was removed",
+                                     volImgUUID, volUUID)
+                except Exception as e:
+                    self.log.exception("Error getting volume %s/%s info",
+                                       volImgUUID, volUUID)
+                    if not isinstance(e, exception.VdsmException):
+                        e = exception.GeneralException(str(e))
+                    errors.append({"uuid": volUUID, "image": volImgUUID,
+                                   "error": e.info()})
+
+        return infos, errors, nextOffset
+
     def isISO(self):
         return self.getMetaParam(DMDK_CLASS) == ISO_DOMAIN
 
@@ -692,6 +744,9 @@ class StorageDomain(object):
     def getAllVolumes(self):
         return self._manifest.getAllVolumes()
 
+    def getVolumesInfo(self, imgUUID=BLANK_UUID, offset=0, limit=0):
+        return self._manifest.getVolumesInfo(imgUUID, offset, limit)
+
     def prepareMailbox(self):
         """
         This method has been introduced in order to prepare the mailbox
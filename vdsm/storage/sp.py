@@ -33,6 +33,7 @@ from imageRepository.formatConverter import DefaultFormatConverter
 
 from vdsm import concurrent
 from vdsm import constants
+from vdsm import metrics
 from vdsm.panic import panic
 from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
@@ -108,6 +109,7 @@ class StoragePool(object):
         self.taskMng = taskManager
         self.hsmMailer = None
         self.spmMailer = None
+        self.extendExecutor = None
         self.masterDomain = None
         self.spmRole = SPM_FREE
         self.domainMonitor = domainMonitor
@@ -371,14 +373,17 @@ class StoragePool(object):
                     outbox = self._master_volume_path("outbox")
                     self.spmMailer = mailbox.SPM_MailMonitor(
                         self, maxHostID, inbox, outbox)
-                    self.spmMailer.registerMessageType('xtnd', partial(
-                        mailbox.SPM_Extend_Message.processRequest,
-                        self))
+                    self.extendExecutor = mailbox.ExtendExecutor(
+                        self, self.spmMailer)
+                    self.spmMailer.registerMessageType(
+                        'xtnd', self.extendExecutor.submit)
+                    metrics.register(self.extendExecutor.report)
                     self.log.debug("SPM mailbox ready for pool %s on master "
                                    "domain %s", self.spUUID,
                                    self.masterDomain.sdUUID)
                 else:
                     self.spmMailer = None
+                    self.extendExecutor = None
 
                 # Restore tasks is last because tasks are spm ops (spm has to
                 # be started)
@@ -425,6 +430,21 @@ class StoragePool(object):
             else:
                 cls.log.debug("master `%s` is not mounted, skipping", master)
 
+    @unsecured
+    def stopExtendExecutor(self):
+        """
+        Stop extending volumes, waiting until running extensions complete.
+        Must be called before stopping the SPM mailbox, so no reply is sent
+        to a stopped mailbox.
+        """
+        if self.extendExecutor is None:
+            return
+        metrics.unregister(self.extendExecutor.report)
+        self.extendExecutor.stop()
+        if not self.extendExecutor.wait(mailbox.EXTEND_STOP_TIMEOUT):
+            self.log.warning("Timeout waiting for running volume extensions")
+        self.extendExecutor = None
+
     def stopSpm(self, force=False):
         with self.lock:
             if not force and self.spmRole == SPM_FREE:
@@ -442,6 +462,9 @@ class StoragePool(object):
                 stopFailed = True
 
             try:
+                # Stop extending volumes before stopping the mailer, so no
+                # reply is sent to a stopped mailer.
+                self.stopExtendExecutor()
                 if self.spmMailer:
                     self.spmMailer.stop()
             except:
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2017 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -34,6 +34,7 @@ from vdsm.storage import exception as se
 from vdsm.storage import fileUtils
 from vdsm.storage import guarded
 from vdsm.storage import misc
+from vdsm.storage import qcow2reader
 from vdsm.storage import resourceManager as rm
 from vdsm.storage import task
 from vdsm.storage.misc import deprecated
@@ -489,8 +490,11 @@ class VolumeManifest(object):
         # Going directly to the metadata parameter as we should skip the size
         # validation in getSize.
         if int(self.getMetaParam(sc.SIZE)) < 1:
-            volInfo = qemuimg.info(
-                self.getVolumePath(), sc.fmt2str(self.getFormat()))
+            if self.getFormat() == sc.COW_FORMAT:
+                volInfo = qcow2reader.info(self.getVolumePath())
+            else:
+                volInfo = qemuimg.info(self.getVolumePath(),
+                                       qemuimg.FORMAT.RAW)
             # qemu/qemu-img rounds down
             self.setSize(volInfo['virtualsize'] / sc.BLOCK_SIZE)
 
@@ -693,6 +697,19 @@ class VolumeManifest(object):
     def getImageVolumes(cls, repoPath, sdUUID, imgUUID):
         raise NotImplementedError
 
+    @classmethod
+    @contextmanager
+    def metadataSnapshot(cls, sdUUID, load=False, volUUIDs=None):
+        """
+        Context manager for reading many volumes metadata of domain sdUUID
+        from a snapshot. If load is True, read the metadata of volUUIDs, or
+        of all volumes, when entering the context.
+
+        The default implementation does nothing; metadata is read directly
+        from storage.
+        """
+        yield
+
     @classmethod
     def newVolumeLease(cls, metaId, sdUUID, volUUID):
         raise NotImplementedError
@@ -1483,6 +1500,11 @@ class Volume(object):
     def getImageVolumes(cls, repoPath, sdUUID, imgUUID):
         return cls.manifestClass.getImageVolumes(repoPath, sdUUID, imgUUID)
 
+    @classmethod
+    def metadataSnapshot(cls, sdUUID, load=False, volUUIDs=None):
+        return cls.manifestClass.metadataSnapshot(sdUUID, load=load,
+                                                  volUUIDs=volUUIDs)
+
     def _extendSizeRaw(self, newSize):
         raise NotImplementedError
 
@@ -42,6 +42,7 @@ from vdsm import concurrent
 from vdsm import constants
 from vdsm import containersconnection
 from vdsm import cpuarch
+from vdsm import executor
 from vdsm import hooks
 from vdsm import host
 from vdsm import libvirtconnection
@@ -57,9 +58,11 @@ from vdsm.logUtils import SimpleLogAdapter, volume_chain_to_str
 from vdsm.network import api as net_api
 from vdsm.storage import fileUtils
 from vdsm.storage import outOfProcess as oop
+from vdsm.virt import drivemonitor
 from vdsm.virt import guestagent
 from vdsm.virt import libvirtxml
 from vdsm.virt import migration
+from vdsm.virt import periodic
 from vdsm.virt import recovery
 from vdsm.virt import sampling
 from vdsm.virt import vmchannels
@@ -77,6 +80,7 @@ from vdsm.virt.vmdevices import hwclass
 from vdsm.virt.vmdevices.storage import DISK_TYPE, VolumeNotFound
 from vdsm.virt.vmpowerdown import VmShutdown, VmReboot
 from vdsm.virt.utils import isVdsmImage, cleanup_guest_socket, is_kvm
+from yajsonrpc import EncodedDict, JsonFragment
 
 # local imports. TODO: move to vdsm.storage
 from storage import sd
@@ -303,6 +307,8 @@ class Vm(object):
             float(self.conf.pop('elapsedTimeOffset', 0))
 
         self._usedIndices = defaultdict(list)  # {'ide': [], 'virtio' = []}
+        self._driveMonitor = drivemonitor.DriveMonitor(self, self.log)
+        self._extendDrivesLock = threading.Lock()
         self.disableDriveMonitor()
         self._vmStartEvent = threading.Event()
         self._vmAsyncStartError = None
@@ -346,6 +352,9 @@ class Vm(object):
         self._shutdownReason = None
         self._vcpuLimit = None
         self._vcpuTuneInfo = {}
+        # Tuple of the state of the vm when the static stats were
+        # gathered, and the encoded static stats.
+        self._staticStats = None
         self._ioTuneLock = threading.Lock()
         self._ioTuneInfo = []
         self._ioTuneValues = {}
@@ -758,6 +767,10 @@ class Vm(object):
         self._driveMonitorEnabled = False
 
     def enableDriveMonitor(self):
+        # The drive monitor is disabled while the volume chain of the drives
+        # is modified, so the block thresholds may be registered on the old
+        # top volumes.
+        self._driveMonitor.clear_thresholds()
         self._driveMonitorEnabled = True
 
     def driveMonitorEnabled(self):
@@ -924,8 +937,9 @@ class Vm(object):
 
     def _getExtendCandidates(self):
         ret = []
+        drives = self._driveMonitor.monitored_drives()
 
-        for drive in self._chunkedDrives():
+        for drive in drives:
             try:
                 capacity, alloc, physical = self._getExtendInfo(drive)
             except libvirt.libvirtError as e:
@@ -935,9 +949,10 @@ class Vm(object):
 
             ret.append((drive, drive.volumeID, capacity, alloc, physical))
 
+        self._driveMonitor.polled(drives)
         return ret
 
-    def _chunkedDrives(self):
+    def getChunkedDrives(self):
         """
         Return list of chunked drives, or non-chunked drives replicating to
         chunked replica drive.
@@ -1010,13 +1025,35 @@ class Vm(object):
         This is called every 2 seconds (configurable) by the periodic system.
         If this returns True, the periodic system will invoke
         extendDrivesIfNeeded during this periodic cycle.
+
+        When using block threshold events, only drives without a threshold or
+        exceeding their threshold are monitored, and all drives are monitored
+        every vm_watermark_safety_interval seconds.
         """
-        return self._driveMonitorEnabled and bool(self._chunkedDrives())
+        return (self._driveMonitorEnabled and
+                bool(self._driveMonitor.monitored_drives()))
 
     def extendDrivesIfNeeded(self):
+        # Called by the periodic drive monitor, and after block threshold
+        # events. If drives are being checked now, drives exceeding their
+        # threshold will be checked again by the next periodic cycle.
+        if not self._extendDrivesLock.acquire(False):
+            self.log.debug("Drives extension check already in progress")
+            return False
         try:
-            extend = [x for x in self._getExtendCandidates()
-                      if self._shouldExtendVolume(*x)]
+            return self._extendDrivesIfNeeded()
+        finally:
+            self._extendDrivesLock.release()
+
+    def _extendDrivesIfNeeded(self):
+        extend = []
+        try:
+            for candidate in self._getExtendCandidates():
+                if self._shouldExtendVolume(*candidate):
+                    extend.append(candidate)
+                else:
+                    drive, _, _, _, physical = candidate
+                    self._driveMonitor.set_threshold(drive, physical)
         except ImprobableResizeRequestError:
             return False
 
@@ -1026,10 +1063,33 @@ class Vm(object):
                 "%s, capacity: %s, allocated: %s, physical: %s)",
                 volumeID, drive.domainID, drive.apparentsize, capacity,
                 alloc, physical)
+            self._driveMonitor.extension_requested(drive)
             self.extendDriveVolume(drive, volumeID, physical, capacity)
 
         return len(extend) > 0
 
+    def onBlockThreshold(self, dev, path, threshold, excess):
+        """
+        Called back by BLOCK_THRESHOLD event, when the guest wrote beyond the
+        threshold registered for a drive. The drive is marked as exceeding
+        its threshold, and extended on the periodic executor, since
+        extending accesses libvirt and storage and must not block the libvirt
+        events thread. If the drive monitor is disabled, or the extension
+        cannot be dispatched, the drive is extended by the periodic drive
+        monitor, which polls drives exceeding their threshold.
+        """
+        drive = self._driveMonitor.on_block_threshold(
+            dev, path, threshold, excess)
+        if drive is None or not self._driveMonitorEnabled:
+            return
+        timeout = config.getint('vars', 'vm_watermark_interval') / 2.
+        try:
+            periodic.dispatch(periodic.DriveWatermarkMonitor(self), timeout)
+        except (executor.NotRunning, executor.TooManyTasks) as e:
+            self.log.warning("Cannot extend drive %r now, will be extended "
+                             "by the periodic drive monitor: %s",
+                             drive.name, e)
+
     def extendDriveVolume(self, vmDrive, volumeID, curSize, capacity):
         """
         Extend drive volume and its replica volume during replication.
@@ -1073,7 +1133,9 @@ class Vm(object):
     def __afterReplicaExtension(self, volInfo):
         self.__verifyVolumeExtension(volInfo)
         vmDrive = self._findDriveByName(volInfo['name'])
-        if vmDrive.chunked:
+        if not vmDrive.chunked:
+            self._driveMonitor.extension_completed(vmDrive)
+        else:
             self.log.debug("Requesting extension for the original drive: %s "
                            "(domainID: %s, volumeID: %s)",
                            vmDrive.name, vmDrive.domainID, vmDrive.volumeID)
@@ -1123,12 +1185,15 @@ class Vm(object):
             vmDrive = self._findDriveByName(volInfo['name'])
             vmDrive.apparentsize = volSize.apparentsize
             vmDrive.truesize = volSize.truesize
+            self._driveMonitor.extension_completed(vmDrive)
 
         try:
             self.cont()
         except libvirt.libvirtError:
             self.log.warn("VM %s can't be resumed", self.id, exc_info=True)
-        self._setWriteWatermarks()
+
+        if not volInfo['internal']:
+            self._driveMonitor.set_threshold(vmDrive, volSize.apparentsize)
 
     def _acquireCpuLockWithTimeout(self):
         timeout = self._loadCorrectedTimeout(
@@ -1381,18 +1446,38 @@ class Vm(object):
         stats = {'statusTime': self._get_status_time()}
         if self.lastStatus == vmstatus.DOWN:
             stats.update(self._getDownVmStats())
+            return stats
+        # Stats are on the destination during post-copy migration, except
+        # for migration progress, which is always on the source.
+        post_copy = self.isMigrating() and self.post_copy
+        if post_copy:
+            stats['migrationProgress'] = self._get_vm_migration_progress()
+            stats.update(self._getVmPauseCodeStats())
         else:
-            stats.update(self._getConfigVmStats())
-            if self.isMigrating() and self.post_copy:
-                # Stats are on the destination during post-copy migration,
-                # except for migration progress, which is always on the source.
-                stats['migrationProgress'] = self._get_vm_migration_progress()
-                stats.update(self._getVmPauseCodeStats())
-            else:
-                stats.update(self._getRunningVmStats())
-                stats.update(self._getGuestStats())
-            stats['status'] = self._getVmStatus()
-        return stats
+            stats.update(self._getRunningVmStats())
+            stats.update(self._getGuestStats())
+        stats['status'] = self._getVmStatus()
+        return EncodedDict(self._getStaticStats(guest=not post_copy), stats)
+
+    def _getStaticStats(self, guest=True):
+        """
+        Return JsonFragment with the stats which change only when the vm
+        status, the vm configuration, or the guest agent info change, encoded
+        once for all the calls until then.
+        """
+        key = (self._lastStatus, self.conf.get('pid'), self.conf.get('cdrom'),
+               guest)
+        if guest:
+            key += (self.guestAgent.infoGeneration,
+                    self.guestAgent.isResponsive())
+        cached = self._staticStats
+        if cached is None or cached[0] != key:
+            stats = self._getConfigVmStats()
+            if guest:
+                stats.update(self._getStaticGuestStats())
+            cached = (key, JsonFragment(stats))
+            self._staticStats = cached
+        return cached[1]
 
     def _getDownVmStats(self):
         stats = {
@@ -1580,8 +1665,14 @@ class Vm(object):
         # else headless VM
         return stats
 
-    def _getGuestStats(self):
+    def _getStaticGuestStats(self):
         stats = self.guestAgent.getGuestInfo()
+        for key in guestagent.HEARTBEAT_INFO:
+            stats.pop(key, None)
+        return stats
+
+    def _getGuestStats(self):
+        stats = self.guestAgent.getHeartbeatInfo()
         realMemUsage = int(stats['memUsage'])
         if realMemUsage != 0:
             memUsage = (100 - float(realMemUsage) /
@@ -4533,13 +4624,6 @@ class Vm(object):
         self.log.exception("Operation failed")
         return response.error(key, msg)
 
-    def _setWriteWatermarks(self):
-        """
-        Define when to receive an event about high write to guest image
-        Currently unavailable by libvirt.
-        """
-        pass
-
     def handle_failed_post_copy(self, clean_vm=False):
         # After a failed post-copy migration, the VM remains in a paused state
         # on both the ends of the migration. There is currently no way to